@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Keep the full-text search index in sync with model saves/deletes
+        from . import search
+        search.connect_signals()
+
+        # Drop the cached part catalogue whenever a RepairPart changes
+        from . import part_catalog
+        part_catalog.connect_signals()
+
+        # Mirror the media path lists of vehicles and inspections into Attachment rows
+        from . import attachments
+        attachments.connect_signals()
@@ -0,0 +1,150 @@
+"""
+Attachment rows for the media path lists of vehicles and inspection reports.
+
+The forms still edit the JSONField lists in core.storage.MEDIA_FIELDS; every
+save of an owner writes the difference into the Attachment table
+(post_save handlers connected in CoreConfig.ready), so files can be looked
+up by path or hash through an index and counted or prefetched for list
+pages without decoding the JSON of every row:
+
+    Vehicle.objects.prefetch_related('attachments')  ->  vehicle.photo_count, vehicle.first_photo
+
+Rows are created with the file's size, its SHA-256 when the name is
+content-addressed (core.storage), and the pixel size of images.
+"""
+import os
+import re
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_save
+from PIL import Image, UnidentifiedImageError
+
+from .models import Attachment, PostInspectionReport, PreInspectionReport, Vehicle
+from .storage import MEDIA_FIELDS
+from .thumbnails import is_image
+
+OWNER_MODELS = [Vehicle, PreInspectionReport, PostInspectionReport]
+
+# <dir>/aa/bb/<sha256>.<ext>, as written by ContentAddressedStorage
+_CONTENT_NAME_RE = re.compile(r'(?:^|/)([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(?:\.[^/.]*)?$')
+
+# EXIF orientations that turn the stored pixels by 90 degrees
+_ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def owner_kinds(model):
+    """Names of the path-list fields of an owner model"""
+    return [field for model_name, field in MEDIA_FIELDS if model_name == model.__name__]
+
+
+def content_hash(path):
+    """SHA-256 encoded in a content-addressed path, or '' for other names"""
+    match = _CONTENT_NAME_RE.search(str(path))
+    if not match or not match.group(3).startswith(match.group(1) + match.group(2)):
+        return ''
+    return match.group(3)
+
+
+def file_metadata(path, storage=None):
+    """Attachment field values (size, sha256, width, height) for a stored file; missing files give None sizes"""
+    storage = storage or default_storage
+    metadata = {'size': None, 'sha256': content_hash(path), 'width': None, 'height': None}
+    try:
+        full_path = storage.path(path)
+        metadata['size'] = os.path.getsize(full_path)
+        if is_image(path):
+            # Only the header is read; the pixels are never decoded
+            with Image.open(full_path) as image:
+                width, height = image.size
+                if image.getexif().get(0x0112) in _ROTATED_ORIENTATIONS:
+                    width, height = height, width
+            metadata['width'], metadata['height'] = width, height
+    except (OSError, ValueError, UnidentifiedImageError, Image.DecompressionBombError):
+        pass
+    return metadata
+
+
+def listed_paths(instance, kind):
+    """The owner's paths for `kind` in list order, without blanks or repeats"""
+    paths = getattr(instance, kind, None)
+    if not isinstance(paths, list):
+        return []
+    return [str(path) for path in dict.fromkeys(path for path in paths if path)]
+
+
+def sync_attachments(instance, kinds=None):
+    """Make the owner's Attachment rows match its path lists; returns (created, deleted)"""
+    content_type = ContentType.objects.get_for_model(instance)
+    kinds = [kind for kind in owner_kinds(type(instance)) if kinds is None or kind in kinds]
+    existing = {
+        (attachment.kind, attachment.path): attachment
+        for attachment in Attachment.objects.filter(content_type=content_type, object_id=instance.pk, kind__in=kinds)
+    }
+
+    to_create, to_move, kept = [], [], set()
+    for kind in kinds:
+        for position, path in enumerate(listed_paths(instance, kind)):
+            attachment = existing.get((kind, path))
+            if attachment is None:
+                to_create.append(Attachment(
+                    content_type=content_type, object_id=instance.pk,
+                    kind=kind, position=position, path=path, **file_metadata(path),
+                ))
+                continue
+            kept.add(attachment.pk)
+            if attachment.position != position:
+                attachment.position = position
+                to_move.append(attachment)
+
+    stale = [attachment.pk for attachment in existing.values() if attachment.pk not in kept]
+    if stale:
+        Attachment.objects.filter(pk__in=stale).delete()
+    if to_move:
+        Attachment.objects.bulk_update(to_move, ['position'])
+    if to_create:
+        Attachment.objects.bulk_create(to_create)
+    return len(to_create), len(stale)
+
+
+def fill_missing_metadata(batch_size=1000):
+    """
+    Read size and image dimensions for Attachment rows that have no size yet,
+    such as those created by migration 0044; returns how many were filled.
+    Rows whose file is missing stay as they are.
+    """
+    filled = 0
+    last_pk = 0
+    while True:
+        batch = list(Attachment.objects.filter(size__isnull=True, pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            return filled
+        last_pk = batch[-1].pk
+        updated = []
+        for attachment in batch:
+            metadata = file_metadata(attachment.path)
+            if metadata['size'] is None:
+                continue
+            for field, value in metadata.items():
+                setattr(attachment, field, value)
+            updated.append(attachment)
+        Attachment.objects.bulk_update(updated, ['size', 'sha256', 'width', 'height'])
+        filled += len(updated)
+
+
+def _sync_on_save(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    kinds = owner_kinds(sender)
+    # Partial saves that don't touch a path list (status recomputes, mileage) need no sync
+    if update_fields is not None and not set(update_fields) & set(kinds):
+        return
+    # Unlike the search index, errors are not swallowed: release() trusts these rows
+    # to know whether a file is still listed, so the save fails with them
+    sync_attachments(instance, kinds)
+
+
+def connect_signals():
+    # Deleting an owner removes its rows through the GenericRelation
+    for model in OWNER_MODELS:
+        post_save.connect(_sync_on_save, sender=model, dispatch_uid=f'attachments_sync_{model.__name__}')
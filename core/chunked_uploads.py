@@ -0,0 +1,251 @@
+"""
+Chunked, resumable uploads for inspection attachments.
+
+Instead of sending every file with the form POST (and again each time the
+form fails validation), the browser uploads each file on its own:
+
+  1. start_session() records the file name, size and optional SHA-256 and
+     returns an UploadSession whose token identifies the upload.
+  2. append_chunk() spools the next chunk from the request body to a
+     temporary file, then appends it to a part file under
+     CHUNKED_UPLOAD_DIR. Chunks must arrive in order: each one starts at
+     session.received, so after a dropped connection the client asks for
+     the session and resumes from there. A chunk whose
+     X-Chunk-Checksum does not match is never appended.
+  3. complete() checks the size and checksum of the assembled file and moves
+     it into the upload storage (core.storage), which stores it by content.
+
+The form then posts only the tokens; when it validates, claim() turns them
+into the storage paths the record lists. Nothing is held in memory beyond
+one read block.
+"""
+import hashlib
+import os
+import secrets
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+
+from .models import UploadSession
+from .storage import upload_storage
+from .thumbnails import is_image
+
+# Storage directory for each purpose, as used by the multipart form uploads
+PURPOSE_DIRECTORIES = {
+    'driver_report': 'pre_inspection/driver_reports',
+    'replaced_part': 'post_inspection/replaced_parts',
+}
+
+CHUNK_SIZE = 1024 * 1024  # what the browser is told to send
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+READ_BLOCK = 64 * 1024
+
+
+class OffsetMismatch(ValidationError):
+    """A chunk did not start where the previous one ended"""
+
+    def __init__(self, received):
+        super().__init__(f"Chunk must start at byte {received}.")
+        self.received = received
+
+
+def upload_dir():
+    return getattr(settings, 'CHUNKED_UPLOAD_DIR', os.path.join(settings.MEDIA_ROOT, 'chunked_uploads'))
+
+
+def max_upload_size():
+    return getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 100 * 1024 * 1024)
+
+
+def part_path(session):
+    return os.path.join(upload_dir(), f'{session.token}.part')
+
+
+def start_session(user, purpose, filename, size, checksum=''):
+    """Validate the announced file and open an UploadSession for it"""
+    filename = os.path.basename(str(filename or '').replace('\\', '/')).strip()
+    if purpose not in PURPOSE_DIRECTORIES:
+        raise ValidationError("Unknown upload type.")
+    if not filename:
+        raise ValidationError("A file name is required.")
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise ValidationError("The file size must be a whole number of bytes.")
+    if size <= 0:
+        raise ValidationError("Empty files cannot be uploaded.")
+    if size > max_upload_size():
+        raise ValidationError(f"Files larger than {max_upload_size() // (1024 * 1024)} MB cannot be uploaded.")
+    if purpose == 'replaced_part' and not is_image(filename):
+        raise ValidationError("Replaced part uploads must be images (JPG, PNG, etc.).")
+    checksum = (checksum or '').strip().lower()
+    if checksum and (len(checksum) != 64 or any(c not in '0123456789abcdef' for c in checksum)):
+        raise ValidationError("The checksum must be a hex SHA-256 digest.")
+
+    os.makedirs(upload_dir(), exist_ok=True)
+    session = UploadSession.objects.create(
+        token=secrets.token_hex(32),
+        user=user,
+        purpose=purpose,
+        filename=filename[:255],
+        size=size,
+        checksum=checksum,
+    )
+    # Create the part file up front so a resumed upload can always append to it
+    open(part_path(session), 'wb').close()
+    return session
+
+
+def get_session(token, user):
+    """The caller's UploadSession for token, or None"""
+    return UploadSession.objects.filter(token=token, user=user).first()
+
+
+def _check_chunk(session, offset, length):
+    if session.status != 'uploading':
+        raise ValidationError("This upload is already complete.")
+    if offset != session.received:
+        raise OffsetMismatch(session.received)
+    if session.received + length > session.size:
+        raise ValidationError("The chunk goes past the announced file size.")
+
+
+def _spool_chunk(stream, length, chunk_checksum, directory):
+    """Copy `length` bytes of `stream` into a temporary file in `directory` and verify them; returns its path"""
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.chunk-')
+    try:
+        digest = hashlib.sha256()
+        written = 0
+        with os.fdopen(descriptor, 'wb') as spool:
+            while written < length:
+                block = stream.read(min(READ_BLOCK, length - written))
+                if not block:
+                    break
+                spool.write(block)
+                digest.update(block)
+                written += len(block)
+        if written != length:
+            raise ValidationError("The chunk ended early; resend it.")
+        if chunk_checksum and digest.hexdigest() != chunk_checksum.strip().lower():
+            raise ValidationError("The chunk checksum does not match; resend it.")
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def append_chunk(session, offset, stream, length, chunk_checksum=''):
+    """
+    Write `length` bytes read from `stream` at `offset`, which must equal
+    session.received. Returns the updated session.
+
+    The body is spooled to a temporary file before the session row is locked,
+    so a slow client never holds the lock; only the local copy onto the part
+    file happens under it.
+    """
+    if length <= 0 or length > MAX_CHUNK_SIZE:
+        raise ValidationError(f"Chunks must be between 1 byte and {MAX_CHUNK_SIZE // (1024 * 1024)} MB.")
+    # Refuse a stale offset before reading the body; it is checked again under the lock
+    _check_chunk(session, offset, length)
+
+    temp_path = _spool_chunk(stream, length, chunk_checksum, upload_dir())
+    try:
+        with transaction.atomic():
+            # One writer per session: concurrent retries of the same chunk queue up here
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            _check_chunk(session, offset, length)
+
+            with open(part_path(session), 'r+b') as part, open(temp_path, 'rb') as spool:
+                part.seek(offset)
+                try:
+                    shutil.copyfileobj(spool, part, READ_BLOCK)
+                except Exception:
+                    # Drop the partial chunk so the upload resumes from the last good byte
+                    part.truncate(offset)
+                    raise
+                part.truncate(offset + length)
+
+            session.received = offset + length
+            session.save(update_fields=['received', 'updated_at'])
+    finally:
+        os.remove(temp_path)
+    return session
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for block in iter(lambda: part.read(READ_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete(session):
+    """Verify the assembled file and move it into upload storage; returns the updated session"""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == 'complete':
+            return session
+        if session.received != session.size:
+            raise ValidationError(f"Only {session.received} of {session.size} bytes have been received.")
+
+        path = part_path(session)
+        if session.checksum and _file_digest(path) != session.checksum:
+            # The chunks were individually fine but the file is not: start over
+            open(path, 'wb').close()
+            session.received = 0
+            session.save(update_fields=['received', 'updated_at'])
+        else:
+            directory = PURPOSE_DIRECTORIES[session.purpose]
+            with open(path, 'rb') as part:
+                session.path = upload_storage().save(f'{directory}/{session.filename}', File(part))
+            session.status = 'complete'
+            session.save(update_fields=['path', 'status', 'updated_at'])
+
+    if session.status != 'complete':
+        raise ValidationError("The file checksum does not match; upload it again.")
+    os.remove(path)
+    return session
+
+
+def completed_sessions(user, tokens, purpose):
+    """The user's complete uploads for `tokens`, in token order"""
+    tokens = [token for token in dict.fromkeys(tokens) if token]
+    if not tokens:
+        return []
+    sessions = {
+        session.token: session
+        for session in UploadSession.objects.filter(
+            token__in=tokens, user=user, purpose=purpose, status='complete',
+        )
+    }
+    return [sessions[token] for token in tokens if token in sessions]
+
+
+def claim(user, tokens, purpose):
+    """
+    Storage paths of the completed uploads in `tokens`, for a valid form.
+    The sessions are deleted, so call it in the transaction.atomic() block
+    that saves the record: a failed save then leaves them to be claimed again.
+    """
+    sessions = completed_sessions(user, tokens, purpose)
+    UploadSession.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+    return [session.path for session in sessions]
+
+
+def discard_stale(before):
+    """Delete upload sessions last touched before `before` with their part files; returns how many"""
+    stale = UploadSession.objects.filter(updated_at__lt=before)
+    count = 0
+    for session in stale.iterator(chunk_size=1000):
+        try:
+            os.remove(part_path(session))
+        except FileNotFoundError:
+            pass
+        count += 1
+    stale.delete()
+    return count
@@ -0,0 +1,236 @@
+"""
+Streaming ZIP dossiers of vehicle records, for audits.
+
+zip_stream() writes the archive into a small in-memory sink and yields
+whatever the zipfile module has produced after every block, so a response
+built on it starts downloading at once, never touches a temp file and holds
+one read block plus one CSV batch in memory however large the files are
+(plus one short files.csv row per archived file).
+The archive has no central directory until the end, which is fine for every
+unzip tool; entries use data descriptors because the output is not seekable.
+
+Layout of a dossier (dossier_entries):
+
+    manifest/repairs.csv, manifest/pms.csv, manifest/inspections.csv
+    <plate>/vehicle/photos/01.jpg, <plate>/vehicle/registration_documents/01.pdf
+    <plate>/pre_inspections/<id>_<date>/<kind>/01.jpg
+    <plate>/post_inspections/<id>_<date>/<kind>/01.jpg
+    manifest/files.csv   every listed file with its record, storage path, size and hash
+
+Stored files are named after their content hash (core.storage), so the
+archive names them by position and files.csv maps them back.
+"""
+import csv
+import io
+import os
+import posixpath
+import re
+import zipfile
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import PMS, Attachment, PostInspectionReport, PreInspectionReport, Repair
+
+READ_BLOCK = 64 * 1024
+CSV_BATCH = 500
+
+# Leading characters that make Excel and LibreOffice evaluate a CSV cell
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# Already compressed: deflating them again costs CPU for nothing
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.pdf', '.zip', '.docx', '.xlsx'}
+
+
+class _Sink:
+    """Write-only file object that hands its bytes back through drain()"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _zip_info(arcname, size=None):
+    info = zipfile.ZipInfo(arcname, date_time=timezone.localtime().timetuple()[:6])
+    extension = os.path.splitext(arcname)[1].lower()
+    info.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+    if size is not None:
+        # Lets zipfile pick ZIP64 headers up front for files over 2 GB
+        info.file_size = size
+    return info
+
+
+def zip_stream(entries):
+    """
+    Yield a ZIP archive of `entries` as it is written. Each entry is
+    (arcname, chunks, size): chunks is an iterable of bytes produced only
+    when the entry is reached, size the length if known in advance.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for arcname, chunks, size in entries:
+            with archive.open(_zip_info(arcname, size), 'w') as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # The central directory is written when the archive closes
+    yield sink.drain()
+
+
+def file_chunks(full_path):
+    with open(full_path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b''):
+            yield block
+
+
+def _csv_cell(value):
+    # Spreadsheets run a cell starting with one of these as a formula; the quote makes it text
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(header, rows):
+    """
+    CSV bytes for header + rows, encoded a batch of rows at a time (UTF-8
+    with BOM for Excel). Text that a spreadsheet would take for a formula is
+    prefixed with a quote.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_csv_cell(value) for value in row])
+        if count % CSV_BATCH == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _folder(text):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(text)).strip('_') or 'unnamed'
+
+
+def _in_range(queryset, field, start, end):
+    if start:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{field}__lte': end})
+    return queryset
+
+
+def _repair_rows(vehicles, start, end):
+    repairs = _in_range(Repair.objects.filter(vehicle__in=vehicles), 'date_of_repair', start, end)
+    repairs = repairs.select_related('vehicle', 'repair_shop').order_by('vehicle__plate_number', 'date_of_repair', 'pk')
+    for repair in repairs.iterator(chunk_size=1000):
+        yield [
+            repair.vehicle.plate_number, repair.pk, repair.date_of_repair, repair.status, repair.description,
+            repair.cost, repair.labor_cost or '', repair.repair_shop.name if repair.repair_shop else '',
+            repair.technician, repair.pre_inspection_id or '', repair.post_inspection_id or '',
+        ]
+
+
+def _pms_rows(vehicles, start, end):
+    records = _in_range(PMS.objects.filter(vehicle__in=vehicles), 'scheduled_date', start, end)
+    records = records.select_related('vehicle').order_by('vehicle__plate_number', 'scheduled_date', 'pk')
+    for pms in records.iterator(chunk_size=1000):
+        yield [
+            pms.vehicle.plate_number, pms.pk, pms.service_type, pms.scheduled_date, pms.completed_date or '',
+            pms.status, pms.mileage_at_service, pms.cost if pms.cost is not None else '', pms.provider,
+            pms.pre_inspection_id or '', pms.post_inspection_id or '',
+        ]
+
+
+def _inspection_rows(vehicles, start, end):
+    for label, model in (('pre', PreInspectionReport), ('post', PostInspectionReport)):
+        reports = _in_range(model.objects.filter(vehicle__in=vehicles), 'inspection_date__date', start, end)
+        reports = reports.select_related('vehicle', 'inspected_by', 'approved_by')
+        for report in reports.order_by('vehicle__plate_number', 'inspection_date', 'pk').iterator(chunk_size=1000):
+            yield [
+                report.vehicle.plate_number, label, report.pk, report.get_report_type_display(),
+                timezone.localtime(report.inspection_date).strftime('%Y-%m-%d %H:%M'),
+                report.inspected_by.get_full_name() or report.inspected_by.username,
+                (report.approved_by.get_full_name() or report.approved_by.username) if report.approved_by else '',
+                getattr(report, 'pre_inspection_id', '') or '',
+            ]
+
+
+def _attachment_files(owner_type, owners, folder_of, files):
+    """Archive entries for the Attachment rows of `owners`; appends a files.csv row per listed file"""
+    attachments = Attachment.objects.filter(
+        content_type=ContentType.objects.get_for_model(owner_type),
+        object_id__in=[owner.pk for owner in owners],
+    ).order_by('object_id', 'kind', 'position')
+    folders = {owner.pk: folder_of(owner) for owner in owners}
+    for attachment in attachments:
+        extension = os.path.splitext(attachment.path)[1].lower()
+        arcname = posixpath.join(folders[attachment.object_id], attachment.kind, f'{attachment.position + 1:02d}{extension}')
+        try:
+            full_path = default_storage.path(attachment.path)
+            size = os.path.getsize(full_path)
+        except (OSError, NotImplementedError, SuspiciousFileOperation):
+            files.append([arcname, owner_type.__name__, attachment.object_id, attachment.kind, attachment.path, '', '', 'missing'])
+            continue
+        files.append([arcname, owner_type.__name__, attachment.object_id, attachment.kind, attachment.path, size, attachment.sha256, 'included'])
+        yield arcname, file_chunks(full_path), size
+
+
+def dossier_entries(vehicles, start=None, end=None, include_vehicle_files=True):
+    """
+    zip_stream() entries for `vehicles` (a queryset): CSV manifests of their
+    repairs, PMS and inspections in the date range, then the vehicle files and
+    inspection attachments, then files.csv. Records are read vehicle by vehicle.
+    """
+    yield 'manifest/repairs.csv', csv_chunks(
+        ['Plate Number', 'Repair ID', 'Date', 'Status', 'Description', 'Cost', 'Labor Cost', 'Repair Shop',
+         'Technician', 'Pre-Inspection ID', 'Post-Inspection ID'],
+        _repair_rows(vehicles, start, end),
+    ), None
+    yield 'manifest/pms.csv', csv_chunks(
+        ['Plate Number', 'PMS ID', 'Service Type', 'Scheduled Date', 'Completed Date', 'Status', 'Mileage',
+         'Cost', 'Provider', 'Pre-Inspection ID', 'Post-Inspection ID'],
+        _pms_rows(vehicles, start, end),
+    ), None
+    yield 'manifest/inspections.csv', csv_chunks(
+        ['Plate Number', 'Stage', 'Report ID', 'Report Type', 'Inspection Date', 'Inspected By', 'Approved By',
+         'Pre-Inspection ID'],
+        _inspection_rows(vehicles, start, end),
+    ), None
+
+    files = []
+    for vehicle in vehicles.order_by('plate_number').iterator(chunk_size=100):
+        plate = _folder(vehicle.plate_number)
+        if include_vehicle_files:
+            yield from _attachment_files(type(vehicle), [vehicle], lambda owner: f'{plate}/vehicle', files)
+        for stage, model in (('pre_inspections', PreInspectionReport), ('post_inspections', PostInspectionReport)):
+            reports = _in_range(model.objects.filter(vehicle=vehicle), 'inspection_date__date', start, end)
+            reports = list(reports.only('pk', 'inspection_date'))
+            if reports:
+                yield from _attachment_files(model, reports, lambda report, stage=stage: posixpath.join(
+                    plate, stage, f'{report.pk}_{timezone.localtime(report.inspection_date):%Y-%m-%d}',
+                ), files)
+
+    yield 'manifest/files.csv', csv_chunks(
+        ['Archive Name', 'Record Type', 'Record ID', 'Kind', 'Storage Path', 'Size (bytes)', 'SHA-256', 'Status'],
+        files,
+    ), None
@@ -0,0 +1,373 @@
+"""
+Streaming CSV and XLSX exports of the repair list, PMS list and reports.
+
+export_response() turns a header and an iterable of rows into a
+StreamingHttpResponse, so the download starts at once and memory stays at
+one batch of rows however many there are:
+
+  csv   dossier.csv_chunks (UTF-8 with a BOM so Excel picks the encoding)
+  xlsx  a minimal SpreadsheetML package written through dossier.zip_stream;
+        strings are stored inline, so there is no shared-string table to
+        build up, and rows are written to the sheet as they are read
+
+The row builders take querysets that the views filter exactly as their
+list pages do, and read them with iterator(chunk_size=...).
+"""
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import groupby
+from xml.sax.saxutils import escape
+
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce, ExtractMonth
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .dossier import csv_chunks, zip_stream
+from .models import FuelMonthlyRollup, TollMonthlyRollup
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+CHUNK_SIZE = 2000
+XLSX_BATCH = 500
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Characters XML 1.0 cannot carry at all
+_XML_ILLEGAL_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+# Cell styles in _STYLES: 0 plain, 1 bold header, 2 date, 3 date and time, 4 amount
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="5">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs></styleSheet>'
+)
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/></Relationships>'
+)
+
+
+def _xml_text(value):
+    return escape(_XML_ILLEGAL_RE.sub('', str(value)), {'"': '&quot;'})
+
+
+def _cell(value, style=0):
+    """One <c> element; rows carry no cell references, which Excel reads as consecutive columns"""
+    if value is None or value == '':
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value)
+        serial = (value - _EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c s="3"><v>{serial:.6f}</v></c>'
+    if isinstance(value, date):
+        return f'<c s="2"><v>{(value - _EXCEL_EPOCH.date()).days}</v></c>'
+    if isinstance(value, Decimal):
+        return f'<c s="4"><v>{value}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    style_attr = f' s="{style}"' if style else ''
+    return f'<c t="inlineStr"{style_attr}><is><t xml:space="preserve">{_xml_text(value)}</t></is></c>'
+
+
+def _sheet_chunks(header, rows):
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+        'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews><sheetData>',
+        '<row>' + ''.join(_cell(title, style=1) for title in header) + '</row>',
+    ]
+    for count, row in enumerate(rows, 1):
+        parts.append('<row>' + ''.join(_cell(value) for value in row) + '</row>')
+        if count % XLSX_BATCH == 0:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+    parts.append('</sheetData></worksheet>')
+    yield ''.join(parts).encode('utf-8')
+
+
+def xlsx_chunks(sheet_title, header, rows):
+    """A one-sheet XLSX workbook of header + rows, yielded as it is written"""
+    sheet_title = re.sub(r'[\[\]:*?/\\]', ' ', sheet_title)[:31] or 'Sheet1'
+    workbook = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{_xml_text(sheet_title)}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    )
+    entries = [
+        ('[Content_Types].xml', [_CONTENT_TYPES.encode()], None),
+        ('_rels/.rels', [_ROOT_RELS.encode()], None),
+        ('xl/workbook.xml', [workbook.encode('utf-8')], None),
+        ('xl/_rels/workbook.xml.rels', [_WORKBOOK_RELS.encode()], None),
+        ('xl/styles.xml', [_STYLES.encode()], None),
+        ('xl/worksheets/sheet1.xml', _sheet_chunks(header, rows), None),
+    ]
+    return zip_stream(entries)
+
+
+def export_response(fmt, filename, sheet_title, header, rows):
+    """Streamed download of header + rows as `fmt` ('csv' or 'xlsx'); filename is without extension"""
+    if fmt == 'xlsx':
+        response = StreamingHttpResponse(xlsx_chunks(sheet_title, header, rows), content_type=XLSX_CONTENT_TYPE)
+    else:
+        response = StreamingHttpResponse(csv_chunks(header, _csv_values(rows)), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def _csv_values(rows):
+    for row in rows:
+        yield [
+            timezone.localtime(value).strftime('%Y-%m-%d %H:%M')
+            if isinstance(value, datetime) and timezone.is_aware(value) else value
+            for value in row
+        ]
+
+
+def _total_cost():
+    return F('cost') + Coalesce(F('labor_cost'), Value(0, output_field=DecimalField(max_digits=10, decimal_places=2)))
+
+
+def _localtime(value):
+    return timezone.localtime(value) if value and timezone.is_aware(value) else value
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+REPAIR_HEADER = [
+    'Repair ID', 'Date', 'Plate Number', 'Vehicle', 'Division', 'Description', 'Parts Replaced',
+    'Parts Cost', 'Labor Cost', 'Total Cost', 'Repair Shop', 'Technician', 'Status', 'Created At',
+]
+
+
+def _part_names(repair_ids):
+    """'Part (qty unit)' labels of the part items of each repair in repair_ids"""
+    from .models import RepairPartItem
+    
+    names = {}
+    items = RepairPartItem.objects.filter(repair_id__in=repair_ids).order_by('repair_id', 'pk')
+    for repair_id, name, quantity, unit in items.values_list('repair_id', 'part__name', 'quantity', 'unit'):
+        label = name or 'N/A'
+        if quantity:
+            label += f' ({quantity} {unit})'.replace(' )', ')')
+        names.setdefault(repair_id, []).append(label)
+    return names
+
+
+def repair_rows(repairs):
+    # Plain value rows: building Repair and Vehicle instances (with their change tracking)
+    # would cost several times the query itself on a ten-year export
+    rows = repairs.values_list(
+        'pk', 'date_of_repair', 'vehicle__plate_number', 'vehicle__brand', 'vehicle__model',
+        'vehicle__division__name', 'description', 'repairing_part__name', 'cost', 'labor_cost',
+        'repair_shop__name', 'technician', 'status', 'created_at',
+    ).iterator(chunk_size=CHUNK_SIZE)
+    for batch in _batches(rows, CHUNK_SIZE):
+        part_names = _part_names([row[0] for row in batch])
+        for (pk, repaired_on, plate, brand, model, division, description, repairing_part, cost, labor_cost,
+             shop, technician, status, created_at) in batch:
+            yield [
+                pk, repaired_on, plate, f'{brand} {model}', division or '', description,
+                '; '.join(part_names.get(pk, [])) or repairing_part or '',
+                cost, labor_cost, (cost or 0) + (labor_cost or 0), shop or '', technician, status,
+                _localtime(created_at),
+            ]
+
+
+PMS_HEADER = [
+    'PMS ID', 'Plate Number', 'Vehicle', 'Service Type', 'Scheduled Date', 'Due Date', 'Completed Date',
+    'Status', 'Mileage at Service', 'Next Service Mileage', 'Cost', 'Provider', 'Technician', 'Description',
+]
+
+
+def pms_rows(records):
+    rows = records.values_list(
+        'pk', 'vehicle__plate_number', 'vehicle__brand', 'vehicle__model', 'service_type', 'scheduled_date',
+        'due_date', 'completed_date', 'status', 'mileage_at_service', 'next_service_mileage', 'cost',
+        'provider', 'technician', 'description',
+    )
+    for pk, plate, brand, model, *rest in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield [pk, plate, f'{brand} {model}', *rest]
+
+
+# ?report= for the reports export: title, header and a row builder taking (completed repairs, year)
+def _monthly_rows(completed, year):
+    totals = dict(
+        completed.filter(date_of_repair__year=year)
+        .annotate(month=ExtractMonth('date_of_repair')).values('month')
+        .annotate(total=Sum(_total_cost())).values_list('month', 'total')
+    )
+    for month in range(1, 13):
+        yield [date(year, month, 1).strftime('%B'), year, totals.get(month) or Decimal('0')]
+
+
+def _vehicle_rows(completed, year):
+    totals = (
+        completed.values('vehicle__plate_number', 'vehicle__brand', 'vehicle__model', 'vehicle__division__name')
+        .annotate(repairs=Count('pk'), total=Sum(_total_cost())).order_by('-total', 'vehicle__plate_number')
+    )
+    for row in totals.iterator(chunk_size=CHUNK_SIZE):
+        yield [
+            row['vehicle__plate_number'], f"{row['vehicle__brand']} {row['vehicle__model']}",
+            row['vehicle__division__name'] or '', row['repairs'], row['total'],
+        ]
+
+
+def _division_rows(completed, year):
+    totals = (
+        completed.exclude(vehicle__division__isnull=True).values('vehicle__division__name')
+        .annotate(vehicles=Count('vehicle', distinct=True), repairs=Count('pk'), total=Sum(_total_cost()))
+        .order_by('-total')
+    )
+    for row in totals:
+        yield [row['vehicle__division__name'], row['vehicles'], row['repairs'], row['total']]
+
+
+def _fuel_vehicle_rows(completed, year):
+    """Fuel (from the monthly rollups) next to completed repair costs, for the year"""
+    repairs = dict(
+        completed.filter(date_of_repair__year=year).values('vehicle')
+        .annotate(total=Sum(_total_cost())).values_list('vehicle', 'total')
+    )
+    totals = (
+        FuelMonthlyRollup.objects.filter(month__year=year)
+        .values('vehicle', 'vehicle__plate_number', 'vehicle__brand', 'vehicle__model', 'vehicle__division__name')
+        .annotate(transactions=Sum('transactions'), liters=Sum('liters'), amount=Sum('amount'))
+        .order_by('-amount', 'vehicle__plate_number')
+    )
+    for row in totals.iterator(chunk_size=CHUNK_SIZE):
+        repair_cost = repairs.get(row['vehicle']) or Decimal('0')
+        yield [
+            row['vehicle__plate_number'], f"{row['vehicle__brand']} {row['vehicle__model']}",
+            row['vehicle__division__name'] or '', row['transactions'], row['liters'], row['amount'],
+            repair_cost, row['amount'] + repair_cost,
+        ]
+
+
+def _fuel_division_rows(completed, year):
+    repairs = dict(
+        completed.filter(date_of_repair__year=year).values('vehicle__division__name')
+        .annotate(total=Sum(_total_cost())).values_list('vehicle__division__name', 'total')
+    )
+    totals = (
+        FuelMonthlyRollup.objects.filter(month__year=year).values('vehicle__division__name')
+        .annotate(
+            vehicles=Count('vehicle', distinct=True), transactions=Sum('transactions'),
+            liters=Sum('liters'), amount=Sum('amount'),
+        )
+        .order_by('-amount')
+    )
+    for row in totals:
+        division = row['vehicle__division__name']
+        repair_cost = repairs.get(division) or Decimal('0')
+        yield [
+            division or 'No division', row['vehicles'], row['transactions'], row['liters'], row['amount'],
+            repair_cost, row['amount'] + repair_cost,
+        ]
+
+
+def _toll_vehicle_rows(completed, year):
+    """Toll spend (from the monthly rollups) per vehicle and month of the year"""
+    totals = (
+        TollMonthlyRollup.objects.filter(month__year=year)
+        .values_list(
+            'vehicle', 'vehicle__plate_number', 'vehicle__brand', 'vehicle__model', 'vehicle__division__name',
+            'month', 'amount',
+        )
+        .order_by('vehicle__plate_number', 'vehicle', 'month')
+    )
+    for (_, plate_number, brand, model, division), months in groupby(
+        totals.iterator(chunk_size=CHUNK_SIZE), key=lambda row: row[:5],
+    ):
+        amounts = [Decimal('0')] * 12
+        for row in months:
+            amounts[row[5].month - 1] += row[6]
+        yield [plate_number, f"{brand} {model}", division or '', *amounts, sum(amounts)]
+
+
+def _toll_division_rows(completed, year):
+    totals = (
+        TollMonthlyRollup.objects.filter(month__year=year).values('vehicle__division__name', 'month')
+        .annotate(amount=Sum('amount')).order_by()
+    )
+    amounts = {}
+    for row in totals:
+        division = row['vehicle__division__name'] or 'No division'
+        amounts.setdefault(division, [Decimal('0')] * 12)[row['month'].month - 1] += row['amount']
+    for division, months in sorted(amounts.items(), key=lambda item: -sum(item[1])):
+        yield [division, *months, sum(months)]
+
+
+FUEL_COST_COLUMNS = ['Fuel Transactions', 'Liters', 'Fuel Cost', 'Repair Cost', 'Fuel + Repair Cost']
+MONTH_COLUMNS = [date(2000, month, 1).strftime('%b') for month in range(1, 13)]
+
+REPORTS = {
+    'monthly': ('Monthly Repair Costs', ['Month', 'Year', 'Cost'], _monthly_rows),
+    'vehicles': ('Repair Costs by Vehicle', ['Plate Number', 'Vehicle', 'Division', 'Completed Repairs', 'Cost'], _vehicle_rows),
+    'divisions': ('Repair Costs by Division', ['Division', 'Vehicles', 'Completed Repairs', 'Cost'], _division_rows),
+    'fuel_vehicles': ('Fuel and Repair Costs by Vehicle', ['Plate Number', 'Vehicle', 'Division', *FUEL_COST_COLUMNS], _fuel_vehicle_rows),
+    'fuel_divisions': ('Fuel and Repair Costs by Division', ['Division', 'Vehicles', *FUEL_COST_COLUMNS], _fuel_division_rows),
+    'toll_vehicles': ('Toll Spend by Vehicle', ['Plate Number', 'Vehicle', 'Division', *MONTH_COLUMNS, 'Total'], _toll_vehicle_rows),
+    'toll_divisions': ('Toll Spend by Division', ['Division', *MONTH_COLUMNS, 'Total'], _toll_division_rows),
+}
+# Reports limited to ?year=
+YEARLY_REPORTS = {'monthly', 'fuel_vehicles', 'fuel_divisions', 'toll_vehicles', 'toll_divisions'}
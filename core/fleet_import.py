@@ -0,0 +1,432 @@
+"""
+Bulk import of vehicles and drivers from CSV/XLSX files.
+
+Rows are streamed from the file (core.importers) and handled a batch at a
+time: one query loads the batch's existing records, every row is checked with
+the same rules as the edit forms (VehicleImportForm / DriverForm), divisions
+and drivers are matched by name against dictionaries loaded once, and the
+valid rows are written with one bulk_create and one bulk_update per batch.
+Rows with errors are skipped and reported by line; since records are keyed
+(vehicles on plate number, drivers on license number, both compared without
+separators or case) the corrected file can simply be imported again.
+
+On an existing record a blank cell keeps the stored value.
+bulk_create/bulk_update send no signals, so the importer does what
+Vehicle.save() and the post_save handlers would: normalized identifiers,
+status tracking and the search index (core.search.index_many).
+"""
+import logging
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.forms.models import model_to_dict
+from django.utils import timezone
+
+from .forms import DriverForm, VehicleImportForm
+from .fuel import import_fuel_statement
+from .importers import NUMBER_NOISE_RE, ImportResult, batched, normalize_header, read_rows
+from .models import Division, Driver, Vehicle, normalize_identifier
+from .search import index_many
+from .tolls import import_toll_statement
+from .vehicle_status import SERVICEABLE, recompute_statuses, with_derived_status
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+IMPORT_STATUS_REASON = 'Set by bulk import'
+
+# Other headers used for the columns; headers matching a field name or label need no entry
+VEHICLE_ALIASES = {
+    'plate': 'plate_number',
+    'plate_no': 'plate_number',
+    'type': 'vehicle_type',
+    'engine_no': 'engine_number',
+    'chassis_no': 'chassis_number',
+    'mileage': 'current_mileage',
+    'odometer': 'current_mileage',
+    'market_value': 'current_market_value',
+    'division_name': 'division',
+    'driver': 'assigned_driver',
+    'driver_name': 'assigned_driver',
+    'driver_license': 'assigned_driver',
+    'autosweep': 'rfid_autosweep_number',
+    'easytrip': 'rfid_easytrip_number',
+    'fleet_card': 'fleet_card_number',
+    'fleet_card_no': 'fleet_card_number',
+}
+DRIVER_ALIASES = {
+    'driver': 'name',
+    'driver_name': 'name',
+    'license': 'license_number',
+    'license_no': 'license_number',
+    'drivers_license': 'license_number',
+    'contact_number': 'phone',
+    'phone_number': 'phone',
+    'mobile': 'phone',
+    'email_address': 'email',
+}
+
+# (header, what goes in it) for the upload page
+VEHICLE_IMPORT_COLUMNS = [
+    ('Plate Number', 'Required. A vehicle with this plate is updated, otherwise one is created'),
+    ('Vehicle Type', ', '.join(value for value, _ in Vehicle.VEHICLE_TYPE_CHOICES)),
+    ('Brand, Model, Year', 'Required for new vehicles'),
+    ('Date Acquired', 'Required for new vehicles; YYYY-MM-DD or MM/DD/YYYY'),
+    ('Division', 'Name of an existing division'),
+    ('Assigned Driver', 'License number or name of an existing driver'),
+    ('Status', 'Optional; a status the repairs and PMS would not give is kept as a manual override'),
+    ('Current Mileage, Acquisition Cost, Current Market Value', 'Optional numbers'),
+    ('Engine Number, Chassis Number, Color, Autosweep RFID Number, Easytrip RFID Number, '
+     'Fleet Card Number, Gas Station, Notes', 'Optional'),
+]
+DRIVER_IMPORT_COLUMNS = [
+    ('License Number', 'Required. A driver with this license is updated, otherwise one is created'),
+    ('Name', 'Required for new drivers'),
+    ('Phone, Email', 'Optional'),
+]
+FUEL_IMPORT_COLUMNS = [
+    ('Card Number', "Required; matched to the vehicles' fleet card numbers"),
+    ('Transaction Date', 'Required, with the time in it or in a Transaction Time column'),
+    ('Amount', 'Required'),
+    ('Liters, Unit Price, Station, Product, Odometer, Reference', 'Optional'),
+]
+TOLL_IMPORT_COLUMNS = [
+    ('Tag Number', "Required; matched to the vehicles' Autosweep and Easytrip RFID numbers"),
+    ('Transaction Date', 'Required, with the time in it or in a Transaction Time column'),
+    ('Amount', 'Required'),
+    ('Provider', 'Optional (Autosweep or Easytrip); otherwise taken from the matched tag'),
+    ('Entry Plaza, Exit Plaza, Reference', 'Optional'),
+]
+
+# Choice columns matched without regard to case ('Pick up' -> 'PICK UP')
+CHOICE_FIELDS = {
+    'vehicle_type': Vehicle.VEHICLE_TYPE_CHOICES,
+    'status': Vehicle.STATUS_CHOICES,
+}
+# Thousands separators and peso signs are dropped from numbers
+NUMBER_FIELDS = {'year', 'acquisition_cost', 'current_market_value', 'current_mileage'}
+
+_AMBIGUOUS = object()
+
+
+def _index(pairs):
+    """{key: value} where a key given for two values maps to _AMBIGUOUS"""
+    index = {}
+    for key, value in pairs:
+        if key:
+            index[key] = _AMBIGUOUS if key in index and index[key] is not value else value
+    return index
+
+
+def _name_key(name):
+    return ' '.join(str(name or '').split()).casefold()
+
+
+def _column_map(form_class, aliases, extra=()):
+    """normalized header -> field name, from the field names, their labels and the aliases"""
+    columns = {}
+    for name, field in form_class.base_fields.items():
+        columns[name] = name
+        if field.label:
+            columns.setdefault(normalize_header(field.label), name)
+    for name in extra:
+        columns[name] = name
+    columns.update(aliases)
+    return columns
+
+
+def _map_row(row, columns):
+    return {columns[header]: value for header, value in row.items() if header in columns}
+
+
+def _clean_values(row):
+    for field, choices in CHOICE_FIELDS.items():
+        if row.get(field):
+            canonical = {value.casefold(): value for value, _ in choices}
+            row[field] = canonical.get(row[field].casefold(), row[field])
+    for field in NUMBER_FIELDS:
+        if row.get(field):
+            row[field] = NUMBER_NOISE_RE.sub('', row[field])
+    return row
+
+
+def _form_data(form_class, row, instance):
+    """Form data for a row: the stored values (or defaults) overlaid with the row's non-blank cells"""
+    fields = form_class._meta.fields
+    if instance is None:
+        data = {}
+        for name in fields:
+            model_field = form_class._meta.model._meta.get_field(name)
+            # Blank or missing columns get the model default, as on a new record
+            if model_field.has_default():
+                data[name] = model_field.get_default()
+    else:
+        data = model_to_dict(instance, fields=fields)
+    data.update({name: value for name, value in row.items() if name in fields and value})
+    return data
+
+
+def _bind(form, data, instance):
+    """
+    Point one form at the next row. A new form per row deep-copies every
+    field, which costs more than the checks themselves.
+    """
+    form.data = data
+    form.instance = instance if instance is not None else form._meta.model()
+    form.is_bound = True
+    form._errors = None
+    form._bound_fields_cache = {}
+    return form
+
+
+def _values(instance):
+    return {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+
+
+def _changes(instance, before):
+    """{column: new value} for what the row changed on an existing record"""
+    return {
+        attname: value for attname, value in _values(instance).items()
+        if attname != 'updated_at' and value != before[attname]
+    }
+
+
+def _update_rows(model, updates, **extra):
+    """
+    Write (instance, changes) pairs with one UPDATE per distinct set of
+    changes. bulk_update() builds a CASE per row and column, which costs far
+    more than the rows themselves, and most re-imported rows share their changes.
+    """
+    groups = {}
+    for instance, changes in updates:
+        groups.setdefault(tuple(sorted(changes.items())), []).append(instance.pk)
+    for changes, pks in groups.items():
+        for start in range(0, len(pks), BATCH_SIZE):
+            model.objects.filter(pk__in=pks[start:start + BATCH_SIZE]).update(**dict(changes), **extra)
+
+
+def _assign_pks(instances, model, key):
+    """Set the primary keys bulk_create could not return (MySQL) by reading them back through `key`"""
+    missing = [instance for instance in instances if instance.pk is None]
+    if not missing:
+        return
+    # Highest pk per key: the row just created when an older one shares it
+    pks = dict(
+        model.objects.filter(**{f'{key}__in': [getattr(instance, key) for instance in missing]})
+        .order_by('pk').values_list(key, 'pk')
+    )
+    for instance in missing:
+        instance.pk = pks.get(getattr(instance, key))
+        instance._state.adding = False
+
+
+def _reindex(instances):
+    try:
+        index_many(instances)
+    except DatabaseError as e:
+        # Like the signal handlers: the import stands, rebuild_search_index repairs the index
+        logger.error(f"Error updating search index after import: {e}")
+
+
+class _DriverLookup:
+    """Drivers by license number or name, loaded once per import"""
+
+    def __init__(self):
+        drivers = list(Driver.objects.all())
+        self.by_license = _index((normalize_identifier(driver.license_number), driver) for driver in drivers)
+        self.by_name = _index((_name_key(driver.name), driver) for driver in drivers)
+
+    def find(self, value):
+        driver = self.by_license.get(normalize_identifier(value))
+        if driver is None:
+            driver = self.by_name.get(_name_key(value))
+        return driver
+
+
+def import_vehicles(file, filename, user=None, dry_run=False, batch_size=BATCH_SIZE):
+    """Create or update vehicles from a CSV/XLSX file, keyed on plate number; returns an ImportResult"""
+    result = ImportResult(dry_run)
+    columns = _column_map(VehicleImportForm, VEHICLE_ALIASES, extra=('division', 'assigned_driver'))
+    divisions = _index((_name_key(division.name), division) for division in Division.objects.all())
+    drivers = _DriverLookup()
+    form = VehicleImportForm()
+    seen = {}  # normalized plate -> line it was first read on
+    checked_header = False
+
+    for batch in batched(read_rows(file, filename), batch_size):
+        result.rows += len(batch)
+        rows = []
+        for line, raw in batch:
+            row = _clean_values(_map_row(raw, columns))
+            if not checked_header:
+                if 'plate_number' not in row:
+                    raise ValidationError('The file has no Plate Number column.')
+                checked_header = True
+            key = normalize_identifier(row.get('plate_number'))
+            if not key:
+                result.add_error(line, 'Plate Number: This field is required.')
+            elif key in seen:
+                result.add_error(line, f'Plate Number: {row["plate_number"]} is already on line {seen[key]}.')
+            else:
+                seen[key] = line
+                rows.append((line, key, row))
+
+        existing = {}
+        for vehicle in Vehicle.objects.filter(plate_number_normalized__in=[key for _, key, _ in rows]):
+            key = vehicle.plate_number_normalized
+            existing[key] = _AMBIGUOUS if key in existing else vehicle
+        derived = {}
+        if any('status' in row for _, _, row in rows):
+            matched = [vehicle.pk for vehicle in existing.values() if vehicle is not _AMBIGUOUS]
+            derived = dict(with_derived_status(Vehicle.objects.filter(pk__in=matched)).values_list('pk', 'derived_status'))
+
+        now = timezone.now()
+        to_create, to_update, recompute = [], [], []
+        for line, key, row in rows:
+            instance = existing.get(key)
+            if instance is _AMBIGUOUS:
+                result.add_error(line, f'Plate Number: {row["plate_number"]} matches more than one vehicle.')
+                continue
+            if instance is not None:
+                # Matched without separators or case: keep the plate as stored
+                row['plate_number'] = instance.plate_number
+
+            errors = []
+            division = driver = None
+            if row.get('division'):
+                division = divisions.get(_name_key(row['division']))
+                if division is None:
+                    errors.append(f'Division: "{row["division"]}" does not exist.')
+                elif division is _AMBIGUOUS:
+                    errors.append(f'Division: more than one division is named "{row["division"]}".')
+            if row.get('assigned_driver'):
+                driver = drivers.find(row['assigned_driver'])
+                if driver is None:
+                    errors.append(f'Assigned driver: no driver has the name or license "{row["assigned_driver"]}".')
+                elif driver is _AMBIGUOUS:
+                    errors.append(f'Assigned driver: more than one driver matches "{row["assigned_driver"]}"; use the license number.')
+
+            before = _values(instance) if instance is not None else None
+            form = _bind(form, _form_data(VehicleImportForm, row, instance), instance)
+            if not form.is_valid():
+                result.add_form_errors(line, form)
+            for message in errors:
+                result.add_error(line, message)
+            if errors or form.errors:
+                continue
+
+            vehicle = form.instance
+            if instance is None or row.get('division'):
+                vehicle.division = division
+            if instance is None or row.get('assigned_driver'):
+                vehicle.assigned_driver = driver
+            if row.get('status'):
+                # An imported status is a manual choice: it overrides the engine unless it agrees
+                vehicle.status_override = vehicle.status != (SERVICEABLE if instance is None else derived[vehicle.pk])
+                if instance is None or vehicle.status != before['status']:
+                    vehicle.status_changed_at = now
+                    vehicle.status_changed_by = user
+                    vehicle.status_change_reason = IMPORT_STATUS_REASON
+            vehicle.normalize_identifiers()
+
+            if instance is None:
+                to_create.append(vehicle)
+                continue
+            changes = _changes(vehicle, before)
+            if not changes:
+                result.unchanged += 1
+                continue
+            to_update.append((vehicle, changes))
+            if not row.get('status'):
+                recompute.append(vehicle.pk)
+
+        result.created += len(to_create)
+        result.updated += len(to_update)
+        if dry_run:
+            continue
+
+        with transaction.atomic():
+            Vehicle.objects.bulk_create(to_create, batch_size=batch_size)
+            _assign_pks(to_create, Vehicle, 'plate_number')
+            _update_rows(Vehicle, to_update, updated_at=now)
+            if recompute:
+                # A new market value can cross the disposal threshold
+                recompute_statuses(Vehicle.objects.filter(pk__in=recompute))
+        _reindex(to_create + [vehicle for vehicle, _ in to_update])
+    return result
+
+
+def import_drivers(file, filename, user=None, dry_run=False, batch_size=BATCH_SIZE):
+    """Create or update drivers from a CSV/XLSX file, keyed on license number; returns an ImportResult"""
+    result = ImportResult(dry_run)
+    columns = _column_map(DriverForm, DRIVER_ALIASES)
+    by_license = _index((normalize_identifier(driver.license_number), driver) for driver in Driver.objects.all())
+    form = DriverForm()
+    seen = {}
+    checked_header = False
+
+    for batch in batched(read_rows(file, filename), batch_size):
+        result.rows += len(batch)
+        to_create, to_update = [], []
+        for line, raw in batch:
+            row = _map_row(raw, columns)
+            if not checked_header:
+                if 'license_number' not in row:
+                    raise ValidationError('The file has no License Number column.')
+                checked_header = True
+            key = normalize_identifier(row.get('license_number'))
+            if not key:
+                result.add_error(line, 'License number: This field is required.')
+                continue
+            if key in seen:
+                result.add_error(line, f'License number: {row["license_number"]} is already on line {seen[key]}.')
+                continue
+            seen[key] = line
+            instance = by_license.get(key)
+            if instance is _AMBIGUOUS:
+                result.add_error(line, f'License number: {row["license_number"]} matches more than one driver.')
+                continue
+            if instance is not None:
+                row['license_number'] = instance.license_number
+
+            before = _values(instance) if instance is not None else None
+            form = _bind(form, _form_data(DriverForm, row, instance), instance)
+            if not form.is_valid():
+                result.add_form_errors(line, form)
+                continue
+            if instance is None:
+                to_create.append(form.instance)
+                continue
+            changes = _changes(form.instance, before)
+            if changes:
+                to_update.append((form.instance, changes))
+            else:
+                result.unchanged += 1
+
+        result.created += len(to_create)
+        result.updated += len(to_update)
+        if dry_run:
+            continue
+
+        with transaction.atomic():
+            Driver.objects.bulk_create(to_create, batch_size=batch_size)
+            _assign_pks(to_create, Driver, 'license_number')
+            _update_rows(Driver, to_update)
+        _reindex(to_create + [driver for driver, _ in to_update])
+        renamed = [driver.pk for driver, changes in to_update if 'name' in changes]
+        if renamed:
+            # Vehicle documents embed their driver's name
+            _reindex(list(
+                Vehicle.objects.filter(assigned_driver__in=renamed).select_related('division', 'assigned_driver')
+            ))
+    return result
+
+
+# kind -> (importer, what a row is, ActivityLog model name)
+IMPORTERS = {
+    'vehicles': (import_vehicles, 'vehicle', 'Vehicle'),
+    'drivers': (import_drivers, 'driver', 'Driver'),
+    'fuel': (import_fuel_statement, 'transaction', 'FuelTransaction'),
+    'tolls': (import_toll_statement, 'transaction', 'TollTransaction'),
+}
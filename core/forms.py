@@ -1,11 +1,51 @@
 from django import forms
 from django.contrib.auth import get_user_model
-from django.forms import inlineformset_factory
-from .models import Vehicle, Repair, Driver, Division, RepairShop, RepairPart, RepairPartItem, PMS, PreInspectionReport, PostInspectionReport
+from django.forms import BaseInlineFormSet, inlineformset_factory
+from django.urls import reverse
+from .models import Vehicle, Repair, Driver, Division, RepairShop, RepairPartItem, PMS, PreInspectionReport, PostInspectionReport
+from .importers import IMPORT_EXTENSIONS
+from .inspection_rules import validate_pms, validate_repair
+from .part_catalog import load_part_catalog
 
 User = get_user_model()
 
 
+class RemoteModelSelect(forms.Select):
+    """Select that only renders the chosen option; the rest are searched over AJAX"""
+    
+    def __init__(self, url_name, placeholder='', attrs=None):
+        default_attrs = {'class': 'form-control js-remote-select', 'data-placeholder': placeholder}
+        if attrs:
+            default_attrs.update(attrs)
+        super().__init__(default_attrs)
+        self.url_name = url_name
+    
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-ajax-url'] = reverse(self.url_name)
+        return context
+    
+    def optgroups(self, name, value, attrs=None):
+        # Only look up the submitted/initial ids instead of iterating the whole queryset
+        selected_ids = [v for v in value if str(v).isdigit()]
+        choices = [('', '')]
+        queryset = getattr(self.choices, 'queryset', None)
+        if selected_ids and queryset is not None:
+            label_from_instance = self.choices.field.label_from_instance
+            choices += [(str(obj.pk), label_from_instance(obj)) for obj in queryset.filter(pk__in=selected_ids)]
+        
+        groups = []
+        for index, (option_value, option_label) in enumerate(choices):
+            option = self.create_option(name, option_value, option_label, option_value in value, index, attrs=attrs)
+            groups.append((None, [option], index))
+        return groups
+
+
+def vehicle_select_widget():
+    """Remote vehicle picker backed by the vehicle_choices endpoint"""
+    return RemoteModelSelect('vehicle_choices', placeholder='Search by plate number, brand or model...')
+
+
 class VehicleForm(forms.ModelForm):
     class Meta:
         model = Vehicle
@@ -40,6 +80,63 @@ class VehicleForm(forms.ModelForm):
         }
 
 
+class VehicleImportForm(VehicleForm):
+    """VehicleForm's rules for one imported row; division and driver are matched by name beforehand"""
+    class Meta(VehicleForm.Meta):
+        fields = [field for field in VehicleForm.Meta.fields if field not in ('division', 'assigned_driver')]
+    
+    def validate_unique(self):
+        # Plate numbers are matched against the whole batch by the importer
+        pass
+
+
+class FleetImportForm(forms.Form):
+    KIND_CHOICES = [
+        ('vehicles', 'Vehicles'),
+        ('drivers', 'Drivers'),
+        ('fuel', 'Fuel card statement'),
+        ('tolls', 'RFID toll statement (Autosweep/Easytrip)'),
+    ]
+    
+    kind = forms.ChoiceField(choices=KIND_CHOICES, widget=forms.Select(attrs={'class': 'form-control'}))
+    file = forms.FileField(
+        help_text='CSV or Excel (.xlsx) file with a header row',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.xlsx'}),
+    )
+    dry_run = forms.BooleanField(
+        required=False,
+        initial=True,
+        label='Dry run (validate only, save nothing)',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+    )
+    
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(IMPORT_EXTENSIONS):
+            raise forms.ValidationError('Upload a CSV or Excel (.xlsx) file.')
+        return upload
+
+
+class CatalogModelChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField that renders and validates from a preloaded PartCatalog"""
+    catalog = None
+    
+    def use_catalog(self, catalog):
+        """Render and validate from catalog; the field's queryset is never evaluated"""
+        self.catalog = catalog
+        self.choices = [('', self.empty_label)] + catalog.choices
+    
+    def to_python(self, value):
+        if self.catalog is None or value in self.empty_values:
+            return super().to_python(value)
+        part = self.catalog.by_pk.get(str(value))
+        if part is None:
+            raise forms.ValidationError(
+                self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value}
+            )
+        return part
+
+
 class RepairPartItemForm(forms.ModelForm):
     UNIT_CHOICES = [
         ('', 'Select unit...'),
@@ -67,6 +164,7 @@ class RepairPartItemForm(forms.ModelForm):
     class Meta:
         model = RepairPartItem
         fields = ['part', 'quantity', 'unit', 'cost', 'additional_info', 'disposal_type']
+        field_classes = {'part': CatalogModelChoiceField}
         widgets = {
             'part': forms.Select(attrs={'class': 'form-control'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
@@ -75,11 +173,11 @@ class RepairPartItemForm(forms.ModelForm):
             'disposal_type': forms.Select(attrs={'class': 'form-control'}),
         }
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, part_catalog=None, **kwargs):
         super().__init__(*args, **kwargs)
-        # Only show active repair parts
-        self.fields['part'].queryset = RepairPart.objects.filter(is_active=True)
         self.fields['part'].empty_label = "Select a part..."
+        # Only active parts, from the catalogue: formsets pass one shared catalogue; a standalone form loads its own
+        self.fields['part'].use_catalog(part_catalog or load_part_catalog())
         self.fields['part'].label = "Part"
         # Make part not required at form level - formset will handle empty forms
         self.fields['part'].required = False
@@ -88,6 +186,12 @@ class RepairPartItemForm(forms.ModelForm):
         if self.instance and self.instance.pk and self.instance.unit:
             self.fields['unit'].initial = self.instance.unit
     
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        # The part was already resolved against the catalogue; skip the per-row FK existence query
+        exclude.add('part')
+        return exclude
+    
     def clean_cost(self):
         cost = self.cleaned_data.get('cost')
         if cost is not None:
@@ -118,11 +222,25 @@ class RepairPartItemForm(forms.ModelForm):
         return cleaned_data
 
 
+class BaseRepairPartItemFormSet(BaseInlineFormSet):
+    """Loads the active part catalogue once and shares it with every form, including empty_form"""
+    
+    def __init__(self, *args, **kwargs):
+        self.part_catalog = load_part_catalog()
+        super().__init__(*args, **kwargs)
+    
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs['part_catalog'] = self.part_catalog
+        return kwargs
+
+
 # Create formset factory for Repair
 RepairPartItemFormSet = inlineformset_factory(
     Repair, 
     RepairPartItem, 
     form=RepairPartItemForm,
+    formset=BaseRepairPartItemFormSet,
     extra=0,  # No extra forms by default
     can_delete=True,
     can_delete_extra=False
@@ -133,6 +251,7 @@ PMSRepairPartItemFormSet = inlineformset_factory(
     Repair, 
     RepairPartItem, 
     form=RepairPartItemForm,
+    formset=BaseRepairPartItemFormSet,
     extra=1,  # Start with 1 empty form for convenience
     can_delete=True,
     can_delete_extra=False,
@@ -149,7 +268,7 @@ class RepairForm(forms.ModelForm):
             'cost', 'labor_cost', 'repair_shop', 'technician', 'status', 'pre_inspection'
         ]
         widgets = {
-            'vehicle': forms.Select(attrs={'class': 'form-control'}),
+            'vehicle': vehicle_select_widget(),
             'date_of_repair': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
             'cost': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
@@ -223,9 +342,7 @@ class RepairForm(forms.ModelForm):
     
     def clean(self):
         cleaned_data = super().clean()
-        pre_inspection = cleaned_data.get('pre_inspection')
         vehicle = cleaned_data.get('vehicle')
-        status = cleaned_data.get('status')
         
         # Check if vehicle is marked for disposal
         if vehicle:
@@ -242,67 +359,13 @@ class RepairForm(forms.ModelForm):
                     f"({vehicle.disposal_threshold:.2f}). The vehicle should be marked for disposal."
                 )
         
-        # Additional validation
-        if pre_inspection:
-            if not pre_inspection.is_approved:
-                raise forms.ValidationError(
-                    "The selected pre-inspection report must be approved before creating a repair."
-                )
-            
-            # Check if pre-inspection vehicle matches repair vehicle
-            if vehicle and pre_inspection.vehicle != vehicle:
-                raise forms.ValidationError(
-                    f"The selected pre-inspection report is for vehicle {pre_inspection.vehicle.plate_number}, "
-                    f"but this repair is for vehicle {vehicle.plate_number}. "
-                    "The pre-inspection report must be for the same vehicle as the repair."
-                )
-            
-            # Check if pre-inspection is already used by another repair or PMS
-            existing_repair = Repair.objects.filter(pre_inspection=pre_inspection).exclude(pk=self.instance.pk if self.instance.pk else None).first()
-            existing_pms = PMS.objects.filter(pre_inspection=pre_inspection).first()
-            
-            if existing_repair:
-                raise forms.ValidationError(
-                    f"This pre-inspection report is already used by repair record for vehicle {existing_repair.vehicle.plate_number}. "
-                    "Each pre-inspection report can only be used once."
-                )
-            
-            if existing_pms:
-                raise forms.ValidationError(
-                    f"[REPAIR FORM VALIDATION] This pre-inspection report is already used by PMS record for vehicle {existing_pms.vehicle.plate_number}. "
-                    f"Existing PMS ID: {existing_pms.pk}. Each pre-inspection report can only be used once."
-                )
-        
-        # Check if post-inspection vehicle matches repair vehicle (if post_inspection exists)
-        if self.instance.pk and self.instance.post_inspection:
-            if vehicle and self.instance.post_inspection.vehicle != vehicle:
-                raise forms.ValidationError(
-                    f"The linked post-inspection report is for vehicle {self.instance.post_inspection.vehicle.plate_number}, "
-                    f"but this repair is for vehicle {vehicle.plate_number}. "
-                    "The post-inspection report must be for the same vehicle as the repair."
-                )
-            
-            # Check if post-inspection is already used by another repair or PMS
-            existing_repair = Repair.objects.filter(post_inspection=self.instance.post_inspection).exclude(pk=self.instance.pk).first()
-            existing_pms = PMS.objects.filter(post_inspection=self.instance.post_inspection).first()
-            
-            if existing_repair:
-                raise forms.ValidationError(
-                    f"This post-inspection report is already used by repair record for vehicle {existing_repair.vehicle.plate_number}. "
-                    "Each post-inspection report can only be used once."
-                )
-            
-            if existing_pms:
-                raise forms.ValidationError(
-                    f"This post-inspection report is already used by PMS record for vehicle {existing_pms.vehicle.plate_number}. "
-                    "Each post-inspection report can only be used once."
-                )
-        
-        if status == 'Completed' and not self.instance.post_inspection:
-            raise forms.ValidationError(
-                "Cannot mark repair as completed without a post-inspection report. "
-                "Please create and approve a post-inspection report first."
-            )
+        # Inspection rules run once here; Repair.save() reuses the result
+        # (skipped while one of their fields is itself invalid)
+        rule_inputs = ('vehicle', 'pre_inspection', 'status')
+        if all(name in cleaned_data for name in rule_inputs):
+            for name in rule_inputs:
+                setattr(self.instance, name, cleaned_data[name])
+            validate_repair(self.instance)
         
         return cleaned_data
 
@@ -347,7 +410,7 @@ class PMSForm(forms.ModelForm):
             'provider', 'technician', 'description', 'notes', 'status', 'pre_inspection'
         ]
         widgets = {
-            'vehicle': forms.Select(attrs={'class': 'form-control'}),
+            'vehicle': vehicle_select_widget(),
             'service_type': forms.HiddenInput(),  # Always set to 'General Inspection'
             'scheduled_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'completed_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
@@ -459,9 +522,7 @@ class PMSForm(forms.ModelForm):
     
     def clean(self):
         cleaned_data = super().clean()
-        pre_inspection = cleaned_data.get('pre_inspection')
         vehicle = cleaned_data.get('vehicle')
-        status = cleaned_data.get('status')
         
         # Check if vehicle is marked for disposal
         if vehicle:
@@ -478,132 +539,13 @@ class PMSForm(forms.ModelForm):
                     f"({vehicle.disposal_threshold:.2f}). The vehicle should be marked for disposal."
                 )
         
-        # Additional validation
-        if pre_inspection:
-            if not pre_inspection.is_approved:
-                raise forms.ValidationError(
-                    "The selected pre-inspection report must be approved before creating a PMS record."
-                )
-            
-            # Check if pre-inspection vehicle matches PMS vehicle
-            if vehicle and pre_inspection.vehicle != vehicle:
-                raise forms.ValidationError(
-                    f"The selected pre-inspection report is for vehicle {pre_inspection.vehicle.plate_number}, "
-                    f"but this PMS is for vehicle {vehicle.plate_number}. "
-                    "The pre-inspection report must be for the same vehicle as the PMS."
-                )
-            
-            # Check if pre-inspection is already used by another repair or PMS
-            # Logic: 
-            # - A repair created from a PMS can share the same pre_inspection (that's OK)
-            # - But a standalone repair or another PMS cannot use it
-            # - When editing, exclude repairs created from this PMS
-            
-            # Check for standalone repairs (not linked to any PMS) using this pre_inspection
-            standalone_repairs = Repair.objects.filter(
-                pre_inspection=pre_inspection,
-                pms_records__isnull=True
-            )
-            # If editing, also exclude repairs created from this PMS
-            if self.instance and self.instance.pk and self.instance.repair:
-                standalone_repairs = standalone_repairs.exclude(pk=self.instance.repair.pk)
-            existing_repair = standalone_repairs.first()
-            
-            # Check for other PMS records using this pre_inspection
-            # Exclude current instance if it has a pk (editing existing PMS)
-            # For new PMS creation, self.instance.pk will be None
-            current_pk = getattr(self.instance, 'pk', None)
-            current_vehicle = cleaned_data.get('vehicle') or (getattr(self.instance, 'vehicle', None) if self.instance else None)
-            
-            # Query for PMS records using this pre_inspection
-            # IMPORTANT: Only check for PMS records that are NOT the current instance
-            # Use select_related to avoid extra queries
-            pms_query = PMS.objects.filter(pre_inspection=pre_inspection).select_related('vehicle')
-            
-            # If we have a pk (editing), exclude this instance from the query
-            # This is critical - without this, we'd find ourselves when editing
-            if current_pk is not None:
-                pms_query = pms_query.exclude(pk=current_pk)
-            
-            # Get all matching PMS records to check
-            existing_pms_list = list(pms_query)
-            
-            # Filter out any PMS that might be the current instance (extra safety check)
-            # CRITICAL: For new PMS creation (current_pk is None), we should not find any conflicts
-            # because the PMS doesn't exist yet. But if we do find one, it's a real conflict.
-            if current_pk is not None:
-                existing_pms_list = [p for p in existing_pms_list if p.pk != current_pk]
-            
-            if existing_repair:
-                raise forms.ValidationError(
-                    f"This pre-inspection report is already used by repair record for vehicle {existing_repair.vehicle.plate_number}. "
-                    "Each pre-inspection report can only be used once."
-                )
-            
-            if existing_pms_list:
-                # Found other PMS records using this pre_inspection
-                # Get the first one for the error message
-                existing_pms = existing_pms_list[0]
-                found_pk = getattr(existing_pms, 'pk', None)
-                
-                # DEBUG: Log what we found
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.debug(f"PMSForm.clean(): Found existing_pms_list: {[p.pk for p in existing_pms_list]}")
-                logger.debug(f"PMSForm.clean(): current_pk={current_pk}, found_pk={found_pk}")
-                
-                # FINAL CHECK: For new PMS (current_pk is None), any found PMS is a conflict
-                # For existing PMS (current_pk is not None), ensure we're not comparing against ourselves
-                if current_pk is None:
-                    # New PMS creation - if we find any existing PMS, it's a conflict
-                    logger.warning(f"PMSForm.clean(): Raising ValidationError for new PMS - found existing PMS {found_pk}")
-                    raise forms.ValidationError(
-                        f"[FORM VALIDATION] This pre-inspection report is already used by PMS record for vehicle {existing_pms.vehicle.plate_number}. "
-                        f"Existing PMS ID: {found_pk}. Each pre-inspection report can only be used once."
-                    )
-                elif found_pk == current_pk:
-                    # This shouldn't happen - we excluded it in the query and filtered it out
-                    # Skip the error as this indicates a bug
-                    logger.warning(f"PMSForm.clean(): Found self in existing_pms_list! This is a bug. current_pk={current_pk}, found_pk={found_pk}")
-                    pass
-                else:
-                    # This is a different PMS - valid conflict
-                    logger.warning(f"PMSForm.clean(): Raising ValidationError for edit - found different PMS {found_pk}")
-                    raise forms.ValidationError(
-                        f"[FORM VALIDATION] This pre-inspection report is already used by PMS record for vehicle {existing_pms.vehicle.plate_number}. "
-                        f"Existing PMS ID: {found_pk}. Each pre-inspection report can only be used once."
-                    )
-        
-        # Check if post-inspection vehicle matches PMS vehicle (if post_inspection exists)
-        if self.instance.pk and self.instance.post_inspection:
-            if vehicle and self.instance.post_inspection.vehicle != vehicle:
-                raise forms.ValidationError(
-                    f"The linked post-inspection report is for vehicle {self.instance.post_inspection.vehicle.plate_number}, "
-                    f"but this PMS is for vehicle {vehicle.plate_number}. "
-                    "The post-inspection report must be for the same vehicle as the PMS."
-                )
-            
-            # Check if post-inspection is already used by another repair or PMS
-            existing_repair = Repair.objects.filter(post_inspection=self.instance.post_inspection).first()
-            existing_pms = PMS.objects.filter(post_inspection=self.instance.post_inspection).exclude(pk=self.instance.pk).first()
-            
-            if existing_repair:
-                raise forms.ValidationError(
-                    f"This post-inspection report is already used by repair record for vehicle {existing_repair.vehicle.plate_number}. "
-                    "Each post-inspection report can only be used once."
-                )
-            
-            if existing_pms:
-                raise forms.ValidationError(
-                    f"This post-inspection report is already used by PMS record for vehicle {existing_pms.vehicle.plate_number}. "
-                    "Each post-inspection report can only be used once."
-                )
-        
-        if status == 'Completed' and not self.instance.post_inspection:
-            raise forms.ValidationError(
-                "Cannot mark PMS as completed without a post-inspection report. "
-                "Please create and approve a post-inspection report first."
-            )
+        # Inspection rules run once here; PMS.save() reuses the result
+        # (skipped while one of their fields is itself invalid)
+        rule_inputs = ('vehicle', 'pre_inspection', 'status')
+        if all(name in cleaned_data for name in rule_inputs):
+            for name in rule_inputs:
+                setattr(self.instance, name, cleaned_data[name])
+            validate_pms(self.instance)
         
         return cleaned_data
     
@@ -701,7 +643,7 @@ class UserForm(forms.ModelForm):
 class RepairShopForm(forms.ModelForm):
     class Meta:
         model = RepairShop
-        fields = ['name', 'address', 'phone', 'email', 'contact_person', 'is_active']
+        fields = ['name', 'address', 'phone', 'email', 'contact_person', 'is_active', 'pms_slots_per_day', 'open_on_weekends']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control'}),
             'address': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
@@ -709,6 +651,8 @@ class RepairShopForm(forms.ModelForm):
             'email': forms.EmailInput(attrs={'class': 'form-control'}),
             'contact_person': forms.TextInput(attrs={'class': 'form-control'}),
             'is_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+            'pms_slots_per_day': forms.NumberInput(attrs={'class': 'form-control', 'min': 0}),
+            'open_on_weekends': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
 
 
@@ -723,7 +667,7 @@ class PreInspectionReportForm(forms.ModelForm):
             'issues_found', 'safety_concerns', 'recommended_actions'
         ]
         widgets = {
-            'vehicle': forms.Select(attrs={'class': 'form-control'}),
+            'vehicle': vehicle_select_widget(),
             'report_type': forms.Select(attrs={'class': 'form-control'}),
             'inspected_by': forms.Select(attrs={'class': 'form-control'}),
             'engine_condition': forms.Select(attrs={'class': 'form-control'}),
@@ -767,7 +711,7 @@ class PostInspectionReportForm(forms.ModelForm):
             'future_recommendations', 'warranty_notes'
         ]
         widgets = {
-            'vehicle': forms.Select(attrs={'class': 'form-control'}),
+            'vehicle': vehicle_select_widget(),
             'report_type': forms.Select(attrs={'class': 'form-control'}),
             'inspected_by': forms.Select(attrs={'class': 'form-control'}),
             'pre_inspection': forms.Select(attrs={'class': 'form-control'}),
@@ -0,0 +1,227 @@
+"""
+Fuel card statements: FuelTransaction rows and their monthly rollups.
+
+import_fuel_statement() streams the card provider's CSV/XLSX statement
+(core.importers) a batch at a time. Cards are matched to vehicles through a
+dict of normalized fleet card numbers loaded once, each batch is checked
+against the stored fingerprints with one query and written with one
+bulk_create. FuelMonthlyRollup is then rebuilt for the vehicle-months the
+committed batches touched, also when a later batch fails, so reports sum a
+row per vehicle and month instead of every purchase. rebuild_fuel_rollups
+rebuilds them all.
+
+Transactions on a card no vehicle carries are stored without a vehicle and
+listed in the result. Importing the statement again after the card number is
+recorded on the vehicle links them.
+"""
+import hashlib
+import os
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .importers import DateTimeParser, StatementResult, batched, parse_decimal, read_rows
+from .models import FuelMonthlyRollup, FuelTransaction, Vehicle, normalize_identifier
+
+BATCH_SIZE = 2000
+
+# Statement column -> the headers card providers use for it
+COLUMNS = {
+    'card_number': ('card_number', 'card_no', 'card', 'fleet_card', 'fleet_card_number', 'fleet_card_no'),
+    'date': ('transaction_date', 'date', 'trans_date', 'date_time', 'transaction_date_time', 'datetime'),
+    'time': ('transaction_time', 'time', 'trans_time'),
+    'station': ('station', 'station_name', 'site', 'merchant', 'location', 'gas_station'),
+    'product': ('product', 'product_name', 'fuel_type', 'fuel', 'item'),
+    'liters': ('liters', 'litres', 'volume', 'quantity', 'qty'),
+    'unit_price': ('unit_price', 'price', 'price_per_liter', 'pump_price'),
+    'amount': ('amount', 'total', 'total_amount', 'net_amount', 'amount_php'),
+    'odometer': ('odometer', 'odometer_reading', 'mileage'),
+    'reference': ('reference', 'reference_no', 'reference_number', 'transaction_id', 'transaction_no', 'receipt_no', 'invoice_no'),
+}
+REQUIRED_COLUMNS = ('card_number', 'date', 'amount')
+_HEADERS = {header: column for column, headers in COLUMNS.items() for header in headers}
+
+
+def card_index():
+    """Normalized fleet card number -> vehicle id; a card recorded on two vehicles matches neither"""
+    index = {}
+    for vehicle_id, card in Vehicle.objects.exclude(fleet_card_number_normalized='').values_list(
+        'pk', 'fleet_card_number_normalized',
+    ):
+        index[card] = None if card in index else vehicle_id
+    return index
+
+
+def fingerprint(card, transaction_at, amount, liters, reference):
+    """Identity of a statement row, so the same statement imported twice adds nothing"""
+    key = '|'.join([
+        card, transaction_at.isoformat(), str(amount.quantize(Decimal('0.01'))),
+        str(liters.quantize(Decimal('0.001'))) if liters is not None else '', reference,
+    ])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _parse(row, dates, errors):
+    """FuelTransaction fields for a statement row; problems are appended to errors"""
+    values = {}
+    card = row.get('card_number', '')
+    values['card_number'] = card[:100]
+    values['card_number_normalized'] = normalize_identifier(card)[:100]
+    if not values['card_number_normalized']:
+        errors.append('Card number is required.')
+
+    try:
+        moment = row.get('date', '')
+        if row.get('time') and len(moment) <= 10:
+            moment = f"{moment} {row['time']}"
+        values['transaction_at'] = dates.parse(moment)
+        values['month'] = values['transaction_at'].date().replace(day=1)
+    except ValueError as e:
+        errors.append(f'Date: {e}.' if row.get('date') else 'Date is required.')
+
+    for name, places in (('amount', '0.01'), ('liters', '0.001'), ('unit_price', '0.0001')):
+        text = row.get(name, '')
+        if not text:
+            if name == 'amount':
+                errors.append('Amount is required.')
+            values[name] = None
+            continue
+        try:
+            values[name] = parse_decimal(text).quantize(Decimal(places))
+        except (ValueError, ArithmeticError) as e:
+            errors.append(f'{name.replace("_", " ").capitalize()}: {e}.')
+
+    odometer = row.get('odometer', '')
+    try:
+        values['odometer'] = int(parse_decimal(odometer)) if odometer else None
+    except ValueError as e:
+        errors.append(f'Odometer: {e}.')
+
+    values['station'] = row.get('station', '')[:200]
+    values['product'] = row.get('product', '')[:100]
+    values['reference'] = row.get('reference', '')[:100]
+    return values
+
+
+def rebuild_rollups(source, rollup, pairs, **totals):
+    """
+    Replace the `rollup` rows of (vehicle id, month) pairs with `transactions`
+    and `totals` (field -> Sum) aggregated from the `source` transactions
+    """
+    vehicles_by_month = defaultdict(set)
+    for vehicle_id, month in pairs:
+        vehicles_by_month[month].add(vehicle_id)
+    with transaction.atomic():
+        for month, vehicle_ids in vehicles_by_month.items():
+            for chunk in batched(sorted(vehicle_ids), 500):
+                rows = (
+                    source.objects.filter(month=month, vehicle_id__in=chunk)
+                    .values('vehicle_id')
+                    .annotate(transactions=Count('pk'), **totals)
+                    .order_by()
+                )
+                rollups = [
+                    rollup(
+                        vehicle_id=row['vehicle_id'], month=month, transactions=row['transactions'],
+                        **{name: row[name] or 0 for name in totals},
+                    )
+                    for row in rows
+                ]
+                rollup.objects.filter(month=month, vehicle_id__in=chunk).delete()
+                rollup.objects.bulk_create(rollups)
+
+
+def rollup_pairs(source, rollup):
+    """Every (vehicle id, month) pair with `source` transactions or a `rollup` row, for a full rebuild"""
+    pairs = set(source.objects.filter(vehicle__isnull=False).values_list('vehicle_id', 'month').distinct())
+    pairs.update(rollup.objects.values_list('vehicle_id', 'month'))
+    return pairs
+
+
+def refresh_rollups(pairs):
+    """Rebuild FuelMonthlyRollup for (vehicle id, month) pairs from their transactions"""
+    rebuild_rollups(FuelTransaction, FuelMonthlyRollup, pairs, liters=Sum('liters'), amount=Sum('amount'))
+
+
+def rebuild_all_rollups():
+    """Rebuild every FuelMonthlyRollup; returns the number of vehicle-months checked"""
+    pairs = rollup_pairs(FuelTransaction, FuelMonthlyRollup)
+    refresh_rollups(pairs)
+    return len(pairs)
+
+
+def import_fuel_statement(file, filename, user=None, dry_run=False, batch_size=BATCH_SIZE):
+    """Add the transactions of a fuel card statement; returns a StatementResult"""
+    result = StatementResult(dry_run)
+    cards = card_index()
+    dates = DateTimeParser()
+    checked_header = False
+
+    stale = set()  # (vehicle id, month) pairs of committed batches
+    try:
+        for batch in batched(read_rows(file, filename), batch_size):
+            result.rows += len(batch)
+            parsed = {}
+            for line, raw in batch:
+                row = {_HEADERS[header]: value for header, value in raw.items() if header in _HEADERS}
+                if not checked_header:
+                    missing = [column for column in REQUIRED_COLUMNS if column not in row]
+                    if missing:
+                        labels = ', '.join(column.replace('_', ' ') for column in missing)
+                        raise ValidationError(f'The statement has no {labels} column.')
+                    checked_header = True
+                errors = []
+                values = _parse(row, dates, errors)
+                if errors:
+                    for message in errors:
+                        result.add_error(line, message)
+                    continue
+                key = fingerprint(
+                    values['card_number_normalized'], values['transaction_at'], values['amount'],
+                    values['liters'], values['reference'],
+                )
+                if key in parsed:
+                    result.unchanged += 1
+                    continue
+                parsed[key] = FuelTransaction(
+                    vehicle_id=cards.get(values['card_number_normalized']), fingerprint=key,
+                    source_file=os.path.basename(str(filename))[:255], imported_by=user, **values,
+                )
+
+            stored = dict(
+                FuelTransaction.objects.filter(fingerprint__in=list(parsed)).values_list('fingerprint', 'vehicle_id')
+            )
+            to_create, relink = [], defaultdict(list)
+            touched = set()  # (vehicle id, month) pairs whose rollups the batch makes stale
+            for key, fuel in parsed.items():
+                if key not in stored:
+                    to_create.append(fuel)
+                    if fuel.vehicle_id is None:
+                        result.add_unknown(fuel.card_number)
+                elif stored[key] is None and fuel.vehicle_id is not None:
+                    # Imported before the card was recorded on its vehicle
+                    relink[fuel.vehicle_id].append(key)
+                else:
+                    result.unchanged += 1
+                    continue
+                if fuel.vehicle_id is not None:
+                    touched.add((fuel.vehicle_id, fuel.month))
+            result.created += len(to_create)
+            result.updated += sum(len(keys) for keys in relink.values())
+            if dry_run:
+                continue
+
+            with transaction.atomic():
+                # ignore_conflicts: a concurrent import of the same statement is not an error
+                FuelTransaction.objects.bulk_create(to_create, ignore_conflicts=True)
+                for vehicle_id, keys in relink.items():
+                    FuelTransaction.objects.filter(fingerprint__in=keys, vehicle__isnull=True).update(vehicle_id=vehicle_id)
+            stale |= touched
+    finally:
+        # Also when a later batch fails: rows already committed must reach the rollups
+        if stale:
+            refresh_rollups(stale)
+    return result
@@ -0,0 +1,137 @@
+"""
+Normalization of uploaded photos before they are stored.
+
+Phone photos arrive as 12MP JPEGs with the rotation in an EXIF tag and the
+GPS position in the metadata. normalize_image() turns them into what the
+pages actually need:
+  - rotated upright (EXIF orientation applied to the pixels)
+  - no EXIF, GPS, XMP or maker-note metadata (the colour profile stays)
+  - at most MAX_DIMENSION pixels on the long side
+  - recompressed (JPEG quality 82, progressive; PNG optimized)
+
+The work is CPU-bound, so it runs in a process pool (normalize_file_in_pool),
+which is handed the path of the stored file rather than its bytes; this
+module only imports Pillow at the top so worker processes start fast.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+MAX_DIMENSION = 2560
+JPEG_QUALITY = 82
+
+# A clean, small-enough image is only re-encoded when that saves at least this share
+MIN_SAVING = 0.1
+
+# Larger files are stored as they are rather than decoded in memory
+MAX_INPUT_BYTES = 50 * 1024 * 1024
+
+# Pillow format -> (output format, extension); animated GIFs are left alone
+OUTPUT_FORMATS = {
+    'JPEG': ('JPEG', '.jpg'),
+    'MPO': ('JPEG', '.jpg'),
+    'PNG': ('PNG', '.png'),
+    'WEBP': ('WEBP', '.webp'),
+    'BMP': ('PNG', '.png'),
+    'TIFF': ('JPEG', '.jpg'),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def normalize_image(data, max_dimension=MAX_DIMENSION, quality=JPEG_QUALITY):
+    """
+    Normalized bytes for an encoded image, as (data, extension), or None
+    when the image should be stored unchanged (unknown format, animation,
+    or nothing to gain).
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        source_format = image.format
+        animated = getattr(image, 'n_frames', 1) > 1 and source_format != 'MPO'
+        if source_format not in OUTPUT_FORMATS or animated:
+            return None
+        output_format, extension = OUTPUT_FORMATS[source_format]
+
+        has_metadata = bool(image.info.get('exif') or image.info.get('xmp') or image.getexif())
+        oversized = max(image.size) > max_dimension
+        # The colour profile is kept: dropping a Display P3 profile visibly shifts colours
+        icc_profile = image.info.get('icc_profile')
+        if output_format == 'JPEG':
+            # Let the decoder downscale by a power of two first when the photo is far too big
+            image.draft('RGB', (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        if oversized:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        if output_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        elif output_format == 'PNG' and image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            image = image.convert('RGBA')
+
+        buffer = io.BytesIO()
+        # Only the colour profile is passed on, so EXIF/GPS/XMP are dropped
+        options = {'icc_profile': icc_profile} if icc_profile else {}
+        if output_format == 'JPEG':
+            image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True, **options)
+        elif output_format == 'WEBP':
+            image.save(buffer, 'WEBP', quality=quality, method=4, **options)
+        else:
+            image.save(buffer, 'PNG', optimize=True, **options)
+        output = buffer.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Image could not be normalized, leaving it unchanged: {e}")
+        return None
+
+    if not has_metadata and not oversized and len(output) > len(data) * (1 - MIN_SAVING):
+        # Already normalized (or compressed well enough): another generation would only lose quality
+        return None
+    return output, extension
+
+
+def normalize_file(path, max_dimension=MAX_DIMENSION, quality=JPEG_QUALITY):
+    """(original size, normalize_image() result) for an image file on disk; for process pools"""
+    size = os.path.getsize(path)
+    if size > MAX_INPUT_BYTES:
+        return size, None
+    with open(path, 'rb') as f:
+        return size, normalize_image(f.read(), max_dimension, quality)
+
+
+def _worker_count():
+    from django.conf import settings
+    return getattr(settings, 'IMAGE_NORMALIZE_WORKERS', min(os.cpu_count() or 1, 4))
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded web worker can deadlock the child
+            _pool = ProcessPoolExecutor(
+                max_workers=_worker_count(),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def normalize_file_in_pool(path):
+    """normalize_file() in the shared process pool, falling back to this process if the pool is unavailable"""
+    global _pool
+    if _worker_count() > 0:
+        try:
+            return _get_pool().submit(normalize_file, path).result()
+        except BrokenProcessPool:
+            logger.warning("Image normalization pool broke; normalizing in-process")
+            with _pool_lock:
+                _pool = None
+    return normalize_file(path)
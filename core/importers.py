@@ -0,0 +1,359 @@
+"""
+Streaming readers for spreadsheet imports (fleet lists, card statements).
+
+read_rows() yields the data rows of an uploaded CSV or XLSX file one at a
+time, as {column: text} dicts keyed by the normalized header ("Plate No." ->
+'plate_no'), so an importer holds one batch of rows in memory however long
+the file is. XLSX files are read straight from the zip with iterparse
+(openpyxl is not a dependency) and each row is discarded once read; only the
+shared strings table stays in memory.
+
+Cell values are text, as a form would receive them: numbers without a
+trailing '.0', and date-formatted cells as ISO dates ('2024-03-01') or
+date-times ('2024-03-01 08:15:00').
+"""
+import csv
+import io
+import os
+import posixpath
+import re
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from xml.etree import ElementTree
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+IMPORT_EXTENSIONS = ('.csv', '.xlsx')
+
+# Errors kept for the report; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_DOC_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+# Built-in number formats that display dates or times
+_DATE_FORMAT_IDS = set(range(14, 23)) | {45, 46, 47}
+# Quoted literals and [colour]/[$currency] sections of a format code are not date parts
+_FORMAT_LITERAL_RE = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+_CELL_REF_RE = re.compile(r'([A-Z]+)')
+
+# Thousands separators, spaces and peso signs around amounts
+NUMBER_NOISE_RE = re.compile(r'[,\s₱]|PHP', re.IGNORECASE)
+
+# Statement dates: ISO or month first (as the providers and Excel here write them), with an optional time
+DATETIME_FORMATS = [
+    f'{date_format} {time_format}'.strip()
+    for date_format in ('%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%Y/%m/%d', '%d-%b-%Y', '%d %b %Y', '%b %d, %Y')
+    for time_format in ('%H:%M:%S', '%H:%M', '%I:%M:%S %p', '%I:%M %p', '')
+]
+
+
+def _tag(name):
+    return f'{{{_MAIN_NS}}}{name}'
+
+
+class ImportResult:
+    """Counts and per-row errors of an import run"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.error_count = 0
+        self.errors = []  # (line, message), the first MAX_REPORTED_ERRORS of them
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def add_form_errors(self, line, form):
+        for field, messages in form.errors.items():
+            label = form.fields[field].label if field in form.fields else ''
+            for message in messages:
+                self.add_error(line, f'{label}: {message}' if label else message)
+
+    @property
+    def skipped(self):
+        return self.rows - self.created - self.updated - self.unchanged
+
+    def summary(self, noun='row'):
+        verb = 'would be' if self.dry_run else 'were'
+        return (
+            f'{self.rows} {noun}(s) read: {self.created} {verb} created, {self.updated} {verb} updated, '
+            f'{self.unchanged} unchanged, {self.skipped} skipped with {self.error_count} error(s).'
+        )
+
+
+class StatementResult(ImportResult):
+    """
+    ImportResult of a card or tag statement. Rows imported before count as
+    unchanged (or updated when they now match a vehicle); rows whose card or
+    tag matches no vehicle are stored anyway and listed in `unknown`.
+    """
+
+    def __init__(self, dry_run=False):
+        super().__init__(dry_run)
+        self.unmatched = 0
+        self.unknown = {}  # identifier as written in the statement -> rows
+
+    def add_unknown(self, identifier):
+        self.unmatched += 1
+        if identifier in self.unknown or len(self.unknown) < MAX_REPORTED_ERRORS:
+            self.unknown[identifier] = self.unknown.get(identifier, 0) + 1
+
+    def summary(self, noun='transaction'):
+        verb = 'would be' if self.dry_run else 'were'
+        return (
+            f'{self.rows} {noun}(s) read: {self.created} {verb} imported ({self.unmatched} not matched to a vehicle), '
+            f'{self.unchanged} already imported, {self.updated} {verb} matched to a vehicle on re-import, '
+            f'{self.skipped} skipped with {self.error_count} error(s).'
+        )
+
+
+class DateTimeParser:
+    """Parses statement dates, trying the format that matched last first (a file uses one format)"""
+
+    def __init__(self, formats=DATETIME_FORMATS):
+        self.formats = list(formats)
+        # Looked up once: get_current_timezone() per row is a measurable share of a large statement
+        self.tz = timezone.get_current_timezone()
+
+    def parse(self, text):
+        """Aware datetime for text; ValueError if no format matches"""
+        text = ' '.join(str(text).split())
+        if len(text) > 10 and text[10] == 'T':
+            text = text[:10] + ' ' + text[11:].split('.')[0].rstrip('Z')
+        if text[4:5] == '-':
+            # ISO dates, the usual export format, without strptime's per-call overhead
+            try:
+                value = datetime.fromisoformat(text)
+            except ValueError:
+                pass
+            else:
+                return timezone.make_aware(value, self.tz) if value.tzinfo is None else value
+        for index, fmt in enumerate(self.formats):
+            try:
+                value = datetime.strptime(text, fmt)
+            except ValueError:
+                continue
+            if index:
+                self.formats.insert(0, self.formats.pop(index))
+            return timezone.make_aware(value, self.tz)
+        raise ValueError(f'"{text}" is not a date')
+
+
+def parse_decimal(text):
+    """Decimal for an amount as statements write it ('1,250.50', '(12.00)', 'PHP 90'); ValueError if invalid"""
+    text = NUMBER_NOISE_RE.sub('', str(text))
+    negative = text.startswith('(') and text.endswith(')')
+    try:
+        value = Decimal(text.strip('()'))
+    except InvalidOperation:
+        raise ValueError(f'"{text}" is not a number')
+    if not value.is_finite():
+        raise ValueError(f'"{text}" is not a number')
+    return -value if negative else value
+
+
+def normalize_header(text):
+    """'Plate No.' -> 'plate_no'"""
+    return re.sub(r'[^0-9a-z]+', '_', str(text or '').strip().lower()).strip('_')
+
+
+def batched(iterable, size):
+    """Lists of up to `size` items from iterable"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _csv_lines(file):
+    stream = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        sample = stream.read(8192)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        stream.seek(0)
+        reader = csv.reader(stream, dialect)
+        for values in reader:
+            yield reader.line_num, values
+    except UnicodeDecodeError:
+        raise ValidationError('The file is not UTF-8 text; save it as "CSV UTF-8" and upload it again.')
+    except csv.Error as e:
+        raise ValidationError(f'Line {reader.line_num}: {e}')
+    finally:
+        # The wrapper would close the upload with it
+        stream.detach()
+
+
+def _shared_strings(archive, names):
+    if 'xl/sharedStrings.xml' not in names:
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, elem in ElementTree.iterparse(f):
+            if elem.tag == _tag('si'):
+                strings.append(_rich_text(elem))
+                elem.clear()
+    return strings
+
+
+def _rich_text(elem):
+    """Text of an <si>/<is> element: its <t>, or the <t> of each run (phonetic hints left out)"""
+    parts = []
+    for child in elem:
+        if child.tag == _tag('t'):
+            parts.append(child.text or '')
+        elif child.tag == _tag('r'):
+            parts.extend(t.text or '' for t in child.iter(_tag('t')))
+    return ''.join(parts)
+
+
+def _date_styles(archive, names):
+    """Indexes of the cell formats (the s attribute) that display dates"""
+    if 'xl/styles.xml' not in names:
+        return set()
+    root = ElementTree.fromstring(archive.read('xl/styles.xml'))
+    date_ids = set(_DATE_FORMAT_IDS)
+    for fmt in root.iter(_tag('numFmt')):
+        code = _FORMAT_LITERAL_RE.sub('', fmt.get('formatCode', ''))
+        if re.search(r'[dmyhs]', code, re.IGNORECASE):
+            date_ids.add(int(fmt.get('numFmtId')))
+    cell_formats = root.find(_tag('cellXfs'))
+    if cell_formats is None:
+        return set()
+    return {
+        index for index, xf in enumerate(cell_formats.findall(_tag('xf')))
+        if int(xf.get('numFmtId', 0)) in date_ids
+    }
+
+
+def _first_sheet(archive):
+    """(member name of the first worksheet, whether the workbook counts dates from 1904)"""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    properties = workbook.find(_tag('workbookPr'))
+    date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+    sheet = workbook.find(f"{_tag('sheets')}/{_tag('sheet')}")
+    if sheet is None:
+        raise ValidationError('The workbook has no worksheets.')
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(f'{{{_PKG_REL_NS}}}Relationship'):
+        if rel.get('Id') == sheet.get(f'{{{_DOC_REL_NS}}}id'):
+            target = rel.get('Target')
+            name = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+            return name, date1904
+    raise ValidationError('The workbook has no worksheets.')
+
+
+def _excel_date(serial, date1904):
+    epoch = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+    moment = epoch + timedelta(seconds=round(serial * 86400))
+    if serial < 1:
+        return moment.strftime('%H:%M:%S')
+    if moment.time() == datetime.min.time():
+        return moment.date().isoformat()
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _number_text(value):
+    number = float(value)
+    return str(int(number)) if number.is_integer() and abs(number) < 1e15 else value
+
+
+def _column_index(ref):
+    index = 0
+    for letter in _CELL_REF_RE.match(ref).group(1):
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def _cell_text(cell, strings, date_styles, date1904):
+    kind = cell.get('t', 'n')
+    if kind == 'inlineStr':
+        inline = cell.find(_tag('is'))
+        return _rich_text(inline) if inline is not None else ''
+    value = cell.find(_tag('v'))
+    if value is None or value.text is None:
+        return ''
+    text = value.text
+    if kind == 's':
+        return strings[int(text)]
+    if kind == 'b':
+        return 'TRUE' if text == '1' else 'FALSE'
+    if kind == 'e':
+        return ''
+    if kind == 'n':
+        if int(cell.get('s', 0)) in date_styles:
+            return _excel_date(float(text), date1904)
+        return _number_text(text)
+    return text
+
+
+def _xlsx_lines(file):
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile:
+        raise ValidationError('The file is not a valid Excel (.xlsx) workbook.')
+    with archive:
+        names = set(archive.namelist())
+        if 'xl/workbook.xml' not in names:
+            raise ValidationError('The file is not a valid Excel (.xlsx) workbook.')
+        strings = _shared_strings(archive, names)
+        date_styles = _date_styles(archive, names)
+        sheet_name, date1904 = _first_sheet(archive)
+
+        with archive.open(sheet_name) as sheet:
+            line = 0
+            for _, elem in ElementTree.iterparse(sheet):
+                if elem.tag != _tag('row'):
+                    continue
+                line = int(elem.get('r', line + 1))
+                values = []
+                for position, cell in enumerate(elem.iter(_tag('c'))):
+                    # Empty cells are usually left out, so place each cell by its reference
+                    ref = cell.get('r')
+                    index = _column_index(ref) if ref else position
+                    values.extend([''] * (index - len(values)))
+                    values.append(_cell_text(cell, strings, date_styles, date1904))
+                elem.clear()
+                yield line, values
+
+
+def read_rows(file, filename):
+    """
+    Yield (line number, {column: text}) for each non-blank data row of a CSV
+    or XLSX file; the first non-blank row is the header.
+    """
+    extension = os.path.splitext(str(filename or ''))[1].lower()
+    if extension == '.csv':
+        lines = _csv_lines(file)
+    elif extension == '.xlsx':
+        lines = _xlsx_lines(file)
+    else:
+        raise ValidationError(f'Unsupported file type "{extension or filename}"; upload a CSV or XLSX file.')
+
+    header = None
+    for line, values in lines:
+        values = [str(value).strip() for value in values]
+        if not any(values):
+            continue
+        if header is None:
+            header = [normalize_header(value) for value in values]
+            continue
+        values.extend([''] * (len(header) - len(values)))
+        yield line, {column: value for column, value in zip(header, values) if column}
+    if header is None:
+        raise ValidationError('The file is empty.')
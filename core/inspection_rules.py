@@ -0,0 +1,164 @@
+"""
+Inspection business rules for repair and PMS writes.
+
+The rules (approved pre/post-inspection, matching vehicle, each report used
+once) used to be checked separately by the form's clean() and again by the
+model's save(), each rule lazily loading reports, vehicles and approvers and
+issuing its own "already used" first() query. Here every rule is evaluated
+from the loaded report ids plus at most one Repair and one PMS query, and the
+instance remembers which values passed so the save that follows the form
+validation does not run the checks again.
+"""
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from .models import PMS, Repair
+
+# Rule sets; a full check also satisfies the reduced one
+FULL = 'full'
+SKIP_PMS_USAGE = 'skip_pms_usage'  # repairs created from a PMS share its pre-inspection
+SKIP_USAGE = 'skip_usage'  # PMS rules 1-6 only
+
+_SATISFIES = {
+    FULL: {FULL, SKIP_PMS_USAGE, SKIP_USAGE},
+    SKIP_PMS_USAGE: {SKIP_PMS_USAGE},
+    SKIP_USAGE: {SKIP_USAGE},
+}
+
+
+def _state(instance):
+    """The values the rules depend on; a change to any of them needs a new check"""
+    return (
+        instance.pk, instance.vehicle_id, instance.pre_inspection_id, instance.post_inspection_id,
+        instance.status, getattr(instance, 'repair_id', None),
+    )
+
+
+def _already_checked(instance, rules):
+    checked = getattr(instance, '_inspection_rules_checked', None)
+    return checked is not None and checked[0] == _state(instance) and rules in _SATISFIES[checked[1]]
+
+
+def _approved(report):
+    # approved_by_id avoids loading the approver just to test for one
+    return report.approved_by_id is not None and report.approval_date is not None
+
+
+def _check_reports(instance, label, record):
+    """Rules 1-6, which only need the instance and its two reports"""
+    pre_inspection = instance.pre_inspection if instance.pre_inspection_id else None
+    post_inspection = instance.post_inspection if instance.post_inspection_id else None
+
+    # Rule 1: Cannot create without approved pre-inspection
+    if not instance.pk and not pre_inspection:
+        raise ValidationError(
+            f"A {record} cannot be created without an approved pre-inspection report. "
+            "Please create and approve a pre-inspection report first."
+        )
+
+    # Rule 2: Cannot mark as completed without post-inspection
+    if instance.status == 'Completed' and not post_inspection:
+        raise ValidationError(
+            f"A {record} cannot be marked as completed without a post-inspection report. "
+            "Please create and approve a post-inspection report first."
+        )
+
+    # Rule 3: Pre-inspection must be approved
+    if pre_inspection and not _approved(pre_inspection):
+        raise ValidationError(
+            f"The pre-inspection report must be approved before creating a {record}. "
+            "Please approve the pre-inspection report first."
+        )
+
+    # Rule 4: Post-inspection must be approved only when marking as completed
+    if instance.status == 'Completed' and post_inspection and not _approved(post_inspection):
+        raise ValidationError(
+            f"The post-inspection report must be approved before marking {label} as completed. "
+            "Please approve the post-inspection report first."
+        )
+
+    # Rules 5 and 6: Reports must be for the same vehicle
+    for kind, report in (('pre', pre_inspection), ('post', post_inspection)):
+        if report and instance.vehicle_id and report.vehicle_id != instance.vehicle_id:
+            raise ValidationError(
+                f"The {kind}-inspection report is for vehicle {report.vehicle.plate_number}, "
+                f"but this {label} is for vehicle {instance.vehicle.plate_number}. "
+                f"The {kind}-inspection report must be for the same vehicle as the {label}."
+            )
+
+
+def _usage_filter(instance):
+    """Q matching rows that reference the instance's pre- or post-inspection"""
+    query = Q()
+    if instance.pre_inspection_id:
+        query |= Q(pre_inspection_id=instance.pre_inspection_id)
+    if instance.post_inspection_id:
+        query |= Q(post_inspection_id=instance.post_inspection_id)
+    return query
+
+
+def _raise_first_conflict(instance, repairs, pms_records, linked_pms_share_pre=False):
+    """Rules 7 and 8, in rule order: pre-inspection before post-inspection, repairs before PMS"""
+    for kind, field in (('pre', 'pre_inspection_id'), ('post', 'post_inspection_id')):
+        report_id = getattr(instance, field)
+        if not report_id:
+            continue
+        for repair in repairs:
+            if getattr(repair, field) == report_id:
+                raise ValidationError(
+                    f"This {kind}-inspection report is already used by repair record for vehicle {repair.vehicle.plate_number}. "
+                    f"Each {kind}-inspection report can only be used once."
+                )
+        for pms in pms_records:
+            if kind == 'pre' and linked_pms_share_pre and pms.repair_id:
+                continue
+            if getattr(pms, field) == report_id:
+                raise ValidationError(
+                    f"This {kind}-inspection report is already used by PMS record for vehicle {pms.vehicle.plate_number}. "
+                    f"Existing PMS ID: {pms.pk}. Each {kind}-inspection report can only be used once."
+                )
+
+
+def validate_repair(repair, rules=FULL):
+    """
+    Raise ValidationError for the first inspection rule the repair breaks.
+
+    rules=SKIP_PMS_USAGE leaves out the PMS usage check, for repairs created
+    from a PMS that share its pre-inspection.
+    """
+    if _already_checked(repair, rules):
+        return
+    _check_reports(repair, 'repair', 'repair')
+
+    usage = _usage_filter(repair)
+    if usage:
+        repairs = list(Repair.objects.filter(usage).exclude(pk=repair.pk).select_related('vehicle'))
+        pms_records = []
+        if rules == FULL:
+            pms_records = list(PMS.objects.filter(usage).select_related('vehicle'))
+        # A PMS linked to a repair shares its pre-inspection with that repair
+        _raise_first_conflict(repair, repairs, pms_records, linked_pms_share_pre=True)
+
+    repair._inspection_rules_checked = (_state(repair), rules)
+
+
+def validate_pms(pms, rules=FULL):
+    """
+    Raise ValidationError for the first inspection rule the PMS breaks.
+
+    rules=SKIP_USAGE checks rules 1-6 only. Repairs created from a PMS may
+    share its reports, so only standalone repairs count as conflicts.
+    """
+    if _already_checked(pms, rules):
+        return
+    _check_reports(pms, 'PMS', 'PMS record')
+
+    usage = _usage_filter(pms)
+    if rules == FULL and usage:
+        repairs = Repair.objects.filter(usage, pms_records__isnull=True).select_related('vehicle')
+        if pms.pk and pms.repair_id:
+            repairs = repairs.exclude(pk=pms.repair_id)
+        pms_records = PMS.objects.filter(usage).exclude(pk=pms.pk).select_related('vehicle')
+        _raise_first_conflict(pms, list(repairs), list(pms_records))
+
+    pms._inspection_rules_checked = (_state(pms), rules)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from core.attachments import fill_missing_metadata
+
+
+class Command(BaseCommand):
+    help = 'Fill in file sizes and image dimensions of attachments listed before the Attachment table existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of attachments read and updated per batch (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        filled = fill_missing_metadata(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Filled in {filled} attachment(s)')
+        )
@@ -0,0 +1,126 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.chunked_uploads import discard_stale, upload_dir
+from core.models import UploadSession
+from core.storage import grace_period, referenced_paths
+from core.thumbnails import thumbnail_original
+
+QUARANTINE_DIR = '.quarantine'
+
+
+def _walk(root):
+    """Yield every regular file under root as a DirEntry, one directory open at a time"""
+    pending = [root]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def _format_bytes(size):
+    if size < 1024:
+        return f'{size} B'
+    for unit in ('KB', 'MB', 'GB', 'TB'):
+        size /= 1024
+        if size < 1024 or unit == 'TB':
+            return f'{size:,.1f} {unit}'
+
+
+class Command(BaseCommand):
+    help = 'Delete (or quarantine) files under MEDIA_ROOT that no vehicle or inspection record references'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='List the unreferenced files and the space they use without removing them',
+        )
+        parser.add_argument(
+            '--grace-hours',
+            type=int,
+            default=None,
+            help='Leave files modified within this many hours alone, e.g. uploads whose form is still open '
+                 '(default MEDIA_GC_GRACE_HOURS, 24)',
+        )
+        parser.add_argument(
+            '--quarantine',
+            action='store_true',
+            help=f'Move unreferenced files to MEDIA_ROOT/{QUARANTINE_DIR}/ instead of deleting them',
+        )
+
+    def handle(self, *args, **options):
+        root = os.path.abspath(settings.MEDIA_ROOT)
+        if not os.path.isdir(root):
+            self.stdout.write(f'{root} does not exist; nothing to collect')
+            return
+        dry_run = options['dry_run']
+        grace = grace_period() if options['grace_hours'] is None else timedelta(hours=options['grace_hours'])
+        cutoff = timezone.now() - grace
+
+        if not dry_run:
+            stale = discard_stale(cutoff)
+            if stale:
+                self.stdout.write(f'Discarded {stale} abandoned chunked upload(s)')
+
+        # Paths only: a few hundred thousand short strings, streamed from the Attachment table in chunks
+        referenced = set(referenced_paths())
+        # Uploads that finished recently but whose form has not been saved yet
+        referenced.update(
+            UploadSession.objects.filter(status='complete').exclude(path='')
+            .values_list('path', flat=True).iterator(chunk_size=2000)
+        )
+        self.stdout.write(f'{len(referenced):,} referenced path(s)')
+
+        skip_dirs = {
+            os.path.join(root, QUARANTINE_DIR),
+            os.path.abspath(upload_dir()),
+        }
+        quarantine_root = os.path.join(root, QUARANTINE_DIR)
+        cutoff_ts = cutoff.timestamp()
+        scanned = removed = reclaimed = 0
+
+        for entry in _walk(root):
+            if any(entry.path.startswith(skip + os.sep) for skip in skip_dirs):
+                continue
+            scanned += 1
+            relative = os.path.relpath(entry.path, root).replace(os.sep, '/')
+            # Thumbnails are kept while their original is
+            if relative in referenced or thumbnail_original(relative) in referenced:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime >= cutoff_ts:
+                continue
+
+            removed += 1
+            reclaimed += stat.st_size
+            if dry_run or options['verbosity'] > 1:
+                self.stdout.write(f'  {relative} ({_format_bytes(stat.st_size)})')
+            if dry_run:
+                continue
+            if options['quarantine']:
+                target = os.path.join(quarantine_root, relative)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(entry.path, target)
+            else:
+                os.remove(entry.path)
+
+        if dry_run:
+            verb = 'would be quarantined' if options['quarantine'] else 'would be deleted'
+            self.stdout.write(self.style.SUCCESS(
+                f'Scanned {scanned:,} file(s): {removed:,} unreferenced {verb}, '
+                f'{_format_bytes(reclaimed)} (dry run)'
+            ))
+        else:
+            verb = 'quarantined' if options['quarantine'] else 'deleted'
+            self.stdout.write(self.style.SUCCESS(
+                f'Scanned {scanned:,} file(s): {verb} {removed:,} unreferenced file(s), '
+                f'reclaimed {_format_bytes(reclaimed)}'
+            ))
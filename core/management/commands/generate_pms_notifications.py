@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
 from core.models import PMS, Notification, CustomUser
+from core.pms_scheduler import mark_overdue
 
 
 class Command(BaseCommand):
@@ -29,7 +30,7 @@ class Command(BaseCommand):
             scheduled_pms = PMS.objects.filter(
                 scheduled_date=target_date,
                 status='Scheduled'
-            )
+            ).select_related('vehicle')
             
             for pms in scheduled_pms:
                 # Determine notification details based on days ahead
@@ -73,11 +74,9 @@ class Command(BaseCommand):
                             f'Created notification for {user.username}: {title}'
                         )
 
-        # Also check for overdue PMS records
-        overdue_pms = PMS.objects.filter(
-            scheduled_date__lt=today,
-            status='Scheduled'
-        )
+        # Also check for overdue PMS records (moving any past-due ones to Overdue first)
+        mark_overdue(today)
+        overdue_pms = PMS.objects.filter(status='Overdue', scheduled_date__lt=today).select_related('vehicle')
         
         for pms in overdue_pms:
             days_overdue = (today - pms.scheduled_date).days
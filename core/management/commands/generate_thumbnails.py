@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.thumbnails import SIZES, generate_thumbnails, uploaded_image_paths
+
+
+class Command(BaseCommand):
+    help = 'Generate missing thumbnails for every uploaded vehicle and inspection image'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the images that would be processed without writing thumbnails',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate thumbnails that already exist',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Images processed in parallel (default 4)',
+        )
+
+    def handle(self, *args, **options):
+        # The same file can be referenced by more than one record
+        paths = list(dict.fromkeys(uploaded_image_paths()))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'{len(paths)} image(s) would get up to {len(SIZES)} thumbnail(s) each (dry run)'
+            ))
+            return
+
+        force = options['force']
+        written = 0
+        failed = 0
+
+        def work(path):
+            try:
+                return generate_thumbnails(path, force=force), None
+            except Exception as e:
+                return 0, e
+
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as executor:
+            for path, (count, error) in zip(paths, executor.map(work, paths)):
+                if error is not None:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f'  {path}: {error}'))
+                written += count
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} thumbnail(s) for {len(paths)} image(s); {failed} failed'
+        ))
@@ -0,0 +1,49 @@
+import os
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from core.fleet_import import BATCH_SIZE, IMPORTERS
+
+
+class Command(BaseCommand):
+    help = (
+        'Create or update vehicles (keyed on plate number) or drivers (keyed on license number), '
+        'or add the transactions of a fuel card or RFID toll statement, from a CSV/XLSX file'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help='What the file lists')
+        parser.add_argument('path', help='CSV or XLSX file with a header row')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate every row and report the errors without saving anything',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Rows validated and written per batch (default {BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'{path} does not exist')
+
+        importer, noun, _ = IMPORTERS[options['kind']]
+        with open(path, 'rb') as f:
+            try:
+                result = importer(f, path, dry_run=options['dry_run'], batch_size=max(options['batch_size'], 1))
+            except ValidationError as e:
+                raise CommandError(' '.join(e.messages))
+
+        for line, message in result.errors:
+            self.stdout.write(self.style.WARNING(f'  line {line}: {message}'))
+        if result.error_count > len(result.errors):
+            self.stdout.write(self.style.WARNING(f'  ... and {result.error_count - len(result.errors)} more error(s)'))
+        for identifier, count in getattr(result, 'unknown', {}).items():
+            self.stdout.write(self.style.WARNING(f'  unknown {identifier}: {count} row(s)'))
+        summary = result.summary(noun)
+        self.stdout.write(self.style.SUCCESS(f'{summary} (dry run)' if result.dry_run else summary))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import PMS
+from core.pms_scheduler import mark_overdue
+
+
+class Command(BaseCommand):
+    help = 'Move every Scheduled PMS whose date has passed to Overdue in one UPDATE'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='List the PMS records that would become Overdue without updating them',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            today = timezone.localdate()
+            pending = (
+                PMS.objects.filter(status='Scheduled', scheduled_date__lt=today)
+                .order_by('scheduled_date')
+                .values_list('pk', 'vehicle__plate_number', 'scheduled_date')
+            )
+            count = 0
+            for pk, plate_number, scheduled_date in pending.iterator(chunk_size=1000):
+                self.stdout.write(f'  PMS {pk} ({plate_number}): scheduled {scheduled_date}, {(today - scheduled_date).days} day(s) past due')
+                count += 1
+            self.stdout.write(self.style.SUCCESS(f'{count} PMS record(s) would be marked Overdue (dry run)'))
+            return
+
+        changed = mark_overdue()
+        self.stdout.write(self.style.SUCCESS(f'Marked {changed} PMS record(s) Overdue'))
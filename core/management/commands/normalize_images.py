@@ -0,0 +1,107 @@
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.image_normalizer import JPEG_QUALITY, MAX_DIMENSION, normalize_file
+from core.storage import referenced_paths, store_normalized, upload_storage
+from core.thumbnails import generate_thumbnails, is_image
+
+
+def _format_bytes(size):
+    if abs(size) < 1024:
+        return f'{size} B'
+    for unit in ('KB', 'MB', 'GB', 'TB'):
+        size /= 1024
+        if abs(size) < 1024 or unit == 'TB':
+            return f'{size:,.1f} {unit}'
+
+
+class Command(BaseCommand):
+    help = 'Auto-orient, strip metadata from, downscale and recompress every stored photo in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the space that would be saved without replacing any file',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help='Worker processes (default: one per CPU)',
+        )
+        parser.add_argument(
+            '--max-dimension',
+            type=int,
+            default=MAX_DIMENSION,
+            help=f'Longest side in pixels after normalizing (default {MAX_DIMENSION})',
+        )
+        parser.add_argument(
+            '--quality',
+            type=int,
+            default=JPEG_QUALITY,
+            help=f'JPEG/WebP quality (default {JPEG_QUALITY})',
+        )
+
+    def handle(self, *args, **options):
+        storage = upload_storage()
+        paths = list(dict.fromkeys(path for path in referenced_paths() if is_image(path)))
+        workers = max(options['workers'], 1)
+        dry_run = options['dry_run']
+
+        normalized = unchanged = failed = 0
+        bytes_before = bytes_after = 0
+
+        pending = {}
+        queue = iter(paths)
+
+        def submit_next():
+            path = next(queue, None)
+            if path is not None:
+                future = pool.submit(normalize_file, storage.path(path), options['max_dimension'], options['quality'])
+                pending[future] = path, timezone.now()
+
+        # A bounded window of work: results (whole images) never pile up in memory
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for _ in range(workers * 2):
+                submit_next()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, read_at = pending.pop(future)
+                    submit_next()
+                    try:
+                        original_size, result = future.result()
+                    except FileNotFoundError:
+                        continue
+                    except Exception as e:
+                        failed += 1
+                        self.stdout.write(self.style.WARNING(f'  {path}: {e}'))
+                        continue
+                    if result is None:
+                        unchanged += 1
+                        continue
+
+                    data, extension = result
+                    normalized += 1
+                    bytes_before += original_size
+                    bytes_after += len(data)
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'  {path}: {_format_bytes(original_size)} -> {_format_bytes(len(data))}')
+                    if dry_run:
+                        continue
+
+                    new_path = store_normalized(path, data, extension, storage, read_at)
+                    if new_path != path:
+                        generate_thumbnails(new_path)
+
+        saved = bytes_before - bytes_after
+        share = f' ({saved * 100 / bytes_before:.0f}%)' if bytes_before else ''
+        prefix = 'Would normalize' if dry_run else 'Normalized'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} {normalized:,} of {len(paths):,} image(s) ({unchanged:,} left as they are, {failed:,} failed): '
+            f'{_format_bytes(bytes_before)} -> {_format_bytes(bytes_after)}, saved {_format_bytes(saved)}{share}'
+        ))
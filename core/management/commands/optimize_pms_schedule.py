@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from core.pms_optimizer import apply_plan, optimize
+
+
+class Command(BaseCommand):
+    help = 'Assign pending PMS records to dates and repair shops within shop capacity, minimising overdue days'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=90,
+            help='Planning horizon in days from today (default 90)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Preview the new dates and shops without saving them',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per bulk UPDATE (default 1000)',
+        )
+
+    def handle(self, *args, **options):
+        plan = optimize(days=options['days'])
+        changes = plan.changes
+
+        if options['dry_run'] or options['verbosity'] > 1:
+            for a in changes:
+                late = (a.new_date - a.due_date).days
+                self.stdout.write(
+                    f'~ PMS {a.pms_id} ({a.plate_number}): {a.old_date} {a.old_provider or "-"} -> '
+                    f'{a.new_date} {a.new_provider}' + (f'  [{late} day(s) late]' if late > 0 else '')
+                )
+        for pk, plate_number, due in plan.unassigned:
+            self.stdout.write(self.style.WARNING(f'! PMS {pk} ({plate_number}) due {due}: no free slot within {plan.days} days'))
+        for shop, load in plan.shop_load.items():
+            self.stdout.write(f'  {shop}: {load} PMS')
+        self.stdout.write(
+            f'Current bookings: {plan.overdue_days_before()} overdue day(s), {plan.overbooked_before()} booking(s) over shop capacity'
+        )
+        self.stdout.write(
+            f'This plan: {plan.overdue_days_after()} overdue day(s), no overbooking; '
+            f'{len(plan.assignments)} PMS planned, {len(plan.unassigned)} unplaced'
+        )
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{len(changes)} PMS record(s) would be rescheduled (dry run)'))
+            return
+
+        updated = apply_plan(plan, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rescheduled {updated} PMS record(s)'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.fuel import rebuild_all_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly fuel rollups behind the fuel reports from the stored fuel card transactions'
+
+    def handle(self, *args, **options):
+        total = rebuild_all_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt fuel rollups for {total} vehicle-month(s)'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from core.search import install_backend_index, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for vehicles, drivers, repairs and inspections'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of rows fetched per database round trip (default: 500)'
+        )
+
+    def handle(self, *args, **options):
+        # Make sure the FULLTEXT index / FTS5 table exists before populating it
+        install_backend_index()
+        total = rebuild_index(chunk_size=options['chunk_size'], stdout=self.stdout)
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully indexed {total} records')
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.tolls import rebuild_all_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly toll rollups behind the toll reports from the stored RFID toll transactions'
+
+    def handle(self, *args, **options):
+        total = rebuild_all_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt toll rollups for {total} vehicle-month(s)'))
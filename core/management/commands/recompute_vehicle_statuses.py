@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from core.models import Vehicle
+from core.vehicle_status import recompute_statuses, with_derived_status
+
+
+class Command(BaseCommand):
+    help = 'Re-derive every vehicle status from its repairs, PMS and disposal threshold in one UPDATE'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='List the vehicles whose status would change without updating them',
+        )
+        parser.add_argument(
+            '--clear-overrides',
+            action='store_true',
+            help='Also drop manual status overrides so those vehicles are recomputed too',
+        )
+
+    def handle(self, *args, **options):
+        vehicles = Vehicle.objects.all()
+        if not options['clear_overrides']:
+            vehicles = vehicles.filter(status_override=False)
+
+        if options['dry_run']:
+            pending = (
+                with_derived_status(vehicles)
+                .exclude(status=F('derived_status'))
+                .order_by('plate_number')
+                .values_list('plate_number', 'status', 'derived_status')
+            )
+            count = 0
+            for plate_number, status, derived in pending.iterator(chunk_size=1000):
+                self.stdout.write(f'  {plate_number}: {status} -> {derived}')
+                count += 1
+            self.stdout.write(self.style.SUCCESS(f'{count} vehicle status(es) would change (dry run)'))
+            return
+
+        if options['clear_overrides']:
+            cleared = Vehicle.objects.filter(status_override=True).update(status_override=False)
+            self.stdout.write(f'Cleared {cleared} manual status override(s)')
+
+        changed = recompute_statuses()
+        self.stdout.write(self.style.SUCCESS(f'Updated {changed} vehicle status(es)'))
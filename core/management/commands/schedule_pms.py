@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Vehicle
+from core.pms_scheduler import apply_schedule, interval_rules, plan_schedule
+
+
+class Command(BaseCommand):
+    help = 'Schedule the next due PMS for every vehicle from its mileage and time interval (skips vehicles with an open PMS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the PMS records that would be created without creating them',
+        )
+        parser.add_argument(
+            '--vehicle-type',
+            action='append',
+            dest='vehicle_types',
+            help='Only schedule vehicles of this type (repeatable)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per bulk INSERT (default 1000)',
+        )
+
+    def handle(self, *args, **options):
+        vehicles = Vehicle.objects.all()
+        if options['vehicle_types']:
+            vehicles = vehicles.filter(vehicle_type__in=options['vehicle_types'])
+
+        today = timezone.localdate()
+        planned, skipped = plan_schedule(vehicles, today=today)
+
+        if options['dry_run']:
+            for vehicle_type, (km, months) in sorted(interval_rules().items()):
+                self.stdout.write(f'  rule {vehicle_type}: every {km:,} km or {months} month(s)')
+            for plan in planned:
+                status = 'Overdue' if plan.due_date < today else 'Scheduled'
+                self.stdout.write(
+                    f'+ {plan.plate_number}  {plan.due_date}  {status}  '
+                    f'due by {plan.reason} at {plan.due_mileage:,} km ({plan.current_mileage:,} km now)'
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'{len(planned)} PMS record(s) would be created; {skipped} vehicle(s) already have an open PMS (dry run)'
+            ))
+            return
+
+        created = apply_schedule(planned, today=today, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(created)} PMS record(s); {skipped + len(planned) - len(created)} vehicle(s) already have an open PMS'
+        ))
@@ -0,0 +1,167 @@
+"""
+Permission-checked serving of uploaded files.
+
+Every /media/ request goes through media_response(): the file must belong to
+a record (see core.storage.owners) and the user must be allowed to see that
+kind of record (MEDIA_VIEW_PERMISSIONS). The transfer itself is handed to
+the front-end server when settings.MEDIA_SERVE_BACKEND says one is there:
+
+    'nginx'   X-Accel-Redirect to MEDIA_ACCEL_REDIRECT_PREFIX + path, e.g.
+                  location /protected-media/ { internal; alias /srv/fleet/media/; }
+    'apache'  X-Sendfile with the absolute file path (mod_xsendfile)
+    'django'  (default) the file is streamed from Python, with single-range
+              Range requests, ETag / If-None-Match and Last-Modified
+
+so large registration PDFs do not hold a Python worker for the whole download.
+"""
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags
+
+from .storage import owners
+
+# Users with any of these flags may download files attached to the record type
+MEDIA_VIEW_PERMISSIONS = {
+    'Vehicle': ('can_view_vehicles', 'can_view_repairs', 'can_view_pms', 'can_view_inspections'),
+    'PreInspectionReport': ('can_view_inspections', 'can_view_repairs', 'can_view_pms'),
+    'PostInspectionReport': ('can_view_inspections', 'can_view_repairs', 'can_view_pms'),
+}
+
+# Shown in the browser; anything else is downloaded so uploaded HTML or SVG never runs on this site
+INLINE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'application/pdf'}
+
+OWNERS_CACHE_SECONDS = 300
+STREAM_BLOCK = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _owners(path):
+    key = 'core:media_owners:' + hashlib.sha1(path.encode()).hexdigest()
+    found = cache.get(key)
+    if found is None:
+        found = owners(path)
+        # Only positive answers are cached, so a new upload is visible at once
+        if found:
+            cache.set(key, found, OWNERS_CACHE_SECONDS)
+    return found
+
+
+def can_view(user, record_owners):
+    if not user.is_active or getattr(user, 'status', 'active') != 'active':
+        return False
+    if user.is_superuser or user.has_admin_access():
+        return True
+    return any(
+        getattr(user, flag, False)
+        for model_name, _pk in record_owners
+        for flag in MEDIA_VIEW_PERMISSIONS.get(model_name, ())
+    )
+
+
+def _clean_path(path):
+    path = posixpath.normpath(str(path).replace('\\', '/')).lstrip('/')
+    if not path or path == '.' or path.startswith('../') or path == '..':
+        raise Http404("File not found")
+    return path
+
+
+def _byte_range(header, size):
+    """(start, end) inclusive for a single-range header; None to send the whole file; False if unsatisfiable"""
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        # Missing, malformed or multi-range: the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def _stream(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(STREAM_BLOCK, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def _python_response(request, full_path, content_type, stat):
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    # If-Range: only honour Range when the client's copy is still current
+    if request.headers.get('If-Range', etag) == etag:
+        byte_range = _byte_range(request.headers.get('Range', ''), stat.st_size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+    elif byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(_stream(full_path, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    else:
+        # FileResponse lets the WSGI server use sendfile() where it can
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(stat.st_size)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def media_response(request, path):
+    """Response for an uploaded file, or Http404 when the user may not see it (never 403, to hide what exists)"""
+    path = _clean_path(path)
+    if not can_view(request.user, _owners(path)):
+        raise Http404("File not found")
+    try:
+        full_path = default_storage.path(path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, NotImplementedError, OSError):
+        raise Http404("File not found")
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    backend = getattr(settings, 'MEDIA_SERVE_BACKEND', 'django')
+    if backend == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(path)
+    elif backend == 'apache':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = _python_response(request, full_path, content_type, stat)
+
+    disposition = 'inline' if content_type in INLINE_TYPES else 'attachment'
+    response['Content-Disposition'] = f"{disposition}; filename*=UTF-8''{quote(posixpath.basename(path))}"
+    response['X-Content-Type-Options'] = 'nosniff'
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
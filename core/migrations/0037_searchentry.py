@@ -0,0 +1,81 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:58
+
+from django.db import migrations, models
+
+
+# Frozen copies of the structures core.search.install_backend_index() creates,
+# so this migration does not depend on the runtime module or the live models
+FTS_TABLE = 'core_searchentry_fts'
+MYSQL_FULLTEXT_INDEX = 'core_searchentry_fulltext'
+
+
+def install_fulltext_index(apps, schema_editor):
+    # FULLTEXT index on MySQL, FTS5 table + sync triggers on SQLite
+    table = apps.get_model('core', 'SearchEntry')._meta.db_table
+    conn = schema_editor.connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'mysql':
+            cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", [MYSQL_FULLTEXT_INDEX])
+            if not cursor.fetchall():
+                cursor.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {MYSQL_FULLTEXT_INDEX} (title, content)")
+        elif conn.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"title, content, content='{table}', content_rowid='id', tokenize='unicode61')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+                f"INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content); END"
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall_fulltext_index(apps, schema_editor):
+    table = apps.get_model('core', 'SearchEntry')._meta.db_table
+    conn = schema_editor.connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'mysql':
+            cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", [MYSQL_FULLTEXT_INDEX])
+            if cursor.fetchall():
+                cursor.execute(f"ALTER TABLE {table} DROP INDEX {MYSQL_FULLTEXT_INDEX}")
+        elif conn.vendor == 'sqlite':
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_remove_preinspectionreport_driver_report_attachment_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.CharField(choices=[('vehicle', 'Vehicle'), ('driver', 'Driver'), ('division', 'Division'), ('user', 'User'), ('repair', 'Repair'), ('pre_inspection', 'Pre-Inspection Report'), ('post_inspection', 'Post-Inspection Report')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('title', models.CharField(max_length=255)),
+                ('subtitle', models.CharField(blank=True, max_length=255)),
+                ('content', models.TextField(blank=True, help_text='Indexed text (FULLTEXT on MySQL, FTS5 on SQLite)')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Search Entry',
+                'verbose_name_plural': 'Search Entries',
+                'unique_together': {('object_type', 'object_id')},
+            },
+        ),
+        migrations.RunPython(install_fulltext_index, uninstall_fulltext_index),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:59
+
+import re
+
+from django.db import migrations, models
+
+
+IDENTIFIER_FIELDS = [
+    'plate_number', 'engine_number', 'chassis_number',
+    'rfid_autosweep_number', 'rfid_easytrip_number', 'fleet_card_number',
+]
+
+
+def normalize_identifier(value):
+    # Frozen copy of core.models.normalize_identifier as of this migration
+    return re.sub(r'[\W_]+', '', value or '').upper()
+
+
+def populate_normalized_identifiers(apps, schema_editor):
+    Vehicle = apps.get_model('core', 'Vehicle')
+    normalized_fields = [f'{field}_normalized' for field in IDENTIFIER_FIELDS]
+    batch = []
+    for vehicle in Vehicle.objects.only('pk', *IDENTIFIER_FIELDS).iterator(chunk_size=1000):
+        for field in IDENTIFIER_FIELDS:
+            setattr(vehicle, f'{field}_normalized', normalize_identifier(getattr(vehicle, field)))
+        batch.append(vehicle)
+        if len(batch) >= 1000:
+            Vehicle.objects.bulk_update(batch, normalized_fields)
+            batch = []
+    if batch:
+        Vehicle.objects.bulk_update(batch, normalized_fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0037_searchentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='chassis_number_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='engine_number_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='fleet_card_number_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='plate_number_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='rfid_autosweep_number_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='rfid_easytrip_number_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.RunPython(populate_normalized_identifiers, migrations.RunPython.noop),
+    ]
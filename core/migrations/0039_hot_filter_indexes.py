@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0038_vehicle_normalized_identifiers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read', 'created_at'], name='notif_user_read_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pms',
+            index=models.Index(fields=['vehicle', 'status', 'scheduled_date'], name='pms_veh_status_sched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pms',
+            index=models.Index(fields=['status', 'scheduled_date'], name='pms_status_sched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='preinspectionreport',
+            index=models.Index(fields=['vehicle', 'report_type', 'approved_by'], name='preinsp_veh_type_appr_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='repair',
+            index=models.Index(fields=['vehicle', 'status', 'date_of_repair'], name='repair_veh_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='repair',
+            index=models.Index(fields=['status', 'date_of_repair'], name='repair_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['status', 'vehicle_type'], name='vehicle_status_type_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:10
+
+from django.db import migrations, models
+
+
+def mark_manual_statuses(apps, schema_editor):
+    # Statuses the old code never set automatically were picked by hand; keep them
+    Vehicle = apps.get_model('core', 'Vehicle')
+    Vehicle.objects.filter(status='Unserviceable').update(status_override=True)
+    (Vehicle.objects.filter(status='For Disposal')
+        .exclude(status_change_reason__startswith='Vehicle marked for disposal')
+        .update(status_override=True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0039_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='status_override',
+            field=models.BooleanField(default=False, help_text="Set when a user picks a status the status engine wouldn't derive; automatic updates skip the vehicle until cleared", verbose_name='Manual Status Override'),
+        ),
+        migrations.RunPython(mark_manual_statuses, migrations.RunPython.noop),
+    ]
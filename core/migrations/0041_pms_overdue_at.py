@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0040_vehicle_status_override'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pms',
+            name='overdue_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Marked Overdue At'),
+        ),
+    ]
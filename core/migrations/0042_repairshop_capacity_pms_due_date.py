@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0041_pms_overdue_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pms',
+            name='due_date',
+            field=models.DateField(blank=True, null=True, verbose_name='Due Date'),
+        ),
+        migrations.AddField(
+            model_name='repairshop',
+            name='open_on_weekends',
+            field=models.BooleanField(default=False, verbose_name='Open on Weekends'),
+        ),
+        migrations.AddField(
+            model_name='repairshop',
+            name='pms_slots_per_day',
+            field=models.PositiveIntegerField(default=2, help_text='How many vehicles the shop can service per working day', verbose_name='PMS Slots per Day'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:34
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+OWNER_FIELDS = {
+    'vehicle': ['photos', 'registration_documents'],
+    'preinspectionreport': ['photos', 'driver_report_attachments'],
+    'postinspectionreport': ['photos', 'replaced_parts_images'],
+}
+
+
+# Frozen copy of core.attachments.content_hash as of this migration
+_CONTENT_NAME_RE = re.compile(r'(?:^|/)([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(?:\.[^/.]*)?$')
+
+
+def content_hash(path):
+    match = _CONTENT_NAME_RE.search(path)
+    if not match or not match.group(3).startswith(match.group(1) + match.group(2)):
+        return ''
+    return match.group(3)
+
+
+def populate_attachments(apps, schema_editor):
+    # Rows only, from the database: release() and gc_media rely on them at once.
+    # File sizes and image dimensions are filled in by `manage.py backfill_attachments`.
+    Attachment = apps.get_model('core', 'Attachment')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    batch = []
+    for model_name, fields in OWNER_FIELDS.items():
+        model = apps.get_model('core', model_name)
+        content_type, _ = ContentType.objects.get_or_create(app_label='core', model=model_name)
+        for record in model.objects.only('pk', *fields).iterator(chunk_size=1000):
+            for kind in fields:
+                paths = getattr(record, kind)
+                if not isinstance(paths, list):
+                    continue
+                for position, path in enumerate(dict.fromkeys(str(path) for path in paths if path)):
+                    batch.append(Attachment(
+                        content_type=content_type, object_id=record.pk,
+                        kind=kind, position=position, path=path, sha256=content_hash(path),
+                    ))
+            if len(batch) >= 1000:
+                Attachment.objects.bulk_create(batch)
+                batch = []
+    if batch:
+        Attachment.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0043_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('kind', models.CharField(choices=[('photos', 'Photo'), ('registration_documents', 'Registration Document'), ('driver_report_attachments', 'Driver Report Attachment'), ('replaced_parts_images', 'Replaced Part Image')], help_text="The owner's path list this file is in", max_length=30)),
+                ('position', models.PositiveIntegerField(default=0, help_text="Order within the owner's list")),
+                ('path', models.CharField(help_text='Storage path, as listed by the owner', max_length=500)),
+                ('size', models.BigIntegerField(blank=True, help_text='File size in bytes, if the file existed when listed', null=True)),
+                ('sha256', models.CharField(blank=True, help_text='Content hash; known for content-addressed uploads', max_length=64)),
+                ('width', models.PositiveIntegerField(blank=True, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'verbose_name': 'Attachment',
+                'verbose_name_plural': 'Attachments',
+                'ordering': ['kind', 'position'],
+                'indexes': [models.Index(fields=['content_type', 'object_id', 'kind', 'position'], name='attachment_owner_idx'), models.Index(fields=['path'], name='attachment_path_idx'), models.Index(fields=['sha256'], name='attachment_sha256_idx')],
+            },
+        ),
+        migrations.RunPython(populate_attachments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0044_attachment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FuelMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('transactions', models.PositiveIntegerField(default=0)),
+                ('liters', models.DecimalField(decimal_places=3, default=0, max_digits=14)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fuel_rollups', to='core.vehicle')),
+            ],
+            options={
+                'ordering': ['-month'],
+                'unique_together': {('vehicle', 'month')},
+            },
+        ),
+        migrations.CreateModel(
+            name='FuelTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('card_number', models.CharField(max_length=100)),
+                ('card_number_normalized', models.CharField(editable=False, max_length=100)),
+                ('transaction_at', models.DateTimeField()),
+                ('month', models.DateField(editable=False, help_text='First day of the local month of the transaction, for the monthly rollups')),
+                ('station', models.CharField(blank=True, max_length=200)),
+                ('product', models.CharField(blank=True, max_length=100)),
+                ('liters', models.DecimalField(blank=True, decimal_places=3, max_digits=10, null=True)),
+                ('unit_price', models.DecimalField(blank=True, decimal_places=4, max_digits=10, null=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('odometer', models.PositiveIntegerField(blank=True, null=True)),
+                ('reference', models.CharField(blank=True, help_text="The provider's transaction or receipt number", max_length=100)),
+                ('fingerprint', models.CharField(editable=False, help_text='Hash of card, time, amount, liters and reference; a statement imported twice adds nothing', max_length=64, unique=True)),
+                ('source_file', models.CharField(blank=True, max_length=255)),
+                ('imported_at', models.DateTimeField(auto_now_add=True)),
+                ('imported_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('vehicle', models.ForeignKey(blank=True, help_text="Empty while the card number matches no vehicle's fleet card", null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='fuel_transactions', to='core.vehicle')),
+            ],
+            options={
+                'ordering': ['-transaction_at'],
+                'indexes': [models.Index(fields=['vehicle', 'month'], name='fuel_vehicle_month_idx'), models.Index(fields=['card_number_normalized', 'month'], name='fuel_card_month_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0045_fuel_transactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TollMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('transactions', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='toll_rollups', to='core.vehicle')),
+            ],
+            options={
+                'ordering': ['-month'],
+                'unique_together': {('vehicle', 'month')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TollTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(blank=True, choices=[('autosweep', 'Autosweep'), ('easytrip', 'Easytrip')], max_length=10)),
+                ('tag_number_normalized', models.CharField(editable=False, max_length=100)),
+                ('transaction_at', models.DateTimeField()),
+                ('month', models.DateField(editable=False, help_text='First day of the local month of the transaction, for the monthly rollups')),
+                ('entry_plaza', models.CharField(blank=True, max_length=100)),
+                ('exit_plaza', models.CharField(blank=True, max_length=100)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reference', models.CharField(blank=True, max_length=50)),
+                ('fingerprint', models.CharField(editable=False, help_text='Hash of tag, time, plazas, amount and reference; a statement imported twice adds nothing', max_length=32, unique=True)),
+                ('vehicle', models.ForeignKey(blank=True, help_text="Empty while the tag matches no vehicle's RFID numbers", null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='toll_transactions', to='core.vehicle')),
+            ],
+            options={
+                'ordering': ['-transaction_at'],
+                'indexes': [models.Index(fields=['vehicle', 'month'], name='toll_vehicle_month_idx'), models.Index(fields=['tag_number_normalized', 'month'], name='toll_tag_month_idx')],
+            },
+        ),
+    ]
@@ -1,8 +1,115 @@
 from django.db import models
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import AbstractUser
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
 from decimal import Decimal
+import copy
+import re
+
+
+def normalize_identifier(value):
+    """Strip separators and case so 'abc-123' and 'ABC 123' both become 'ABC123'"""
+    return re.sub(r'[\W_]+', '', value or '').upper()
+
+
+class DirtyFieldsMixin(models.Model):
+    """
+    Remembers the field values an instance was loaded (or last saved) with.
+    
+    Save hooks can compare against previous() instead of re-reading the row,
+    and saves of loaded rows only write the columns in changed_fields.
+    """
+    
+    class Meta:
+        abstract = True
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_loaded_values()
+        return instance
+    
+    def _snapshot_loaded_values(self, field_names=None):
+        """Snapshot every loaded field, or only field_names (the columns just written or read)"""
+        if field_names is None:
+            deferred = self.get_deferred_fields()
+            self._loaded_values = {}
+            attnames = [field.attname for field in self._meta.concrete_fields if field.attname not in deferred]
+        else:
+            attnames = [self._meta.get_field(name).attname for name in field_names]
+        for attname in attnames:
+            value = getattr(self, attname)
+            # JSON lists/dicts are mutated in place (photos.append), so keep a copy
+            self._loaded_values[attname] = copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+    
+    @property
+    def changed_fields(self):
+        """Names of loaded fields whose value differs from the snapshot"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return set()
+        return {
+            field.name for field in self._meta.concrete_fields
+            if field.attname in loaded and getattr(self, field.attname) != loaded[field.attname]
+        }
+    
+    def previous(self, field_name):
+        """Value field_name had when loaded/last saved, or None for a new instance"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return loaded.get(self._meta.get_field(field_name).attname)
+    
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        # Partial refresh: keep the snapshot of fields that may hold unsaved edits
+        if fields is None or getattr(self, '_loaded_values', None) is None:
+            self._snapshot_loaded_values()
+        else:
+            self._snapshot_loaded_values(fields)
+    
+    def save(self, *args, **kwargs):
+        # Loaded rows only write what changed (plus auto_now timestamps)
+        if (not self._state.adding and getattr(self, '_loaded_values', None) is not None
+                and kwargs.get('update_fields') is None and not args
+                and not kwargs.get('force_insert')):
+            auto_now = {
+                field.name for field in self._meta.concrete_fields
+                if getattr(field, 'auto_now', False)
+            }
+            kwargs['update_fields'] = self.changed_fields | auto_now
+        super().save(*args, **kwargs)
+        # After save(update_fields=...) only those columns match the row; other edits stay dirty
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or getattr(self, '_loaded_values', None) is None:
+            self._snapshot_loaded_values()
+        else:
+            self._snapshot_loaded_values(update_fields)
+
+
+class AttachmentOwnerMixin:
+    """
+    Accessors over a record's Attachment rows. They read attachments.all(),
+    so a list view that uses prefetch_related('attachments') runs no query per row.
+    """
+    
+    def attachments_of(self, kind):
+        return [attachment for attachment in self.attachments.all() if attachment.kind == kind]
+    
+    @property
+    def photo_attachments(self):
+        return self.attachments_of('photos')
+    
+    @property
+    def photo_count(self):
+        return len(self.photo_attachments)
+    
+    @property
+    def first_photo(self):
+        photos = self.photo_attachments
+        return photos[0] if photos else None
 
 
 class CustomUser(AbstractUser):
@@ -173,7 +280,7 @@ class Driver(models.Model):
         return self.name
 
 
-class Vehicle(models.Model):
+class Vehicle(AttachmentOwnerMixin, DirtyFieldsMixin, models.Model):
     STATUS_CHOICES = [
         ('Serviceable', 'Serviceable'),
         ('Under Repair', 'Under Repair'),
@@ -208,22 +315,56 @@ class Vehicle(models.Model):
     status_changed_at = models.DateTimeField(null=True, blank=True, verbose_name='Status Changed At')
     status_changed_by = models.ForeignKey('CustomUser', on_delete=models.SET_NULL, null=True, blank=True, related_name='vehicle_status_changes', verbose_name='Status Changed By')
     status_change_reason = models.TextField(blank=True, verbose_name='Status Change Reason')
+    status_override = models.BooleanField(default=False, verbose_name='Manual Status Override', help_text="Set when a user picks a status the status engine wouldn't derive; automatic updates skip the vehicle until cleared")
     date_acquired = models.DateField()
     current_mileage = models.IntegerField(default=0)
     photos = models.JSONField(default=list, blank=True, help_text="List of vehicle photo file paths")
     registration_documents = models.JSONField(default=list, blank=True, help_text="List of registration document file paths")
+    attachments = GenericRelation('Attachment')
     # RFID and Fleet Card Information
     rfid_autosweep_number = models.CharField(max_length=100, blank=True, verbose_name='Autosweep RFID Number')
     rfid_easytrip_number = models.CharField(max_length=100, blank=True, verbose_name='Easytrip RFID Number')
     fleet_card_number = models.CharField(max_length=100, blank=True, verbose_name='Fleet Card Number')
     gas_station = models.CharField(max_length=200, blank=True, verbose_name='Gas Station')
     notes = models.TextField(blank=True)
+    # Normalized copies of the identifiers above (see normalize_identifier) for indexed prefix lookups
+    plate_number_normalized = models.CharField(max_length=50, blank=True, editable=False, db_index=True)
+    engine_number_normalized = models.CharField(max_length=100, blank=True, editable=False, db_index=True)
+    chassis_number_normalized = models.CharField(max_length=100, blank=True, editable=False, db_index=True)
+    rfid_autosweep_number_normalized = models.CharField(max_length=100, blank=True, editable=False, db_index=True)
+    rfid_easytrip_number_normalized = models.CharField(max_length=100, blank=True, editable=False, db_index=True)
+    fleet_card_number_normalized = models.CharField(max_length=100, blank=True, editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Identifiers staff look vehicles up by, in typeahead priority order
+    IDENTIFIER_FIELDS = [
+        'plate_number',
+        'engine_number',
+        'chassis_number',
+        'rfid_autosweep_number',
+        'rfid_easytrip_number',
+        'fleet_card_number',
+    ]
+    
     def __str__(self):
         return f"{self.plate_number} - {self.brand} {self.model}"
     
+    def normalize_identifiers(self):
+        """Fill the *_normalized columns from their source fields; bulk writes must call this themselves"""
+        for field in self.IDENTIFIER_FIELDS:
+            setattr(self, f'{field}_normalized', normalize_identifier(getattr(self, field)))
+    
+    def save(self, *args, **kwargs):
+        # Keep normalized identifier columns in sync with their source fields
+        self.normalize_identifiers()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                f'{field}_normalized' for field in self.IDENTIFIER_FIELDS if field in update_fields
+            }
+        super().save(*args, **kwargs)
+    
     def update_status(self, new_status, user=None, reason='', auto_update=False):
         """Update vehicle status with tracking"""
         from django.utils import timezone
@@ -234,8 +375,8 @@ class Vehicle(models.Model):
         self.status_changed_by = user
         self.status_change_reason = reason
         
-        # Save the vehicle
-        self.save()
+        # Only write the status columns so concurrent edits to other fields aren't clobbered
+        self.save(update_fields=['status', 'status_changed_at', 'status_changed_by', 'status_change_reason', 'status_override', 'updated_at'])
         
         # Create notification if not auto-update
         if not auto_update and user:
@@ -284,36 +425,16 @@ class Vehicle(models.Model):
         return self.total_repair_costs >= threshold
     
     def check_and_mark_for_disposal(self, user=None):
-        """Check if vehicle exceeds threshold and automatically mark/unmark for disposal if needed"""
-        # Refresh from DB to get latest repair costs
-        self.refresh_from_db()
-        
-        threshold = self.disposal_threshold
-        if threshold is None:
-            return False
-        
-        total_costs = self.total_repair_costs
-        is_for_disposal = total_costs >= threshold
-        
-        # Mark for disposal if costs exceed threshold
-        if is_for_disposal and self.status != 'For Disposal':
-            reason = f'Vehicle marked for disposal: Total repair costs ({total_costs:.2f}) exceed half of current market value (threshold: {threshold:.2f})'
-            self.update_status('For Disposal', user=user, reason=reason, auto_update=True)
-            return True
-        
-        # Unmark from disposal if costs drop below threshold
-        if not is_for_disposal and self.status == 'For Disposal':
-            # Check if vehicle has ongoing repairs
-            ongoing_repairs = self.repairs.filter(status='Ongoing').exists()
-            new_status = 'Under Repair' if ongoing_repairs else 'Serviceable'
-            reason = f'Vehicle unmarked from disposal: Total repair costs ({total_costs:.2f}) are below threshold ({threshold:.2f})'
-            self.update_status(new_status, user=user, reason=reason, auto_update=True)
-            return True
-        
-        return False
+        """Re-derive status (including the disposal threshold) through the status engine"""
+        from .vehicle_status import sync_vehicle_status
+        return sync_vehicle_status(self)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Dashboard status counts and per-type breakdowns
+            models.Index(fields=['status', 'vehicle_type'], name='vehicle_status_type_idx'),
+        ]
 
 
 class RepairShop(models.Model):
@@ -323,6 +444,9 @@ class RepairShop(models.Model):
     email = models.EmailField(blank=True)
     contact_person = models.CharField(max_length=200, blank=True)
     is_active = models.BooleanField(default=True)
+    # Capacity used by the PMS schedule optimizer (optimize_pms_schedule)
+    pms_slots_per_day = models.PositiveIntegerField(default=2, verbose_name='PMS Slots per Day', help_text='How many vehicles the shop can service per working day')
+    open_on_weekends = models.BooleanField(default=False, verbose_name='Open on Weekends')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -349,7 +473,7 @@ class RepairPart(models.Model):
         verbose_name_plural = 'Repair Parts'
 
 
-class Repair(models.Model):
+class Repair(DirtyFieldsMixin, models.Model):
     STATUS_CHOICES = [
         ('Completed', 'Completed'),
         ('Ongoing', 'Ongoing'),
@@ -404,244 +528,38 @@ class Repair(models.Model):
         else:
             self._validate_inspection_requirements()
         
-        # Store old status and cost to check if we need to re-calculate disposal status
-        old_status = None
-        old_cost = None
-        if self.pk:
-            try:
-                old_repair = self.__class__.objects.get(pk=self.pk)
-                old_status = old_repair.status
-                old_cost = old_repair.cost + (old_repair.labor_cost or 0)
-            except self.__class__.DoesNotExist:
-                pass
+        # Only status, costs or the vehicle itself affect the vehicle's derived status
+        adding = self._state.adding
+        status_inputs_changed = self.changed_fields & {'status', 'cost', 'labor_cost', 'vehicle'}
+        old_vehicle_id = self.previous('vehicle')
         
         super().save(*args, **kwargs)
         
-        # Check if vehicle should be marked/unmarked for disposal
-        # This happens when:
-        # 1. A repair is marked as Completed
-        # 2. A completed repair's cost is updated
-        # 3. A repair is changed from Completed to Ongoing (reduces total costs)
-        should_recheck_disposal = False
-        current_cost = self.total_cost
-        
-        if self.status == 'Completed':
-            # Always recheck when repair is completed or cost changes
-            should_recheck_disposal = True
-        elif old_status == 'Completed':
-            # Repair was completed before - check if cost changed or status changed to Ongoing
-            if old_cost != current_cost or self.status != 'Completed':
-                should_recheck_disposal = True
-        
-        if should_recheck_disposal and self.vehicle.current_market_value:
-            # Refresh vehicle from DB to get latest repair costs
-            self.vehicle.refresh_from_db()
-            self.vehicle.check_and_mark_for_disposal(user=None)
-        
-        # Check if status changed to Completed
-        if self.status == 'Completed' and old_status != 'Completed':
-            # Refresh vehicle from DB to get current status
-            self.vehicle.refresh_from_db()
-            
-            # Check if there are any other ongoing repairs or PMS for this vehicle
-            ongoing_repairs = self.vehicle.repairs.filter(status='Ongoing').exclude(id=self.id).exists()
-            ongoing_pms = self.vehicle.pms_records.filter(status='In Progress').exists()
-            
-            # Only set to serviceable if:
-            # 1. No ongoing repairs or PMS
-            # 2. Vehicle is not marked for disposal
-            # 3. Vehicle is currently Under Repair or Unserviceable (could be set to serviceable)
-            if not ongoing_repairs and not ongoing_pms and self.vehicle.status != 'For Disposal':
-                # Set vehicle to serviceable when all maintenance is completed
-                self.vehicle.update_status(
-                    'Serviceable', 
-                    reason=f'Repair completed for vehicle {self.vehicle.plate_number}',
-                    auto_update=True
-                )
-        elif old_status == 'Completed' and self.status != 'Completed':
-            # Repair was un-completed, recheck disposal status as costs have decreased
-            if self.vehicle.current_market_value:
-                self.vehicle.refresh_from_db()
-                self.vehicle.check_and_mark_for_disposal(user=None)
-        
-        elif self.status == 'Ongoing' and self.vehicle.status == 'Serviceable':
-            # Set vehicle to under repair when repair starts
-            self.vehicle.update_status(
-                'Under Repair',
-                reason=f'Repair started for vehicle {self.vehicle.plate_number}',
-                auto_update=True
-            )
+        if adding or status_inputs_changed:
+            from .vehicle_status import recompute_statuses, sync_vehicle_status
+            sync_vehicle_status(self.vehicle)
+            if old_vehicle_id and old_vehicle_id != self.vehicle_id:
+                # Repair moved to another vehicle: the old one may be serviceable again
+                recompute_statuses(Vehicle.objects.filter(pk=old_vehicle_id))
     
     def _validate_inspection_requirements_skip_pms(self):
         """Validate inspection requirements except PMS usage checks (for repairs created from PMS)"""
-        from django.core.exceptions import ValidationError
-        
-        # Rule 1: Cannot create repair without approved pre-inspection
-        if not self.pk and not self.pre_inspection:
-            raise ValidationError(
-                "A repair cannot be created without an approved pre-inspection report. "
-                "Please create and approve a pre-inspection report first."
-            )
-        
-        # Rule 2: Cannot mark as completed without post-inspection
-        if self.status == 'Completed' and not self.post_inspection:
-            raise ValidationError(
-                "A repair cannot be marked as completed without a post-inspection report. "
-                "Please create and approve a post-inspection report first."
-            )
-        
-        # Rule 3: Pre-inspection must be approved
-        if self.pre_inspection and not self.pre_inspection.is_approved:
-            raise ValidationError(
-                "The pre-inspection report must be approved before creating a repair. "
-                "Please approve the pre-inspection report first."
-            )
-        
-        # Rule 4: Post-inspection must be approved only when marking repair as completed
-        if self.status == 'Completed' and self.post_inspection and not self.post_inspection.is_approved:
-            raise ValidationError(
-                "The post-inspection report must be approved before marking repair as completed. "
-                "Please approve the post-inspection report first."
-            )
-        
-        # Rule 5: Pre-inspection vehicle must match repair vehicle
-        if self.pre_inspection and self.vehicle:
-            if self.pre_inspection.vehicle != self.vehicle:
-                raise ValidationError(
-                    f"The pre-inspection report is for vehicle {self.pre_inspection.vehicle.plate_number}, "
-                    f"but this repair is for vehicle {self.vehicle.plate_number}. "
-                    "The pre-inspection report must be for the same vehicle as the repair."
-                )
-        
-        # Rule 6: Post-inspection vehicle must match repair vehicle
-        if self.post_inspection and self.vehicle:
-            if self.post_inspection.vehicle != self.vehicle:
-                raise ValidationError(
-                    f"The post-inspection report is for vehicle {self.post_inspection.vehicle.plate_number}, "
-                    f"but this repair is for vehicle {self.vehicle.plate_number}. "
-                    "The post-inspection report must be for the same vehicle as the repair."
-                )
-        
-        # Rule 7: Check for other repairs using this pre_inspection (but skip PMS check)
-        if self.pre_inspection:
-            existing_repair = Repair.objects.filter(pre_inspection=self.pre_inspection).exclude(pk=self.pk if self.pk else None).first()
-            if existing_repair:
-                raise ValidationError(
-                    f"This pre-inspection report is already used by repair record for vehicle {existing_repair.vehicle.plate_number}. "
-                    "Each pre-inspection report can only be used once."
-                )
-        
-        # Rule 8: Check for other repairs using this post_inspection (but skip PMS check)
-        if self.post_inspection:
-            existing_repair = Repair.objects.filter(post_inspection=self.post_inspection).exclude(pk=self.pk if self.pk else None).first()
-            if existing_repair:
-                raise ValidationError(
-                    f"This post-inspection report is already used by repair record for vehicle {existing_repair.vehicle.plate_number}. "
-                    "Each post-inspection report can only be used once."
-                )
+        from .inspection_rules import SKIP_PMS_USAGE, validate_repair
+        validate_repair(self, SKIP_PMS_USAGE)
     
     def _validate_inspection_requirements(self):
         """Validate inspection requirements based on business rules"""
-        from django.core.exceptions import ValidationError
-        
-        # Rule 1: Cannot create repair without approved pre-inspection
-        if not self.pk and not self.pre_inspection:
-            raise ValidationError(
-                "A repair cannot be created without an approved pre-inspection report. "
-                "Please create and approve a pre-inspection report first."
-            )
-        
-        # Rule 2: Cannot mark as completed without post-inspection
-        if self.status == 'Completed' and not self.post_inspection:
-            raise ValidationError(
-                "A repair cannot be marked as completed without a post-inspection report. "
-                "Please create and approve a post-inspection report first."
-            )
-        
-        # Rule 3: Pre-inspection must be approved
-        if self.pre_inspection and not self.pre_inspection.is_approved:
-            raise ValidationError(
-                "The pre-inspection report must be approved before creating a repair. "
-                "Please approve the pre-inspection report first."
-            )
-        
-        # Rule 4: Post-inspection must be approved only when marking repair as completed
-        if self.status == 'Completed' and self.post_inspection and not self.post_inspection.is_approved:
-            raise ValidationError(
-                "The post-inspection report must be approved before marking repair as completed. "
-                "Please approve the post-inspection report first."
-            )
-        
-        # Rule 5: Pre-inspection vehicle must match repair vehicle
-        if self.pre_inspection and self.vehicle:
-            if self.pre_inspection.vehicle != self.vehicle:
-                raise ValidationError(
-                    f"The pre-inspection report is for vehicle {self.pre_inspection.vehicle.plate_number}, "
-                    f"but this repair is for vehicle {self.vehicle.plate_number}. "
-                    "The pre-inspection report must be for the same vehicle as the repair."
-                )
-        
-        # Rule 6: Post-inspection vehicle must match repair vehicle
-        if self.post_inspection and self.vehicle:
-            if self.post_inspection.vehicle != self.vehicle:
-                raise ValidationError(
-                    f"The post-inspection report is for vehicle {self.post_inspection.vehicle.plate_number}, "
-                    f"but this repair is for vehicle {self.vehicle.plate_number}. "
-                    "The post-inspection report must be for the same vehicle as the repair."
-                )
-        
-        # Rule 7: Pre-inspection can only be used once (by one repair or one PMS)
-        # Exception: A repair created from a PMS can share the same pre_inspection as the PMS
-        if self.pre_inspection:
-            existing_repair = Repair.objects.filter(pre_inspection=self.pre_inspection).exclude(pk=self.pk if self.pk else None).first()
-            
-            # Check for PMS records using this pre_inspection
-            # IMPORTANT: Only check for standalone PMS (not linked to any repair yet)
-            # If a PMS is linked to a repair, that repair can share the pre_inspection
-            existing_pms = PMS.objects.filter(
-                pre_inspection=self.pre_inspection,
-                repair__isnull=True  # Only standalone PMS (not linked to a repair)
-            ).first()
-            
-            if existing_repair:
-                raise ValidationError(
-                    f"This pre-inspection report is already used by repair record for vehicle {existing_repair.vehicle.plate_number}. "
-                    "Each pre-inspection report can only be used once."
-                )
-            
-            if existing_pms:
-                # Found a standalone PMS using this pre_inspection
-                # This is only allowed if this repair will be linked to that PMS
-                # But we can't check that during validation, so we need to skip this check
-                # and rely on the view to handle it correctly
-                # Actually, we should allow it if the repair is being created from a PMS
-                # Since we can't know that during model validation, we'll skip this check
-                # and let the view/form handle it
-                raise ValidationError(
-                    f"[REPAIR MODEL VALIDATION] This pre-inspection report is already used by PMS record for vehicle {existing_pms.vehicle.plate_number}. "
-                    f"Existing PMS ID: {existing_pms.pk}, Current Repair ID: {self.pk}. Each pre-inspection report can only be used once. "
-                    f"Note: If this repair is being created from a PMS, use skip_pms_validation=True."
-                )
-        
-        # Rule 8: Post-inspection can only be used once (by one repair or one PMS)
-        if self.post_inspection:
-            existing_repair = Repair.objects.filter(post_inspection=self.post_inspection).exclude(pk=self.pk if self.pk else None).first()
-            existing_pms = PMS.objects.filter(post_inspection=self.post_inspection).first()
-            
-            if existing_repair:
-                raise ValidationError(
-                    f"This post-inspection report is already used by repair record for vehicle {existing_repair.vehicle.plate_number}. "
-                    "Each post-inspection report can only be used once."
-                )
-            
-            if existing_pms:
-                raise ValidationError(
-                    f"This post-inspection report is already used by PMS record for vehicle {existing_pms.vehicle.plate_number}. "
-                    "Each post-inspection report can only be used once."
-                )
+        from .inspection_rules import validate_repair
+        validate_repair(self)
     
     class Meta:
         ordering = ['-date_of_repair', '-created_at']
+        indexes = [
+            # Vehicle detail / repair list filters and completed-cost totals per vehicle
+            models.Index(fields=['vehicle', 'status', 'date_of_repair'], name='repair_veh_status_date_idx'),
+            # Dashboard monthly and yearly completed repair costs
+            models.Index(fields=['status', 'date_of_repair'], name='repair_status_date_idx'),
+        ]
 
 
 class RepairPartItem(models.Model):
@@ -704,9 +622,13 @@ class Notification(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Notification'
         verbose_name_plural = 'Notifications'
+        indexes = [
+            # Navbar unread badge and dropdown (context processor) on every page
+            models.Index(fields=['user', 'is_read', 'created_at'], name='notif_user_read_created_idx'),
+        ]
 
 
-class PreInspectionReport(models.Model):
+class PreInspectionReport(AttachmentOwnerMixin, models.Model):
     """Pre-inspection report before repair or PMS"""
     
     REPORT_TYPE_CHOICES = [
@@ -757,6 +679,7 @@ class PreInspectionReport(models.Model):
     
     # Driver report attachments (multiple)
     driver_report_attachments = models.JSONField(default=list, blank=True, help_text="List of driver report attachment file paths")
+    attachments = GenericRelation('Attachment')
     
     # Approval
     approved_by = models.ForeignKey('CustomUser', on_delete=models.SET_NULL, null=True, blank=True, related_name='approved_pre_inspections')
@@ -812,9 +735,13 @@ class PreInspectionReport(models.Model):
         ordering = ['-inspection_date']
         verbose_name = 'Pre-Inspection Report'
         verbose_name_plural = 'Pre-Inspection Reports'
+        indexes = [
+            # Approved, unused pre-inspections offered for a vehicle on repair/PMS forms
+            models.Index(fields=['vehicle', 'report_type', 'approved_by'], name='preinsp_veh_type_appr_idx'),
+        ]
 
 
-class PostInspectionReport(models.Model):
+class PostInspectionReport(AttachmentOwnerMixin, models.Model):
     """Post-inspection report after repair or PMS completion"""
     
     REPORT_TYPE_CHOICES = [
@@ -877,6 +804,7 @@ class PostInspectionReport(models.Model):
     
     # Replaced parts images attachment (multiple images)
     replaced_parts_images = models.JSONField(default=list, blank=True, null=True, help_text="List of replaced parts image file paths")
+    attachments = GenericRelation('Attachment')
     
     def get_replaced_parts_images_list(self):
         """Safely get replaced_parts_images as a list"""
@@ -974,7 +902,7 @@ class PostInspectionReport(models.Model):
         verbose_name_plural = 'Post-Inspection Reports'
 
 
-class PMS(models.Model):
+class PMS(DirtyFieldsMixin, models.Model):
     """Preventive Maintenance Service"""
     STATUS_CHOICES = [
         ('Scheduled', 'Scheduled'),
@@ -1003,6 +931,10 @@ class PMS(models.Model):
     
     # Link to repair record if parts were replaced during PMS
     repair = models.ForeignKey(Repair, on_delete=models.SET_NULL, null=True, blank=True, related_name='pms_records', verbose_name='Associated Repair')
+    # Date the service falls due; scheduled_date is the booked date, which the optimizer may move
+    due_date = models.DateField(null=True, blank=True, verbose_name='Due Date')
+    # Set when a past-due Scheduled PMS is moved to Overdue (see pms_scheduler.mark_overdue)
+    overdue_at = models.DateTimeField(null=True, blank=True, verbose_name='Marked Overdue At')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -1020,175 +952,235 @@ class PMS(models.Model):
             # Still validate other requirements, just not the usage checks
             self._validate_other_requirements()
         
-        # Store old status to check if status changed
-        old_status = None
-        if self.pk:
-            try:
-                old_pms = self.__class__.objects.get(pk=self.pk)
-                old_status = old_pms.status
-            except self.__class__.DoesNotExist:
-                pass
+        # Only the PMS status (or moving it to another vehicle) affects the vehicle's derived status
+        adding = self._state.adding
+        status_inputs_changed = self.changed_fields & {'status', 'vehicle'}
+        old_vehicle_id = self.previous('vehicle')
         
         super().save(*args, **kwargs)
         
-        # Auto-update vehicle status based on PMS status
-        if self.status == 'In Progress' and self.vehicle.status == 'Serviceable':
-            # Set vehicle to under repair when PMS starts
-            self.vehicle.update_status(
-                'Under Repair',
-                reason=f'PMS in progress for vehicle {self.vehicle.plate_number}',
-                auto_update=True
-            )
-        
-        # Check if status changed to Completed
-        elif self.status == 'Completed' and old_status != 'Completed':
-            # Refresh vehicle from DB to get current status
-            self.vehicle.refresh_from_db()
-            
-            # Check if there are ongoing repairs or PMS in progress
-            ongoing_repairs = self.vehicle.repairs.filter(status='Ongoing').exists()
-            ongoing_pms = self.vehicle.pms_records.filter(status='In Progress').exclude(id=self.id).exists()
-            
-            # Only set to serviceable if:
-            # 1. No ongoing repairs or PMS
-            # 2. Vehicle is not marked for disposal
-            # 3. Vehicle is currently Under Repair or Unserviceable (could be set to serviceable)
-            if not ongoing_repairs and not ongoing_pms and self.vehicle.status != 'For Disposal':
-                # Set vehicle to serviceable when all maintenance is completed
-                self.vehicle.update_status(
-                    'Serviceable',
-                    reason=f'PMS completed for vehicle {self.vehicle.plate_number}',
-                    auto_update=True
-                )
+        if adding or status_inputs_changed:
+            from .vehicle_status import recompute_statuses, sync_vehicle_status
+            sync_vehicle_status(self.vehicle)
+            if old_vehicle_id and old_vehicle_id != self.vehicle_id:
+                recompute_statuses(Vehicle.objects.filter(pk=old_vehicle_id))
     
     def _validate_other_requirements(self):
         """Validate inspection requirements except usage checks (for form saves)"""
-        from django.core.exceptions import ValidationError
-        
-        # Rule 1: Cannot create PMS without approved pre-inspection
-        if not self.pk and not self.pre_inspection:
-            raise ValidationError(
-                "A PMS record cannot be created without an approved pre-inspection report. "
-                "Please create and approve a pre-inspection report first."
-            )
-        
-        # Rule 2: Cannot mark as completed without post-inspection
-        if self.status == 'Completed' and not self.post_inspection:
-            raise ValidationError(
-                "A PMS record cannot be marked as completed without a post-inspection report. "
-                "Please create and approve a post-inspection report first."
-            )
-        
-        # Rule 3: Pre-inspection must be approved
-        if self.pre_inspection and not self.pre_inspection.is_approved:
-            raise ValidationError(
-                "The pre-inspection report must be approved before creating a PMS record. "
-                "Please approve the pre-inspection report first."
-            )
-        
-        # Rule 4: Post-inspection must be approved only when marking PMS as completed
-        if self.status == 'Completed' and self.post_inspection and not self.post_inspection.is_approved:
-            raise ValidationError(
-                "The post-inspection report must be approved before marking PMS as completed. "
-                "Please approve the post-inspection report first."
-            )
-        
-        # Rule 5: Pre-inspection vehicle must match PMS vehicle
-        if self.pre_inspection and self.vehicle:
-            if self.pre_inspection.vehicle != self.vehicle:
-                raise ValidationError(
-                    f"The pre-inspection report is for vehicle {self.pre_inspection.vehicle.plate_number}, "
-                    f"but this PMS is for vehicle {self.vehicle.plate_number}. "
-                    "The pre-inspection report must be for the same vehicle as the PMS."
-                )
-        
-        # Rule 6: Post-inspection vehicle must match PMS vehicle
-        if self.post_inspection and self.vehicle:
-            if self.post_inspection.vehicle != self.vehicle:
-                raise ValidationError(
-                    f"The post-inspection report is for vehicle {self.post_inspection.vehicle.plate_number}, "
-                    f"but this PMS is for vehicle {self.vehicle.plate_number}. "
-                    "The post-inspection report must be for the same vehicle as the PMS."
-                )
+        from .inspection_rules import SKIP_USAGE, validate_pms
+        validate_pms(self, SKIP_USAGE)
     
     def _validate_inspection_requirements(self):
         """Validate inspection requirements based on business rules"""
-        from django.core.exceptions import ValidationError
-        
-        # First validate other requirements
-        self._validate_other_requirements()
-        
-        # Rule 7: Check if pre-inspection is already used by another repair or PMS
-        # Exclude current instance and repairs created from this PMS
-        # NOTE: This validation is also done in the form, but we keep it here as a safety check
-        # However, we must be careful to exclude the current instance to avoid false positives
-        if self.pre_inspection:
-            # Check for standalone repairs (not linked to PMS) using this pre_inspection
-            standalone_repairs = Repair.objects.filter(
-                pre_inspection=self.pre_inspection,
-                pms_records__isnull=True
-            )
-            # Exclude repairs created from this PMS if it exists
-            if self.pk and self.repair:
-                standalone_repairs = standalone_repairs.exclude(pk=self.repair.pk)
-            existing_repair = standalone_repairs.first()
-            
-            # Check for other PMS records using this pre_inspection
-            # CRITICAL: Exclude current instance - without this, we'd find ourselves when saving
-            pms_query = PMS.objects.filter(pre_inspection=self.pre_inspection)
-            if self.pk:
-                pms_query = pms_query.exclude(pk=self.pk)
-            existing_pms = pms_query.first()
-            
-            if existing_repair:
-                raise ValidationError(
-                    f"This pre-inspection report is already used by repair record for vehicle {existing_repair.vehicle.plate_number}. "
-                    "Each pre-inspection report can only be used once."
-                )
-            
-            if existing_pms:
-                # Final check: ensure we're not comparing against ourselves
-                if existing_pms.pk != self.pk:
-                    raise ValidationError(
-                        f"[MODEL VALIDATION] This pre-inspection report is already used by PMS record for vehicle {existing_pms.vehicle.plate_number}. "
-                        f"Existing PMS ID: {existing_pms.pk}, Current PMS ID: {self.pk}. Each pre-inspection report can only be used once."
-                    )
-        
-        # Rule 8: Check if post-inspection is already used by another repair or PMS
-        # Exclude current instance and repairs created from this PMS
-        if self.post_inspection:
-            # Check for standalone repairs (not linked to PMS) using this post_inspection
-            standalone_repairs = Repair.objects.filter(
-                post_inspection=self.post_inspection,
-                pms_records__isnull=True
-            )
-            # Exclude repairs created from this PMS if it exists
-            if self.pk and self.repair:
-                standalone_repairs = standalone_repairs.exclude(pk=self.repair.pk)
-            existing_repair = standalone_repairs.first()
-            
-            # Check for other PMS records using this post_inspection
-            # CRITICAL: Exclude current instance
-            pms_query = PMS.objects.filter(post_inspection=self.post_inspection)
-            if self.pk:
-                pms_query = pms_query.exclude(pk=self.pk)
-            existing_pms = pms_query.first()
-            
-            if existing_repair:
-                raise ValidationError(
-                    f"This post-inspection report is already used by repair record for vehicle {existing_repair.vehicle.plate_number}. "
-                    "Each post-inspection report can only be used once."
-                )
-            
-            if existing_pms:
-                # Final check: ensure we're not comparing against ourselves
-                if existing_pms.pk != self.pk:
-                    raise ValidationError(
-                        f"[MODEL VALIDATION] This post-inspection report is already used by PMS record for vehicle {existing_pms.vehicle.plate_number}. "
-                        f"Existing PMS ID: {existing_pms.pk}, Current PMS ID: {self.pk}. Each post-inspection report can only be used once."
-                    )
+        from .inspection_rules import validate_pms
+        validate_pms(self)
     
     class Meta:
         verbose_name = 'Preventive Maintenance Service'
         verbose_name_plural = 'Preventive Maintenance Services'
         ordering = ['-scheduled_date', '-created_at']
+        indexes = [
+            # Dashboard "near PMS" lookups and PMS list vehicle/status filters
+            models.Index(fields=['vehicle', 'status', 'scheduled_date'], name='pms_veh_status_sched_idx'),
+            # Overdue / upcoming scans across the fleet (notifications)
+            models.Index(fields=['status', 'scheduled_date'], name='pms_status_sched_idx'),
+        ]
+
+
+class SearchEntry(models.Model):
+    """Denormalized full-text search document for a searchable record"""
+    OBJECT_TYPE_CHOICES = [
+        ('vehicle', 'Vehicle'),
+        ('driver', 'Driver'),
+        ('division', 'Division'),
+        ('user', 'User'),
+        ('repair', 'Repair'),
+        ('pre_inspection', 'Pre-Inspection Report'),
+        ('post_inspection', 'Post-Inspection Report'),
+    ]
+    
+    object_type = models.CharField(max_length=20, choices=OBJECT_TYPE_CHOICES)
+    object_id = models.PositiveIntegerField()
+    title = models.CharField(max_length=255)
+    subtitle = models.CharField(max_length=255, blank=True)
+    content = models.TextField(blank=True, help_text="Indexed text (FULLTEXT on MySQL, FTS5 on SQLite)")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.get_object_type_display()}: {self.title}"
+    
+    class Meta:
+        unique_together = [('object_type', 'object_id')]
+        verbose_name = 'Search Entry'
+        verbose_name_plural = 'Search Entries'
+
+
+class UploadSession(models.Model):
+    """A file uploaded in ordered chunks before the form that uses it is submitted (see core/chunked_uploads.py)"""
+    PURPOSE_CHOICES = [
+        ('driver_report', 'Driver Report Attachment'),
+        ('replaced_part', 'Replaced Part Image'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('complete', 'Complete'),
+    ]
+    
+    token = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='upload_sessions')
+    purpose = models.CharField(max_length=20, choices=PURPOSE_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField(help_text="Total file size in bytes")
+    checksum = models.CharField(max_length=64, blank=True, help_text="Expected SHA-256 of the whole file, if the client sent one")
+    received = models.BigIntegerField(default=0, help_text="Bytes written so far; the next chunk must start here")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    path = models.CharField(max_length=255, blank=True, help_text="Storage path once the upload is complete")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size} bytes)"
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Upload Session'
+        verbose_name_plural = 'Upload Sessions'
+
+
+class Attachment(models.Model):
+    """
+    One uploaded file listed by a vehicle or inspection report. Rows mirror the
+    JSON path lists of their owner and are kept in sync on save (see core/attachments.py).
+    """
+    KIND_CHOICES = [
+        ('photos', 'Photo'),
+        ('registration_documents', 'Registration Document'),
+        ('driver_report_attachments', 'Driver Report Attachment'),
+        ('replaced_parts_images', 'Replaced Part Image'),
+    ]
+    
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    owner = GenericForeignKey('content_type', 'object_id')
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES, help_text="The owner's path list this file is in")
+    position = models.PositiveIntegerField(default=0, help_text="Order within the owner's list")
+    path = models.CharField(max_length=500, help_text="Storage path, as listed by the owner")
+    size = models.BigIntegerField(null=True, blank=True, help_text="File size in bytes, if the file existed when listed")
+    sha256 = models.CharField(max_length=64, blank=True, help_text="Content hash; known for content-addressed uploads")
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.path}"
+    
+    class Meta:
+        ordering = ['kind', 'position']
+        indexes = [
+            models.Index(fields=['content_type', 'object_id', 'kind', 'position'], name='attachment_owner_idx'),
+            models.Index(fields=['path'], name='attachment_path_idx'),
+            models.Index(fields=['sha256'], name='attachment_sha256_idx'),
+        ]
+        verbose_name = 'Attachment'
+        verbose_name_plural = 'Attachments'
+
+
+class FuelTransaction(models.Model):
+    """A purchase on a fleet fuel card, imported from the card provider's statement (core.fuel)"""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.SET_NULL, null=True, blank=True, related_name='fuel_transactions', help_text="Empty while the card number matches no vehicle's fleet card")
+    card_number = models.CharField(max_length=100)
+    card_number_normalized = models.CharField(max_length=100, editable=False)
+    transaction_at = models.DateTimeField()
+    month = models.DateField(editable=False, help_text="First day of the local month of the transaction, for the monthly rollups")
+    station = models.CharField(max_length=200, blank=True)
+    product = models.CharField(max_length=100, blank=True)
+    liters = models.DecimalField(max_digits=10, decimal_places=3, null=True, blank=True)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    odometer = models.PositiveIntegerField(null=True, blank=True)
+    reference = models.CharField(max_length=100, blank=True, help_text="The provider's transaction or receipt number")
+    fingerprint = models.CharField(max_length=64, unique=True, editable=False, help_text="Hash of card, time, amount, liters and reference; a statement imported twice adds nothing")
+    source_file = models.CharField(max_length=255, blank=True)
+    imported_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    imported_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.card_number} - {self.transaction_at:%Y-%m-%d} - {self.amount}"
+    
+    class Meta:
+        ordering = ['-transaction_at']
+        indexes = [
+            # Vehicle fuel history and the rollup refresh
+            models.Index(fields=['vehicle', 'month'], name='fuel_vehicle_month_idx'),
+            # Unmatched cards
+            models.Index(fields=['card_number_normalized', 'month'], name='fuel_card_month_idx'),
+        ]
+
+
+class FuelMonthlyRollup(models.Model):
+    """A vehicle's fuel totals for one month, rebuilt from FuelTransaction after each import"""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='fuel_rollups')
+    month = models.DateField(help_text="First day of the month")
+    transactions = models.PositiveIntegerField(default=0)
+    liters = models.DecimalField(max_digits=14, decimal_places=3, default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.vehicle.plate_number} - {self.month:%B %Y}: {self.amount}"
+    
+    class Meta:
+        ordering = ['-month']
+        unique_together = [('vehicle', 'month')]
+
+
+class TollTransaction(models.Model):
+    """
+    An Autosweep or Easytrip toll charge, imported from the operator's statement
+    (core.tolls). Statements run to hundreds of thousands of rows a month, so
+    only the normalized tag and the charge itself are kept per row.
+    """
+    PROVIDER_CHOICES = [
+        ('autosweep', 'Autosweep'),
+        ('easytrip', 'Easytrip'),
+    ]
+    
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.SET_NULL, null=True, blank=True, related_name='toll_transactions', help_text="Empty while the tag matches no vehicle's RFID numbers")
+    provider = models.CharField(max_length=10, choices=PROVIDER_CHOICES, blank=True)
+    tag_number_normalized = models.CharField(max_length=100, editable=False)
+    transaction_at = models.DateTimeField()
+    month = models.DateField(editable=False, help_text="First day of the local month of the transaction, for the monthly rollups")
+    entry_plaza = models.CharField(max_length=100, blank=True)
+    exit_plaza = models.CharField(max_length=100, blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    reference = models.CharField(max_length=50, blank=True)
+    fingerprint = models.CharField(max_length=32, unique=True, editable=False, help_text="Hash of tag, time, plazas, amount and reference; a statement imported twice adds nothing")
+    
+    def __str__(self):
+        return f"{self.tag_number_normalized} - {self.transaction_at:%Y-%m-%d %H:%M} - {self.amount}"
+    
+    class Meta:
+        ordering = ['-transaction_at']
+        indexes = [
+            # Vehicle toll history and the rollup refresh
+            models.Index(fields=['vehicle', 'month'], name='toll_vehicle_month_idx'),
+            # Unknown tags
+            models.Index(fields=['tag_number_normalized', 'month'], name='toll_tag_month_idx'),
+        ]
+
+
+class TollMonthlyRollup(models.Model):
+    """A vehicle's toll totals for one month, rebuilt from TollTransaction after each import"""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='toll_rollups')
+    month = models.DateField(help_text="First day of the month")
+    transactions = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.vehicle.plate_number} - {self.month:%B %Y}: {self.amount}"
+    
+    class Meta:
+        ordering = ['-month']
+        unique_together = [('vehicle', 'month')]
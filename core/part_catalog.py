@@ -0,0 +1,69 @@
+"""
+Process-level cache of the active repair part catalogue.
+
+The part formsets render one <select> per part line plus the empty template
+form. Instead of every form querying and iterating RepairPart, the active
+parts are loaded once per process and shared until the catalogue version
+changes. The version lives in Django's cache so that, with a shared cache
+backend, a RepairPart save in one worker invalidates every worker; MAX_AGE
+bounds staleness when workers only have a local cache.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+
+from .models import RepairPart
+
+VERSION_KEY = 'core:repair_part_catalog_version'
+MAX_AGE = 300  # seconds
+
+# Fields needed to rebuild full RepairPart instances from the cached rows
+FIELD_NAMES = [field.attname for field in RepairPart._meta.concrete_fields]
+
+_lock = threading.Lock()
+_cached = {'version': None, 'loaded_at': 0.0, 'rows': ()}
+
+
+class PartCatalog:
+    """Active parts of one catalogue version, with choices and a pk lookup built once"""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.by_pk = {str(part.pk): part for part in parts}
+        self.choices = [(part.pk, str(part)) for part in parts]
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def load_part_catalog():
+    """Active parts from the process cache, reloading when the version or MAX_AGE says so"""
+    version = _current_version()
+    with _lock:
+        expired = time.monotonic() - _cached['loaded_at'] > MAX_AGE
+        if _cached['version'] != version or expired:
+            rows = tuple(RepairPart.objects.filter(is_active=True).order_by('name').values_list(*FIELD_NAMES))
+            _cached.update(version=version, loaded_at=time.monotonic(), rows=rows)
+        rows = _cached['rows']
+    # Fresh instances per call so requests never share mutable model objects
+    return PartCatalog([RepairPart.from_db(DEFAULT_DB_ALIAS, FIELD_NAMES, row) for row in rows])
+
+
+def invalidate_part_catalog(**kwargs):
+    """Bump the catalogue version; connected to RepairPart save/delete"""
+    cache.set(VERSION_KEY, time.time_ns(), None)
+    with _lock:
+        _cached['version'] = None
+
+
+def connect_signals():
+    post_save.connect(invalidate_part_catalog, sender=RepairPart, dispatch_uid='part_catalog_save')
+    post_delete.connect(invalidate_part_catalog, sender=RepairPart, dispatch_uid='part_catalog_delete')
@@ -0,0 +1,197 @@
+"""
+Capacity-aware assignment of pending PMS records to repair shops and dates.
+
+Every pending PMS (Scheduled or Overdue, not yet serviced) is given a date and
+a shop within the planning horizon so that no shop books more vehicles on a
+day than its pms_slots_per_day, and the total number of overdue days is as
+small as possible. A service takes one slot-day whenever it happens, so a
+vehicle's downtime only grows through lateness; the objective is therefore
+the sum of max(0, booked date - due date).
+
+Bookings that already work are kept: taken in due-date order, a record
+booked on time (today or later, not after its due date) at an active shop
+with a slot left that day keeps its date and shop, so re-running the
+optimizer on a feasible plan changes nothing.
+
+The rest (overbooked, late or unbooked) are placed earliest-due-date greedy
+on the capacity left: in due-date order each goes to the first working day,
+on or after its release day (EARLY_DAYS before it falls due, never before
+today), that still has a free slot. For unit-length jobs on parallel shops
+this minimises total and maximum lateness of the moved records. Full days
+are skipped with a path-compressed "next free day" pointer, so a quarter for
+thousands of vehicles is planned in milliseconds. Among the shops free that
+day the record keeps its current provider when possible, otherwise it goes
+to the shop with the most slots left. Every planned record ends up on a
+future date, so Overdue records that are moved become Scheduled again.
+"""
+from collections import Counter, namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import PMS, RepairShop
+
+PENDING_STATUSES = ['Scheduled', 'Overdue']
+
+# Services are not booked more than this many days ahead of their due date
+EARLY_DAYS = 7
+
+Assignment = namedtuple('Assignment', [
+    'pms_id', 'plate_number', 'due_date', 'old_date', 'old_provider', 'old_status', 'new_date', 'new_provider',
+])
+
+
+class SchedulePlan:
+    """Result of optimize(): the assignments plus the records that did not fit"""
+
+    def __init__(self, today, days, shops, assignments, unassigned, shop_load):
+        self.today = today
+        self.days = days
+        self.shops = shops
+        self.assignments = assignments
+        self.unassigned = unassigned
+        self.shop_load = shop_load
+
+    @property
+    def changes(self):
+        return [
+            a for a in self.assignments
+            if (a.old_date, a.old_provider, a.old_status) != (a.new_date, a.new_provider, 'Scheduled')
+        ]
+
+    def overdue_days_before(self):
+        return sum(max((max(a.old_date, self.today) - a.due_date).days, 0) for a in self.assignments)
+
+    def overbooked_before(self):
+        """Current bookings beyond a shop's slots for their day (the plan itself never overbooks)"""
+        capacity = {shop.name: shop for shop in self.shops}
+        booked = Counter((a.old_provider, a.old_date) for a in self.assignments if a.old_date >= self.today)
+        over = 0
+        for (provider, day), count in booked.items():
+            shop = capacity.get(provider)
+            if shop is not None:
+                over += max(count - _slots(shop, day), 0)
+        return over
+
+    def overdue_days_after(self):
+        return sum(max((a.new_date - a.due_date).days, 0) for a in self.assignments)
+
+
+def _slots(shop, day):
+    return 0 if day.weekday() >= 5 and not shop.open_on_weekends else shop.pms_slots_per_day
+
+
+def _pending_pms(horizon_end):
+    """Pending PMS due before the horizon ends, with everything the solver needs in one query"""
+    return (
+        PMS.objects.filter(status__in=PENDING_STATUSES, post_inspection__isnull=True)
+        .filter(Q(due_date__lt=horizon_end) | Q(due_date__isnull=True, scheduled_date__lt=horizon_end))
+        .order_by('pk')
+        .values_list('pk', 'vehicle__plate_number', 'due_date', 'scheduled_date', 'provider', 'status')
+    )
+
+
+def optimize(days=90, today=None):
+    """Plan every pending PMS due within the next `days` days onto shop capacity"""
+    today = today or timezone.localdate()
+    horizon_end = today + timedelta(days=days)
+    shops = list(RepairShop.objects.filter(is_active=True, pms_slots_per_day__gt=0).order_by('name'))
+
+    # remaining[d][i]: free slots of shops[i] on day today + d
+    remaining = [
+        [_slots(shop, today + timedelta(days=offset)) for shop in shops]
+        for offset in range(days)
+    ]
+
+    shop_index = {shop.name: i for i, shop in enumerate(shops)}
+    records = sorted(
+        (
+            (due or scheduled, pk, plate, scheduled, provider, status)
+            for pk, plate, due, scheduled, provider, status in _pending_pms(horizon_end)
+        ),
+        key=lambda record: (record[0], record[1]),
+    )
+
+    assignments = []
+    movable = []
+    for due, pk, plate, scheduled, provider, status in records:
+        offset = (scheduled - today).days if scheduled else -1
+        booked = shop_index.get(provider)
+        if 0 <= offset < days and scheduled <= due and booked is not None and remaining[offset][booked]:
+            # On time and within the shop's capacity: keep the booking
+            remaining[offset][booked] -= 1
+            assignments.append(Assignment(pk, plate, due, scheduled, provider, status, scheduled, provider))
+        else:
+            movable.append((due, pk, plate, scheduled, provider, status))
+
+    # next_free[d]: first day >= d that may still have a slot (days == past the horizon)
+    next_free = list(range(days + 1))
+
+    def find_free(offset):
+        root = offset
+        while next_free[root] != root:
+            root = next_free[root]
+        while next_free[offset] != root:
+            next_free[offset], offset = root, next_free[offset]
+        return root
+
+    for offset in range(days):
+        if not any(remaining[offset]):
+            next_free[offset] = offset + 1
+
+    unassigned = []
+    for due, pk, plate, scheduled, provider, status in movable:
+        release = max((due - today).days - EARLY_DAYS, 0)
+        offset = find_free(release) if release < days else days
+        if offset >= days:
+            unassigned.append((pk, plate, due))
+            continue
+        slots = remaining[offset]
+        preferred = shop_index.get(provider)
+        if preferred is not None and slots[preferred]:
+            chosen = preferred
+        else:
+            chosen = max(range(len(shops)), key=slots.__getitem__)
+        slots[chosen] -= 1
+        if not any(slots):
+            next_free[offset] = offset + 1
+        assignments.append(Assignment(
+            pk, plate, due, scheduled, provider, status, today + timedelta(days=offset), shops[chosen].name,
+        ))
+
+    shop_load = {shop.name: 0 for shop in shops}
+    for assignment in assignments:
+        shop_load[assignment.new_provider] += 1
+    return SchedulePlan(today, days, shops, assignments, unassigned, shop_load)
+
+
+def apply_plan(plan, batch_size=1000):
+    """Write the plan's changed dates and shops with bulk_update; returns rows written"""
+    changes = plan.changes
+    if not changes:
+        return 0
+    now = timezone.now()
+    records = []
+    with transaction.atomic():
+        # Records serviced or cancelled since the plan was made keep their dates
+        still_pending = set(
+            PMS.objects.filter(pk__in=[a.pms_id for a in changes], status__in=PENDING_STATUSES)
+            .select_for_update().values_list('pk', flat=True)
+        )
+        for assignment in changes:
+            if assignment.pms_id not in still_pending:
+                continue
+            pms = PMS(pk=assignment.pms_id)
+            pms.scheduled_date = assignment.new_date
+            pms.provider = assignment.new_provider
+            # The new date is today or later, so an Overdue record is back on schedule
+            pms.status = 'Scheduled'
+            pms.overdue_at = None
+            # Keep the original due date so later runs still measure lateness against it
+            pms.due_date = assignment.due_date
+            pms.updated_at = now
+            records.append(pms)
+        PMS.objects.bulk_update(records, ['scheduled_date', 'provider', 'status', 'overdue_at', 'due_date', 'updated_at'], batch_size=batch_size)
+    return len(records)
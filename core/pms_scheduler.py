@@ -0,0 +1,192 @@
+"""
+Fleet-wide PMS scheduling from mileage and time intervals.
+
+Each vehicle type has a service interval in kilometres and in months (see
+INTERVAL_RULES; settings.PMS_INTERVAL_RULES overrides entries). A vehicle's
+next PMS is due at whichever comes first:
+  - its last completed PMS (or acquisition, if it never had one) plus the
+    month interval
+  - the day its mileage reaches the next service mileage, projected from the
+    kilometres driven per day since that service
+
+Everything the rule needs is read in one annotated Vehicle query and the new
+records are written with bulk_create. Vehicles that already have an open
+(Scheduled, Overdue or In Progress) PMS are skipped, so running the scheduler
+again creates nothing new.
+
+Scheduled PMS whose date has passed are moved to Overdue by mark_overdue(), a
+single UPDATE over the (status, scheduled_date) index. It runs from the
+mark_overdue_pms command and, throttled by ensure_overdue_marked(), from the
+views that list PMS, so readers can filter on status='Overdue' directly.
+"""
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import PMS, Vehicle
+
+# (kilometres, months) between services per vehicle type
+INTERVAL_RULES = {
+    'SEDAN': (10000, 6),
+    'SUV': (10000, 6),
+    'PICK UP': (10000, 6),
+    'CLOSE VAN': (10000, 6),
+    'TRUCK': (5000, 3),
+    'MOTORCYCLE': (3000, 3),
+}
+DEFAULT_INTERVAL = (10000, 6)
+
+OPEN_STATUSES = ['Scheduled', 'Overdue', 'In Progress']
+
+# Vehicles the scheduler never plans for
+EXCLUDED_VEHICLE_STATUSES = ['For Disposal']
+
+# Seconds between the per-request overdue sweeps (shared by all workers through the cache)
+OVERDUE_SWEEP_INTERVAL = 300
+OVERDUE_SWEEP_KEY = 'core:pms_overdue_sweep'
+
+_next_local_sweep = 0.0
+
+PlannedPMS = namedtuple('PlannedPMS', [
+    'vehicle_id', 'plate_number', 'vehicle_type', 'current_mileage',
+    'due_mileage', 'due_date', 'reason', 'interval_km',
+])
+
+
+def interval_rules():
+    rules = dict(INTERVAL_RULES)
+    rules.update(getattr(settings, 'PMS_INTERVAL_RULES', {}))
+    return rules
+
+
+def _fleet_rows(queryset):
+    """One row per vehicle with its last completed PMS and whether an open PMS exists"""
+    last_completed = (
+        PMS.objects.filter(vehicle=OuterRef('pk'), status='Completed')
+        .annotate(service_date=Coalesce('completed_date', 'scheduled_date'))
+        .order_by('-service_date', '-pk')
+    )
+    return (
+        queryset.exclude(status__in=EXCLUDED_VEHICLE_STATUSES)
+        .annotate(
+            last_service_date=Subquery(last_completed.values('service_date')[:1]),
+            last_service_mileage=Subquery(last_completed.values('mileage_at_service')[:1]),
+            last_next_mileage=Subquery(last_completed.values('next_service_mileage')[:1]),
+            has_open_pms=Exists(PMS.objects.filter(vehicle=OuterRef('pk'), status__in=OPEN_STATUSES)),
+        )
+        .order_by('plate_number')
+        .values_list(
+            'pk', 'plate_number', 'vehicle_type', 'current_mileage', 'date_acquired',
+            'last_service_date', 'last_service_mileage', 'last_next_mileage', 'has_open_pms',
+        )
+    )
+
+
+def plan_schedule(queryset=None, today=None):
+    """
+    Next due PMS for every vehicle in queryset without an open PMS.
+
+    Returns (planned, skipped): planned is a list of PlannedPMS ordered by
+    plate number, skipped the number of vehicles left alone because they
+    already have an open PMS.
+    """
+    queryset = Vehicle.objects.all() if queryset is None else queryset
+    today = today or timezone.localdate()
+    rules = interval_rules()
+    planned = []
+    skipped = 0
+    for (vehicle_id, plate_number, vehicle_type, mileage, acquired,
+         last_date, last_mileage, last_next, has_open) in _fleet_rows(queryset).iterator(chunk_size=2000):
+        if has_open:
+            skipped += 1
+            continue
+        interval_km, interval_months = rules.get(vehicle_type, DEFAULT_INTERVAL)
+        mileage = mileage or 0
+        base_date = last_date or acquired or today
+        base_mileage = last_mileage or 0
+        due_mileage = last_next or base_mileage + interval_km
+
+        time_due = base_date + relativedelta(months=interval_months)
+        remaining_km = due_mileage - mileage
+        if remaining_km <= 0:
+            mileage_due = today
+        else:
+            # Project the due day from the kilometres driven per day since the base date
+            days = (today - base_date).days
+            driven = mileage - base_mileage
+            mileage_due = today + timedelta(days=int(remaining_km * days / driven)) if days > 0 and driven > 0 else None
+
+        if mileage_due is not None and mileage_due < time_due:
+            due_date, reason = mileage_due, 'mileage'
+        else:
+            due_date, reason = time_due, 'time'
+        planned.append(PlannedPMS(
+            vehicle_id, plate_number, vehicle_type, mileage, due_mileage, due_date, reason, interval_km,
+        ))
+    return planned, skipped
+
+
+def _pms_for(plan, today, now):
+    if plan.reason == 'mileage':
+        notes = f'Auto-scheduled: due at {plan.due_mileage:,} km ({plan.current_mileage:,} km recorded)'
+    else:
+        notes = 'Auto-scheduled: time-based service interval since the last PMS'
+    return PMS(
+        vehicle_id=plan.vehicle_id,
+        service_type='General Inspection',
+        scheduled_date=plan.due_date,
+        due_date=plan.due_date,
+        mileage_at_service=plan.due_mileage,
+        next_service_mileage=plan.due_mileage + plan.interval_km,
+        description='Routine general inspection',
+        notes=notes,
+        status='Overdue' if plan.due_date < today else 'Scheduled',
+        overdue_at=now if plan.due_date < today else None,
+    )
+
+
+def apply_schedule(planned, today=None, batch_size=1000):
+    """Create the planned PMS records; vehicles that gained an open PMS meanwhile are skipped"""
+    today = today or timezone.localdate()
+    if not planned:
+        return []
+    with transaction.atomic():
+        # A PMS may have been added since the plan was made (e.g. while a dry run was reviewed)
+        vehicle_ids = [plan.vehicle_id for plan in planned]
+        taken = set()
+        for start in range(0, len(vehicle_ids), batch_size):
+            taken.update(
+                PMS.objects.filter(vehicle_id__in=vehicle_ids[start:start + batch_size], status__in=OPEN_STATUSES)
+                .values_list('vehicle_id', flat=True)
+            )
+        now = timezone.now()
+        records = [_pms_for(plan, today, now) for plan in planned if plan.vehicle_id not in taken]
+        return PMS.objects.bulk_create(records, batch_size=batch_size)
+
+
+def mark_overdue(today=None):
+    """Move every Scheduled PMS dated before today to Overdue in one UPDATE; returns rows changed"""
+    today = today or timezone.localdate()
+    now = timezone.now()
+    return PMS.objects.filter(status='Scheduled', scheduled_date__lt=today).update(
+        status='Overdue', overdue_at=now, updated_at=now,
+    )
+
+
+def ensure_overdue_marked():
+    """Per-request guard: run mark_overdue() at most once per OVERDUE_SWEEP_INTERVAL across workers"""
+    global _next_local_sweep
+    if time.monotonic() < _next_local_sweep:
+        return 0
+    _next_local_sweep = time.monotonic() + OVERDUE_SWEEP_INTERVAL
+    if not cache.add(OVERDUE_SWEEP_KEY, True, OVERDUE_SWEEP_INTERVAL):
+        return 0
+    return mark_overdue()
@@ -0,0 +1,431 @@
+"""
+Full-text search index for vehicles, drivers, divisions, users, repairs and
+inspection reports.
+
+Every searchable record is flattened into one SearchEntry row which is kept in
+sync by post_save/post_delete signals (connected in CoreConfig.ready). Queries
+use the database's native full-text engine: a FULLTEXT index with
+MATCH ... AGAINST on MySQL, and an FTS5 external-content table on SQLite (used
+for local development and tests). Any other backend falls back to icontains.
+"""
+import logging
+import re
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+
+from .models import (
+    CustomUser, Division, Driver, PostInspectionReport, PreInspectionReport,
+    Repair, SearchEntry, Vehicle, normalize_identifier,
+)
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'core_searchentry_fts'
+MYSQL_FULLTEXT_INDEX = 'core_searchentry_fulltext'
+
+# Order in which result groups are shown on the global search page
+GROUP_ORDER = ['vehicle', 'repair', 'pre_inspection', 'post_inspection', 'driver', 'division', 'user']
+
+# URL name used to link a search hit back to its record
+DETAIL_URLS = {
+    'vehicle': 'vehicle_detail',
+    'driver': 'driver_edit',
+    'division': 'division_edit',
+    'user': 'user_edit',
+    'repair': 'repair_detail',
+    'pre_inspection': 'pre_inspection_detail',
+    'post_inspection': 'post_inspection_detail',
+}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _join(*parts):
+    return ' '.join(str(part) for part in parts if part)
+
+
+def _identifier_terms(*values):
+    """Compact forms of identifiers so searching 'ABC123' finds 'ABC-123'"""
+    return [normalize_identifier(value) for value in values if value]
+
+
+# Document builders: each returns (title, subtitle, content) for an instance
+
+def _vehicle_document(vehicle):
+    identifiers = [
+        vehicle.plate_number, vehicle.engine_number, vehicle.chassis_number,
+        vehicle.rfid_autosweep_number, vehicle.rfid_easytrip_number, vehicle.fleet_card_number,
+    ]
+    content = _join(
+        *identifiers,
+        *_identifier_terms(*identifiers),
+        vehicle.brand, vehicle.model, vehicle.vehicle_type, vehicle.year, vehicle.color,
+        vehicle.gas_station,
+        vehicle.division.name if vehicle.division_id else '',
+        vehicle.assigned_driver.name if vehicle.assigned_driver_id else '',
+        vehicle.notes,
+    )
+    return vehicle.plate_number, f"{vehicle.brand} {vehicle.model} ({vehicle.vehicle_type})", content
+
+
+def _driver_document(driver):
+    content = _join(
+        driver.name, driver.license_number, *_identifier_terms(driver.license_number),
+        driver.phone, driver.email,
+    )
+    return driver.name, driver.license_number, content
+
+
+def _division_document(division):
+    return division.name, '', _join(division.name, division.description)
+
+
+def _user_document(user):
+    content = _join(user.username, user.first_name, user.last_name, user.email, user.phone)
+    return user.get_full_name() or user.username, user.username, content
+
+
+def _repair_document(repair):
+    plate_number = repair.vehicle.plate_number
+    content = _join(
+        plate_number, *_identifier_terms(plate_number),
+        repair.description, repair.technician, repair.status,
+        repair.repair_shop.name if repair.repair_shop_id else '',
+    )
+    return f"{plate_number} - {repair.date_of_repair}", repair.description, content
+
+
+def _pre_inspection_document(report):
+    plate_number = report.vehicle.plate_number
+    content = _join(
+        plate_number, *_identifier_terms(plate_number), report.get_report_type_display(),
+        report.issues_found, report.safety_concerns, report.recommended_actions,
+    )
+    subtitle = report.issues_found or report.safety_concerns or report.get_report_type_display()
+    return f"Pre-Inspection: {plate_number}", subtitle, content
+
+
+def _post_inspection_document(report):
+    plate_number = report.vehicle.plate_number
+    content = _join(
+        plate_number, *_identifier_terms(plate_number), report.get_report_type_display(),
+        report.remaining_issues, report.test_drive_notes, report.future_recommendations,
+        report.warranty_notes,
+    )
+    subtitle = report.remaining_issues or report.future_recommendations or report.get_report_type_display()
+    return f"Post-Inspection: {plate_number}", subtitle, content
+
+
+# model -> (object_type, document builder, source fields the document is built from)
+INDEXED_MODELS = {
+    Vehicle: ('vehicle', _vehicle_document, {
+        'plate_number', 'engine_number', 'chassis_number', 'rfid_autosweep_number',
+        'rfid_easytrip_number', 'fleet_card_number', 'brand', 'model', 'vehicle_type',
+        'year', 'color', 'gas_station', 'division', 'assigned_driver', 'notes',
+    }),
+    Driver: ('driver', _driver_document, {'name', 'license_number', 'phone', 'email'}),
+    Division: ('division', _division_document, {'name', 'description'}),
+    CustomUser: ('user', _user_document, {'username', 'first_name', 'last_name', 'email', 'phone'}),
+    Repair: ('repair', _repair_document, {
+        'vehicle', 'date_of_repair', 'description', 'technician', 'status', 'repair_shop',
+    }),
+    PreInspectionReport: ('pre_inspection', _pre_inspection_document, {
+        'vehicle', 'report_type', 'issues_found', 'safety_concerns', 'recommended_actions',
+    }),
+    PostInspectionReport: ('post_inspection', _post_inspection_document, {
+        'vehicle', 'report_type', 'remaining_issues', 'test_drive_notes',
+        'future_recommendations', 'warranty_notes',
+    }),
+}
+
+
+def index_instance(instance):
+    """Create or refresh the search entry for a single record"""
+    spec = INDEXED_MODELS.get(type(instance))
+    if spec is None or instance.pk is None:
+        return None
+    object_type, build_document, _ = spec
+    title, subtitle, content = build_document(instance)
+    entry, _ = SearchEntry.objects.update_or_create(
+        object_type=object_type,
+        object_id=instance.pk,
+        defaults={
+            'title': (title or '')[:255],
+            'subtitle': (subtitle or '')[:255],
+            'content': content,
+        },
+    )
+    return entry
+
+
+def index_many(instances):
+    """
+    index_instance() for records of one model written with bulk_create/bulk_update
+    (which send no signals): one delete and one insert instead of two queries per record
+    """
+    instances = [instance for instance in instances if instance.pk is not None]
+    if not instances:
+        return 0
+    object_type, build_document, _ = INDEXED_MODELS[type(instances[0])]
+    entries = []
+    for instance in instances:
+        title, subtitle, content = build_document(instance)
+        entries.append(SearchEntry(
+            object_type=object_type,
+            object_id=instance.pk,
+            title=(title or '')[:255],
+            subtitle=(subtitle or '')[:255],
+            content=content,
+        ))
+    with transaction.atomic():
+        SearchEntry.objects.filter(
+            object_type=object_type, object_id__in=[entry.object_id for entry in entries],
+        ).delete()
+        SearchEntry.objects.bulk_create(entries, batch_size=500)
+    return len(entries)
+
+
+def remove_instance(instance):
+    """Drop the search entry for a deleted record"""
+    spec = INDEXED_MODELS.get(type(instance))
+    if spec is None:
+        return
+    SearchEntry.objects.filter(object_type=spec[0], object_id=instance.pk).delete()
+
+
+def rebuild_index(chunk_size=500, stdout=None):
+    """Re-index every searchable record; returns the number of entries written"""
+    total = 0
+    for model, (object_type, _, _) in INDEXED_MODELS.items():
+        queryset = model.objects.all()
+        if model in (Repair, PreInspectionReport, PostInspectionReport):
+            queryset = queryset.select_related('vehicle')
+        if model is Repair:
+            queryset = queryset.select_related('repair_shop')
+        if model is Vehicle:
+            queryset = queryset.select_related('division', 'assigned_driver')
+        count = 0
+        for instance in queryset.iterator(chunk_size=chunk_size):
+            index_instance(instance)
+            count += 1
+        # Remove entries whose records no longer exist
+        SearchEntry.objects.filter(object_type=object_type).exclude(
+            object_id__in=model.objects.values('pk')
+        ).delete()
+        if stdout is not None:
+            stdout.write(f'Indexed {count} {object_type} record(s)')
+        total += count
+    return total
+
+
+def install_backend_index(schema_editor=None):
+    """Create the vendor-specific full-text structures (idempotent)"""
+    conn = schema_editor.connection if schema_editor is not None else connection
+    table = SearchEntry._meta.db_table
+    with conn.cursor() as cursor:
+        if conn.vendor == 'mysql':
+            cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", [MYSQL_FULLTEXT_INDEX])
+            if not cursor.fetchall():
+                cursor.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {MYSQL_FULLTEXT_INDEX} (title, content)")
+        elif conn.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"title, content, content='{table}', content_rowid='id', tokenize='unicode61')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+                f"INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content); END"
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall_backend_index(schema_editor=None):
+    """Drop the vendor-specific full-text structures"""
+    conn = schema_editor.connection if schema_editor is not None else connection
+    table = SearchEntry._meta.db_table
+    with conn.cursor() as cursor:
+        if conn.vendor == 'mysql':
+            cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", [MYSQL_FULLTEXT_INDEX])
+            if cursor.fetchall():
+                cursor.execute(f"ALTER TABLE {table} DROP INDEX {MYSQL_FULLTEXT_INDEX}")
+        elif conn.vendor == 'sqlite':
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def _query_terms(query):
+    return TOKEN_RE.findall(query or '')[:10]
+
+
+def _search_mysql(terms, object_types, limit):
+    against = ' '.join(f'+{term}*' for term in terms)
+    score = RawSQL('MATCH (title, content) AGAINST (%s IN BOOLEAN MODE)', (against,), output_field=FloatField())
+    queryset = SearchEntry.objects.annotate(score=score).filter(score__gt=0)
+    if object_types:
+        queryset = queryset.filter(object_type__in=object_types)
+    return list(queryset.order_by('-score')[:limit])
+
+
+def _search_sqlite(terms, object_types, limit):
+    match = ' '.join(f'"{term}"*' for term in terms)
+    table = SearchEntry._meta.db_table
+    sql = (
+        f"SELECT e.id, bm25({FTS_TABLE}, 10.0, 1.0) AS rank FROM {FTS_TABLE} "
+        f"JOIN {table} e ON e.id = {FTS_TABLE}.rowid WHERE {FTS_TABLE} MATCH %s"
+    )
+    params = [match]
+    if object_types:
+        sql += f" AND e.object_type IN ({', '.join(['%s'] * len(object_types))})"
+        params.extend(object_types)
+    sql += " ORDER BY rank LIMIT %s"
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ranked = cursor.fetchall()
+    entries = SearchEntry.objects.in_bulk([row[0] for row in ranked])
+    results = []
+    for entry_id, rank in ranked:
+        entry = entries.get(entry_id)
+        if entry is not None:
+            # bm25() is lower-is-better; flip it so higher scores rank first everywhere
+            entry.score = -rank
+            results.append(entry)
+    return results
+
+
+def _search_fallback(terms, object_types, limit):
+    queryset = SearchEntry.objects.all()
+    for term in terms:
+        queryset = queryset.filter(content__icontains=term)
+    if object_types:
+        queryset = queryset.filter(object_type__in=object_types)
+    results = list(queryset.order_by('object_type', 'title')[:limit])
+    for entry in results:
+        entry.score = 0
+    return results
+
+
+def search(query, object_types=None, limit=50):
+    """Return SearchEntry objects matching every term of query, best match first"""
+    terms = _query_terms(query)
+    if not terms:
+        return []
+    object_types = list(object_types) if object_types else None
+    try:
+        if connection.vendor == 'mysql':
+            return _search_mysql(terms, object_types, limit)
+        if connection.vendor == 'sqlite':
+            return _search_sqlite(terms, object_types, limit)
+    except DatabaseError as e:
+        # Full-text structures missing (e.g. migrations not applied) - degrade gracefully
+        logger.warning(f"Full-text search unavailable, falling back to icontains: {e}")
+    return _search_fallback(terms, object_types, limit)
+
+
+def _fulltext_available():
+    """Whether the backend's full-text structures exist; checked without raising, so a transaction stays usable"""
+    table = SearchEntry._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", [MYSQL_FULLTEXT_INDEX])
+            return bool(cursor.fetchall())
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            return cursor.fetchone() is not None
+    return False
+
+
+def search_ids(query, object_type):
+    """
+    Unevaluated subquery of the primary keys of every record of one type
+    matching query, for filter(pk__in=...). Unlike search() it is not capped,
+    so list views filter exactly as an icontains filter would.
+    """
+    terms = _query_terms(query)
+    entries = SearchEntry.objects.filter(object_type=object_type)
+    if not terms:
+        return entries.none().values('object_id')
+    vendor = connection.vendor if _fulltext_available() else None
+    if vendor == 'mysql':
+        against = ' '.join(f'+{term}*' for term in terms)
+        entries = entries.annotate(
+            score=RawSQL('MATCH (title, content) AGAINST (%s IN BOOLEAN MODE)', (against,), output_field=FloatField()),
+        ).filter(score__gt=0)
+    elif vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        entries = entries.filter(pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,)))
+    else:
+        for term in terms:
+            entries = entries.filter(content__icontains=term)
+    return entries.values('object_id')
+
+
+def search_grouped(query, object_types=None, per_type=10):
+    """Ranked results grouped by object type, in GROUP_ORDER; each type is queried with its own limit"""
+    types = [t for t in GROUP_ORDER if not object_types or t in object_types]
+    labels = dict(SearchEntry.OBJECT_TYPE_CHOICES)
+    groups = []
+    for object_type in types:
+        hits = search(query, object_types=[object_type], limit=per_type)
+        if hits:
+            groups.append({'object_type': object_type, 'label': labels[object_type], 'results': hits})
+    return groups
+
+
+def reindex_vehicle_records(vehicle):
+    """Refresh the repair and inspection entries of vehicle, whose documents embed its plate number"""
+    for model in (Repair, PreInspectionReport, PostInspectionReport):
+        queryset = model.objects.filter(vehicle=vehicle).select_related('vehicle')
+        if model is Repair:
+            queryset = queryset.select_related('repair_shop')
+        index_many(list(queryset))
+
+
+# Signal receivers keeping the index in sync with the source tables
+
+def _index_on_save(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    # Partial saves that don't touch indexed columns (status flips, last_login) need no reindex
+    if update_fields is not None and not set(update_fields) & INDEXED_MODELS[sender][2]:
+        return
+    try:
+        index_instance(instance)
+        # Vehicle documents embed their division and driver names
+        if sender in (Division, Driver):
+            related = Vehicle.objects.select_related('division', 'assigned_driver')
+            related = related.filter(division=instance) if sender is Division else related.filter(assigned_driver=instance)
+            for vehicle in related.iterator():
+                index_instance(vehicle)
+        # Repair and inspection documents embed the plate number
+        if sender is Vehicle and not created and (update_fields is None or 'plate_number' in update_fields):
+            reindex_vehicle_records(instance)
+    except DatabaseError as e:
+        # Never fail the user's write because of the search index
+        logger.error(f"Error updating search index for {sender.__name__} {instance.pk}: {e}")
+
+
+def _remove_on_delete(sender, instance, **kwargs):
+    try:
+        remove_instance(instance)
+    except DatabaseError as e:
+        logger.error(f"Error removing {sender.__name__} {instance.pk} from search index: {e}")
+
+
+def connect_signals():
+    for model in INDEXED_MODELS:
+        post_save.connect(_index_on_save, sender=model, dispatch_uid=f'search_index_save_{model.__name__}')
+        post_delete.connect(_remove_on_delete, sender=model, dispatch_uid=f'search_index_delete_{model.__name__}')
@@ -0,0 +1,165 @@
+"""
+Write services shared by views, management commands and API endpoints.
+
+Each service persists a validated form (and its formsets) inside one
+transaction so the model save hooks (business-rule validation, disposal
+recheck, vehicle status updates) run exactly once per submission.
+"""
+import logging
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from .models import ActivityLog, Repair, RepairPartItem
+
+logger = logging.getLogger(__name__)
+
+
+class _QueryCounter:
+    """connection.execute_wrapper() hook that counts the queries it sees"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def _query_counter():
+    """Count executed queries in DEBUG only, yielding the counter (None otherwise); production pays nothing"""
+    if not settings.DEBUG:
+        yield None
+        return
+    counter = _QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+def parts_cost_from_formset(formset):
+    """Total cost of the part lines the formset will keep, from its cleaned data"""
+    deleted = set(formset.deleted_forms) if formset.can_delete else set()
+    total = Decimal('0')
+    for form in formset.forms:
+        if form in deleted:
+            continue
+        # Untouched extra forms are never saved
+        if not form.instance.pk and not form.has_changed():
+            continue
+        cost = form.cleaned_data.get('cost')
+        if cost:
+            total += cost
+    return total
+
+
+def save_repair(form, formset):
+    """
+    Persist a valid RepairForm and RepairPartItemFormSet with a single Repair.save().
+
+    The parts cost is summed from the cleaned formset before the save, so the
+    repair is written once with its final cost. Returns (repair, query_count);
+    query_count is None unless DEBUG is on.
+    """
+    with _query_counter() as counter, transaction.atomic():
+        repair = form.save(commit=False)
+        repair.cost = parts_cost_from_formset(formset)
+        repair.save()
+        form.save_m2m()
+
+        formset.instance = repair
+        formset.save()
+
+    query_count = counter.count if counter is not None else None
+    if query_count is not None:
+        logger.debug('save_repair(%s) used %d queries', repair.pk, query_count)
+    return repair, query_count
+
+
+# Largest value of a DecimalField(max_digits=10, decimal_places=2)
+MAX_REPAIR_COST = Decimal('99999999.99')
+
+
+def _kept_part_forms(formset):
+    """Part forms whose line will be saved: changed, valid and not marked for deletion"""
+    if formset is None:
+        return []
+    deleted = set(formset.deleted_forms) if formset.can_delete else set()
+    return [
+        form for form in formset.forms
+        if form not in deleted and form.has_changed() and form.cleaned_data
+    ]
+
+
+def create_pms(form, formset=None, user=None, ip_address=None):
+    """
+    Create a PMS from a PMSForm and, when parts were replaced, its repair and part lines.
+
+    The form and formset are validated once (their cached results are reused if
+    the caller already checked them) and everything is written in one
+    transaction: the repair first, so the PMS row is inserted already linked
+    to it, then the part lines and activity log entries with bulk_create.
+    Raises ValidationError if either is invalid. Returns (pms, repair), repair
+    being None when no parts were entered.
+    """
+    if not form.is_valid():
+        raise ValidationError(form.errors.as_data())
+    if formset is not None and not formset.is_valid():
+        errors = [error.as_text() for error in formset.errors if error] + list(formset.non_form_errors())
+        raise ValidationError(errors or 'The replaced parts are invalid.')
+
+    part_forms = _kept_part_forms(formset)
+    with _query_counter() as counter, transaction.atomic():
+        pms = form.save(commit=False)
+        repair = None
+        logs = []
+        if part_forms:
+            parts_cost = sum((part_form.cleaned_data.get('cost') or Decimal('0') for part_form in part_forms), Decimal('0'))
+            if parts_cost > MAX_REPAIR_COST:
+                logger.warning('create_pms: parts cost %s capped at %s', parts_cost, MAX_REPAIR_COST)
+            # Ongoing until the post-inspection completes the PMS
+            repair = Repair(
+                vehicle=pms.vehicle,
+                date_of_repair=pms.scheduled_date,
+                description=f"PMS: {pms.service_type}",
+                cost=min(parts_cost, MAX_REPAIR_COST),
+                labor_cost=min(pms.cost or Decimal('0'), MAX_REPAIR_COST),
+                repair_shop=form.cleaned_data.get('repair_shop'),
+                technician=pms.technician,
+                status='Ongoing',
+                pre_inspection=pms.pre_inspection,
+            )
+            # Shares the PMS's pre-inspection, so only the PMS usage check is skipped
+            repair.save(skip_pms_validation=True)
+            pms.repair = repair
+
+        # PMSForm.clean() already ran the usage checks
+        pms.save(skip_usage_validation=True)
+
+        if repair is not None:
+            items = []
+            for part_form in part_forms:
+                item = part_form.save(commit=False)
+                item.repair = repair
+                items.append(item)
+            # RepairPartItem has no save() override and no signal receivers, so
+            # bulk_create skips nothing the formset save in save_repair() runs
+            RepairPartItem.objects.bulk_create(items)
+            logs.append(ActivityLog(
+                user=user, action='create', model_name='Repair', object_id=repair.pk,
+                description=f'Created repair record for PMS: {pms.vehicle.plate_number}', ip_address=ip_address,
+            ))
+        logs.append(ActivityLog(
+            user=user, action='create', model_name='PMS', object_id=pms.pk,
+            description=f'Created PMS record for {pms.vehicle.plate_number} - {pms.service_type}', ip_address=ip_address,
+        ))
+        if user is not None:
+            ActivityLog.objects.bulk_create(logs)
+
+    query_count = counter.count if counter is not None else None
+    if query_count is not None:
+        logger.debug('create_pms(%s) used %d queries', pms.pk, query_count)
+    return pms, repair
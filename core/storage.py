@@ -0,0 +1,284 @@
+"""
+Content-addressed storage for uploaded vehicle and inspection files.
+
+Uploads used to be saved under their original names, so every re-upload of
+the same registration document or photo was written again with a random
+suffix. ContentAddressedStorage names a file after the SHA-256 of its bytes,
+sharded two levels deep under the directory the caller asked for:
+
+    vehicles/photos/IMG_0042.jpg -> vehicles/photos/3f/a2/3fa2...c9.jpg
+
+Saving content that is already stored returns the existing path without
+writing anything, so the same file may be listed by any number of records.
+Files are therefore never deleted directly: release() removes a path only
+once no record lists it any more (core.attachments keeps the Attachment
+table that answers this in step with the JSON path lists in MEDIA_FIELDS).
+
+Images are normalized after the upload's record is saved, not while the
+request waits: schedule_processing() runs normalize_stored() and the
+thumbnails in a worker thread once the transaction commits.
+
+A file is written under a temporary name and hard-linked onto its hash name,
+so two uploads of the same bytes never clobber each other, and saving over
+an existing file touches it instead. Neither release() nor gc_media delete a
+file modified within the grace period, which covers an upload whose form has
+not been saved yet. The one exception is the original of a normalized image,
+deleted as soon as no record lists it so its EXIF/GPS metadata is not kept.
+"""
+import hashlib
+import logging
+import os
+import posixpath
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, storages
+from django.utils import timezone
+
+from .image_normalizer import normalize_file_in_pool
+from .thumbnails import delete_thumbnails, schedule_thumbnails, thumbnail_original
+
+logger = logging.getLogger(__name__)
+
+
+def grace_period():
+    """How long a stored file is kept after it was last written, whether or not a record lists it"""
+    return timedelta(hours=getattr(settings, 'MEDIA_GC_GRACE_HOURS', 24))
+
+# Every JSONField list of uploaded file paths, as (model name, field name)
+MEDIA_FIELDS = [
+    ('Vehicle', 'photos'),
+    ('Vehicle', 'registration_documents'),
+    ('PreInspectionReport', 'photos'),
+    ('PreInspectionReport', 'driver_report_attachments'),
+    ('PostInspectionReport', 'photos'),
+    ('PostInspectionReport', 'replaced_parts_images'),
+]
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that stores each distinct content once, named by its
+    hash. With normalize_images=True, schedule_processing() replaces stored
+    images with auto-oriented, metadata-free, size-capped and recompressed
+    copies (core.image_normalizer), stored under their own hash.
+    """
+
+    def __init__(self, normalize_images=False, **kwargs):
+        super().__init__(**kwargs)
+        self.normalize_images = normalize_images
+
+    def content_name(self, name, digest):
+        directory = posixpath.dirname(str(name).replace('\\', '/'))
+        extension = os.path.splitext(str(name))[1].lower()
+        return posixpath.join(directory, digest[:2], digest[2:4], f'{digest}{extension}')
+
+    @staticmethod
+    def content_directory(path):
+        """The directory a path was saved under: vehicles/photos/3f/a2/3fa2...c9.jpg -> vehicles/photos"""
+        directory, name = posixpath.split(path)
+        digest = posixpath.splitext(name)[0]
+        parent, second = posixpath.split(directory)
+        root, first = posixpath.split(parent)
+        if len(digest) == 64 and (first, second) == (digest[:2], digest[2:4]):
+            return root
+        return directory
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        name = self.content_name(name, digest.hexdigest())
+
+        # Same bytes, same name: a duplicate upload is not written again
+        if self._touch(name):
+            return name
+        self._write(name, content)
+        return name
+
+    def _touch(self, name):
+        """Restart the grace period of a stored file, so it outlives the form of the upload it was reused for"""
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _write(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            # mkstemp() creates the file owner-only
+            os.chmod(temp_path, self.file_permissions_mode if self.file_permissions_mode is not None else 0o644)
+            try:
+                # Fails instead of overwriting when a concurrent upload of the same bytes got there first
+                os.link(temp_path, full_path)
+            except FileExistsError:
+                if not self._touch(name):
+                    os.replace(temp_path, full_path)
+            except OSError:
+                # No hard links on this filesystem: the bytes are identical, so replacing is harmless
+                os.replace(temp_path, full_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def upload_storage():
+    return storages['uploads']
+
+
+def _attachments():
+    from django.apps import apps
+
+    return apps.get_model('core', 'Attachment').objects
+
+
+def referenced_paths():
+    """Every path listed in MEDIA_FIELDS, streamed in chunks (duplicates included)"""
+    return _attachments().order_by().values_list('path', flat=True).iterator(chunk_size=5000)
+
+
+def _owner_pairs(attachments):
+    from django.contrib.contenttypes.models import ContentType
+
+    pairs = attachments.order_by().values_list('content_type_id', 'object_id').distinct()
+    return [(ContentType.objects.get_for_id(content_type_id).model_class().__name__, pk) for content_type_id, pk in pairs]
+
+
+def reference_count(path):
+    """Number of records whose media path lists contain `path`"""
+    return _attachments().filter(path=path).values('content_type_id', 'object_id').distinct().count()
+
+
+def owners(path):
+    """
+    (model name, pk) of the records a media file belongs to. A thumbnail
+    belongs to the records of its original.
+    """
+    return _owner_pairs(_attachments().filter(path=thumbnail_original(path) or path))
+
+
+def replace_references(old, new):
+    """Point every media path list that contains `old` at `new` instead; returns the records changed"""
+    from django.contrib.contenttypes.models import ContentType
+    from django.db import transaction
+
+    from .attachments import sync_attachments
+
+    changed = 0
+    with transaction.atomic():
+        kinds_by_owner = {}
+        listed = _attachments().filter(path=old).order_by().values_list('content_type_id', 'object_id', 'kind')
+        for content_type_id, pk, kind in listed:
+            kinds_by_owner.setdefault((content_type_id, pk), []).append(kind)
+
+        for (content_type_id, pk), kinds in kinds_by_owner.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            record = model.objects.select_for_update().filter(pk=pk).first()
+            if record is None:
+                continue
+            for kind in kinds:
+                updated = []
+                for path in getattr(record, kind) or []:
+                    path = new if path == old else path
+                    if path not in updated:
+                        updated.append(path)
+                setattr(record, kind, updated)
+            # update() rather than save(): only the path lists change, no signals or status recompute,
+            # so the Attachment rows are synced here
+            model.objects.filter(pk=pk).update(**{kind: getattr(record, kind) for kind in kinds})
+            sync_attachments(record, kinds)
+            changed += 1
+    return changed
+
+
+def release(paths, storage=None, modified_before=None):
+    """
+    Delete the files in `paths` (and their thumbnails) that no record lists
+    any more. Call it after saving the record the paths were removed from.
+    Files modified since `modified_before` (by default, within the grace
+    period) are left for gc_media: an upload of the same bytes may be about
+    to list them. Returns the paths that were deleted.
+    """
+    storage = storage or upload_storage()
+    cutoff = modified_before or timezone.now() - grace_period()
+    deleted = []
+    for path in dict.fromkeys(paths):
+        if not path or reference_count(path):
+            continue
+        try:
+            if storage.exists(path):
+                if storage.get_modified_time(path) >= cutoff:
+                    continue
+                storage.delete(path)
+        except OSError as e:
+            logger.warning(f"Could not delete media file {path}: {e}")
+            continue
+        delete_thumbnails(path, storage)
+        deleted.append(path)
+    return deleted
+
+
+def store_normalized(path, data, extension, storage=None, read_at=None):
+    """
+    Store the normalized bytes of the image at `path`, point every record
+    listing it at the new file and delete the original; returns the new path.
+
+    The original still carries the EXIF and GPS metadata, so it is deleted
+    at once rather than after the grace period, unless it was saved again
+    since `read_at` (when its bytes were read): a new upload of the same
+    file is then about to list it.
+    """
+    storage = storage or upload_storage()
+    read_at = read_at or timezone.now()
+    # The bytes are normalized already; the storage must not schedule it a second time
+    writer = ContentAddressedStorage(location=storage.location, base_url=storage.base_url)
+    new_path = writer.save(posixpath.join(writer.content_directory(path), f'image{extension}'), ContentFile(data))
+    if new_path != path:
+        replace_references(path, new_path)
+        release([path], storage, modified_before=read_at)
+    return new_path
+
+
+def normalize_stored(path, storage=None):
+    """Normalize the stored image at `path` in the process pool; returns the path records now list"""
+    storage = storage or upload_storage()
+    read_at = timezone.now()
+    _, result = normalize_file_in_pool(storage.path(path))
+    if result is None:
+        return path
+    return store_normalized(path, *result, storage=storage, read_at=read_at)
+
+
+def schedule_processing(paths):
+    """
+    Normalize the images among newly stored `paths` and generate their
+    thumbnails, in a worker thread once the current transaction commits.
+    Call it after saving the record that lists them.
+    """
+    if upload_storage().normalize_images:
+        schedule_thumbnails(paths, prepare=normalize_stored)
+    else:
+        schedule_thumbnails(paths)
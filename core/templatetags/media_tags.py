@@ -0,0 +1,40 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from core.thumbnails import SIZES, is_image, thumbnail_path
+
+register = template.Library()
+
+# Thumbnails already seen on disk. A thumbnail is only deleted together with its
+# original, so an entry never points at a file worth showing that is gone.
+_existing_thumbnails = set()
+MAX_REMEMBERED_THUMBNAILS = 100000
+
+
+def _thumbnail_exists(thumb):
+    if thumb in _existing_thumbnails:
+        return True
+    if not default_storage.exists(thumb):
+        return False
+    if len(_existing_thumbnails) >= MAX_REMEMBERED_THUMBNAILS:
+        _existing_thumbnails.clear()
+    _existing_thumbnails.add(thumb)
+    return True
+
+
+@register.simple_tag
+def thumbnail_url(path, size='medium'):
+    """
+    URL of the `size` thumbnail of an uploaded image, or of the original while
+    the thumbnail has not been generated yet (or the file is not an image).
+    Only thumbnails not yet known to exist are looked up on disk.
+
+    Usage: <img src="{% thumbnail_url vehicle.photos.0 'small' %}">
+    """
+    if not path:
+        return ''
+    if size in SIZES and is_image(path):
+        thumb = thumbnail_path(path, size)
+        if _thumbnail_exists(thumb):
+            return default_storage.url(thumb)
+    return default_storage.url(path)
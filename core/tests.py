@@ -1,3 +1,1813 @@
+import csv
+import hashlib
+import importlib
+from datetime import date, timedelta
+import io
+import os
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+from unittest import mock
+import zipfile
+
+from django.apps import apps as django_apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError, connection, models, transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import chunked_uploads
+from .dossier import csv_chunks, dossier_entries, zip_stream
+from .exports import REPAIR_HEADER, XLSX_CONTENT_TYPE, xlsx_chunks
+from .fleet_import import IMPORT_STATUS_REASON, import_drivers, import_vehicles
+from .fuel import import_fuel_statement, rebuild_all_rollups as rebuild_fuel_rollups
+from .forms import PMSForm, PMSRepairPartItemFormSet, PreInspectionReportForm, RepairForm, RepairPartItemFormSet
+from .models import (
+    ActivityLog, Attachment, CustomUser, Division, Driver, FuelMonthlyRollup, FuelTransaction, Vehicle, Repair,
+    RepairPart, RepairPartItem, RepairShop, PMS, Notification, PreInspectionReport, PostInspectionReport,
+    TollMonthlyRollup, TollTransaction, UploadSession,
+)
+from .inspection_rules import SKIP_PMS_USAGE, validate_pms, validate_repair
+from .part_catalog import invalidate_part_catalog
+from . import pms_scheduler
+from .pms_optimizer import apply_plan, optimize
+from .pms_scheduler import OVERDUE_SWEEP_KEY, apply_schedule, ensure_overdue_marked, mark_overdue, plan_schedule
+from .services import create_pms, save_repair
+from .image_normalizer import normalize_image
+from .storage import normalize_stored, release, store_normalized, upload_storage
+from .templatetags import media_tags
+from .thumbnails import SIZES, generate_thumbnails, schedule_thumbnails, thumbnail_original, thumbnail_path
+from .tolls import import_toll_statement
+from .vehicle_status import apply_chosen_status, recompute_statuses, set_manual_status
+from .search import install_backend_index, search, search_grouped, search_ids
+
+
+# Tables covered by the hot filter indexes; a full scan on any of them is a regression
+HOT_TABLES = {'core_vehicle', 'core_repair', 'core_pms', 'core_notification', 'core_preinspectionreport', 'core_attachment'}
+
+
+def full_scans(sql):
+    """Full table scans of hot tables in the backend's query plan for sql"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            scans = []
+            for row in cursor.fetchall():
+                detail = row[-1].replace('SCAN TABLE ', 'SCAN ')
+                parts = detail.split()
+                # "SCAN t USING [COVERING] INDEX i" walks an index, plain "SCAN t" reads every row
+                if parts[0] == 'SCAN' and parts[1] in HOT_TABLES and 'USING' not in parts:
+                    scans.append(detail)
+            return scans
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return [f"{row['table']} type=ALL" for row in rows if row['type'] == 'ALL' and row['table'] in HOT_TABLES]
+    return []
+
+
+class HotFilterQueryPlanTests(TestCase):
+    """EXPLAIN every filtered query of the list/dashboard views on a seeded fleet"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='planner', password='x', can_view_admin_dashboard=True,
+        )
+        today = date.today()
+
+        Vehicle.objects.bulk_create([
+            Vehicle(
+                plate_number=f'QRY-{i:04d}', plate_number_normalized=f'QRY{i:04d}',
+                vehicle_type=['Sedan', 'SUV', 'Pickup'][i % 3], brand='Toyota', model='Hilux', year=2020,
+                engine_number=f'ENG{i}', chassis_number=f'CHS{i}', color='White',
+                acquisition_cost=Decimal('1500000'), date_acquired=today,
+                status=['Serviceable', 'Under Repair', 'Unserviceable', 'For Disposal'][i % 4],
+            )
+            for i in range(200)
+        ])
+        vehicles = list(Vehicle.objects.order_by('pk'))
+        cls.vehicle = vehicles[0]
+
+        Repair.objects.bulk_create([
+            Repair(
+                vehicle=vehicle, date_of_repair=today - timedelta(days=n * 30), description='Seeded repair',
+                cost=Decimal('1000'), status='Completed' if n % 2 else 'Ongoing',
+            )
+            for vehicle in vehicles for n in range(8)
+        ])
+        PMS.objects.bulk_create([
+            PMS(
+                vehicle=vehicle, scheduled_date=today + timedelta(days=n * 45 - 90),
+                status=['Scheduled', 'Completed', 'Overdue'][n % 3],
+            )
+            for vehicle in vehicles for n in range(6)
+        ])
+        PreInspectionReport.objects.bulk_create([
+            PreInspectionReport(
+                vehicle=vehicle, report_type='repair' if n % 2 else 'pms', inspected_by=cls.user,
+                approved_by=cls.user if n % 3 else None, current_mileage=1000 * n, fuel_level='full',
+                **{f'{part}_condition': 'good' for part in (
+                    'engine', 'transmission', 'brakes', 'suspension', 'electrical', 'body', 'tires', 'lights',
+                )},
+            )
+            for vehicle in vehicles[:50] for n in range(4)
+        ])
+        Attachment.objects.bulk_create([
+            Attachment(
+                owner=vehicle, kind=kind, position=n,
+                path=f'vehicles/{kind}/{vehicle.pk:04d}-{n}.jpg',
+            )
+            for vehicle in vehicles for kind in ('photos', 'registration_documents') for n in range(3)
+        ])
+        Notification.objects.bulk_create([
+            Notification(
+                user=cls.user, notification_type='general', title=f'Notice {n}',
+                message='Seeded notification', is_read=bool(n % 2),
+            )
+            for n in range(500)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assertNoFullScans(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        offenders = []
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT') or ' WHERE ' not in sql:
+                continue
+            scans = full_scans(sql)
+            if scans:
+                offenders.append(f'{sql}\n    -> {"; ".join(scans)}')
+        self.assertFalse(offenders, f'Full scans while rendering {url}:\n' + '\n'.join(offenders))
+
+    def test_dashboard(self):
+        self.assertNoFullScans(reverse('dashboard'))
+
+    def test_vehicle_list_status_filter(self):
+        self.assertNoFullScans(reverse('vehicle_list') + '?status=Serviceable')
+
+    def test_vehicle_detail(self):
+        self.assertNoFullScans(reverse('vehicle_detail', args=[self.vehicle.pk]))
+
+    def test_repair_list_filters(self):
+        self.assertNoFullScans(reverse('repair_list') + f'?vehicle={self.vehicle.pk}&status=Completed')
+
+    def test_pms_list_filters(self):
+        self.assertNoFullScans(reverse('pms_list') + f'?vehicle={self.vehicle.pk}&status=Scheduled')
+
+    def test_pre_inspection_list_vehicle_filter(self):
+        self.assertNoFullScans(reverse('pre_inspection_list') + f'?vehicle={self.vehicle.pk}')
+
+    def test_pre_inspections_by_vehicle(self):
+        self.assertNoFullScans(
+            reverse('get_pre_inspections_by_vehicle') + f'?vehicle_id={self.vehicle.pk}&report_type=repair'
+        )
+
+    def test_notifications(self):
+        self.assertNoFullScans(reverse('notifications'))
+
+    def test_hot_filters_use_composite_indexes(self):
+        today = date.today()
+        expected = {
+            'vehicle_status_type_idx': Vehicle.objects.filter(status='Serviceable')
+                .values('vehicle_type').annotate(count=Count('id')),
+            'repair_veh_status_date_idx': Repair.objects.filter(vehicle=self.vehicle, status='Completed'),
+            'repair_status_date_idx': Repair.objects.filter(date_of_repair__year=today.year, status='Completed')
+                .order_by().values('cost'),
+            'pms_veh_status_sched_idx': PMS.objects.filter(
+                vehicle=self.vehicle, status__in=['Scheduled', 'Overdue'], scheduled_date__lt=today,
+            ).order_by('scheduled_date'),
+            'notif_user_read_created_idx': Notification.objects.filter(user=self.user, is_read=False)
+                .order_by('-created_at'),
+            'preinsp_veh_type_appr_idx': PreInspectionReport.objects.filter(
+                vehicle=self.vehicle, report_type='repair', approved_by__isnull=False,
+            ),
+            'attachment_owner_idx': Attachment.objects.filter(
+                content_type=ContentType.objects.get_for_model(Vehicle), object_id__in=[self.vehicle.pk], kind='photos',
+            ),
+            'attachment_path_idx': Attachment.objects.filter(path='vehicles/photos/ab/cd/seeded.jpg').values('object_id'),
+        }
+        if connection.vendor == 'sqlite':
+            # SQLite gets "NOT is_read" rather than "is_read = false", which cannot seek the
+            # composite; MySQL compares the boolean directly (production backend)
+            del expected['notif_user_read_created_idx']
+        for index_name, queryset in expected.items():
+            with self.subTest(index=index_name):
+                self.assertIn(index_name, queryset.explain())
+
+
+CONDITIONS = ('engine', 'transmission', 'brakes', 'suspension', 'electrical', 'body', 'tires', 'lights')
+
+
+def make_vehicle(plate_number, **fields):
+    fields = {
+        'vehicle_type': 'SEDAN', 'brand': 'Toyota', 'model': 'Vios', 'year': 2020, 'date_acquired': date(2020, 1, 1),
+        **fields,
+    }
+    return Vehicle.objects.create(plate_number=plate_number, **fields)
+
+
+def make_pre_inspection(vehicle, user, report_type='repair', approved=True, **fields):
+    return PreInspectionReport.objects.create(
+        vehicle=vehicle, report_type=report_type, inspected_by=user, current_mileage=1000, fuel_level='full',
+        approved_by=user if approved else None, approval_date=timezone.now() if approved else None,
+        **{f'{part}_condition': 'good' for part in CONDITIONS}, **fields,
+    )
+
+
+def make_post_inspection(pre_inspection, user, approved=True, **fields):
+    return PostInspectionReport.objects.create(
+        vehicle=pre_inspection.vehicle, report_type=pre_inspection.report_type, pre_inspection=pre_inspection,
+        inspected_by=user, quality_of_work='good', timeliness='good', cleanliness='good',
+        approved_by=user if approved else None, approval_date=timezone.now() if approved else None,
+        **{f'{part}_condition': 'good' for part in CONDITIONS}, **fields,
+    )
+
+
+class SearchIndexTests(TestCase):
+    """The search index follows saves and deletes, and queries match identifiers however they are written"""
+
+    @classmethod
+    def setUpTestData(cls):
+        if connection.vendor == 'sqlite':
+            # The test database is built without migrations, so create the FTS5 table and its triggers here
+            install_backend_index()
+        cls.user = CustomUser.objects.create_user(username='searcher', password='x')
+        cls.division = Division.objects.create(name='Forestry Division')
+        cls.vehicle = make_vehicle('ABC-123', engine_number='4N15-XYZ9', division=cls.division)
+        pre_inspection = make_pre_inspection(cls.vehicle, cls.user, issues_found='Grinding noise when braking')
+        cls.repair = Repair.objects.create(
+            vehicle=cls.vehicle, pre_inspection=pre_inspection, date_of_repair=date(2026, 3, 2),
+            description='Replace brake pads', cost=Decimal('2500'),
+        )
+        cls.pre_inspection = pre_inspection
+
+    def hits(self, query, object_type):
+        return set(search_ids(query, object_type).values_list('object_id', flat=True))
+
+    def assertFinds(self, query, object_type, record):
+        self.assertIn(record.pk, self.hits(query, object_type))
+        self.assertIn(record.pk, [entry.object_id for entry in search(query, [object_type])])
+
+    def test_identifiers_match_however_they_are_written(self):
+        for query in ('ABC-123', 'abc 123', 'ABC123', '4n15xyz9'):
+            with self.subTest(query=query):
+                self.assertFinds(query, 'vehicle', self.vehicle)
+        self.assertFinds('grinding brak', 'pre_inspection', self.pre_inspection)
+        self.assertEqual(self.hits('montero', 'vehicle'), set())
+
+    def test_related_renames_and_deletes_follow(self):
+        self.division.name = 'Parks Division'
+        self.division.save()
+        self.assertFinds('parks', 'vehicle', self.vehicle)
+        self.assertEqual(self.hits('forestry', 'vehicle'), set())
+
+        self.repair.delete()
+        self.assertEqual(self.hits('brake pads', 'repair'), set())
+
+    def test_plate_change_reindexes_repairs_and_inspections(self):
+        vehicle = Vehicle.objects.get(pk=self.vehicle.pk)
+        vehicle.plate_number = 'XYZ-789'
+        vehicle.save()
+        self.assertFinds('XYZ789', 'repair', self.repair)
+        self.assertFinds('xyz 789', 'pre_inspection', self.pre_inspection)
+        self.assertEqual(self.hits('ABC123', 'repair'), set())
+        self.assertEqual(self.hits('ABC123', 'pre_inspection'), set())
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        vehicle = Vehicle.objects.get(pk=self.vehicle.pk)
+        vehicle.notes = 'Assigned to the nursery'
+        vehicle.save()
+        self.assertFinds('nursery', 'vehicle', self.vehicle)
+
+        other = make_vehicle('NUR-001', notes='Nursery shuttle')
+        self.assertEqual(self.hits('nursery', 'vehicle'), {self.vehicle.pk, other.pk})
+        other.delete()
+        self.assertEqual(self.hits('nursery', 'vehicle'), {self.vehicle.pk})
+
+    def test_search_ids_is_not_capped_and_groups_have_their_own_limit(self):
+        for n in range(60):
+            make_vehicle(f'BULK-{n:03d}', brand='Isuzu')
+        self.assertEqual(len(search('isuzu', ['vehicle'])), 50)
+        self.assertEqual(len(self.hits('isuzu', 'vehicle')), 60)
+
+        groups = search_grouped('abc123', per_type=5)
+        self.assertEqual([group['object_type'] for group in groups], ['vehicle', 'repair', 'pre_inspection'])
+        groups = search_grouped('bulk', per_type=5)
+        self.assertEqual([len(group['results']) for group in groups], [5])
+
+
+class VehicleIdentifierLookupTests(TestCase):
+    """Normalized identifier columns and the typeahead that prefix-matches them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='clerk', password='x')
+        cls.sedan = make_vehicle('ABC-1234', engine_number='4n15 abc 99', fleet_card_number='7001-0002')
+        cls.truck = make_vehicle('XYZ 987', chassis_number='ABC-77-TRK')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def lookup(self, query, **params):
+        response = self.client.get(reverse('vehicle_lookup'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(row['plate_number'], row['matched_field']) for row in response.json()['results']]
+
+    def test_saves_fill_the_normalized_columns(self):
+        self.assertEqual(
+            Vehicle.objects.values_list('plate_number_normalized', 'engine_number_normalized', 'fleet_card_number_normalized')
+            .get(pk=self.sedan.pk),
+            ('ABC1234', '4N15ABC99', '70010002'),
+        )
+        vehicle = Vehicle.objects.get(pk=self.truck.pk)
+        vehicle.plate_number = 'xyz-988'
+        vehicle.save(update_fields=['plate_number'])
+        self.assertEqual(Vehicle.objects.get(pk=self.truck.pk).plate_number_normalized, 'XYZ988')
+
+    def test_lookup_prefix_matches_in_identifier_priority_order(self):
+        self.assertEqual(self.lookup('abc'), [('ABC-1234', 'Plate Number'), ('XYZ 987', 'Chassis Number')])
+        self.assertEqual(self.lookup('abc 12'), [('ABC-1234', 'Plate Number')])
+        self.assertEqual(self.lookup('7001 00'), [('ABC-1234', 'Fleet Card Number')])
+        self.assertEqual(self.lookup('abc', limit=1), [('ABC-1234', 'Plate Number')])
+        # Prefixes only, and at least two characters
+        self.assertEqual(self.lookup('1234'), [])
+        self.assertEqual(self.lookup('a'), [])
+
+    def test_migration_backfills_with_its_own_normalizer(self):
+        migration = importlib.import_module('core.migrations.0038_vehicle_normalized_identifiers')
+        Vehicle.objects.update(plate_number_normalized='', chassis_number_normalized='')
+        migration.populate_normalized_identifiers(django_apps, None)
+        self.assertEqual(
+            dict(Vehicle.objects.values_list('plate_number_normalized', 'chassis_number_normalized')),
+            {'ABC1234': '', 'XYZ987': 'ABC77TRK'},
+        )
+
+
+class VehicleChoicesTests(TestCase):
+    """The remote vehicle select and the paginated vehicle_choices endpoint behind it"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='dispatcher', password='x')
+        cls.vehicles = [make_vehicle(f'PAG-{n:03d}', brand='Isuzu' if n % 2 else 'Toyota') for n in range(45)]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def choices(self, **params):
+        response = self.client.get(reverse('vehicle_choices'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_through_every_vehicle_in_plate_order(self):
+        pages = [self.choices(page=page) for page in (1, 2, 3)]
+        self.assertEqual([page['pagination']['more'] for page in pages], [True, True, False])
+        ids = [row['id'] for page in pages for row in page['results']]
+        self.assertEqual(ids, [vehicle.pk for vehicle in self.vehicles])
+        self.assertEqual(self.choices(page='x')['results'][0]['id'], self.vehicles[0].pk)
+
+    def test_query_and_filters_narrow_the_choices(self):
+        results = self.choices(q='PAG01')['results']
+        self.assertEqual([row['text'] for row in results], [str(vehicle) for vehicle in self.vehicles[10:20]])
+        results = self.choices(q='pag', brand='isuzu')['results']
+        self.assertTrue(results and all('Isuzu' in row['text'] for row in results))
+
+    def test_widget_renders_only_the_selected_vehicle(self):
+        selected = self.vehicles[30]
+        form = PreInspectionReportForm(initial={'vehicle': selected.pk})
+        with CaptureQueriesContext(connection) as context:
+            html = str(form['vehicle'])
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertIn(f'data-ajax-url="{reverse("vehicle_choices")}"', html)
+        self.assertIn(f'<option value="{selected.pk}" selected>{selected}</option>', html)
+        self.assertEqual(html.count('<option'), 2)
+
+
+class PartCatalogTests(TestCase):
+    """Part formsets share one cached catalogue of active parts"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.brake_pads = RepairPart.objects.create(name='Brake pads')
+        cls.oil_filter = RepairPart.objects.create(name='Oil filter')
+        cls.retired = RepairPart.objects.create(name='Carburetor', is_active=False)
+
+    def setUp(self):
+        # The catalogue is cached per process; start each test from the rows of this one
+        invalidate_part_catalog()
+
+    def formset_data(self, *part_ids):
+        data = {
+            'part_items-TOTAL_FORMS': str(len(part_ids)), 'part_items-INITIAL_FORMS': '0',
+            'part_items-MIN_NUM_FORMS': '0', 'part_items-MAX_NUM_FORMS': '1000',
+        }
+        for index, part_id in enumerate(part_ids):
+            data.update({
+                f'part_items-{index}-part': str(part_id), f'part_items-{index}-quantity': '1',
+                f'part_items-{index}-disposal_type': 'normal',
+            })
+        return data
+
+    def part_queries(self, context):
+        table = connection.ops.quote_name(RepairPart._meta.db_table)
+        return [query for query in context.captured_queries if table in query['sql']]
+
+    def test_formset_renders_active_parts_with_one_query(self):
+        with CaptureQueriesContext(connection) as context:
+            formset = RepairPartItemFormSet(self.formset_data(self.brake_pads.pk, self.oil_filter.pk, ''), prefix='part_items')
+            html = ''.join(str(form['part']) for form in [*formset.forms, formset.empty_form])
+        self.assertEqual(len(self.part_queries(context)), 1)
+        self.assertEqual(html.count('>Brake pads</option>'), 4)
+        self.assertNotIn('Carburetor', html)
+
+        # Later formsets reuse the cached catalogue
+        with CaptureQueriesContext(connection) as context:
+            formset = RepairPartItemFormSet(self.formset_data(self.brake_pads.pk), prefix='part_items')
+            self.assertTrue(formset.is_valid(), formset.errors)
+        self.assertEqual(self.part_queries(context), [])
+        self.assertEqual(formset.forms[0].cleaned_data['part'], self.brake_pads)
+
+    def test_inactive_parts_are_rejected(self):
+        formset = RepairPartItemFormSet(self.formset_data(self.retired.pk), prefix='part_items')
+        self.assertFalse(formset.is_valid())
+        self.assertIn('part', formset.forms[0].errors)
+
+    def test_part_saves_and_deletes_invalidate_the_catalogue(self):
+        RepairPartItemFormSet(prefix='part_items')
+        self.retired.is_active = True
+        self.retired.save()
+        formset = RepairPartItemFormSet(self.formset_data(self.retired.pk), prefix='part_items')
+        self.assertTrue(formset.is_valid(), formset.errors)
+
+        self.oil_filter.delete()
+        self.assertNotIn('Oil filter', str(RepairPartItemFormSet(prefix='part_items').empty_form['part']))
+
+
+def part_formset_data(*lines, prefix='part_items', initial=0):
+    """POST data for a part formset; each line is (part, quantity, cost)"""
+    data = {
+        f'{prefix}-TOTAL_FORMS': str(len(lines)), f'{prefix}-INITIAL_FORMS': str(initial),
+        f'{prefix}-MIN_NUM_FORMS': '0', f'{prefix}-MAX_NUM_FORMS': '1000',
+    }
+    for index, (part, quantity, cost) in enumerate(lines):
+        data.update({
+            f'{prefix}-{index}-part': str(part.pk), f'{prefix}-{index}-quantity': str(quantity),
+            f'{prefix}-{index}-cost': str(cost), f'{prefix}-{index}-disposal_type': 'normal',
+        })
+    return data
+
+
+class SaveRepairTests(TestCase):
+    """save_repair() writes a repair and its part lines in one transaction with one Repair.save()"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='mechanic', password='x')
+        cls.shop = RepairShop.objects.create(name='Alpha Motors')
+        cls.vehicle = make_vehicle('SRV 100')
+        cls.parts = [RepairPart.objects.create(name=name) for name in ('Brake pads', 'Oil filter', 'Spark plug')]
+
+    def setUp(self):
+        invalidate_part_catalog()
+        self.pre_inspection = make_pre_inspection(self.vehicle, self.user)
+
+    def forms(self, *lines):
+        form = RepairForm({
+            'vehicle': self.vehicle.pk, 'date_of_repair': '2026-03-02', 'description': 'Brake job',
+            'cost': '0', 'labor_cost': '500', 'repair_shop': self.shop.pk, 'technician': 'Pedro',
+            'status': 'Ongoing', 'pre_inspection': self.pre_inspection.pk,
+        })
+        formset = RepairPartItemFormSet(part_formset_data(*lines), prefix='part_items')
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertTrue(formset.is_valid(), formset.errors)
+        return form, formset
+
+    def test_repair_is_written_once_with_its_parts_cost(self):
+        form, formset = self.forms((self.parts[0], 2, '1200.50'), (self.parts[1], 1, '300'))
+        with CaptureQueriesContext(connection) as context:
+            repair, _ = save_repair(form, formset)
+        table = connection.ops.quote_name(Repair._meta.db_table)
+        repair_writes = [
+            query['sql'].split()[0] for query in context.captured_queries
+            if query['sql'].startswith((f'INSERT INTO {table} ', f'UPDATE {table} '))
+        ]
+        self.assertEqual(repair_writes, ['INSERT'])
+
+        repair.refresh_from_db()
+        self.assertEqual(repair.cost, Decimal('1500.50'))
+        self.assertEqual(
+            sorted(repair.part_items.values_list('part__name', 'cost')),
+            [('Brake pads', Decimal('1200.50')), ('Oil filter', Decimal('300.00'))],
+        )
+        self.assertEqual(Vehicle.objects.get(pk=self.vehicle.pk).status, 'Under Repair')
+
+    @override_settings(DEBUG=True)
+    def test_query_count_grows_only_by_the_part_inserts(self):
+        counts = []
+        for lines in ([self.parts[0]], [self.parts[0]], self.parts):
+            self.pre_inspection = make_pre_inspection(self.vehicle, self.user)
+            counts.append(save_repair(*self.forms(*[(part, 1, '100') for part in lines]))[1])
+        # The first save also re-reads the vehicle whose status it changed
+        self.assertEqual(counts[2] - counts[1], 2)
+
+    def test_query_count_is_not_collected_outside_debug(self):
+        self.assertIsNone(save_repair(*self.forms((self.parts[0], 1, '100')))[1])
+
+    def test_failed_part_save_rolls_back_the_repair(self):
+        form, formset = self.forms((self.parts[0], 1, '100'))
+        with mock.patch.object(formset, 'save', side_effect=DatabaseError), self.assertRaises(DatabaseError):
+            save_repair(form, formset)
+        self.assertFalse(Repair.objects.exists())
+        self.assertEqual(Vehicle.objects.get(pk=self.vehicle.pk).status, 'Serviceable')
+
+
+class DirtyFieldsTests(TestCase):
+    """Loaded Vehicle, Repair and PMS rows only write the fields that changed"""
+
+    def setUp(self):
+        self.vehicle = make_vehicle('DRT 100', color='White')
+
+    def test_loaded_rows_write_only_changed_fields(self):
+        vehicle = Vehicle.objects.get(pk=self.vehicle.pk)
+        self.assertEqual(vehicle.changed_fields, set())
+        vehicle.color = 'Red'
+        vehicle.photos.append('vehicles/photos/front.jpg')
+        self.assertEqual(vehicle.changed_fields, {'color', 'photos'})
+        self.assertEqual(vehicle.previous('color'), 'White')
+
+        with CaptureQueriesContext(connection) as context:
+            vehicle.save()
+        update = next(query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE'))
+        columns = update.split(' SET ')[1].split(' WHERE ')[0]
+        for name in ('color', 'photos', 'updated_at'):
+            self.assertIn(connection.ops.quote_name(name), columns)
+        self.assertNotIn(connection.ops.quote_name('brand'), columns)
+        self.assertEqual(vehicle.changed_fields, set())
+        self.assertEqual(vehicle.previous('color'), 'Red')
+
+    def test_concurrent_edits_to_different_fields_both_survive(self):
+        first = Vehicle.objects.get(pk=self.vehicle.pk)
+        second = Vehicle.objects.get(pk=self.vehicle.pk)
+        first.color = 'Red'
+        second.current_mileage = 5000
+        first.save()
+        second.save()
+        self.assertEqual(
+            Vehicle.objects.values_list('color', 'current_mileage').get(pk=self.vehicle.pk), ('Red', 5000),
+        )
+
+    def test_partial_saves_and_refreshes_keep_other_edits_dirty(self):
+        vehicle = Vehicle.objects.get(pk=self.vehicle.pk)
+        vehicle.color = 'Red'
+        vehicle.brand = 'Isuzu'
+        vehicle.save(update_fields=['color'])
+        self.assertEqual(vehicle.changed_fields, {'brand'})
+
+        vehicle.refresh_from_db(fields=['color'])
+        self.assertEqual(vehicle.changed_fields, {'brand'})
+        vehicle.save()
+        self.assertEqual(Vehicle.objects.values_list('color', 'brand').get(pk=self.vehicle.pk), ('Red', 'Isuzu'))
+
+    def test_repair_and_pms_track_their_fields(self):
+        repair = Repair.objects.bulk_create([Repair(
+            vehicle=self.vehicle, date_of_repair=date(2026, 3, 2), description='Tune-up', cost=Decimal('100'),
+        )])[0]
+        pms = PMS.objects.bulk_create([PMS(vehicle=self.vehicle, scheduled_date=date(2026, 3, 2))])[0]
+        repair = Repair.objects.get(pk=repair.pk)
+        pms = PMS.objects.get(pk=pms.pk)
+        repair.technician = 'Pedro'
+        pms.notes = 'Bring the logbook'
+        self.assertEqual((repair.changed_fields, pms.changed_fields), ({'technician'}, {'notes'}))
+        repair.save()
+        pms.save()
+        self.assertEqual((repair.changed_fields, pms.changed_fields), (set(), set()))
+        self.assertEqual(Repair.objects.get(pk=repair.pk).technician, 'Pedro')
+        self.assertEqual(PMS.objects.get(pk=pms.pk).notes, 'Bring the logbook')
+
+
+class VehicleStatusEngineTests(TestCase):
+    """Derived statuses and manual overrides"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='fleetadmin', password='x', can_view_admin_dashboard=True)
+
+    def setUp(self):
+        self.vehicle = make_vehicle('STS 100', current_market_value=Decimal('100000'))
+
+    def add_repair(self, status, cost='1000'):
+        # bulk_create: Repair.save() would need an approved pre-inspection
+        Repair.objects.bulk_create([Repair(
+            vehicle=self.vehicle, date_of_repair=date.today(), description='Test repair',
+            cost=Decimal(cost), status=status,
+        )])
+
+    def status(self):
+        return Vehicle.objects.values_list('status', 'status_override').get(pk=self.vehicle.pk)
+
+    def test_derived_statuses(self):
+        self.add_repair('Ongoing')
+        recompute_statuses()
+        self.assertEqual(self.status(), ('Under Repair', False))
+
+        Repair.objects.update(status='Completed')
+        recompute_statuses()
+        self.assertEqual(self.status(), ('Serviceable', False))
+
+        self.add_repair('Completed', cost='49000')
+        recompute_statuses()
+        self.assertEqual(self.status(), ('For Disposal', False))
+
+    def test_manual_status_overrides_until_it_matches_the_engine(self):
+        self.assertTrue(set_manual_status(self.vehicle, 'Unserviceable', user=self.user, reason='Flood damage'))
+        self.add_repair('Ongoing')
+        recompute_statuses()
+        self.assertEqual(self.status(), ('Unserviceable', True))
+
+        # Choosing what the engine derives hands the vehicle back to it
+        vehicle = Vehicle.objects.get(pk=self.vehicle.pk)
+        self.assertFalse(set_manual_status(vehicle, 'Under Repair', user=self.user))
+        Repair.objects.update(status='Completed')
+        recompute_statuses()
+        self.assertEqual(self.status(), ('Serviceable', False))
+
+    def test_status_picked_on_the_vehicle_form_is_flagged(self):
+        vehicle = Vehicle.objects.get(pk=self.vehicle.pk)
+        vehicle.status = 'Unserviceable'
+        self.assertTrue(apply_chosen_status(vehicle, user=self.user, reason='Changed on the vehicle form'))
+        vehicle.save()
+        self.assertEqual(self.status(), ('Unserviceable', True))
+        self.assertEqual(Vehicle.objects.get(pk=self.vehicle.pk).status_changed_by, self.user)
+
+        vehicle.status = 'Serviceable'
+        self.assertFalse(apply_chosen_status(vehicle, user=self.user))
+
+    def test_command_recomputes_and_the_list_view_does_not(self):
+        self.add_repair('Ongoing')
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(reverse('vehicle_list')).status_code, 200)
+        vehicle_table = connection.ops.quote_name(Vehicle._meta.db_table)
+        self.assertFalse([query for query in context.captured_queries if query['sql'].startswith(f'UPDATE {vehicle_table}')])
+        self.assertEqual(self.status(), ('Serviceable', False))
+
+        call_command('recompute_vehicle_statuses', stdout=io.StringIO())
+        self.assertEqual(self.status(), ('Under Repair', False))
+
+
+class InspectionRuleTests(TestCase):
+    """The batched inspection rules shared by repair/PMS forms and model saves"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='inspector', password='x')
+        cls.vehicle = make_vehicle('INS 100')
+        cls.other_vehicle = make_vehicle('INS 200')
+
+    def repair(self, pre_inspection=None, **fields):
+        return Repair(
+            vehicle=self.vehicle, pre_inspection=pre_inspection, date_of_repair=date(2026, 3, 2),
+            description='Brake job', cost=Decimal('100'), **fields,
+        )
+
+    def assertBreaks(self, record, message, validate=validate_repair, **kwargs):
+        with self.assertRaisesMessage(ValidationError, message):
+            validate(record, **kwargs)
+
+    def test_each_rule_reports_its_own_message(self):
+        self.assertBreaks(self.repair(), 'cannot be created without an approved pre-inspection')
+        unapproved = make_pre_inspection(self.vehicle, self.user, approved=False)
+        self.assertBreaks(self.repair(unapproved), 'must be approved before creating a repair')
+        foreign = make_pre_inspection(self.other_vehicle, self.user)
+        self.assertBreaks(self.repair(foreign), 'The pre-inspection report is for vehicle INS 200')
+        approved = make_pre_inspection(self.vehicle, self.user)
+        self.assertBreaks(self.repair(approved, status='Completed'), 'cannot be marked as completed without a post-inspection')
+        self.assertBreaks(
+            PMS(vehicle=self.vehicle, scheduled_date=date(2026, 3, 2)),
+            'A PMS record cannot be created without an approved pre-inspection', validate=validate_pms,
+        )
+
+    def test_reports_are_used_once(self):
+        pre_inspection = make_pre_inspection(self.vehicle, self.user)
+        self.repair(pre_inspection).save()
+        self.assertBreaks(self.repair(pre_inspection), 'already used by repair record for vehicle INS 100')
+
+        pms_pre_inspection = make_pre_inspection(self.vehicle, self.user, report_type='pms')
+        PMS.objects.bulk_create([PMS(vehicle=self.vehicle, scheduled_date=date(2026, 3, 2), pre_inspection=pms_pre_inspection)])
+        self.assertBreaks(self.repair(pms_pre_inspection), 'already used by PMS record for vehicle INS 100')
+        # Repairs created from a PMS share its pre-inspection
+        validate_repair(self.repair(pms_pre_inspection), SKIP_PMS_USAGE)
+
+    def test_rules_run_in_bounded_queries_and_once_per_state(self):
+        pre_inspection = PreInspectionReport.objects.get(pk=make_pre_inspection(self.vehicle, self.user).pk)
+        repair = self.repair(pre_inspection)
+        repair.vehicle = Vehicle.objects.get(pk=self.vehicle.pk)
+        # One Repair and one PMS usage query; the reports are already loaded
+        with self.assertNumQueries(2):
+            validate_repair(repair)
+        with self.assertNumQueries(0):
+            validate_repair(repair)
+            validate_repair(repair, SKIP_PMS_USAGE)
+
+        # A changed rule input needs a new check
+        repair.pre_inspection = make_pre_inspection(self.other_vehicle, self.user)
+        self.assertBreaks(repair, 'must be for the same vehicle')
+
+    def test_form_check_is_reused_by_the_save(self):
+        shop = RepairShop.objects.create(name='Alpha Motors')
+        pre_inspection = make_pre_inspection(self.vehicle, self.user)
+        form = RepairForm({
+            'vehicle': self.vehicle.pk, 'date_of_repair': '2026-03-02', 'description': 'Brake job', 'cost': '100',
+            'labor_cost': '0', 'repair_shop': shop.pk, 'technician': 'Pedro', 'status': 'Ongoing',
+            'pre_inspection': pre_inspection.pk,
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        with CaptureQueriesContext(connection) as context:
+            form.save()
+        pms_table = connection.ops.quote_name(PMS._meta.db_table)
+        usage_queries = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and f'FROM {pms_table}' in query['sql']
+        ]
+        self.assertEqual(usage_queries, [])
+
+        form = RepairForm({**form.data, 'description': 'Second job'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('Select a valid choice', str(form.errors['pre_inspection']))
+
+
+class CreatePMSTests(TestCase):
+    """create_pms() writes the PMS, its repair, part lines and logs in one transaction"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='pmsclerk', password='x')
+        cls.shop = RepairShop.objects.create(name='Alpha Motors')
+        cls.vehicle = make_vehicle('PMS 100')
+        cls.parts = [RepairPart.objects.create(name=name) for name in ('Oil filter', 'Engine oil')]
+
+    def setUp(self):
+        invalidate_part_catalog()
+        self.pre_inspection = make_pre_inspection(self.vehicle, self.user, report_type='pms')
+
+    def forms(self, *lines):
+        form = PMSForm({
+            'vehicle': self.vehicle.pk, 'service_type': 'General Inspection', 'scheduled_date': '2026-03-02',
+            'mileage_at_service': '10000', 'next_service_mileage': '20000', 'cost': '800', 'technician': 'Pedro',
+            'description': '10,000 km service', 'notes': 'n/a', 'status': 'Scheduled',
+            'pre_inspection': self.pre_inspection.pk, 'repair_shop': self.shop.pk,
+        })
+        return form, PMSRepairPartItemFormSet(part_formset_data(*lines))
+
+    def test_parts_create_a_linked_repair(self):
+        form, formset = self.forms((self.parts[0], 1, '350'), (self.parts[1], 4, '1200'))
+        with CaptureQueriesContext(connection) as context:
+            pms, repair = create_pms(form, formset, user=self.user, ip_address='127.0.0.1')
+        pms_table = connection.ops.quote_name(PMS._meta.db_table)
+        self.assertFalse([query for query in context.captured_queries if query['sql'].startswith(f'UPDATE {pms_table}')])
+
+        pms.refresh_from_db()
+        self.assertEqual(pms.repair, repair)
+        self.assertEqual((repair.cost, repair.labor_cost, repair.status), (Decimal('1550'), Decimal('800'), 'Ongoing'))
+        self.assertEqual(repair.pre_inspection, self.pre_inspection)
+        self.assertEqual(
+            sorted(repair.part_items.values_list('part__name', 'quantity')),
+            [('Engine oil', Decimal('4')), ('Oil filter', Decimal('1'))],
+        )
+        self.assertEqual(sorted(ActivityLog.objects.values_list('model_name', 'object_id')), [('PMS', pms.pk), ('Repair', repair.pk)])
+
+    def test_without_parts_there_is_no_repair(self):
+        pms, repair = create_pms(self.forms()[0])
+        self.assertIsNone(repair)
+        self.assertIsNone(PMS.objects.get(pk=pms.pk).repair)
+        self.assertFalse(Repair.objects.exists())
+
+    def test_invalid_input_writes_nothing(self):
+        form, formset = self.forms((self.parts[0], 1, '-5'))
+        with self.assertRaises(ValidationError):
+            create_pms(form, formset)
+        self.pre_inspection.approved_by = None
+        self.pre_inspection.save()
+        with self.assertRaises(ValidationError):
+            create_pms(self.forms()[0])
+        self.assertFalse(PMS.objects.exists())
+        self.assertFalse(Repair.objects.exists())
+
+    def test_part_lines_have_no_save_hooks_for_bulk_create_to_skip(self):
+        # create_pms() bulk-creates the part lines that save_repair() saves one by one
+        self.assertIs(RepairPartItem.save, models.Model.save)
+        for signal in (pre_save, post_save, pre_delete, post_delete):
+            self.assertFalse(signal.has_listeners(RepairPartItem), signal)
+
+
+class PMSPlanningTests(TestCase):
+    """The PMS scheduler, the overdue sweep and the capacity-aware optimizer"""
+
+    today = date(2026, 3, 2)  # a Monday
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vehicles = [
+            make_vehicle(f'PMS {n:03d}', date_acquired=date(2025, 1, 1), current_mileage=1000) for n in range(6)
+        ]
+        RepairShop.objects.create(name='Alpha Motors', pms_slots_per_day=2)
+        RepairShop.objects.create(name='Beta Service', pms_slots_per_day=2)
+
+    def book(self, vehicle, scheduled, due, provider, status='Scheduled', **fields):
+        # bulk_create: PMS.save() would need an approved pre-inspection
+        return PMS.objects.bulk_create([PMS(
+            vehicle=vehicle, scheduled_date=scheduled, due_date=due, provider=provider, status=status, **fields,
+        )])[0]
+
+    def test_scheduler_plans_each_vehicle_once(self):
+        planned, skipped = plan_schedule(today=self.today)
+        self.assertEqual((len(planned), skipped), (6, 0))
+        # Six months after acquisition; 1,000 km is far from the 10,000 km interval
+        self.assertEqual({(plan.due_date, plan.reason) for plan in planned}, {(date(2025, 7, 1), 'time')})
+
+        created = apply_schedule(planned, today=self.today)
+        self.assertEqual({record.status for record in created}, {'Overdue'})
+        self.assertEqual(plan_schedule(today=self.today), ([], 6))
+        self.assertEqual(apply_schedule(planned, today=self.today), [])
+
+    def test_mileage_is_projected_from_the_last_service(self):
+        truck, sedan = self.vehicles[:2]
+        Vehicle.objects.filter(pk=truck.pk).update(vehicle_type='TRUCK', current_mileage=24000)
+        Vehicle.objects.filter(pk=sedan.pk).update(current_mileage=31000)
+        for vehicle in (truck, sedan):
+            self.book(
+                vehicle, date(2026, 1, 1), None, '', status='Completed', completed_date=date(2026, 1, 1),
+                mileage_at_service=20000, next_service_mileage=25000 if vehicle is truck else 30000,
+            )
+
+        planned, _ = plan_schedule(Vehicle.objects.filter(pk__in=[truck.pk, sedan.pk]), today=self.today)
+        due = {plan.vehicle_id: (plan.due_date, plan.reason) for plan in planned}
+        # 4,000 km in 60 days leaves 1,000 km: 15 days, before the truck's 3-month interval
+        self.assertEqual(due[truck.pk], (date(2026, 3, 17), 'mileage'))
+        # Already past its service mileage
+        self.assertEqual(due[sedan.pk], (self.today, 'mileage'))
+
+        with override_settings(PMS_INTERVAL_RULES={'TRUCK': (5000, 1)}):
+            plan = plan_schedule(Vehicle.objects.filter(pk=truck.pk), today=self.today)[0][0]
+        self.assertEqual((plan.due_date, plan.reason), (date(2026, 2, 1), 'time'))
+
+    def test_vehicles_for_disposal_are_not_planned(self):
+        Vehicle.objects.filter(pk=self.vehicles[0].pk).update(status='For Disposal')
+        call_command('schedule_pms', dry_run=True, stdout=io.StringIO())
+        self.assertFalse(PMS.objects.exists())
+        call_command('schedule_pms', stdout=io.StringIO())
+        self.assertEqual(PMS.objects.count(), 5)
+        self.assertFalse(PMS.objects.filter(vehicle=self.vehicles[0]).exists())
+
+    def test_mark_overdue_moves_past_scheduled_records(self):
+        past = self.book(self.vehicles[0], self.today - timedelta(days=1), self.today - timedelta(days=1), '')
+        upcoming = self.book(self.vehicles[1], self.today, self.today, '')
+        self.assertEqual(mark_overdue(today=self.today), 1)
+        self.assertEqual(PMS.objects.get(pk=past.pk).status, 'Overdue')
+        self.assertIsNotNone(PMS.objects.get(pk=past.pk).overdue_at)
+        self.assertEqual(PMS.objects.get(pk=upcoming.pk).status, 'Scheduled')
+
+    def test_overdue_sweep_is_throttled_across_requests_and_workers(self):
+        yesterday = date.today() - timedelta(days=1)
+        self.book(self.vehicles[0], yesterday, yesterday, '')
+        cache.delete(OVERDUE_SWEEP_KEY)
+        self.addCleanup(cache.delete, OVERDUE_SWEEP_KEY)
+        with mock.patch.object(pms_scheduler, '_next_local_sweep', 0.0):
+            self.assertEqual(ensure_overdue_marked(), 1)
+            self.book(self.vehicles[1], yesterday, yesterday, '')
+            # Same worker within the interval
+            self.assertEqual(ensure_overdue_marked(), 0)
+            # Another worker: its local throttle is free, but the shared cache key is taken
+            pms_scheduler._next_local_sweep = 0.0
+            self.assertEqual(ensure_overdue_marked(), 0)
+        self.assertEqual(PMS.objects.filter(status='Scheduled').count(), 1)
+
+    def test_dashboard_counts_unswept_past_records_as_overdue(self):
+        today = date.today()
+        self.book(self.vehicles[0], today - timedelta(days=2), today - timedelta(days=2), '')
+        self.book(self.vehicles[0], today + timedelta(days=5), today + timedelta(days=5), '')
+        self.book(self.vehicles[1], today + timedelta(days=10), today + timedelta(days=10), '')
+        self.book(self.vehicles[2], today + timedelta(days=60), today + timedelta(days=60), '')
+        self.client.force_login(CustomUser.objects.create_superuser(username='boss', password='x', email='b@example.com'))
+
+        # The sweep has not run yet
+        with mock.patch.object(pms_scheduler, '_next_local_sweep', time.monotonic() + 3600):
+            response = self.client.get(reverse('dashboard'))
+        near = {entry['vehicle'].pk: entry for entry in response.context['vehicles_near_pms']}
+        self.assertEqual(set(near), {self.vehicles[0].pk, self.vehicles[1].pk})
+        self.assertEqual((near[self.vehicles[0].pk]['days_overdue'], near[self.vehicles[0].pk]['days_until']), (2, None))
+        self.assertTrue(near[self.vehicles[0].pk]['reason'].startswith('PMS overdue by 2 days '))
+        self.assertEqual(near[self.vehicles[1].pk]['days_until'], 10)
+
+    def test_optimizer_keeps_a_feasible_plan(self):
+        day = self.today + timedelta(days=7)
+        for vehicle in self.vehicles[:2]:
+            self.book(vehicle, day, day + timedelta(days=3), 'Alpha Motors')
+        for vehicle in self.vehicles[2:4]:
+            self.book(vehicle, day, day, 'Beta Service')
+
+        plan = optimize(days=60, today=self.today)
+        self.assertEqual(len(plan.assignments), 4)
+        self.assertEqual(plan.changes, [])
+        self.assertEqual(apply_plan(plan), 0)
+
+    def test_optimizer_moves_overbooked_and_overdue_records_once(self):
+        day = self.today + timedelta(days=7)
+        for vehicle in self.vehicles[:3]:
+            self.book(vehicle, day, day, 'Alpha Motors')
+        late = self.book(
+            self.vehicles[3], self.today - timedelta(days=3), self.today - timedelta(days=3), 'Alpha Motors', status='Overdue',
+        )
+
+        plan = optimize(days=60, today=self.today)
+        self.assertEqual(plan.overbooked_before(), 1)
+        self.assertEqual(len(plan.changes), 2)
+        self.assertEqual(apply_plan(plan), 2)
+
+        late.refresh_from_db()
+        self.assertEqual((late.status, late.overdue_at, late.due_date), ('Scheduled', None, self.today - timedelta(days=3)))
+        self.assertGreaterEqual(late.scheduled_date, self.today)
+        booked = PMS.objects.values('provider', 'scheduled_date').annotate(count=Count('id'))
+        self.assertTrue(all(row['count'] <= 2 for row in booked))
+
+        # The plan it produced is feasible, so a second run leaves it alone
+        self.assertEqual(optimize(days=60, today=self.today).changes, [])
+
+    def test_optimize_command_dry_run_writes_nothing(self):
+        day = date.today() + timedelta(days=7)
+        for vehicle in self.vehicles[:3]:
+            self.book(vehicle, day, day, 'Alpha Motors')
+        output = io.StringIO()
+        call_command('optimize_pms_schedule', dry_run=True, stdout=output)
+        self.assertIn('1 booking(s) over shop capacity', output.getvalue())
+        self.assertIn('1 PMS record(s) would be rescheduled (dry run)', output.getvalue())
+        self.assertEqual(PMS.objects.filter(scheduled_date=day, provider='Alpha Motors').count(), 3)
+
+        call_command('optimize_pms_schedule', stdout=io.StringIO())
+        self.assertEqual(PMS.objects.filter(scheduled_date=day, provider='Alpha Motors').count(), 2)
+
+
+class TemporaryMediaMixin:
+    """Runs each test against an empty MEDIA_ROOT, with helpers to store images in it"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = upload_storage()
+
+    def image_bytes(self, color='red', size=(64, 48), image_format='PNG', **save_options):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, color).save(buffer, image_format, **save_options)
+        return buffer.getvalue()
+
+    def save_image(self, name, color='red', **options):
+        return self.storage.save(name, ContentFile(self.image_bytes(color, **options)))
+
+    def age(self, path, days=3):
+        """Backdate a stored file past the grace period"""
+        past = time.time() - days * 86400
+        os.utime(self.storage.path(path), (past, past))
+
+
+class ThumbnailTests(TemporaryMediaMixin, TestCase):
+    """Fixed-size thumbnails, their paths and the thumbnail_url tag"""
+
+    def setUp(self):
+        super().setUp()
+        media_tags._existing_thumbnails.clear()
+
+    def test_thumbnail_paths_keep_the_original_extension(self):
+        jpg = thumbnail_path('vehicles/photos/car.jpg', 'small')
+        png = thumbnail_path('vehicles/photos/car.png', 'small')
+        self.assertNotEqual(jpg, png)
+        self.assertTrue(jpg.startswith('vehicles/photos/.thumbs/car.jpg.small.'))
+        self.assertEqual(thumbnail_original(jpg), 'vehicles/photos/car.jpg')
+        self.assertIsNone(thumbnail_original('vehicles/photos/car.jpg'))
+
+    def test_every_size_fits_its_box_once(self):
+        path = self.save_image('vehicles/photos/wide.png', size=(2000, 1000))
+        self.assertEqual(generate_thumbnails(path), len(SIZES))
+        for size, box in SIZES.items():
+            with self.storage.open(thumbnail_path(path, size)) as thumb:
+                width, height = Image.open(thumb).size
+            self.assertEqual((width, height), (box[0], box[0] // 2))
+        self.assertEqual(generate_thumbnails(path), 0)
+        self.assertEqual(generate_thumbnails(path, force=True), len(SIZES))
+        # Small images are not scaled up, and documents get none
+        small = self.save_image('vehicles/photos/small.png', size=(40, 30))
+        generate_thumbnails(small)
+        with self.storage.open(thumbnail_path(small, 'large')) as thumb:
+            self.assertEqual(Image.open(thumb).size, (40, 30))
+        self.assertEqual(generate_thumbnails(self.storage.save('vehicles/registration/or.pdf', ContentFile(b'%PDF-1.4'))), 0)
+
+    def test_exif_orientation_is_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotate 90 degrees clockwise to display
+        path = self.storage.save(
+            'vehicles/photos/sideways.jpg', ContentFile(self.image_bytes(size=(400, 300), image_format='JPEG', exif=exif)),
+        )
+        generate_thumbnails(path)
+        with self.storage.open(thumbnail_path(path, 'small')) as thumb:
+            self.assertEqual(Image.open(thumb).size, (90, 120))
+
+    def test_tag_falls_back_to_the_original_and_remembers_thumbnails(self):
+        path = self.save_image('vehicles/photos/front.png')
+        self.assertEqual(media_tags.thumbnail_url(path, 'small'), default_storage.url(path))
+        generate_thumbnails(path)
+        thumb = thumbnail_path(path, 'small')
+        self.assertEqual(media_tags.thumbnail_url(path, 'small'), default_storage.url(thumb))
+        # Known thumbnails are not looked up on disk again
+        self.storage.delete(thumb)
+        self.assertEqual(media_tags.thumbnail_url(path, 'small'), default_storage.url(thumb))
+        self.assertEqual(media_tags.thumbnail_url(path, 'huge'), default_storage.url(path))
+        self.assertEqual(media_tags.thumbnail_url('', 'small'), '')
+
+    def test_thumbnails_are_generated_after_commit(self):
+        path = self.save_image('vehicles/photos/front.png')
+        with self.captureOnCommitCallbacks() as callbacks:
+            schedule_thumbnails([path, 'vehicles/registration/or.pdf', ''])
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(self.storage.exists(thumbnail_path(path, 'small')))
+        callbacks[0]()
+        deadline = time.monotonic() + 10
+        while not self.storage.exists(thumbnail_path(path, 'large')) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(all(self.storage.exists(thumbnail_path(path, size)) for size in SIZES))
+
+
+class ContentAddressedStorageTests(TemporaryMediaMixin, TestCase):
+    """Uploads are stored once per content and only deleted once nothing lists them"""
+
+    def setUp(self):
+        super().setUp()
+        self.vehicle = make_vehicle('MED 100')
+
+    def test_same_content_is_stored_once(self):
+        first = self.save_image('vehicles/photos/front.png')
+        second = self.save_image('vehicles/photos/copy of front.png')
+        other = self.save_image('vehicles/photos/back.png', color='blue')
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r'^vehicles/photos/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(os.listdir(os.path.dirname(self.storage.path(first))), [os.path.basename(first)])
+        self.assertEqual(os.stat(self.storage.path(first)).st_mode & 0o777, 0o644)
+
+    def test_saving_stored_content_again_restarts_its_grace_period(self):
+        path = self.save_image('vehicles/photos/front.png')
+        self.age(path)
+        self.assertEqual(self.save_image('vehicles/photos/again.png'), path)
+        self.assertEqual(release([path]), [])
+        self.assertTrue(self.storage.exists(path))
+
+    def test_release_deletes_only_unlisted_files_past_the_grace_period(self):
+        listed = self.save_image('vehicles/photos/front.png')
+        unlisted = self.save_image('vehicles/photos/back.png', color='blue')
+        fresh = self.save_image('vehicles/photos/side.png', color='green')
+        self.vehicle.photos = [listed]
+        self.vehicle.save()
+        generate_thumbnails(unlisted)
+        for path in (listed, unlisted):
+            self.age(path)
+
+        self.assertEqual(release([listed, unlisted, fresh]), [unlisted])
+        self.assertTrue(self.storage.exists(listed))
+        self.assertTrue(self.storage.exists(fresh))
+        self.assertFalse(self.storage.exists(unlisted))
+        self.assertFalse(self.storage.exists(thumbnail_path(unlisted, 'small')))
+
+        with override_settings(MEDIA_GC_GRACE_HOURS=0):
+            self.assertEqual(release([fresh]), [fresh])
+
+
+class ChunkedUploadTests(TemporaryMediaMixin, TestCase):
+    """Resumable chunked uploads: ordered appends, completion and claiming"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='uploader', password='x')
+
+    def start(self, data, **fields):
+        return chunked_uploads.start_session(self.user, 'driver_report', 'report.pdf', len(data), **fields)
+
+    def append(self, session, offset, data, checksum=''):
+        return chunked_uploads.append_chunk(session, offset, io.BytesIO(data), len(data), checksum)
+
+    def test_chunks_are_appended_in_order_and_completed_into_storage(self):
+        data = b'0123456789' * 10
+        session = self.start(data, checksum=hashlib.sha256(data).hexdigest())
+        session = self.append(session, 0, data[:40], hashlib.sha256(data[:40]).hexdigest())
+        session = self.append(session, 40, data[40:])
+        self.assertEqual(session.received, len(data))
+
+        session = chunked_uploads.complete(session)
+        self.assertEqual(session.status, 'complete')
+        self.assertTrue(session.path.startswith('pre_inspection/driver_reports/'))
+        with self.storage.open(session.path) as stored:
+            self.assertEqual(stored.read(), data)
+        self.assertFalse(os.path.exists(chunked_uploads.part_path(session)))
+
+    def test_a_chunk_at_the_wrong_offset_reports_where_to_resume(self):
+        data = b'x' * 30
+        session = self.append(self.start(data), 0, data[:10])
+        with self.assertRaises(chunked_uploads.OffsetMismatch) as raised:
+            self.append(session, 0, data[:10])
+        self.assertEqual(raised.exception.received, 10)
+
+        # A client holding a stale session is refused under the lock too
+        stale = UploadSession.objects.get(pk=session.pk)
+        self.append(session, 10, data[10:20])
+        with self.assertRaises(chunked_uploads.OffsetMismatch):
+            self.append(stale, 10, data[10:20])
+        self.assertEqual(UploadSession.objects.get(pk=session.pk).received, 20)
+
+    def test_a_bad_or_short_chunk_is_never_appended(self):
+        data = b'y' * 20
+        session = self.start(data)
+        with self.assertRaises(ValidationError):
+            self.append(session, 0, data[:10], checksum='0' * 64)
+        with self.assertRaises(ValidationError):
+            chunked_uploads.append_chunk(session, 0, io.BytesIO(data[:5]), 10)
+
+        session.refresh_from_db()
+        self.assertEqual(session.received, 0)
+        self.assertEqual(os.path.getsize(chunked_uploads.part_path(session)), 0)
+        # The spooled chunks are gone as well
+        self.assertEqual(os.listdir(chunked_uploads.upload_dir()), [os.path.basename(chunked_uploads.part_path(session))])
+
+    def test_the_body_is_read_before_the_session_is_locked(self):
+        data = b'z' * (chunked_uploads.READ_BLOCK * 2)
+        session = self.start(data)
+        events = []
+
+        class Body(io.BytesIO):
+            def read(self, size=-1):
+                events.append('read')
+                return super().read(size)
+
+        select_for_update = UploadSession.objects.select_for_update
+
+        def locking():
+            events.append('lock')
+            return select_for_update()
+
+        with mock.patch.object(UploadSession.objects, 'select_for_update', locking):
+            chunked_uploads.append_chunk(session, 0, Body(data), len(data))
+        self.assertEqual(events, ['read', 'read', 'lock'])
+
+    def test_claim_is_undone_when_the_record_is_not_saved(self):
+        data = b'report'
+        session = chunked_uploads.complete(self.append(self.start(data), 0, data))
+
+        with self.assertRaises(DatabaseError):
+            with transaction.atomic():
+                self.assertEqual(chunked_uploads.claim(self.user, [session.token], 'driver_report'), [session.path])
+                raise DatabaseError("the report failed to save")
+        self.assertTrue(UploadSession.objects.filter(pk=session.pk).exists())
+
+        # Only the owner's complete uploads of the right purpose can be claimed, once
+        other = CustomUser.objects.create_user(username='someone', password='x')
+        self.assertEqual(chunked_uploads.claim(other, [session.token], 'driver_report'), [])
+        self.assertEqual(chunked_uploads.claim(self.user, [session.token], 'replaced_part'), [])
+        self.assertEqual(chunked_uploads.claim(self.user, [session.token, session.token], 'driver_report'), [session.path])
+        self.assertEqual(chunked_uploads.claim(self.user, [session.token], 'driver_report'), [])
+
+
+class MediaFileTests(TemporaryMediaMixin, TestCase):
+    """Permission-checked /media/ downloads"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = CustomUser.objects.create_user(username='viewer', password='x', can_view_vehicles=True)
+        cls.outsider = CustomUser.objects.create_user(username='outsider', password='x', can_view_users=True)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.data = b'%PDF-1.4 ' + bytes(range(256)) * 4
+        self.path = self.storage.save('vehicles/registration/or-cr.pdf', ContentFile(self.data))
+        vehicle = make_vehicle('MED 200')
+        vehicle.registration_documents = [self.path]
+        vehicle.save()
+        self.url = reverse('media_file', kwargs={'path': self.path})
+
+    def test_only_users_who_may_see_the_record_get_the_file(self):
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        self.client.force_login(self.outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        self.client.force_login(self.viewer)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response['Content-Disposition'].startswith('inline;'))
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_unlisted_and_escaping_paths_are_not_found(self):
+        self.client.force_login(self.viewer)
+        unlisted = self.storage.save('vehicles/registration/other.pdf', ContentFile(b'%PDF-1.4 other'))
+        self.assertEqual(self.client.get(reverse('media_file', kwargs={'path': unlisted})).status_code, 404)
+        self.assertEqual(self.client.get('/media/vehicles/../../settings.py').status_code, 404)
+
+    def test_range_requests(self):
+        self.client.force_login(self.viewer)
+        size = len(self.data)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{size}')
+        self.assertEqual(b''.join(response.streaming_content), self.data[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+
+        # A stale If-Range gets the whole file; a current ETag gets a 304
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_front_end_servers_are_handed_the_transfer(self):
+        self.client.force_login(self.viewer)
+        with override_settings(MEDIA_SERVE_BACKEND='nginx', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.path)
+        self.assertEqual(response.content, b'')
+
+        with override_settings(MEDIA_SERVE_BACKEND='apache'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.storage.path(self.path))
+
+
+class GcMediaTests(TemporaryMediaMixin, TestCase):
+    """The gc_media command"""
+
+    def setUp(self):
+        super().setUp()
+        self.vehicle = make_vehicle('MED 300')
+
+    def test_keeps_listed_files_and_their_thumbnails(self):
+        listed = self.save_image('vehicles/photos/front.png')
+        orphan = self.save_image('vehicles/photos/back.png', color='blue')
+        fresh = self.save_image('vehicles/photos/side.png', color='green')
+        self.vehicle.photos = [listed]
+        self.vehicle.save()
+        generate_thumbnails(listed)
+        generate_thumbnails(orphan)
+        for path in (listed, orphan, thumbnail_path(listed, 'small'), thumbnail_path(orphan, 'small')):
+            self.age(path)
+
+        call_command('gc_media', dry_run=True, stdout=io.StringIO())
+        self.assertTrue(self.storage.exists(orphan))
+
+        call_command('gc_media', stdout=io.StringIO())
+        self.assertTrue(self.storage.exists(listed))
+        self.assertTrue(self.storage.exists(thumbnail_path(listed, 'small')))
+        self.assertTrue(self.storage.exists(fresh))
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertFalse(self.storage.exists(thumbnail_path(orphan, 'small')))
+
+    def test_keeps_completed_uploads_and_quarantines_instead_of_deleting(self):
+        user = CustomUser.objects.create_user(username='collector', password='x')
+        uploaded = self.save_image('pre_inspection/driver_reports/report.png')
+        orphan = self.save_image('vehicles/photos/back.png', color='blue')
+        UploadSession.objects.create(
+            token='a' * 64, user=user, purpose='driver_report', filename='report.png',
+            size=1, received=1, status='complete', path=uploaded,
+        )
+        for path in (uploaded, orphan):
+            self.age(path)
+
+        call_command('gc_media', quarantine=True, stdout=io.StringIO())
+        self.assertTrue(self.storage.exists(uploaded))
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertTrue(self.storage.exists(f'.quarantine/{orphan}'))
+
+
+@override_settings(IMAGE_NORMALIZE_WORKERS=0)
+class ImageNormalizationTests(TemporaryMediaMixin, TestCase):
+    """Upright, metadata-free copies of stored photos replacing their originals"""
+
+    def setUp(self):
+        super().setUp()
+        self.vehicle = make_vehicle('MED 400')
+
+    def phone_photo(self, name='vehicles/photos/IMG_0042.jpg'):
+        """A sideways JPEG with a GPS position, as phones store them"""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotate 90 degrees clockwise to display
+        exif[0x010F] = 'PhoneMaker'
+        exif[0x8825] = {1: 'N', 2: (14.0, 35.0, 0.0)}
+        return self.storage.save(name, ContentFile(self.image_bytes(size=(64, 48), image_format='JPEG', exif=exif)))
+
+    def test_normalized_photo_is_upright_and_has_no_metadata(self):
+        original = self.phone_photo()
+        with self.storage.open(original) as stored:
+            self.assertIn(0x8825, Image.open(stored).getexif())
+
+        normalized = normalize_stored(original)
+        self.assertNotEqual(normalized, original)
+        with self.storage.open(normalized) as stored:
+            image = Image.open(stored)
+            self.assertEqual(image.size, (48, 64))
+            self.assertFalse(image.getexif())
+            self.assertNotIn('exif', image.info)
+        # Already normalized: stored as it is
+        self.assertEqual(normalize_stored(normalized), normalized)
+
+    def test_records_are_repointed_and_the_original_deleted_at_once(self):
+        original = self.phone_photo()
+        other = self.save_image('vehicles/photos/back.png', color='blue')
+        self.vehicle.photos = [original, other]
+        self.vehicle.save()
+        generate_thumbnails(original)
+
+        normalized = normalize_stored(original)
+        self.vehicle.refresh_from_db()
+        self.assertEqual(self.vehicle.photos, [normalized, other])
+        self.assertEqual(
+            set(Attachment.objects.filter(object_id=self.vehicle.pk).values_list('path', flat=True)),
+            {normalized, other},
+        )
+        # Within the grace period, but the GPS position must not outlive the upload
+        self.assertFalse(self.storage.exists(original))
+        self.assertFalse(self.storage.exists(thumbnail_path(original, 'small')))
+
+    def test_an_original_saved_again_meanwhile_is_kept(self):
+        original = self.phone_photo()
+        with self.storage.open(original) as stored:
+            data, extension = normalize_image(stored.read())
+        # Read a minute ago; the upload of the same photo since then touched the file
+        self.phone_photo('vehicles/photos/again.jpg')
+        store_normalized(original, data, extension, read_at=timezone.now() - timedelta(minutes=1))
+        self.assertTrue(self.storage.exists(original))
+
+    def test_normalize_images_command_backfills_listed_photos(self):
+        original = self.phone_photo()
+        self.vehicle.photos = [original]
+        self.vehicle.save()
+
+        out = io.StringIO()
+        call_command('normalize_images', workers=1, stdout=out)
+        self.assertIn('Normalized 1 of 1 image(s)', out.getvalue())
+        self.vehicle.refresh_from_db()
+        self.assertNotEqual(self.vehicle.photos, [original])
+        self.assertFalse(self.storage.exists(original))
+        self.assertTrue(self.storage.exists(thumbnail_path(self.vehicle.photos[0], 'small')))
+
+
+class AttachmentBackfillTests(TemporaryMediaMixin, TestCase):
+    """Attachment rows for paths listed before the table existed"""
+
+    def setUp(self):
+        super().setUp()
+        self.photo = self.save_image('vehicles/photos/front.png', size=(64, 48))
+        self.vehicle = make_vehicle('MED 500', photos=[self.photo, 'vehicles/photos/gone.png'])
+        Attachment.objects.all().delete()
+
+    def test_migration_creates_rows_without_opening_files(self):
+        migration = importlib.import_module('core.migrations.0044_attachment')
+        with mock.patch('builtins.open', side_effect=AssertionError('a file was opened')):
+            migration.populate_attachments(django_apps, None)
+
+        rows = list(Attachment.objects.filter(object_id=self.vehicle.pk).values_list('kind', 'position', 'path', 'sha256', 'size'))
+        digest = os.path.splitext(os.path.basename(self.photo))[0]
+        self.assertEqual(rows, [
+            ('photos', 0, self.photo, digest, None),
+            ('photos', 1, 'vehicles/photos/gone.png', '', None),
+        ])
+
+    def test_command_fills_in_sizes_of_existing_files(self):
+        importlib.import_module('core.migrations.0044_attachment').populate_attachments(django_apps, None)
+        call_command('backfill_attachments', batch_size=1, stdout=io.StringIO())
+
+        photo = Attachment.objects.get(path=self.photo)
+        self.assertEqual((photo.size, photo.width, photo.height), (os.path.getsize(self.storage.path(self.photo)), 64, 48))
+        gone = Attachment.objects.get(path='vehicles/photos/gone.png')
+        self.assertEqual((gone.size, gone.width), (None, None))
+
+
+class DossierTests(TemporaryMediaMixin, TestCase):
+    """Streamed ZIP dossiers of vehicle records and files"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = CustomUser.objects.create_user(username='auditor', password='x', can_view_vehicles=True)
+
+    def setUp(self):
+        super().setUp()
+        self.vehicle = make_vehicle('MED 600')
+        Repair.objects.bulk_create([
+            Repair(vehicle=self.vehicle, date_of_repair=day, description=description, cost=Decimal('2500'), status='Completed')
+            for day, description in [(date(2026, 3, 2), 'Brake pads'), (date(2025, 1, 5), 'Wipers')]
+        ])
+
+    def read_zip(self, chunks):
+        return zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+    def read_csv(self, archive, name):
+        return list(csv.reader(io.StringIO(archive.read(name).decode('utf-8-sig'))))
+
+    def test_dossier_lists_records_and_files(self):
+        photo = self.save_image('vehicles/photos/front.png')
+        self.vehicle.photos = [photo, 'vehicles/photos/gone.png']
+        self.vehicle.save()
+
+        archive = self.read_zip(zip_stream(dossier_entries(Vehicle.objects.all(), date(2026, 1, 1))))
+        self.assertIsNone(archive.testzip())
+        with self.storage.open(photo) as stored:
+            self.assertEqual(archive.read('MED_600/vehicle/photos/01.png'), stored.read())
+
+        repairs = self.read_csv(archive, 'manifest/repairs.csv')
+        self.assertEqual([(row[0], row[4]) for row in repairs[1:]], [('MED 600', 'Brake pads')])
+        files = {row[4]: row[-1] for row in self.read_csv(archive, 'manifest/files.csv')}
+        self.assertEqual(files[photo], 'included')
+        self.assertEqual(files['vehicles/photos/gone.png'], 'missing')
+
+    def test_vehicle_dossier_is_streamed_to_users_who_may_see_it(self):
+        url = reverse('vehicle_dossier', args=[self.vehicle.pk])
+        self.client.force_login(CustomUser.objects.create_user(username='nobody', password='x'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_login(self.viewer)
+        response = self.client.get(url, {'start': '2025-01-01', 'end': '2025-12-31'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = self.read_zip(response.streaming_content)
+        self.assertEqual([row[4] for row in self.read_csv(archive, 'manifest/repairs.csv')[1:]], ['Wipers'])
+
+        response = self.client.get(url, {'start': '2026-01-01', 'end': '2025-01-01'})
+        self.assertRedirects(response, reverse('vehicle_detail', args=[self.vehicle.pk]), fetch_redirect_response=False)
+
+    def test_fleet_dossier_needs_admin_access_and_a_date_range(self):
+        url = reverse('fleet_dossier')
+        self.client.force_login(self.viewer)
+        self.assertRedirects(self.client.get(url), reverse('dashboard'), fetch_redirect_response=False)
+
+        admin = CustomUser.objects.create_user(username='admin', password='x', can_view_admin_dashboard=True)
+        self.client.force_login(admin)
+        self.assertRedirects(self.client.get(url, {'start': '2026-01-01'}), reverse('dashboard'), fetch_redirect_response=False)
+        response = self.client.get(url, {'start': '2026-01-01', 'end': '2026-12-31'})
+        archive = self.read_zip(response.streaming_content)
+        self.assertEqual([row[4] for row in self.read_csv(archive, 'manifest/repairs.csv')[1:]], ['Brake pads'])
+
+
+class ExportTests(TestCase):
+    """Streamed CSV and XLSX exports of the repair list, PMS list and reports"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='exporter', password='x')
+        cls.vehicle = make_vehicle('EXP 100')
+        other = make_vehicle('EXP 200')
+        # bulk_create: Repair.save() and PMS.save() would need an approved pre-inspection
+        Repair.objects.bulk_create([
+            Repair(vehicle=cls.vehicle, date_of_repair=date(2026, 3, 2), description='=HYPERLINK("http://x.test","ok")',
+                   cost=Decimal('2500'), labor_cost=Decimal('500'), status='Completed'),
+            Repair(vehicle=other, date_of_repair=date(2026, 2, 1), description='Wipers', cost=Decimal('300'), status='Pending'),
+        ])
+        PMS.objects.bulk_create([PMS(
+            vehicle=cls.vehicle, scheduled_date=date(2026, 4, 1), due_date=date(2026, 4, 8), provider='@Casa Motors',
+            status='Scheduled',
+        )])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def csv_rows(self, response):
+        self.assertTrue(response.streaming)
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+
+    def test_repair_csv_follows_the_list_filters_and_defuses_formulas(self):
+        response = self.client.get(reverse('repair_export', args=['csv']), {'vehicle': self.vehicle.pk})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertTrue(response['Content-Disposition'].startswith('attachment; filename="repairs-'))
+        header, *rows = self.csv_rows(response)
+        self.assertEqual(header, REPAIR_HEADER)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][2], 'EXP 100')
+        self.assertEqual(rows[0][5], '\'=HYPERLINK("http://x.test","ok")')
+        self.assertEqual(rows[0][9], '3000.00')
+
+        self.assertEqual(self.client.get(reverse('repair_export', args=['pdf'])).status_code, 404)
+
+    def test_only_text_cells_are_quoted(self):
+        rows = [['-5', Decimal('-5'), '+63 917', '@cell', '\tx', 'a-b', 7]]
+        lines = b''.join(csv_chunks(['h'] * 7, rows)).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[1], "'-5,-5,'+63 917,'@cell,'\tx,a-b,7")
+
+    def test_pms_xlsx_is_a_streamed_workbook(self):
+        response = self.client.get(reverse('pms_export', args=['xlsx']))
+        self.assertEqual(response['Content-Type'], XLSX_CONTENT_TYPE)
+        workbook = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(workbook.testzip())
+        sheet = workbook.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(sheet.count('<row>'), 2)
+        # Inline strings are never evaluated, so XLSX cells need no quoting
+        self.assertIn('<t xml:space="preserve">@Casa Motors</t>', sheet)
+        self.assertIn('<t xml:space="preserve">EXP 100</t>', sheet)
+
+    def test_report_export(self):
+        response = self.client.get(reverse('report_export', args=['csv']), {'report': 'monthly', 'year': '2026'})
+        self.assertTrue(response['Content-Disposition'].endswith('filename="repair-costs-monthly-2026.csv"'))
+        header, *rows = self.csv_rows(response)
+        self.assertEqual(header, ['Month', 'Year', 'Cost'])
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[2][:2], ['March', '2026'])
+        self.assertEqual([Decimal(row[2]) for row in rows[1:3]], [Decimal('0'), Decimal('3000')])
+
+        response = self.client.get(reverse('report_export', args=['csv']), {'report': 'vehicles'})
+        self.assertEqual([row[0] for row in self.csv_rows(response)[1:]], ['EXP 100'])
+        self.assertEqual(self.client.get(reverse('report_export', args=['csv']), {'report': 'nope'}).status_code, 404)
+
+
+def csv_file(header, rows):
+    """An uploaded-CSV stand-in for the importers"""
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return io.BytesIO(text.getvalue().encode('utf-8'))
+
+
+def xlsx_file(header, rows):
+    return io.BytesIO(b''.join(xlsx_chunks('Import', header, rows)))
+
+
+VEHICLE_HEADER = ['Plate Number', 'Vehicle Type', 'Brand', 'Model', 'Year', 'Date Acquired', 'Division', 'Driver', 'Mileage']
+
+
+class FleetImportTests(TestCase):
+    """Vehicle and driver imports: round trips, re-imports and statuses"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='importer', password='x')
+        Division.objects.create(name='Motor Pool')
+        Driver.objects.create(name='Juan Dela Cruz', license_number='N01-23-456789')
+
+    def vehicle_rows(self):
+        return [
+            ['ABC 1234', 'Sedan', 'Toyota', 'Vios', 2020, date(2020, 1, 15), 'motor pool', 'N01-23-456789', 12000],
+            ['XYZ-987', 'PICK UP', 'Isuzu', 'D-Max', 2021, date(2021, 6, 1), '', '', 5000],
+        ]
+
+    def test_xlsx_round_trip_then_csv_reimport_changes_nothing(self):
+        result = import_vehicles(xlsx_file(VEHICLE_HEADER, self.vehicle_rows()), 'fleet.xlsx', user=self.user)
+        self.assertEqual((result.created, result.updated, result.error_count), (2, 0, 0), result.errors)
+
+        vehicle = Vehicle.objects.get(plate_number='ABC 1234')
+        self.assertEqual(vehicle.vehicle_type, 'SEDAN')
+        self.assertEqual(vehicle.date_acquired, date(2020, 1, 15))
+        self.assertEqual(vehicle.division.name, 'Motor Pool')
+        self.assertEqual(vehicle.assigned_driver.license_number, 'N01-23-456789')
+        self.assertEqual(vehicle.current_mileage, 12000)
+        self.assertEqual(vehicle.plate_number_normalized, 'ABC1234')
+
+        # The same data as CSV, plates written differently: matched, nothing to change
+        rows = self.vehicle_rows()
+        rows[0][0], rows[1][0] = 'abc-1234', 'XYZ 987'
+        rows[0][5], rows[1][5] = '01/15/2020', '2021-06-01'
+        result = import_vehicles(csv_file(VEHICLE_HEADER, rows), 'fleet.csv', user=self.user)
+        self.assertEqual((result.created, result.updated, result.unchanged), (0, 0, 2), result.errors)
+        self.assertEqual(Vehicle.objects.count(), 2)
+
+    def test_reimport_updates_only_non_blank_cells(self):
+        import_vehicles(csv_file(VEHICLE_HEADER, self.vehicle_rows()), 'fleet.csv')
+        result = import_vehicles(
+            csv_file(['Plate', 'Mileage', 'Brand'], [['ABC1234', '15,500', '']]), 'fleet.csv',
+        )
+        self.assertEqual((result.created, result.updated), (0, 1), result.errors)
+        vehicle = Vehicle.objects.get(plate_number='ABC 1234')
+        self.assertEqual(vehicle.current_mileage, 15500)
+        self.assertEqual(vehicle.brand, 'Toyota')
+        self.assertEqual(vehicle.division.name, 'Motor Pool')
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        rows = self.vehicle_rows() + [
+            ['ABC-1234', 'SEDAN', 'Toyota', 'Vios', 2020, '2020-01-15', '', '', ''],
+            ['NEW 1', 'SEDAN', 'Toyota', 'Vios', 2020, '2020-01-15', 'Nowhere', '', ''],
+            ['', 'SEDAN', 'Toyota', 'Vios', 2020, '2020-01-15', '', '', ''],
+        ]
+        result = import_vehicles(csv_file(VEHICLE_HEADER, rows), 'fleet.csv')
+        self.assertEqual(result.created, 2)
+        self.assertEqual(result.skipped, 3)
+        self.assertEqual(sorted(line for line, _ in result.errors), [4, 5, 6])
+        self.assertIn((4, 'Plate Number: ABC-1234 is already on line 2.'), result.errors)
+        self.assertFalse(Vehicle.objects.filter(plate_number='NEW 1').exists())
+
+    def test_dry_run_writes_nothing(self):
+        result = import_vehicles(csv_file(VEHICLE_HEADER, self.vehicle_rows()), 'fleet.csv', dry_run=True)
+        self.assertEqual(result.created, 2)
+        self.assertFalse(Vehicle.objects.exists())
+
+    def test_imported_status_overrides_the_engine_unless_it_agrees(self):
+        header = VEHICLE_HEADER + ['Status']
+        rows = [row + [status] for row, status in zip(self.vehicle_rows(), ['Unserviceable', 'Serviceable'])]
+        import_vehicles(csv_file(header, rows), 'fleet.csv', user=self.user)
+
+        manual = Vehicle.objects.get(plate_number='ABC 1234')
+        self.assertEqual(manual.status, 'Unserviceable')
+        self.assertTrue(manual.status_override)
+        self.assertEqual(manual.status_change_reason, IMPORT_STATUS_REASON)
+        self.assertEqual(manual.status_changed_by, self.user)
+        self.assertFalse(Vehicle.objects.get(plate_number='XYZ-987').status_override)
+
+        recompute_statuses()
+        self.assertEqual(Vehicle.objects.get(pk=manual.pk).status, 'Unserviceable')
+
+    def test_drivers_keyed_on_license_number(self):
+        header = ['License Number', 'Name', 'Mobile']
+        result = import_drivers(csv_file(header, [['n01 23 456789', 'Juan Dela Cruz', '0917'], ['D02', 'Ana Reyes', '']]), 'drivers.csv')
+        self.assertEqual((result.created, result.updated), (1, 1), result.errors)
+        self.assertEqual(Driver.objects.get(license_number='N01-23-456789').phone, '0917')
+
+        result = import_drivers(csv_file(header, [['D02', 'Ana Reyes', '']]), 'drivers.csv')
+        self.assertEqual((result.created, result.updated, result.unchanged), (0, 0, 1))
+
+
+
+FUEL_HEADER = ['Card Number', 'Transaction Date', 'Station', 'Liters', 'Amount', 'Reference']
+
+
+class FuelImportTests(TestCase):
+    """Fuel card statements: idempotent re-imports and the monthly rollups"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vehicle = make_vehicle('FUL 100', fleet_card_number='7001-0002-0003')
+        cls.other = make_vehicle('FUL 200')
+
+    def statement(self):
+        return csv_file(FUEL_HEADER, [
+            ['7001 0002 0003', '2026-03-05 08:30', 'Petron EDSA', '25.5', '1,500.00', 'R1'],
+            ['70010002 0003', '2026-03-20 17:10', 'Shell C5', '10', '600.00', 'R2'],
+            ['7001-0002-0003', '2026-04-02 07:00', 'Petron EDSA', '30', '1,800.00', 'R3'],
+            ['9999-0000', '2026-03-07 12:00', 'Caltex', '12', '720.00', 'R4'],
+        ])
+
+    def rollups(self, vehicle):
+        return list(
+            FuelMonthlyRollup.objects.filter(vehicle=vehicle).order_by('month')
+            .values_list('month', 'transactions', 'liters', 'amount')
+        )
+
+    def test_reimport_adds_nothing(self):
+        result = import_fuel_statement(self.statement(), 'fuel.csv')
+        self.assertEqual((result.created, result.unmatched, result.error_count), (4, 1, 0), result.errors)
+        self.assertEqual(result.unknown, {'9999-0000': 1})
+        expected = [
+            (date(2026, 3, 1), 2, Decimal('35.500'), Decimal('2100.00')),
+            (date(2026, 4, 1), 1, Decimal('30.000'), Decimal('1800.00')),
+        ]
+        self.assertEqual(self.rollups(self.vehicle), expected)
+
+        result = import_fuel_statement(self.statement(), 'fuel.csv')
+        self.assertEqual((result.created, result.updated, result.unchanged), (0, 0, 4))
+        self.assertEqual(FuelTransaction.objects.count(), 4)
+        self.assertEqual(self.rollups(self.vehicle), expected)
+
+    def test_unknown_card_is_linked_on_reimport(self):
+        import_fuel_statement(self.statement(), 'fuel.csv')
+        self.other.fleet_card_number = '9999 0000'
+        self.other.save()
+
+        result = import_fuel_statement(self.statement(), 'fuel.csv')
+        self.assertEqual((result.created, result.updated, result.unchanged), (0, 1, 3))
+        self.assertEqual(self.rollups(self.other), [(date(2026, 3, 1), 1, Decimal('12.000'), Decimal('720.00'))])
+
+    def test_bad_rows_are_reported(self):
+        statement = csv_file(FUEL_HEADER, [
+            ['7001-0002-0003', 'yesterday', '', '', '100', ''],
+            ['7001-0002-0003', '2026-03-05 08:30', '', '', '', ''],
+            ['', '2026-03-05 08:30', '', '', '100', ''],
+        ])
+        result = import_fuel_statement(statement, 'fuel.csv')
+        self.assertEqual((result.created, result.skipped), (0, 3))
+        self.assertEqual(sorted(line for line, _ in result.errors), [2, 3, 4])
+
+    def test_rebuild_restores_rollups(self):
+        import_fuel_statement(self.statement(), 'fuel.csv')
+        expected = self.rollups(self.vehicle)
+        FuelMonthlyRollup.objects.filter(month=date(2026, 3, 1)).delete()
+        FuelMonthlyRollup.objects.filter(month=date(2026, 4, 1)).update(amount=0)
+        FuelMonthlyRollup.objects.create(vehicle=self.other, month=date(2026, 1, 1), transactions=9, amount=99)
+
+        rebuild_fuel_rollups()
+        self.assertEqual(self.rollups(self.vehicle), expected)
+        self.assertEqual(self.rollups(self.other), [])
+
+    def test_report_export_reads_the_rollups(self):
+        import_fuel_statement(self.statement(), 'fuel.csv')
+        self.client.force_login(CustomUser.objects.create_superuser(username='reports', password='x', email='r@example.com'))
+        response = self.client.get(reverse('report_export', args=['csv']), {'report': 'fuel_vehicles', 'year': 2026})
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['Plate Number', 'Vehicle', 'Division'])
+        cells = lines[1].split(',')
+        self.assertEqual(cells[:4], ['FUL 100', 'Toyota Vios', '', '3'])
+        self.assertEqual([Decimal(cell) for cell in cells[4:]], [Decimal('65.5'), Decimal('3900'), 0, Decimal('3900')])
+
+        response = self.client.get(reverse('report_export', args=['xlsx']), {'report': 'fuel_vehicles', 'year': 2026})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="fuel-costs-vehicles-2026.xlsx"')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+
+
+
+
+TOLL_HEADER = ['Tag Number', 'Transaction Date', 'Entry Plaza', 'Exit Plaza', 'Amount', 'Reference']
+
+
+class TollImportTests(TestCase):
+    """RFID toll statements: idempotent re-imports and the monthly rollups"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vehicle = make_vehicle('TOL 100', rfid_autosweep_number='AS-100-200', rfid_easytrip_number='ET 555')
+
+    def statement(self, *extra):
+        return csv_file(TOLL_HEADER, [
+            ['AS100200', '2026-03-05 08:30', 'Magallanes', 'Calamba', '245.00', 'T1'],
+            ['ET-555', '03/06/2026 18:00', 'Balintawak', 'Sta. Rita', '1,102.00', 'T2'],
+            ['ET-555', '03/06/2026 18:00', 'Balintawak', 'Sta. Rita', '1,102.00', 'T2'],
+            ['UNKNOWN 1', '2026-03-07 09:00', 'Alabang', 'Sucat', '50.00', 'T3'],
+            *extra,
+        ])
+
+    def test_reimport_adds_nothing(self):
+        result = import_toll_statement(self.statement(), 'tolls.csv')
+        # The repeated line counts as already imported
+        self.assertEqual((result.created, result.unchanged, result.unmatched), (3, 1, 1), result.errors)
+        self.assertEqual(
+            dict(TollTransaction.objects.filter(vehicle=self.vehicle).values_list('reference', 'provider')),
+            {'T1': 'autosweep', 'T2': 'easytrip'},
+        )
+        rollups = list(TollMonthlyRollup.objects.values_list('vehicle', 'month', 'transactions', 'amount'))
+        self.assertEqual(rollups, [(self.vehicle.pk, date(2026, 3, 1), 2, Decimal('1347.00'))])
+
+        result = import_toll_statement(self.statement(), 'tolls.csv')
+        self.assertEqual((result.created, result.updated, result.unchanged), (0, 0, 4))
+        self.assertEqual(TollTransaction.objects.count(), 3)
+        self.assertEqual(list(TollMonthlyRollup.objects.values_list('vehicle', 'month', 'transactions', 'amount')), rollups)
+
+    def test_unknown_tag_is_linked_on_reimport(self):
+        import_toll_statement(self.statement(), 'tolls.csv')
+        other = make_vehicle('TOL 200', rfid_easytrip_number='unknown-1')
+        result = import_toll_statement(self.statement(), 'tolls.csv')
+        self.assertEqual((result.created, result.updated), (0, 1))
+        self.assertEqual(TollTransaction.objects.get(reference='T3').provider, 'easytrip')
+        self.assertEqual(TollMonthlyRollup.objects.get(vehicle=other).amount, Decimal('50.00'))
+
+    def test_bad_rows_are_reported(self):
+        result = import_toll_statement(self.statement(
+            ['AS100200', '2026-03-08 10:00', 'Magallanes', 'Calamba', '123456789012', 'T4'],
+            ['AS100200', '', 'Magallanes', 'Calamba', '10.00', 'T5'],
+        ), 'tolls.csv')
+        self.assertEqual((result.created, result.skipped), (3, 2))
+        self.assertIn((6, 'Amount: "123456789012" is too large.'), result.errors)
+        self.assertIn((7, 'Date is required.'), result.errors)
+
+    def test_missing_column_rejects_the_file(self):
+        with self.assertRaisesMessage(ValidationError, 'The statement has no amount column.'):
+            import_toll_statement(csv_file(['Tag Number', 'Date'], [['AS100200', '2026-03-05']]), 'tolls.csv')
+        self.assertFalse(TollTransaction.objects.exists())
+
+
+
+    def test_rebuild_command_restores_rollups(self):
+        import_toll_statement(self.statement(), 'tolls.csv')
+        expected = list(TollMonthlyRollup.objects.values_list('vehicle', 'month', 'transactions', 'amount'))
+        TollMonthlyRollup.objects.update(amount=0)
 
-# Create your tests here.
+        call_command('rebuild_toll_rollups', stdout=io.StringIO())
+        self.assertEqual(list(TollMonthlyRollup.objects.values_list('vehicle', 'month', 'transactions', 'amount')), expected)
@@ -0,0 +1,169 @@
+"""
+Fixed-size thumbnails for uploaded vehicle and inspection images.
+
+Each image gets one derivative per size in SIZES, stored next to the original
+in a .thumbs directory (vehicles/photos/car.jpg ->
+vehicles/photos/.thumbs/car.jpg.small.webp), so the path of a thumbnail
+follows from the path of its original, and back, and nothing extra is stored
+in the database. The original's extension stays in the name so car.jpg and
+car.png do not share thumbnails.
+Thumbnails are WebP when Pillow supports it, JPEG otherwise.
+
+Uploads schedule their thumbnails through core.storage.schedule_processing(),
+which normalizes the images first; the work runs in a small thread pool after the transaction commits, so the request returns
+as soon as the originals are stored. Until a thumbnail exists, the
+{% thumbnail_url %} tag falls back to the original.
+"""
+import io
+import logging
+import os
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Bounding boxes (width, height); images are scaled down to fit, never up
+SIZES = {
+    'small': (160, 120),   # list rows
+    'medium': (480, 360),  # cards and galleries
+    'large': (1280, 960),  # detail carousels
+}
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp'}
+
+THUMBNAIL_DIR = '.thumbs'
+
+if features.check('webp'):
+    FORMAT, EXTENSION, SAVE_OPTIONS = 'WEBP', '.webp', {'quality': 80, 'method': 4}
+else:
+    FORMAT, EXTENSION, SAVE_OPTIONS = 'JPEG', '.jpg', {'quality': 80, 'optimize': True}
+
+# Attachment kinds that may hold images (registration documents are scans and PDFs)
+IMAGE_KINDS = ['photos', 'driver_report_attachments', 'replaced_parts_images']
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def is_image(path):
+    return os.path.splitext(str(path))[1].lower() in IMAGE_EXTENSIONS
+
+
+def thumbnail_path(path, size):
+    """Storage path of the `size` thumbnail of the image at `path`"""
+    directory, name = posixpath.split(str(path))
+    return posixpath.join(directory, THUMBNAIL_DIR, f'{name}.{size}{EXTENSION}')
+
+
+def thumbnail_original(path):
+    """Storage path of the original a thumbnail path was made from, or None if `path` is no thumbnail"""
+    directory, name = posixpath.split(str(path))
+    if posixpath.basename(directory) != THUMBNAIL_DIR or name.count('.') < 3:
+        return None
+    return posixpath.join(posixpath.dirname(directory), name.rsplit('.', 2)[0])
+
+
+def generate_thumbnails(path, force=False, storage=None):
+    """Write every missing thumbnail of `path`; returns how many were written"""
+    storage = storage or default_storage
+    targets = [(size, thumbnail_path(path, size)) for size in SIZES]
+    if not force:
+        targets = [(size, target) for size, target in targets if not storage.exists(target)]
+    if not targets or not is_image(path) or not storage.exists(path):
+        return 0
+
+    with storage.open(path, 'rb') as source:
+        image = Image.open(source)
+        # Draft mode lets the JPEG decoder skip most of the work for big downscales
+        # (square box: the EXIF rotation below may swap width and height)
+        longest = max(max(box) for box in SIZES.values())
+        image.draft('RGB', (longest, longest))
+        # Phone photos are often stored sideways with an EXIF orientation tag
+        image = ImageOps.exif_transpose(image)
+        if FORMAT == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+
+        written = 0
+        for size, target in targets:
+            thumb = image.copy()
+            thumb.thumbnail(SIZES[size], Image.LANCZOS)
+            buffer = io.BytesIO()
+            thumb.save(buffer, FORMAT, **SAVE_OPTIONS)
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(buffer.getvalue()))
+            written += 1
+    return written
+
+
+def delete_thumbnails(path, storage=None):
+    """Remove the thumbnails of an image that is being deleted"""
+    storage = storage or default_storage
+    for size in SIZES:
+        target = thumbnail_path(path, size)
+        try:
+            if storage.exists(target):
+                storage.delete(target)
+        except OSError as e:
+            logger.warning(f"Could not delete thumbnail {target}: {e}")
+
+
+def uploaded_image_paths():
+    """Every image path listed as an Attachment of IMAGE_KINDS, streamed in chunks"""
+    from django.apps import apps
+
+    attachments = apps.get_model('core', 'Attachment').objects.filter(kind__in=IMAGE_KINDS)
+    for path in attachments.order_by().values_list('path', flat=True).iterator(chunk_size=5000):
+        if is_image(path):
+            yield path
+
+
+def _safe_generate(path, prepare=None):
+    try:
+        if prepare is not None:
+            path = prepare(path)
+        return generate_thumbnails(path)
+    except Exception as e:
+        # A corrupt or unsupported upload must never break anything else
+        logger.warning(f"Thumbnail generation failed for {path}: {e}")
+        return 0
+    finally:
+        if prepare is not None:
+            # prepare() may have queried the database from this worker thread
+            connection.close()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def schedule_thumbnails(paths, prepare=None):
+    """
+    Generate thumbnails for the image paths in a worker thread once the
+    current transaction commits. `prepare`, when given, is called with each
+    path first and returns the path to generate them for.
+    """
+    images = [path for path in paths or [] if path and is_image(path)]
+    if not images:
+        return
+
+    def submit():
+        executor = _get_executor()
+        for path in images:
+            executor.submit(_safe_generate, path, prepare)
+
+    transaction.on_commit(submit)
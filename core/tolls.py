@@ -0,0 +1,264 @@
+"""
+RFID toll statements: TollTransaction rows and their monthly rollups.
+
+import_toll_statement() streams an Autosweep or Easytrip statement
+(core.importers) a batch at a time. Tags are matched to vehicles through a
+dict of the normalized RFID numbers loaded once, each batch is checked
+against the stored fingerprints with one query, and the new rows are written
+with a single multi-row INSERT that skips fingerprints already stored.
+Statements run to hundreds of thousands of rows a month, so rows never
+become model instances: building and preparing a TollTransaction per row
+costs more than parsing the file.
+
+TollMonthlyRollup is then rebuilt for the vehicle-months the committed
+batches touched, also when a later batch fails; the reports sum it per
+vehicle, division and month. rebuild_toll_rollups rebuilds them all.
+
+Charges on a tag no vehicle carries are stored without a vehicle and listed
+in the result. Importing the statement again after the tag is recorded on
+the vehicle links them.
+"""
+import hashlib
+from collections import defaultdict
+from decimal import Decimal
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.db.models.constants import OnConflict
+
+from .fuel import rebuild_rollups, rollup_pairs
+from .importers import DateTimeParser, StatementResult, batched, parse_decimal, read_rows
+from .models import TollMonthlyRollup, TollTransaction, Vehicle, normalize_identifier
+
+BATCH_SIZE = 5000
+MAX_AMOUNT = Decimal('99999999.99')  # TollTransaction.amount is DECIMAL(10, 2)
+
+# Statement column -> the headers toll operators use for it
+COLUMNS = {
+    'tag_number': ('tag_number', 'tag_no', 'tag', 'tag_id', 'rfid', 'rfid_number', 'rfid_no', 'rfid_tag', 'account_tag', 'sticker_no'),
+    'provider': ('provider', 'operator', 'toll_operator', 'tag_type', 'rfid_type'),
+    'date': ('transaction_date', 'date', 'trans_date', 'date_time', 'transaction_date_time', 'datetime', 'exit_date', 'exit_date_time'),
+    'time': ('transaction_time', 'time', 'trans_time', 'exit_time'),
+    'entry_plaza': ('entry_plaza', 'entry', 'entry_point', 'entry_toll_plaza', 'origin'),
+    'exit_plaza': ('exit_plaza', 'exit', 'exit_point', 'exit_toll_plaza', 'plaza', 'toll_plaza', 'destination'),
+    'amount': ('amount', 'toll', 'toll_fee', 'toll_amount', 'fee', 'debit', 'total', 'total_amount'),
+    'reference': ('reference', 'reference_no', 'reference_number', 'transaction_id', 'transaction_no', 'trans_id', 'receipt_no'),
+}
+REQUIRED_COLUMNS = ('tag_number', 'date', 'amount')
+_HEADERS = {header: column for column, headers in COLUMNS.items() for header in headers}
+
+# Words in a provider cell -> TollTransaction.provider
+_PROVIDERS = {
+    'autosweep': 'autosweep', 'smc': 'autosweep', 'skyway': 'autosweep', 'slex': 'autosweep',
+    'easytrip': 'easytrip', 'mptc': 'easytrip', 'nlex': 'easytrip', 'cavitex': 'easytrip',
+}
+_TAG_FIELDS = (
+    ('rfid_autosweep_number_normalized', 'autosweep'),
+    ('rfid_easytrip_number_normalized', 'easytrip'),
+)
+# Column order of the rows passed to _insert()
+INSERT_FIELDS = (
+    'vehicle', 'provider', 'tag_number_normalized', 'transaction_at', 'month',
+    'entry_plaza', 'exit_plaza', 'amount', 'reference', 'fingerprint',
+)
+
+
+def tag_index():
+    """Normalized RFID tag -> (vehicle id, provider); a tag recorded on two vehicles matches neither"""
+    index = {}
+    for field, provider in _TAG_FIELDS:
+        for vehicle_id, tag in Vehicle.objects.exclude(**{field: ''}).values_list('pk', field):
+            index[tag] = (None, provider) if tag in index else (vehicle_id, provider)
+    return index
+
+
+@lru_cache(maxsize=256)
+def parse_provider(text):
+    """'AUTOSWEEP RFID', 'Easytrip' or 'NLEX' -> a TollTransaction.provider value; '' if unrecognised"""
+    key = normalize_identifier(text).lower()
+    for word, provider in _PROVIDERS.items():
+        if word in key:
+            return provider
+    return ''
+
+
+def fingerprint(tag, transaction_at, entry_plaza, exit_plaza, amount, reference):
+    """Identity of a statement row, so the same statement imported twice adds nothing"""
+    key = '|'.join([tag, transaction_at.isoformat(), entry_plaza, exit_plaza, str(amount), reference])
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _parse(row, dates, errors):
+    """TollTransaction fields for a statement row; problems are appended to errors"""
+    values = {'tag_number_normalized': normalize_identifier(row.get('tag_number', ''))[:100]}
+    if not values['tag_number_normalized']:
+        errors.append('Tag number is required.')
+
+    try:
+        moment = row.get('date', '')
+        if row.get('time') and len(moment) <= 10:
+            moment = f"{moment} {row['time']}"
+        values['transaction_at'] = dates.parse(moment)
+        values['month'] = values['transaction_at'].date().replace(day=1)
+    except ValueError as e:
+        errors.append(f'Date: {e}.' if row.get('date') else 'Date is required.')
+
+    amount = row.get('amount', '')
+    try:
+        values['amount'] = parse_decimal(amount).quantize(Decimal('0.01'))
+    except (ValueError, ArithmeticError) as e:
+        errors.append(f'Amount: {e}.' if amount else 'Amount is required.')
+    else:
+        # Checked here: MySQL's INSERT IGNORE would clamp it to the column's range instead of failing
+        if abs(values['amount']) > MAX_AMOUNT:
+            errors.append(f'Amount: "{amount}" is too large.')
+
+    values['provider'] = parse_provider(row.get('provider', ''))
+    values['entry_plaza'] = row.get('entry_plaza', '')[:100]
+    values['exit_plaza'] = row.get('exit_plaza', '')[:100]
+    values['reference'] = row.get('reference', '')[:50]
+    return values
+
+
+def _insert(rows):
+    """
+    Insert rows (tuples in INSERT_FIELDS order) in one statement, skipping
+    fingerprints already stored; returns the number of rows inserted.
+
+    IGNORE also lets MySQL skip a row it would otherwise reject (a vehicle
+    deleted meanwhile), so the caller compares the count with len(rows).
+    """
+    if not rows:
+        return 0
+    ops = connection.ops
+    meta = TollTransaction._meta
+    columns = ', '.join(ops.quote_name(meta.get_field(name).column) for name in INSERT_FIELDS)
+    placeholders = ', '.join(['%s'] * len(INSERT_FIELDS))
+    # A plain INSERT ... VALUES (...) shape, which MySQLdb's executemany sends as one multi-row INSERT
+    sql = (
+        f'{ops.insert_statement(on_conflict=OnConflict.IGNORE)} {ops.quote_name(meta.db_table)} '
+        f'({columns}) VALUES ({placeholders}) '
+        f'{ops.on_conflict_suffix_sql([], OnConflict.IGNORE, None, None)}'
+    ).strip()
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (
+                vehicle_id, provider, tag, ops.adapt_datetimefield_value(transaction_at),
+                ops.adapt_datefield_value(month), entry_plaza, exit_plaza,
+                ops.adapt_decimalfield_value(amount, 10, 2), reference, key,
+            )
+            for vehicle_id, provider, tag, transaction_at, month, entry_plaza, exit_plaza, amount, reference, key in rows
+        ])
+        return cursor.rowcount
+
+
+def _account_skipped(rows, inserted, parsed, result):
+    """
+    Sort out the rows _insert() skipped: those a concurrent import stored
+    first count as already imported, the rest are reported as errors
+    """
+    keys = [row[-1] for row in rows]
+    stored = set(TollTransaction.objects.filter(fingerprint__in=keys).values_list('fingerprint', flat=True))
+    result.created -= len(rows) - inserted
+    result.unchanged += len(stored) - inserted
+    for key in keys:
+        if key not in stored:
+            result.add_error(parsed[key][2], 'The database rejected this row; it was not imported.')
+
+
+def refresh_rollups(pairs):
+    """Rebuild TollMonthlyRollup for (vehicle id, month) pairs from their transactions"""
+    rebuild_rollups(TollTransaction, TollMonthlyRollup, pairs, amount=Sum('amount'))
+
+
+def rebuild_all_rollups():
+    """Rebuild every TollMonthlyRollup; returns the number of vehicle-months checked"""
+    pairs = rollup_pairs(TollTransaction, TollMonthlyRollup)
+    refresh_rollups(pairs)
+    return len(pairs)
+
+
+def import_toll_statement(file, filename, user=None, dry_run=False, batch_size=BATCH_SIZE):
+    """
+    Add the charges of an Autosweep or Easytrip statement; returns a
+    StatementResult. `user` is accepted like the other importers but not
+    stored per row (the upload view logs the import).
+    """
+    result = StatementResult(dry_run)
+    tags = tag_index()
+    dates = DateTimeParser()
+    checked_header = False
+
+    stale = set()  # (vehicle id, month) pairs of committed batches
+    try:
+        for batch in batched(read_rows(file, filename), batch_size):
+            result.rows += len(batch)
+            parsed = {}  # fingerprint -> (row for _insert, tag as written, line)
+            for line, raw in batch:
+                row = {_HEADERS[header]: value for header, value in raw.items() if header in _HEADERS}
+                if not checked_header:
+                    missing = [column for column in REQUIRED_COLUMNS if column not in row]
+                    if missing:
+                        labels = ', '.join(column.replace('_', ' ') for column in missing)
+                        raise ValidationError(f'The statement has no {labels} column.')
+                    checked_header = True
+                errors = []
+                values = _parse(row, dates, errors)
+                if errors:
+                    for message in errors:
+                        result.add_error(line, message)
+                    continue
+                tag = values['tag_number_normalized']
+                key = fingerprint(
+                    tag, values['transaction_at'], values['entry_plaza'], values['exit_plaza'],
+                    values['amount'], values['reference'],
+                )
+                if key in parsed:
+                    result.unchanged += 1
+                    continue
+                vehicle_id, provider = tags.get(tag, (None, ''))
+                parsed[key] = ((
+                    vehicle_id, values['provider'] or provider, tag, values['transaction_at'], values['month'],
+                    values['entry_plaza'], values['exit_plaza'], values['amount'], values['reference'], key,
+                ), row['tag_number'], line)
+
+            stored = dict(
+                TollTransaction.objects.filter(fingerprint__in=list(parsed)).values_list('fingerprint', 'vehicle_id')
+            )
+            to_create, relink = [], defaultdict(list)
+            touched = set()  # (vehicle id, month) pairs whose rollups the batch makes stale
+            for key, (values, tag_as_written, _) in parsed.items():
+                vehicle_id, provider, month = values[0], values[1], values[4]
+                if key not in stored:
+                    to_create.append(values)
+                    if vehicle_id is None:
+                        result.add_unknown(tag_as_written)
+                elif stored[key] is None and vehicle_id is not None:
+                    # Imported before the tag was recorded on its vehicle
+                    relink[vehicle_id, provider].append(key)
+                else:
+                    result.unchanged += 1
+                    continue
+                if vehicle_id is not None:
+                    touched.add((vehicle_id, month))
+            result.created += len(to_create)
+            result.updated += sum(len(keys) for keys in relink.values())
+            if dry_run:
+                continue
+
+            with transaction.atomic():
+                inserted = _insert(to_create)
+                if inserted < len(to_create):
+                    _account_skipped(to_create, inserted, parsed, result)
+                for (vehicle_id, provider), keys in relink.items():
+                    TollTransaction.objects.filter(fingerprint__in=keys, vehicle__isnull=True).update(
+                        vehicle_id=vehicle_id, provider=provider,
+                    )
+            stale |= touched
+    finally:
+        # Also when a later batch fails: rows already committed must reach the rollups
+        if stale:
+            refresh_rollups(stale)
+    return result
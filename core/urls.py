@@ -42,11 +42,15 @@ urlpatterns = [
     path('vehicles/<int:pk>/edit/', views.vehicle_edit, name='vehicle_edit'),
     path('vehicles/<int:pk>/delete/', views.vehicle_delete, name='vehicle_delete'),
     path('vehicles/<int:pk>/status-change/', views.vehicle_status_change, name='vehicle_status_change'),
+    path('vehicles/<int:pk>/dossier/', views.vehicle_dossier, name='vehicle_dossier'),
+    path('dossier/', views.fleet_dossier, name='fleet_dossier'),
+    path('import/', views.fleet_import, name='fleet_import'),
     
     # Repair URLs
     path('repairs/', views.repair_list, name='repair_list'),
     path('repairs/<int:pk>/', views.repair_detail, name='repair_detail'),
     path('repairs/add/', views.repair_create, name='repair_create'),
+    path('repairs/export/<str:fmt>/', views.repair_export, name='repair_export'),
     path('repairs/<int:pk>/edit/', views.repair_edit, name='repair_edit'),
     path('repairs/<int:pk>/delete/', views.repair_delete, name='repair_delete'),
     path('repairs/<int:pk>/complete/', views.repair_complete, name='repair_complete'),
@@ -55,6 +59,7 @@ urlpatterns = [
     path('pms/', views.pms_list, name='pms_list'),
     path('pms/<int:pk>/', views.pms_detail, name='pms_detail'),
     path('pms/add/', views.pms_create, name='pms_create'),
+    path('pms/export/<str:fmt>/', views.pms_export, name='pms_export'),
     path('pms/<int:pk>/edit/', views.pms_edit, name='pms_edit'),
     path('pms/<int:pk>/delete/', views.pms_delete, name='pms_delete'),
     path('pms/<int:pk>/complete/', views.pms_complete, name='pms_complete'),
@@ -64,12 +69,16 @@ urlpatterns = [
     
     # Reports
     path('reports/', views.reports, name='reports'),
+    path('reports/export/<str:fmt>/', views.report_export, name='report_export'),
     
     # Notifications
     path('notifications/', views.notifications, name='notifications'),
     path('notifications/<int:notification_id>/mark-read/', views.mark_notification_read, name='mark_notification_read'),
     path('notifications/mark-all-read/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
     
+    # Global Search
+    path('search/', views.global_search, name='global_search'),
+    
     # System Manual
     path('manual/', views.system_manual, name='system_manual'),
     
@@ -92,4 +101,13 @@ urlpatterns = [
     
     # AJAX endpoints
     path('api/pre-inspections-by-vehicle/', views.get_pre_inspections_by_vehicle, name='get_pre_inspections_by_vehicle'),
+    path('api/search/', views.search_api, name='search_api'),
+    path('api/vehicles/lookup/', views.vehicle_lookup, name='vehicle_lookup'),
+    path('api/vehicles/choices/', views.vehicle_choices, name='vehicle_choices'),
+    
+    # Chunked uploads (inspection attachments)
+    path('api/uploads/', views.upload_session_create, name='upload_session_create'),
+    path('api/uploads/<str:token>/', views.upload_session_status, name='upload_session_status'),
+    path('api/uploads/<str:token>/chunk/', views.upload_session_chunk, name='upload_session_chunk'),
+    path('api/uploads/<str:token>/complete/', views.upload_session_complete, name='upload_session_complete'),
 ]
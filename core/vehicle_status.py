@@ -0,0 +1,122 @@
+"""
+Vehicle status engine.
+
+A vehicle's status is derived from its aggregate maintenance state, in order:
+  1. status_override (set by a manual status change) -> status is left alone
+  2. completed repair costs (parts + labor) >= half the current market value -> For Disposal
+  3. an ongoing repair or a PMS in progress -> Under Repair
+  4. otherwise -> Serviceable
+
+The derivation is a single SQL CASE over correlated subqueries and is applied
+with one conditional UPDATE, so a concurrent repair/PMS write can never slip
+between reading the state and writing the status.
+"""
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, Exists, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThanOrEqual
+from django.utils import timezone
+
+from .models import PMS, Repair, Vehicle
+
+FOR_DISPOSAL = 'For Disposal'
+UNDER_REPAIR = 'Under Repair'
+SERVICEABLE = 'Serviceable'
+
+# status_change_reason written with each automatic transition
+REASONS = {
+    FOR_DISPOSAL: 'Vehicle marked for disposal: total completed repair costs reached half of the current market value',
+    UNDER_REPAIR: 'Repair ongoing or PMS in progress',
+    SERVICEABLE: 'All repairs and PMS completed',
+}
+
+
+def _completed_repair_cost():
+    totals = (
+        Repair.objects.filter(vehicle=OuterRef('pk'), status='Completed')
+        .order_by().values('vehicle')
+        .annotate(total=Sum(F('cost') + Coalesce('labor_cost', Value(Decimal('0')))))
+        .values('total')
+    )
+    return Coalesce(
+        Subquery(totals), Value(Decimal('0')),
+        output_field=DecimalField(max_digits=15, decimal_places=2),
+    )
+
+
+def _derived_case(values):
+    """CASE over the status rules, yielding values[status] for the matching rule"""
+    over_threshold = GreaterThanOrEqual(_completed_repair_cost(), F('current_market_value') / Value(Decimal('2')))
+    ongoing_repair = Exists(Repair.objects.filter(vehicle=OuterRef('pk'), status='Ongoing'))
+    pms_in_progress = Exists(PMS.objects.filter(vehicle=OuterRef('pk'), status='In Progress'))
+    return Case(
+        When(over_threshold, current_market_value__gt=0, then=Value(values[FOR_DISPOSAL])),
+        When(ongoing_repair, then=Value(values[UNDER_REPAIR])),
+        When(pms_in_progress, then=Value(values[UNDER_REPAIR])),
+        default=Value(values[SERVICEABLE]),
+    )
+
+
+def derived_status():
+    """Expression evaluating to the status a vehicle row should have"""
+    return _derived_case({status: status for status in REASONS})
+
+
+def with_derived_status(queryset=None):
+    """Annotate vehicles with derived_status (for previews and manual-change checks)"""
+    queryset = Vehicle.objects.all() if queryset is None else queryset
+    return queryset.annotate(derived_status=derived_status())
+
+
+def recompute_statuses(queryset=None):
+    """Apply the derived status to every non-overridden vehicle in queryset; returns rows changed"""
+    queryset = Vehicle.objects.all() if queryset is None else queryset
+    now = timezone.now()
+    return (
+        queryset.filter(status_override=False)
+        .exclude(status=derived_status())
+        .update(
+            status=derived_status(),
+            status_change_reason=_derived_case(REASONS),
+            status_changed_at=now,
+            status_changed_by=None,
+            updated_at=now,
+        )
+    )
+
+
+def sync_vehicle_status(vehicle):
+    """Recompute one vehicle after a repair/PMS write; refreshes the instance if it changed"""
+    if vehicle is None:
+        return False
+    changed = recompute_statuses(Vehicle.objects.filter(pk=vehicle.pk)) > 0
+    if changed:
+        vehicle.refresh_from_db(fields=['status', 'status_change_reason', 'status_changed_at', 'status_changed_by', 'updated_at'])
+    return changed
+
+
+def _derived_for(vehicle):
+    """The status the engine would give vehicle (a new vehicle has no repairs or PMS yet)"""
+    if vehicle.pk is None:
+        return SERVICEABLE
+    return with_derived_status(Vehicle.objects.filter(pk=vehicle.pk)).values_list('derived_status', flat=True).first()
+
+
+def apply_chosen_status(vehicle, user=None, reason=''):
+    """
+    For a status picked on the vehicle form: flag it as an override unless it
+    matches the derived status, and record the change. The caller saves.
+    """
+    vehicle.status_override = vehicle.status != _derived_for(vehicle)
+    vehicle.status_changed_at = timezone.now()
+    vehicle.status_changed_by = user
+    vehicle.status_change_reason = reason
+    return vehicle.status_override
+
+
+def set_manual_status(vehicle, new_status, user=None, reason=''):
+    """Manual status change; it overrides the engine unless it matches what the engine would derive"""
+    vehicle.status_override = new_status != _derived_for(vehicle)
+    vehicle.update_status(new_status, user=user, reason=reason)
+    return vehicle.status_override
@@ -7,17 +7,30 @@ from django.core.exceptions import ValidationError
 from django import forms
 import json
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import Sum, Count, Q, F, Value, DecimalField
+from django.db import transaction
+from django.db.models import Sum, Count, Q, F, Value, DecimalField, Prefetch
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 from datetime import datetime, timedelta
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth import get_user_model
 import json
-from .models import Vehicle, Repair, Driver, Division, ActivityLog, RepairShop, PMS, Notification, PreInspectionReport, PostInspectionReport
-from .forms import VehicleForm, RepairForm, DriverForm, DivisionForm, UserForm, RepairShopForm, RepairPartItemFormSet, PMSForm, PMSRepairPartItemFormSet, PreInspectionReportForm, PostInspectionReportForm
+from .models import Vehicle, Repair, Driver, Division, ActivityLog, RepairShop, PMS, Notification, PreInspectionReport, PostInspectionReport, Attachment, normalize_identifier
+from .forms import VehicleForm, RepairForm, DriverForm, DivisionForm, UserForm, RepairShopForm, RepairPartItemFormSet, PMSForm, PMSRepairPartItemFormSet, PreInspectionReportForm, PostInspectionReportForm, FleetImportForm
+from .search import DETAIL_URLS, search_grouped, search_ids
+from .pms_scheduler import ensure_overdue_marked
+from . import chunked_uploads
+from .dossier import dossier_entries, zip_stream
+from .exports import EXPORT_FORMATS, PMS_HEADER, REPAIR_HEADER, REPORTS, YEARLY_REPORTS, export_response, pms_rows, repair_rows
+from .fleet_import import (
+    DRIVER_IMPORT_COLUMNS, FUEL_IMPORT_COLUMNS, IMPORTERS, TOLL_IMPORT_COLUMNS, VEHICLE_IMPORT_COLUMNS,
+)
+from .media import can_view as can_view_media, media_response
+from .services import MAX_REPAIR_COST, create_pms, save_repair
+from .storage import release as release_media, schedule_processing, upload_storage
+from .vehicle_status import SERVICEABLE, apply_chosen_status, set_manual_status, sync_vehicle_status
 
 User = get_user_model()
 
@@ -70,61 +83,50 @@ def dashboard(request):
         today = timezone.now().date()
         one_month_from_now = today + relativedelta(months=1)
         
-        vehicles_near_pms = []
-        all_vehicles = Vehicle.objects.filter(status='Serviceable')
+        # Overdue is a status kept current by the throttled sweep; Scheduled records dated
+        # before today that the sweep has not reached yet count as overdue too
+        ensure_overdue_marked()
+        open_pms = (
+            PMS.objects.filter(vehicle__status='Serviceable')
+            .filter(Q(status='Overdue') | Q(status='Scheduled', scheduled_date__lte=one_month_from_now))
+            .select_related('vehicle')
+            .order_by('scheduled_date', 'pk')
+        )
+
+        def is_overdue(pms_record):
+            return pms_record.status == 'Overdue' or pms_record.scheduled_date < today
+
+        # Per vehicle: its earliest overdue PMS (highest priority), else its earliest upcoming one
+        pms_by_vehicle = {}
+        for pms_record in open_pms:
+            current = pms_by_vehicle.get(pms_record.vehicle_id)
+            if current is None or (is_overdue(pms_record) and not is_overdue(current)):
+                pms_by_vehicle[pms_record.vehicle_id] = pms_record
         
-        for vehicle in all_vehicles:
-            # Check for overdue PMS first (highest priority)
-            overdue_pms = PMS.objects.filter(
-                vehicle=vehicle,
-                status__in=['Scheduled', 'Overdue'],
-                scheduled_date__lt=today
-            ).order_by('scheduled_date').first()
-            
-            needs_pms = False
-            reason = ""
-            scheduled_date = None
+        vehicles_near_pms = []
+        for pms_record in pms_by_vehicle.values():
+            scheduled_date = pms_record.scheduled_date
             days_until = None
-            pms_record = None
-            
-            if overdue_pms:
-                # Found an overdue PMS - show this first (highest priority)
-                needs_pms = True
-                pms_record = overdue_pms
-                scheduled_date = overdue_pms.scheduled_date
-                days_overdue = (today - scheduled_date).days
+            if is_overdue(pms_record):
+                days_overdue = max((today - scheduled_date).days, 0)
                 reason = f"PMS overdue by {days_overdue} day{'s' if days_overdue != 1 else ''} ({scheduled_date.strftime('%b %d, %Y')})"
             else:
-                # Get upcoming scheduled PMS records that are within 1 month
-                upcoming_pms = PMS.objects.filter(
-                    vehicle=vehicle,
-                    status__in=['Scheduled', 'Overdue'],
-                    scheduled_date__gte=today,
-                    scheduled_date__lte=one_month_from_now
-                ).order_by('scheduled_date').first()
-                
-                if upcoming_pms:
-                    # Found a scheduled PMS within 1 month
-                    needs_pms = True
-                    pms_record = upcoming_pms
-                    scheduled_date = upcoming_pms.scheduled_date
-                    days_until = (scheduled_date - today).days
-                    if days_until == 0:
-                        reason = "PMS scheduled today"
-                    elif days_until == 1:
-                        reason = "PMS scheduled tomorrow"
-                    else:
-                        reason = f"PMS scheduled in {days_until} days ({scheduled_date.strftime('%b %d, %Y')})"
+                days_until = (scheduled_date - today).days
+                if days_until == 0:
+                    reason = "PMS scheduled today"
+                elif days_until == 1:
+                    reason = "PMS scheduled tomorrow"
+                else:
+                    reason = f"PMS scheduled in {days_until} days ({scheduled_date.strftime('%b %d, %Y')})"
             
-            if needs_pms:
-                vehicles_near_pms.append({
-                    'vehicle': vehicle,
-                    'reason': reason,
-                    'scheduled_date': scheduled_date,
-                    'days_until': days_until,
-                    'days_overdue': (today - scheduled_date).days if scheduled_date and scheduled_date < today else None,
-                    'pms_record': pms_record
-                })
+            vehicles_near_pms.append({
+                'vehicle': pms_record.vehicle,
+                'reason': reason,
+                'scheduled_date': scheduled_date,
+                'days_until': days_until,
+                'days_overdue': (today - scheduled_date).days if scheduled_date < today else None,
+                'pms_record': pms_record
+            })
         
         # Sort by urgency (overdue first, then by scheduled date - earliest first)
         vehicles_near_pms.sort(key=lambda x: (
@@ -190,19 +192,15 @@ def vehicle_list(request):
     if division_filter:
         vehicles = vehicles.filter(division_id=division_filter)
     if search_query:
-        vehicles = vehicles.filter(
-            Q(plate_number__icontains=search_query) |
-            Q(brand__icontains=search_query) |
-            Q(model__icontains=search_query)
-        )
-    
-    # Check and mark vehicles for disposal based on repair costs
-    for vehicle in vehicles:
-        if vehicle.current_market_value:  # Only check if current market value is set
-            vehicle.check_and_mark_for_disposal(user=request.user)
+        vehicles = vehicles.filter(pk__in=search_ids(search_query, 'vehicle'))
     
     divisions = Division.objects.all()
     
+    # Photo count and first thumbnail come from one prefetch of the photo Attachment rows
+    vehicles = vehicles.prefetch_related(
+        Prefetch('attachments', queryset=Attachment.objects.filter(kind='photos'))
+    )
+    
     # Prepare vehicle data with overuse information for template
     vehicle_data = []
     for vehicle in vehicles:
@@ -258,11 +256,14 @@ def vehicle_detail(request, pk):
     vehicle = get_object_or_404(Vehicle, pk=pk)
     repairs = vehicle.repairs.all()
     total_repair_cost = repairs.filter(status='Completed').aggregate(total=Sum('cost'))['total'] or 0
+    fuel_rollups = list(vehicle.fuel_rollups.all()[:12])
     
     context = {
         'vehicle': vehicle,
         'repairs': repairs,
         'total_repair_cost': total_repair_cost,
+        'fuel_rollups': fuel_rollups,
+        'total_fuel_cost': sum(rollup.amount for rollup in fuel_rollups),
     }
     
     return render(request, 'core/vehicle_detail.html', context)
@@ -284,12 +285,12 @@ def vehicle_create(request):
                 photos_list.extend([f for f in request.FILES.getlist('photo')])
             
             if photos_list:
-                from django.core.files.storage import default_storage
                 photo_paths = []
                 for photo in photos_list:
                     if photo:
-                        path = default_storage.save(f'vehicles/photos/{photo.name}', photo)
-                        photo_paths.append(path)
+                        path = upload_storage().save(f'vehicles/photos/{photo.name}', photo)
+                        if path not in photo_paths:
+                            photo_paths.append(path)
                 vehicle.photos = photo_paths
             
             # Handle multiple registration documents
@@ -301,15 +302,18 @@ def vehicle_create(request):
                 documents_list.extend([f for f in request.FILES.getlist('registration_document')])
             
             if documents_list:
-                from django.core.files.storage import default_storage
                 doc_paths = []
                 for doc in documents_list:
                     if doc:
-                        path = default_storage.save(f'documents/registration/{doc.name}', doc)
-                        doc_paths.append(path)
+                        path = upload_storage().save(f'documents/registration/{doc.name}', doc)
+                        if path not in doc_paths:
+                            doc_paths.append(path)
                 vehicle.registration_documents = doc_paths
             
+            if vehicle.status != SERVICEABLE:
+                apply_chosen_status(vehicle, user=request.user, reason='Set when the vehicle was added')
             vehicle.save()
+            schedule_processing(vehicle.photos)
             messages.success(request, 'Vehicle created successfully!')
             return redirect('vehicle_list')
     else:
@@ -330,10 +334,10 @@ def vehicle_edit(request, pk):
             existing_photos = vehicle.photos if vehicle.photos else []
             existing_documents = vehicle.registration_documents if vehicle.registration_documents else []
             
-            from django.core.files.storage import default_storage
-
             photo_paths = existing_photos.copy()
             document_paths = existing_documents.copy()
+            # Files are shared between records; they are released once this vehicle is saved
+            removed_paths = []
 
             # Handle removal of existing photos
             remove_photos = request.POST.getlist('remove_photos')
@@ -341,11 +345,7 @@ def vehicle_edit(request, pk):
                 for path in remove_photos:
                     if path in photo_paths:
                         photo_paths.remove(path)
-                        try:
-                            if default_storage.exists(path):
-                                default_storage.delete(path)
-                        except Exception:
-                            pass
+                        removed_paths.append(path)
 
             # Handle removal of existing documents
             remove_documents = request.POST.getlist('remove_documents')
@@ -353,11 +353,7 @@ def vehicle_edit(request, pk):
                 for path in remove_documents:
                     if path in document_paths:
                         document_paths.remove(path)
-                        try:
-                            if default_storage.exists(path):
-                                default_storage.delete(path)
-                        except Exception:
-                            pass
+                        removed_paths.append(path)
 
             # Handle multiple photos
             photos_list = []
@@ -367,11 +363,14 @@ def vehicle_edit(request, pk):
             if 'photo' in request.FILES:
                 photos_list.extend([f for f in request.FILES.getlist('photo')])
 
+            new_photo_paths = []
             if photos_list:
                 for photo in photos_list:
                     if photo:
-                        path = default_storage.save(f'vehicles/photos/{photo.name}', photo)
-                        photo_paths.append(path)
+                        path = upload_storage().save(f'vehicles/photos/{photo.name}', photo)
+                        if path not in photo_paths and path not in new_photo_paths:
+                            new_photo_paths.append(path)
+            photo_paths.extend(new_photo_paths)
 
             # Handle multiple registration documents
             documents_list = []
@@ -384,13 +383,21 @@ def vehicle_edit(request, pk):
             if documents_list:
                 for doc in documents_list:
                     if doc:
-                        path = default_storage.save(f'documents/registration/{doc.name}', doc)
-                        document_paths.append(path)
+                        path = upload_storage().save(f'documents/registration/{doc.name}', doc)
+                        if path not in document_paths:
+                            document_paths.append(path)
 
             vehicle.photos = photo_paths
             vehicle.registration_documents = document_paths
 
+            if 'status' in form.changed_data:
+                apply_chosen_status(vehicle, user=request.user, reason='Changed on the vehicle form')
             vehicle.save()
+            if 'current_market_value' in form.changed_data:
+                # The disposal threshold moved
+                sync_vehicle_status(vehicle)
+            release_media(removed_paths)
+            schedule_processing(new_photo_paths)
             messages.success(request, 'Vehicle updated successfully!')
             return redirect('vehicle_detail', pk=pk)
     else:
@@ -424,12 +431,18 @@ def vehicle_status_change(request, pk):
         
         if new_status in [choice[0] for choice in Vehicle.STATUS_CHOICES]:
             old_status = vehicle.status
-            vehicle.update_status(new_status, user=request.user, reason=reason)
+            overridden = set_manual_status(vehicle, new_status, user=request.user, reason=reason)
             
             messages.success(
                 request, 
                 f'Vehicle status changed from {old_status} to {new_status} successfully!'
             )
+            if overridden:
+                messages.info(
+                    request,
+                    'This status overrides the automatic status, which will no longer change until '
+                    'the status is set back to the one derived from repairs and PMS.'
+                )
             return redirect('vehicle_detail', pk=pk)
         else:
             messages.error(request, 'Invalid status selected.')
@@ -448,11 +461,17 @@ def repair_detail(request, pk):
     return render(request, 'core/repair_detail.html', {'repair': repair})
 
 
-@login_required
-def repair_list(request):
+def _selected_vehicle(vehicle_id):
+    """Vehicle currently picked in a list filter; other options load over AJAX"""
+    if not vehicle_id or not str(vehicle_id).isdigit():
+        return None
+    return Vehicle.objects.filter(pk=vehicle_id).only('id', 'plate_number', 'brand', 'model').first()
+
+
+def _filtered_repairs(request):
+    """Repairs matching the repair list's ?vehicle= and ?status= filters"""
     repairs = Repair.objects.all()
     
-    # Filtering
     vehicle_filter = request.GET.get('vehicle', '')
     status_filter = request.GET.get('status', '')
     
@@ -460,12 +479,16 @@ def repair_list(request):
         repairs = repairs.filter(vehicle_id=vehicle_filter)
     if status_filter:
         repairs = repairs.filter(status=status_filter)
-    
-    vehicles = Vehicle.objects.all()
+    return repairs, vehicle_filter, status_filter
+
+
+@login_required
+def repair_list(request):
+    repairs, vehicle_filter, status_filter = _filtered_repairs(request)
     
     context = {
         'repairs': repairs,
-        'vehicles': vehicles,
+        'selected_vehicle': _selected_vehicle(vehicle_filter),
         'vehicle_filter': vehicle_filter,
         'status_filter': status_filter,
     }
@@ -473,6 +496,16 @@ def repair_list(request):
     return render(request, 'core/repair_list.html', context)
 
 
+@login_required
+def repair_export(request, fmt):
+    """The repair list, with the same filters, as a streamed CSV or XLSX download"""
+    if fmt not in EXPORT_FORMATS:
+        raise Http404("Unknown export format")
+    repairs, _, _ = _filtered_repairs(request)
+    rows = repair_rows(repairs.order_by('-date_of_repair', '-pk'))
+    return export_response(fmt, f'repairs-{timezone.localdate():%Y%m%d}', 'Repairs', REPAIR_HEADER, rows)
+
+
 @login_required
 def repair_create(request):
     if request.method == 'POST':
@@ -481,19 +514,9 @@ def repair_create(request):
         
         try:
             if form.is_valid() and formset.is_valid():
-                repair = form.save()
-                formset.instance = repair
-                formset.save()
-                
-                # Calculate and update the total parts cost
-                total_parts_cost = sum(item.cost for item in repair.part_items.all() if item.cost)
-                repair.cost = total_parts_cost
-                repair.save()
-                
-                # If vehicle is marked as damaged, update its status
-                if 'damaged' in repair.description.lower() or repair.status == 'Ongoing':
-                    repair.vehicle.status = 'Damaged'
-                    repair.vehicle.save()
+                # Repair and parts are written in one transaction with a single Repair.save()
+                # (Repair.save moves the vehicle to Under Repair through the status engine)
+                repair, _ = save_repair(form, formset)
                 
                 messages.success(request, 'Repair record created successfully!')
                 return redirect('repair_list')
@@ -517,17 +540,15 @@ def repair_edit(request, pk):
     if request.method == 'POST':
         form = RepairForm(request.POST, instance=repair)
         formset = RepairPartItemFormSet(request.POST, instance=repair)
-        if form.is_valid() and formset.is_valid():
-            repair = form.save()
-            formset.save()
-            
-            # Calculate and update the total parts cost
-            total_parts_cost = sum(item.cost for item in repair.part_items.all() if item.cost)
-            repair.cost = total_parts_cost
-            repair.save()
-            
-            messages.success(request, 'Repair record updated successfully!')
-            return redirect('repair_list')
+        try:
+            if form.is_valid() and formset.is_valid():
+                # Repair and parts are written in one transaction with a single Repair.save()
+                repair, _ = save_repair(form, formset)
+                
+                messages.success(request, 'Repair record updated successfully!')
+                return redirect('repair_list')
+        except ValidationError as e:
+            messages.error(request, str(e))
     else:
         form = RepairForm(instance=repair)
         formset = RepairPartItemFormSet(instance=repair)
@@ -546,10 +567,8 @@ def repair_delete(request, pk):
     if request.method == 'POST':
         vehicle = repair.vehicle
         repair.delete()
-        # Recheck disposal status after repair deletion
-        if vehicle.acquisition_cost:
-            vehicle.refresh_from_db()
-            vehicle.check_and_mark_for_disposal(user=request.user)
+        # Costs and ongoing work changed, so re-derive the vehicle status
+        sync_vehicle_status(vehicle)
         messages.success(request, 'Repair record deleted successfully!')
         return redirect('repair_list')
     return render(request, 'core/repair_delete.html', {'repair': repair})
@@ -614,15 +633,54 @@ def reports(request):
                 'cost': total
             })
     
+    # Fuel next to repair costs by division, this year
+    fuel_report = [
+        {'division': division, 'liters': liters, 'fuel_cost': fuel_cost, 'repair_cost': repair_cost, 'total': total}
+        for division, _, _, liters, fuel_cost, repair_cost, total in REPORTS['fuel_divisions'][2](
+            Repair.objects.filter(status='Completed'), current_year,
+        )
+    ]
+    
+    # Toll spend by division and month, this year
+    toll_report = [
+        {'division': division, 'months': months, 'total': total}
+        for division, *months, total in REPORTS['toll_divisions'][2](None, current_year)
+    ]
+    
     context = {
         'monthly_report': monthly_report,
         'vehicle_report': vehicle_report,
         'division_report': division_report,
+        'fuel_report': fuel_report,
+        'toll_report': toll_report,
+        'toll_months': REPORTS['toll_divisions'][1][1:-1],
+        'current_year': current_year,
     }
     
     return render(request, 'core/reports.html', context)
 
 
+@login_required
+def report_export(request, fmt):
+    """
+    One table of the reports page as a streamed CSV or XLSX download:
+    ?report=monthly, vehicles or divisions, or the fuel_ and toll_ vehicles
+    and divisions reports (?year= for the yearly ones, default this year).
+    """
+    report = request.GET.get('report', 'monthly')
+    if fmt not in EXPORT_FORMATS or report not in REPORTS:
+        raise Http404("Unknown export")
+    year = request.GET.get('year', '')
+    year = int(year) if year.isdigit() and 1900 <= int(year) <= 9999 else timezone.now().year
+    
+    title, header, build_rows = REPORTS[report]
+    rows = build_rows(Repair.objects.filter(status='Completed'), year)
+    suffix = f'-{year}' if report in YEARLY_REPORTS else ''
+    kind, _, name = report.rpartition('_')
+    prefix = {'fuel': 'fuel-costs', 'toll': 'toll-spend'}.get(kind, 'repair-costs')
+    return export_response(fmt, f"{prefix}-{name}{suffix}", title, header, rows)
+
+
 @login_required
 def notifications(request):
     """View all notifications for the current user"""
@@ -733,12 +791,7 @@ def user_list(request):
     if status_filter:
         users = users.filter(status=status_filter)
     if search_query:
-        users = users.filter(
-            Q(username__icontains=search_query) |
-            Q(first_name__icontains=search_query) |
-            Q(last_name__icontains=search_query) |
-            Q(email__icontains=search_query)
-        )
+        users = users.filter(pk__in=search_ids(search_query, 'user'))
     
     context = {
         'users': users,
@@ -924,10 +977,7 @@ def division_list(request):
     # Filtering
     search_query = request.GET.get('search', '')
     if search_query:
-        divisions = divisions.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
+        divisions = divisions.filter(pk__in=search_ids(search_query, 'division'))
     
     context = {
         'divisions': divisions,
@@ -1035,12 +1085,7 @@ def driver_list(request):
     # Filtering
     search_query = request.GET.get('search', '')
     if search_query:
-        drivers = drivers.filter(
-            Q(name__icontains=search_query) |
-            Q(license_number__icontains=search_query) |
-            Q(phone__icontains=search_query) |
-            Q(email__icontains=search_query)
-        )
+        drivers = drivers.filter(pk__in=search_ids(search_query, 'driver'))
     
     context = {
         'drivers': drivers,
@@ -1257,9 +1302,9 @@ def repairshop_delete(request, pk):
 
 
 # PMS Views
-@login_required
-def pms_list(request):
-    """List all PMS records"""
+def _filtered_pms(request):
+    """PMS records matching the PMS list's ?status= and ?vehicle= filters, newest first"""
+    ensure_overdue_marked()
     pms_records = PMS.objects.all().order_by('-scheduled_date')
     
     # Filter by status
@@ -1271,10 +1316,17 @@ def pms_list(request):
     vehicle_filter = request.GET.get('vehicle')
     if vehicle_filter:
         pms_records = pms_records.filter(vehicle_id=vehicle_filter)
+    return pms_records, status_filter, vehicle_filter
+
+
+@login_required
+def pms_list(request):
+    """List all PMS records"""
+    pms_records, status_filter, vehicle_filter = _filtered_pms(request)
     
     context = {
         'pms_records': pms_records,
-        'vehicles': Vehicle.objects.all(),
+        'selected_vehicle': _selected_vehicle(vehicle_filter),
         'status_choices': PMS.STATUS_CHOICES,
         'status_filter': status_filter,
         'vehicle_filter': vehicle_filter,
@@ -1282,239 +1334,55 @@ def pms_list(request):
     return render(request, 'core/pms_list.html', context)
 
 
+@login_required
+def pms_export(request, fmt):
+    """The PMS list, with the same filters, as a streamed CSV or XLSX download"""
+    if fmt not in EXPORT_FORMATS:
+        raise Http404("Unknown export format")
+    pms_records, _, _ = _filtered_pms(request)
+    rows = pms_rows(pms_records.order_by('-scheduled_date', '-pk'))
+    return export_response(fmt, f'pms-{timezone.localdate():%Y%m%d}', 'PMS Records', PMS_HEADER, rows)
+
+
 @login_required
 def pms_create(request):
     """Create new PMS record"""
     if request.method == 'POST':
         form = PMSForm(request.POST)
+        # The parts formset is optional; without its management form there are no parts
+        has_formset = any(key.endswith('-TOTAL_FORMS') for key in request.POST)
+        formset = PMSRepairPartItemFormSet(request.POST) if has_formset else None
         
-        # Check if there are any parts in the formset data
-        # Find the formset prefix from POST data
-        formset_prefix = None
-        total_forms = 0
-        has_parts_data = False
-        
-        # Find the TOTAL_FORMS field to determine prefix
-        for key in request.POST.keys():
-            if key.endswith('-TOTAL_FORMS'):
-                formset_prefix = key.replace('-TOTAL_FORMS', '')
-                total_forms = int(request.POST.get(key, 0))
-                break
-        
-        # If we found a prefix, check if any form has a part selected
-        if formset_prefix and total_forms > 0:
-            for i in range(total_forms):
-                part_value = request.POST.get(f'{formset_prefix}-{i}-part', '')
-                delete_value = request.POST.get(f'{formset_prefix}-{i}-DELETE', '')
-                if part_value and not delete_value:
-                    has_parts_data = True
-                    break
-        
-        # Validate form first
         form_valid = form.is_valid()
-        
-        # DEBUG: Check if form has errors after validation
-        if form.errors:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.debug(f"Form validation errors: {form.errors}")
-            logger.debug(f"Form non_field_errors: {form.non_field_errors()}")
-        
-        # Create formset without instance for validation (like repair_create)
-        formset = PMSRepairPartItemFormSet(request.POST)
-        
-        # Only validate formset if there are parts or if formset has data
-        formset_valid = True
-        if has_parts_data or total_forms > 0:
-            formset_valid = formset.is_valid()
-        
-        try:
-            if form_valid and formset_valid:
-                # CRITICAL: If form has ANY errors, don't save - even if form_valid is True
-                # This can happen if ValidationError was raised but form_valid wasn't properly set
-                if form.errors:
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.error(f"CRITICAL: Form has errors but form_valid is True! Errors: {form.errors}")
-                    # Don't save - fall through to error handling
-                    form_valid = False
-                
-                # Only save if form is truly valid (no errors)
-                if form_valid and formset_valid and not form.errors:
-                    # Save with skip_usage_validation=True since form already validated pre-inspection usage
-                    pms = form.save(commit=False)
-                    pms.save(skip_usage_validation=True)
-                    
-                    # Only proceed if we successfully saved (pms has a pk)
-                    if not hasattr(pms, 'pk') or pms.pk is None:
-                        # Save failed somehow, don't continue
-                        messages.error(request, 'Failed to save PMS record. Please try again.')
-                    else:
-                        # Check if user selected any parts to replace
-                        has_parts = False
-                        parts_cost = 0
-                        
-                        for part_form in formset:
-                            if part_form.cleaned_data and not part_form.cleaned_data.get('DELETE', False):
-                                has_parts = True
-                                cost = part_form.cleaned_data.get('cost') or 0
-                                try:
-                                    parts_cost += float(cost)
-                                except (ValueError, TypeError):
-                                    # Skip invalid cost values
-                                    pass
-                        
-                        # If parts were replaced, create a repair record
-                        if has_parts:
-                            from django.utils import timezone
-                            
-                            # Get PMS service cost to use as labor cost
-                            try:
-                                pms_service_cost = float(pms.cost) if pms.cost else 0
-                            except (ValueError, TypeError):
-                                pms_service_cost = 0
-                            
-                            # Ensure parts_cost doesn't exceed max_digits (10 digits total, 8 before decimal, 2 after)
-                            # max_digits=10, decimal_places=2 means max value is 99999999.99
-                            max_cost = 99999999.99
-                            if parts_cost > max_cost:
-                                messages.warning(request, f'Total parts cost ({parts_cost:.2f}) exceeds maximum allowed ({max_cost:.2f}). It will be capped at maximum.')
-                                parts_cost = max_cost
-                            
-                            # Create repair record for PMS with 'Ongoing' status initially
-                            # It will be marked as 'Completed' when post-inspection is done
-                            repair_data = {
-                                'vehicle': pms.vehicle,
-                                'date_of_repair': pms.scheduled_date,
-                                'description': f"PMS: {pms.service_type}",
-                                'cost': min(parts_cost, max_cost),  # Cap at maximum
-                                'labor_cost': min(pms_service_cost, max_cost) if pms_service_cost else 0,
-                                'repair_shop': form.cleaned_data.get('repair_shop'),
-                                'technician': pms.technician,
-                                'status': 'Ongoing',  # Start as Ongoing, not Completed
-                            }
-                            # Only add pre_inspection if it exists and is not None
-                            if pms.pre_inspection_id:
-                                try:
-                                    # Verify the pre_inspection still exists by accessing the ID
-                                    pre_inspection = PreInspectionReport.objects.get(pk=pms.pre_inspection_id)
-                                    repair_data['pre_inspection'] = pre_inspection
-                                except (PreInspectionReport.DoesNotExist, AttributeError):
-                                    # Pre-inspection was deleted or doesn't exist, skip it
-                                    pass
-                            
-                            # Create repair with skip_pms_validation=True since it's being created from PMS
-                            # The repair can share the same pre_inspection as the PMS
-                            # We need to create it without validation first, then save with skip_pms_validation
-                            repair = Repair(**repair_data)
-                            repair.save(skip_pms_validation=True)
-                            
-                            # Link repair to PMS
-                            # Use update() to avoid triggering model validation again
-                            # The form validation already checked everything
-                            PMS.objects.filter(pk=pms.pk).update(repair=repair)
-                            # Refresh the instance to get the updated repair
-                            pms.refresh_from_db()
-                            
-                            # Create a new formset with the repair instance to ensure proper saving
-                            # This is necessary because the formset was validated without an instance
-                            repair_formset = PMSRepairPartItemFormSet(request.POST, instance=repair)
-                            if repair_formset.is_valid():
-                                repair_formset.save()
-                            else:
-                                # If validation fails, log error but don't fail the entire operation
-                                import traceback
-                                traceback.print_exc()
-                                messages.warning(request, 'PMS created but some parts may not have been saved. Please check the repair record.')
-                            
-                            # Log activity
-                            ActivityLog.objects.create(
-                                user=request.user,
-                                action='create',
-                                model_name='Repair',
-                                object_id=repair.id,
-                                description=f'Created repair record for PMS: {pms.vehicle.plate_number}',
-                                ip_address=request.META.get('REMOTE_ADDR')
-                            )
-                        
-                        # Log activity for PMS
-                        ActivityLog.objects.create(
-                            user=request.user,
-                            action='create',
-                            model_name='PMS',
-                            object_id=pms.id,
-                            description=f'Created PMS record for {pms.vehicle.plate_number} - {pms.service_type}',
-                            ip_address=request.META.get('REMOTE_ADDR')
-                        )
-                        
-                        # Clear any form errors before redirecting (they shouldn't exist if we got here)
-                        # But just to be safe, clear them explicitly
-                        if hasattr(form, '_errors'):
-                            form._errors = {}
-                        
-                        messages.success(request, 'PMS record created successfully!')
-                        return redirect('pms_list')
-                else:
-                    # Form or formset was invalid, or save didn't happen
-                    # Don't do anything here - let it fall through to error handling below
-                    pass
-            else:
-                # Form or formset validation failed - errors will be displayed in template
-                if form.errors:
-                    # Check for non-field errors (ValidationError from clean() method)
-                    if form.non_field_errors():
-                        for error in form.non_field_errors():
-                            messages.error(request, str(error))
-                    # Check for field-specific errors
-                    for field, errors in form.errors.items():
-                        if field != '__all__':
-                            for error in errors:
-                                messages.error(request, f'{field}: {error}')
-                if has_parts_data and formset.errors:
-                    for i, form_errors in enumerate(formset.errors):
-                        if form_errors:
-                            for field, errors in form_errors.items():
-                                for error in errors:
-                                    messages.error(request, f'Part form {i+1} - {field}: {error}')
-                    # Also check for non-form errors
-                    # non_form_errors is a property that returns an ErrorList
-                    try:
-                        # Access non_form_errors as a property (not a method)
-                        non_form_errors = getattr(formset, 'non_form_errors', None)
-                        if non_form_errors:
-                            # Convert to list if it's an ErrorList or other iterable
-                            if hasattr(non_form_errors, '__iter__') and not isinstance(non_form_errors, (str, bytes)):
-                                for error in non_form_errors:
-                                    messages.error(request, f'Formset error: {error}')
-                            elif isinstance(non_form_errors, str):
-                                messages.error(request, f'Formset error: {non_form_errors}')
-                    except Exception as e:
-                        # If there's an issue accessing non_form_errors, skip it silently
-                        pass
-                # Re-create formset for display with errors
-                if not form_valid:
-                    formset = PMSRepairPartItemFormSet(request.POST) if has_parts_data else PMSRepairPartItemFormSet()
-                elif has_parts_data:
-                    # Form is valid but formset failed, recreate formset with form data
-                    temp_repair = Repair()
-                    temp_repair.vehicle = form.cleaned_data.get('vehicle')
-                    formset = PMSRepairPartItemFormSet(request.POST, instance=temp_repair)
-        except (ValidationError, forms.ValidationError) as e:
-            messages.error(request, str(e))
-            # Re-render the form with errors - ensure formset is created
+        formset_valid = formset is None or formset.is_valid()
+        if form_valid and formset_valid:
             try:
-                formset
-            except NameError:
-                formset = PMSRepairPartItemFormSet(request.POST) if has_parts_data else PMSRepairPartItemFormSet()
-        except Exception as e:
-            messages.error(request, f'An error occurred: {str(e)}')
-            import traceback
-            traceback.print_exc()
-            # Ensure formset is created even on exception
-            try:
-                formset
-            except NameError:
-                formset = PMSRepairPartItemFormSet(request.POST) if has_parts_data else PMSRepairPartItemFormSet()
+                pms, repair = create_pms(form, formset, user=request.user, ip_address=request.META.get('REMOTE_ADDR'))
+            except ValidationError as e:
+                for error in e.messages:
+                    messages.error(request, error)
+            else:
+                if repair is not None and repair.cost >= MAX_REPAIR_COST:
+                    messages.warning(request, f'Total parts cost exceeds maximum allowed ({MAX_REPAIR_COST:.2f}). It was capped at maximum.')
+                messages.success(request, 'PMS record created successfully!')
+                return redirect('pms_list')
+        else:
+            # Form or formset validation failed - errors will be displayed in template
+            for error in form.non_field_errors():
+                messages.error(request, str(error))
+            for field, errors in form.errors.items():
+                if field != '__all__':
+                    for error in errors:
+                        messages.error(request, f'{field}: {error}')
+            if formset is not None:
+                for i, form_errors in enumerate(formset.errors):
+                    for field, errors in form_errors.items():
+                        for error in errors:
+                            messages.error(request, f'Part form {i+1} - {field}: {error}')
+                for error in formset.non_form_errors():
+                    messages.error(request, f'Formset error: {error}')
+        if formset is None:
+            formset = PMSRepairPartItemFormSet()
     else:
         form = PMSForm()
         formset = PMSRepairPartItemFormSet()
@@ -1762,7 +1630,10 @@ def pms_delete(request, pk):
             ip_address=request.META.get('REMOTE_ADDR')
         )
         
+        vehicle = pms.vehicle
         pms.delete()
+        # A deleted in-progress PMS may leave the vehicle serviceable again
+        sync_vehicle_status(vehicle)
         messages.success(request, 'PMS record deleted successfully!')
         return redirect('pms_list')
     
@@ -1785,14 +1656,14 @@ def pre_inspection_list(request):
     # Apply filters
     if availability_filter == 'used':
         # Get IDs of reports used by repairs or PMS
-        used_repair_ids = Repair.objects.exclude(pre_inspection__isnull=True).values_list('pre_inspection_id', flat=True)
-        used_pms_ids = PMS.objects.exclude(pre_inspection__isnull=True).values_list('pre_inspection_id', flat=True)
+        used_repair_ids = Repair.objects.exclude(pre_inspection__isnull=True).order_by().values_list('pre_inspection_id', flat=True)
+        used_pms_ids = PMS.objects.exclude(pre_inspection__isnull=True).order_by().values_list('pre_inspection_id', flat=True)
         used_ids = set(list(used_repair_ids) + list(used_pms_ids))
         reports = reports.filter(id__in=used_ids)
     elif availability_filter == 'available':
         # Get IDs of reports used by repairs or PMS
-        used_repair_ids = Repair.objects.exclude(pre_inspection__isnull=True).values_list('pre_inspection_id', flat=True)
-        used_pms_ids = PMS.objects.exclude(pre_inspection__isnull=True).values_list('pre_inspection_id', flat=True)
+        used_repair_ids = Repair.objects.exclude(pre_inspection__isnull=True).order_by().values_list('pre_inspection_id', flat=True)
+        used_pms_ids = PMS.objects.exclude(pre_inspection__isnull=True).order_by().values_list('pre_inspection_id', flat=True)
         used_ids = set(list(used_repair_ids) + list(used_pms_ids))
         reports = reports.exclude(id__in=used_ids)
     
@@ -1831,12 +1702,9 @@ def pre_inspection_list(request):
         report.used_by_pms = pms_usage
         report.is_used = repair_usage is not None or pms_usage is not None
     
-    # Get all vehicles for filter dropdown
-    vehicles = Vehicle.objects.all().order_by('plate_number')
-    
     context = {
         'reports': reports,
-        'vehicles': vehicles,
+        'selected_vehicle': _selected_vehicle(vehicle_filter),
         'availability_filter': availability_filter,
         'vehicle_filter': vehicle_filter,
         'date_from': date_from,
@@ -1846,6 +1714,18 @@ def pre_inspection_list(request):
     return render(request, 'core/pre_inspection_list.html', context)
 
 
+# Hidden inputs holding the tokens of files sent through the chunked upload endpoint
+DRIVER_REPORT_UPLOADS = 'driver_report_attachments_upload'
+REPLACED_PART_UPLOADS = 'replaced_parts_images_upload'
+
+
+def _pending_uploads(request, field, purpose):
+    """Chunked uploads referenced by a form that failed validation, so they are offered again"""
+    if request.method != 'POST':
+        return []
+    return chunked_uploads.completed_sessions(request.user, request.POST.getlist(field), purpose)
+
+
 @login_required
 def pre_inspection_create(request):
     """Create a new pre-inspection report"""
@@ -1865,16 +1745,23 @@ def pre_inspection_create(request):
             if 'driver_report_attachment' in request.FILES:
                 attachments_list.extend([f for f in request.FILES.getlist('driver_report_attachment')])
             
+            attachment_paths = []
             if attachments_list:
-                from django.core.files.storage import default_storage
-                attachment_paths = []
                 for attachment in attachments_list:
                     if attachment:
-                        path = default_storage.save(f'pre_inspection/driver_reports/{attachment.name}', attachment)
+                        path = upload_storage().save(f'pre_inspection/driver_reports/{attachment.name}', attachment)
+                        if path not in attachment_paths:
+                            attachment_paths.append(path)
+            # Files already sent through the chunked upload endpoint; their sessions go when the report is saved
+            with transaction.atomic():
+                for path in chunked_uploads.claim(request.user, request.POST.getlist(DRIVER_REPORT_UPLOADS), 'driver_report'):
+                    if path not in attachment_paths:
                         attachment_paths.append(path)
-                report.driver_report_attachments = attachment_paths
-            
-            report.save()
+                if attachment_paths:
+                    report.driver_report_attachments = attachment_paths
+
+                report.save()
+            schedule_processing(report.driver_report_attachments)
             
             # Log activity
             ActivityLog.objects.create(
@@ -1893,7 +1780,11 @@ def pre_inspection_create(request):
         # Set default inspected_by to current user
         form.fields['inspected_by'].initial = request.user
     
-    return render(request, 'core/pre_inspection_form.html', {'form': form, 'title': 'Create Pre-Inspection Report'})
+    return render(request, 'core/pre_inspection_form.html', {
+        'form': form,
+        'title': 'Create Pre-Inspection Report',
+        'pending_uploads': _pending_uploads(request, DRIVER_REPORT_UPLOADS, 'driver_report'),
+    })
 
 
 @login_required
@@ -1929,19 +1820,14 @@ def pre_inspection_edit(request, pk):
             # Get existing attachments
             existing_attachments = list(report.driver_report_attachments or [])
 
-            from django.core.files.storage import default_storage
-
-            # Handle removal of existing attachments
+            # Handle removal of existing attachments (released once the report is saved)
+            removed_attachments = []
             attachments_to_remove = request.POST.getlist('remove_driver_attachments')
             if attachments_to_remove:
                 for path in attachments_to_remove:
                     if path in existing_attachments:
                         existing_attachments.remove(path)
-                        try:
-                            if default_storage.exists(path):
-                                default_storage.delete(path)
-                        except Exception:
-                            pass
+                        removed_attachments.append(path)
             
             # Handle multiple driver report attachments
             attachments_list = []
@@ -1951,15 +1837,25 @@ def pre_inspection_edit(request, pk):
             if 'driver_report_attachment' in request.FILES:
                 attachments_list.extend([f for f in request.FILES.getlist('driver_report_attachment')])
             
+            new_attachments = []
             if attachments_list:
                 for attachment in attachments_list:
                     if attachment:
-                        path = default_storage.save(f'pre_inspection/driver_reports/{attachment.name}', attachment)
-                        existing_attachments.append(path)
-
-            report.driver_report_attachments = existing_attachments
-            
-            report.save()
+                        path = upload_storage().save(f'pre_inspection/driver_reports/{attachment.name}', attachment)
+                        if path not in existing_attachments and path not in new_attachments:
+                            new_attachments.append(path)
+            # Files already sent through the chunked upload endpoint; their sessions go when the report is saved
+            with transaction.atomic():
+                for path in chunked_uploads.claim(request.user, request.POST.getlist(DRIVER_REPORT_UPLOADS), 'driver_report'):
+                    if path not in existing_attachments and path not in new_attachments:
+                        new_attachments.append(path)
+                existing_attachments.extend(new_attachments)
+
+                report.driver_report_attachments = existing_attachments
+
+                report.save()
+            release_media(removed_attachments)
+            schedule_processing(new_attachments)
             
             # Log activity
             ActivityLog.objects.create(
@@ -1976,7 +1872,12 @@ def pre_inspection_edit(request, pk):
     else:
         form = PreInspectionReportForm(instance=report)
     
-    return render(request, 'core/pre_inspection_form.html', {'form': form, 'title': 'Edit Pre-Inspection Report', 'report': report})
+    return render(request, 'core/pre_inspection_form.html', {
+        'form': form,
+        'title': 'Edit Pre-Inspection Report',
+        'report': report,
+        'pending_uploads': _pending_uploads(request, DRIVER_REPORT_UPLOADS, 'driver_report'),
+    })
 
 
 @login_required
@@ -2101,12 +2002,9 @@ def post_inspection_list(request):
         report.used_by_pms = pms_usage
         report.is_used = repair_usage is not None or pms_usage is not None
     
-    # Get all vehicles for filter dropdown
-    vehicles = Vehicle.objects.all().order_by('plate_number')
-    
     context = {
         'reports': reports,
-        'vehicles': vehicles,
+        'selected_vehicle': _selected_vehicle(vehicle_filter),
         'availability_filter': availability_filter,
         'vehicle_filter': vehicle_filter,
         'date_from': date_from,
@@ -2178,9 +2076,9 @@ def post_inspection_create(request):
             
             # Handle multiple image uploads after initial save
             uploaded_images = request.FILES.getlist('replaced_parts_images')
-            if uploaded_images:
+            upload_tokens = request.POST.getlist(REPLACED_PART_UPLOADS)
+            if uploaded_images or upload_tokens:
                 try:
-                    from django.core.files.storage import default_storage
                     import os
                     from django.utils import timezone
                     image_paths = []
@@ -2194,12 +2092,19 @@ def post_inspection_create(request):
                         unique_filename = f"post_inspection/replaced_parts/{plate_number}_{timestamp}_{idx}{file_extension}"
                         
                         # Save the file
-                        file_path = default_storage.save(unique_filename, image)
-                        image_paths.append(file_path)
-                    
-                    # Store paths in JSONField
-                    report.replaced_parts_images = image_paths
-                    report.save()  # Save again with images
+                        file_path = upload_storage().save(unique_filename, image)
+                        if file_path not in image_paths:
+                            image_paths.append(file_path)
+                    with transaction.atomic():
+                        # Images already sent through the chunked upload endpoint; their sessions go with this save
+                        for file_path in chunked_uploads.claim(request.user, upload_tokens, 'replaced_part'):
+                            if file_path not in image_paths:
+                                image_paths.append(file_path)
+
+                        # Store paths in JSONField
+                        report.replaced_parts_images = image_paths
+                        report.save()  # Save again with images
+                    schedule_processing(image_paths)
                 except Exception as e:
                     # Log error but don't fail the entire save
                     import logging
@@ -2287,6 +2192,7 @@ def post_inspection_create(request):
         'title': 'Create Post-Inspection Report',
         'repair_id': repair_id,
         'pms_id': pms_id,
+        'pending_uploads': _pending_uploads(request, REPLACED_PART_UPLOADS, 'replaced_part'),
     })
 
 
@@ -2321,26 +2227,23 @@ def post_inspection_edit(request, pk):
                 if not report.inspected_by:
                     report.inspected_by = request.user
             
-            from django.core.files.storage import default_storage
             import os
 
             # Get existing images or initialize empty list
             existing_images = list(report.get_replaced_parts_images_list())
 
-            # Handle removal of existing images
+            # Handle removal of existing images (released once the report is saved)
+            removed_images = []
             remove_images = request.POST.getlist('remove_replaced_images')
             if remove_images:
                 for path in remove_images:
                     if path in existing_images:
                         existing_images.remove(path)
-                        try:
-                            if default_storage.exists(path):
-                                default_storage.delete(path)
-                        except Exception:
-                            pass
+                        removed_images.append(path)
 
             # Handle multiple image uploads - append to existing images
             uploaded_images = request.FILES.getlist('replaced_parts_images')
+            new_images = []
             if uploaded_images:
                 try:
                     from django.utils import timezone
@@ -2353,8 +2256,9 @@ def post_inspection_edit(request, pk):
                         unique_filename = f"post_inspection/replaced_parts/{plate_number}_{timestamp}_{len(existing_images) + idx}{file_extension}"
                         
                         # Save the file
-                        file_path = default_storage.save(unique_filename, image)
-                        existing_images.append(file_path)
+                        file_path = upload_storage().save(unique_filename, image)
+                        if file_path not in existing_images and file_path not in new_images:
+                            new_images.append(file_path)
                 except Exception as e:
                     # Log error but don't fail the entire save
                     import logging
@@ -2362,9 +2266,17 @@ def post_inspection_edit(request, pk):
                     logger.error(f"Error saving replaced parts images: {str(e)}")
                     messages.warning(request, f'Some images could not be saved: {str(e)}')
 
-            report.replaced_parts_images = existing_images
-            
-            report.save()
+            # Images already sent through the chunked upload endpoint; their sessions go when the report is saved
+            with transaction.atomic():
+                for file_path in chunked_uploads.claim(request.user, request.POST.getlist(REPLACED_PART_UPLOADS), 'replaced_part'):
+                    if file_path not in existing_images and file_path not in new_images:
+                        new_images.append(file_path)
+                existing_images.extend(new_images)
+                report.replaced_parts_images = existing_images
+
+                report.save()
+            release_media(removed_images)
+            schedule_processing(new_images)
             
             # Log activity
             ActivityLog.objects.create(
@@ -2381,7 +2293,12 @@ def post_inspection_edit(request, pk):
     else:
         form = PostInspectionReportForm(instance=report)
     
-    return render(request, 'core/post_inspection_form.html', {'form': form, 'title': 'Edit Post-Inspection Report', 'report': report})
+    return render(request, 'core/post_inspection_form.html', {
+        'form': form,
+        'title': 'Edit Post-Inspection Report',
+        'report': report,
+        'pending_uploads': _pending_uploads(request, REPLACED_PART_UPLOADS, 'replaced_part'),
+    })
 
 
 @login_required
@@ -2542,6 +2459,170 @@ def pms_complete(request, pk):
     return render(request, 'core/pms_complete.html', context)
 
 
+def _searchable_types(user):
+    """Search index object types the user is allowed to see"""
+    types = ['vehicle', 'repair', 'pre_inspection', 'post_inspection']
+    if user.has_admin_access():
+        types += ['driver', 'division']
+    if user.can_view_users:
+        types.append('user')
+    return types
+
+
+def _search_result_groups(user, query, per_type):
+    groups = search_grouped(query, object_types=_searchable_types(user), per_type=per_type)
+    for group in groups:
+        for entry in group['results']:
+            entry.url = reverse(DETAIL_URLS[entry.object_type], args=[entry.object_id])
+    return groups
+
+
+@login_required
+def global_search(request):
+    """Search vehicles, repairs, inspections, drivers, divisions and users at once"""
+    search_query = request.GET.get('q', '').strip()
+    groups = _search_result_groups(request.user, search_query, per_type=20) if search_query else []
+    
+    context = {
+        'search_query': search_query,
+        'groups': groups,
+        'total_results': sum(len(group['results']) for group in groups),
+    }
+    
+    return render(request, 'core/search_results.html', context)
+
+
+@login_required
+def search_api(request):
+    """AJAX endpoint returning ranked search results grouped by record type"""
+    search_query = request.GET.get('q', '').strip()
+    try:
+        per_type = min(max(int(request.GET.get('limit', 5)), 1), 20)
+    except ValueError:
+        per_type = 5
+    
+    groups = _search_result_groups(request.user, search_query, per_type=per_type) if search_query else []
+    
+    return JsonResponse({
+        'query': search_query,
+        'groups': [
+            {
+                'type': group['object_type'],
+                'label': group['label'],
+                'results': [
+                    {
+                        'id': entry.object_id,
+                        'title': entry.title,
+                        'subtitle': entry.subtitle,
+                        'url': entry.url,
+                        'score': entry.score,
+                    }
+                    for entry in group['results']
+                ],
+            }
+            for group in groups
+        ],
+    })
+
+
+def _prefix_match(field, term):
+    """
+    Prefix match on a normalized column. MySQL answers LIKE 'TERM%' from the
+    index; a computed upper bound (TERM with its last character bumped) would
+    depend on the column's collation order, which is not code-point order.
+    Normalized values hold only letters and digits, so there is nothing to escape.
+    """
+    return {f'{field}__startswith': term}
+
+
+VEHICLE_CHOICES_PAGE_SIZE = 20
+
+
+@login_required
+def vehicle_choices(request):
+    """Paginated vehicle options for the remote select widget (Select2 format)"""
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    
+    vehicles = Vehicle.objects.all()
+    
+    if query:
+        # Plate prefix or any indexed vehicle text (brand, model, division, driver...)
+        condition = Q(pk__in=search_ids(query, 'vehicle'))
+        term = normalize_identifier(query)
+        if term:
+            condition |= Q(**_prefix_match('plate_number_normalized', term))
+        vehicles = vehicles.filter(condition)
+    
+    brand = request.GET.get('brand', '').strip()
+    if brand:
+        vehicles = vehicles.filter(brand__iexact=brand)
+    model = request.GET.get('model', '').strip()
+    if model:
+        vehicles = vehicles.filter(model__iexact=model)
+    status = request.GET.get('status', '').strip()
+    if status:
+        vehicles = vehicles.filter(status=status)
+    
+    # Fetch one extra row to know whether there is a next page without a COUNT(*)
+    offset = (page - 1) * VEHICLE_CHOICES_PAGE_SIZE
+    rows = list(
+        vehicles.order_by('plate_number')
+        .only('id', 'plate_number', 'brand', 'model', 'status')[offset:offset + VEHICLE_CHOICES_PAGE_SIZE + 1]
+    )
+    has_more = len(rows) > VEHICLE_CHOICES_PAGE_SIZE
+    
+    results = [
+        {'id': vehicle.pk, 'text': str(vehicle), 'status': vehicle.status}
+        for vehicle in rows[:VEHICLE_CHOICES_PAGE_SIZE]
+    ]
+    return JsonResponse({'results': results, 'pagination': {'more': has_more}})
+
+
+@login_required
+def vehicle_lookup(request):
+    """AJAX typeahead: prefix match on plate, engine, chassis, RFID and fleet card numbers"""
+    term = normalize_identifier(request.GET.get('q', ''))
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 20)
+    except ValueError:
+        limit = 10
+    
+    if len(term) < 2:
+        return JsonResponse({'results': []})
+    
+    results = []
+    seen_ids = set()
+    # One indexed prefix scan per identifier, in priority order, until the cap is reached
+    for field in Vehicle.IDENTIFIER_FIELDS:
+        remaining = limit - len(results)
+        if remaining <= 0:
+            break
+        normalized_field = f'{field}_normalized'
+        matches = (
+            Vehicle.objects
+            .filter(**_prefix_match(normalized_field, term))
+            .exclude(pk__in=seen_ids)
+            .order_by(normalized_field)
+            .only('id', 'plate_number', 'brand', 'model', 'status', field)[:remaining]
+        )
+        for vehicle in matches:
+            seen_ids.add(vehicle.pk)
+            results.append({
+                'id': vehicle.pk,
+                'text': str(vehicle),
+                'plate_number': vehicle.plate_number,
+                'status': vehicle.status,
+                'matched_field': Vehicle._meta.get_field(field).verbose_name.title(),
+                'matched_value': getattr(vehicle, field),
+            })
+    
+    return JsonResponse({'results': results})
+
+
 @login_required
 def get_pre_inspections_by_vehicle(request):
     """AJAX endpoint to get pre-inspection reports filtered by vehicle and report type"""
@@ -2558,12 +2639,14 @@ def get_pre_inspections_by_vehicle(request):
         # Get pre-inspections used by other repairs
         used_pre_inspection_ids.update(
             Repair.objects.exclude(pre_inspection__isnull=True)
+                         .order_by()  # no default ordering, so the FK index covers the lookup
                          .values_list('pre_inspection_id', flat=True)
         )
         
         # Get pre-inspections used by PMS
         used_pre_inspection_ids.update(
             PMS.objects.exclude(pre_inspection__isnull=True)
+                      .order_by()  # no default ordering, so the FK index covers the lookup
                       .values_list('pre_inspection_id', flat=True)
         )
         
@@ -2585,4 +2668,213 @@ def get_pre_inspections_by_vehicle(request):
         return JsonResponse({'options': options}, safe=False)
         
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def _upload_session_json(session):
+    return {
+        'token': session.token,
+        'filename': session.filename,
+        'size': session.size,
+        'received': session.received,
+        'complete': session.status == 'complete',
+        'chunk_size': chunked_uploads.CHUNK_SIZE,
+    }
+
+
+@login_required
+def upload_session_create(request):
+    """Open a chunked upload for one file (POST purpose, filename, size and an optional SHA-256 checksum)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    try:
+        session = chunked_uploads.start_session(
+            request.user,
+            request.POST.get('purpose'),
+            request.POST.get('filename'),
+            request.POST.get('size'),
+            request.POST.get('checksum', ''),
+        )
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
+    return JsonResponse(_upload_session_json(session), status=201)
+
+
+@login_required
+def upload_session_status(request, token):
+    """How far a chunked upload got, so the client can resume it"""
+    session = chunked_uploads.get_session(token, request.user)
+    if session is None:
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+    return JsonResponse(_upload_session_json(session))
+
+
+@login_required
+def upload_session_chunk(request, token):
+    """Append the raw request body at ?offset=; an X-Chunk-Checksum header (SHA-256) is verified"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    session = chunked_uploads.get_session(token, request.user)
+    if session is None:
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+    try:
+        offset = int(request.GET.get('offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'offset must be a whole number of bytes'}, status=400)
+    try:
+        # The body is read straight from the request stream, one block at a time
+        session = chunked_uploads.append_chunk(
+            session, offset, request, length, request.headers.get('X-Chunk-Checksum', ''),
+        )
+    except chunked_uploads.OffsetMismatch as e:
+        return JsonResponse({'error': e.messages[0], 'received': e.received}, status=409)
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
+    return JsonResponse(_upload_session_json(session))
+
+
+@login_required
+def upload_session_complete(request, token):
+    """Assemble a fully received upload; the returned token can then be posted with the form"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    session = chunked_uploads.get_session(token, request.user)
+    if session is None:
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+    try:
+        session = chunked_uploads.complete(session)
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
+    return JsonResponse(_upload_session_json(session))
+
+
+@login_required
+def media_file(request, path):
+    """Uploaded file, served after checking the user may see the record it belongs to"""
+    return media_response(request, path)
+
+
+def _dossier_range(request):
+    """(start, end) dates from the query string; raises ValidationError for unreadable or reversed dates"""
+    from django.utils.dateparse import parse_date
+    
+    dates = []
+    for name in ('start', 'end'):
+        value = request.GET.get(name, '').strip()
+        try:
+            parsed = parse_date(value) if value else None
+        except ValueError:
+            parsed = None
+        if value and parsed is None:
+            raise ValidationError(f"Invalid {name} date: use YYYY-MM-DD.")
+        dates.append(parsed)
+    if dates[0] and dates[1] and dates[0] > dates[1]:
+        raise ValidationError("The start date must not be after the end date.")
+    return dates
+
+
+def _dossier_response(entries, filename):
+    response = StreamingHttpResponse(zip_stream(entries), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+@login_required
+def vehicle_dossier(request, pk):
+    """
+    A vehicle's photos, registration documents and inspection attachments with
+    CSV manifests of its repairs, PMS and inspections, as a ZIP streamed while
+    it is built. ?start=&end= (YYYY-MM-DD) limit the records to a date range.
+    """
+    vehicle = get_object_or_404(Vehicle, pk=pk)
+    if not can_view_media(request.user, [('Vehicle', vehicle.pk)]):
+        raise Http404("Vehicle not found")
+    try:
+        start, end = _dossier_range(request)
+    except ValidationError as e:
+        messages.error(request, e.messages[0])
+        return redirect('vehicle_detail', pk=vehicle.pk)
+    
+    entries = dossier_entries(Vehicle.objects.filter(pk=vehicle.pk), start, end)
+    filename = f'dossier-{normalize_identifier(vehicle.plate_number) or vehicle.pk}-{timezone.localdate():%Y%m%d}.zip'
+    return _dossier_response(entries, filename)
+
+
+@login_required
+def fleet_dossier(request):
+    """
+    Inspection attachments and record manifests of every vehicle for a date
+    range (?start=&end=, both required), as a streamed ZIP. ?vehicle_files=1
+    adds each vehicle's own photos and registration documents.
+    """
+    if not request.user.has_admin_access():
+        messages.error(request, 'You do not have permission to access this page.')
+        return redirect('dashboard')
+    try:
+        start, end = _dossier_range(request)
+        if not start or not end:
+            raise ValidationError("Choose a start and an end date for the dossier.")
+    except ValidationError as e:
+        messages.error(request, e.messages[0])
+        return redirect('dashboard')
+    
+    entries = dossier_entries(
+        Vehicle.objects.all(), start, end,
+        include_vehicle_files=request.GET.get('vehicle_files') == '1',
+    )
+    return _dossier_response(entries, f'fleet-dossier-{start:%Y%m%d}-{end:%Y%m%d}.zip')
+
+
+
+@login_required
+def fleet_import(request):
+    """Upload a CSV/XLSX list of vehicles or drivers, or a fuel card or toll statement; a dry run reports the row errors without saving"""
+    if not request.user.has_admin_access():
+        messages.error(request, 'You do not have permission to access this page.')
+        return redirect('dashboard')
+    
+    result = None
+    if request.method == 'POST':
+        form = FleetImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            importer, noun, model_name = IMPORTERS[form.cleaned_data['kind']]
+            upload = form.cleaned_data['file']
+            try:
+                result = importer(upload, upload.name, user=request.user, dry_run=form.cleaned_data['dry_run'])
+            except ValidationError as e:
+                form.add_error('file', e)
+                if not form.cleaned_data['dry_run']:
+                    # Batches read before the error are already saved; importing the fixed file again skips them
+                    ActivityLog.objects.create(
+                        user=request.user,
+                        action='create',
+                        model_name=model_name,
+                        description=f'Import of {upload.name} stopped: {" ".join(e.messages)}',
+                        ip_address=request.META.get('REMOTE_ADDR')
+                    )
+            else:
+                if not result.dry_run and (result.created or result.updated):
+                    ActivityLog.objects.create(
+                        user=request.user,
+                        action='create',
+                        model_name=model_name,
+                        description=f'Imported {upload.name}: {result.summary(noun)}',
+                        ip_address=request.META.get('REMOTE_ADDR')
+                    )
+                if result.error_count:
+                    messages.warning(request, result.summary(noun))
+                else:
+                    messages.success(request, result.summary(noun))
+    else:
+        form = FleetImportForm(initial={'kind': request.GET.get('kind', 'vehicles')})
+    
+    return render(request, 'core/fleet_import.html', {
+        'form': form,
+        'result': result,
+        'vehicle_columns': VEHICLE_IMPORT_COLUMNS,
+        'driver_columns': DRIVER_IMPORT_COLUMNS,
+        'fuel_columns': FUEL_IMPORT_COLUMNS,
+        'toll_columns': TOLL_IMPORT_COLUMNS,
+    })
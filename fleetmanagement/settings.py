@@ -120,6 +120,29 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Who sends /media/ files once core.media has checked permissions:
+# 'django' streams them from Python, 'nginx' uses X-Accel-Redirect to
+# MEDIA_ACCEL_REDIRECT_PREFIX (an internal location aliased to MEDIA_ROOT),
+# 'apache' uses X-Sendfile
+MEDIA_SERVE_BACKEND = os.environ.get('MEDIA_SERVE_BACKEND', 'django')
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    # Uploaded vehicle and inspection files, stored once per distinct content;
+    # once the upload's record is saved, photos are auto-oriented, stripped of
+    # EXIF/GPS and recompressed, and the original is deleted
+    'uploads': {
+        'BACKEND': 'core.storage.ContentAddressedStorage',
+        'OPTIONS': {'normalize_images': True},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
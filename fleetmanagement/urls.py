@@ -1,16 +1,21 @@
-from django.urls import path, include
+import re
+
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 from django.shortcuts import redirect
 
+from core.views import media_file
+
 def redirect_to_login(request):
     return redirect('login')
 
 urlpatterns = [
     path('', redirect_to_login),
     path('fleet/', include('core.urls')),
+    # Uploaded files are permission-checked in every environment (core/media.py)
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media_file, name='media_file'),
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -0,0 +1,180 @@
+// Chunked upload: files picked in <input type="file" data-chunked-upload="<endpoint>"> are sent
+// ahead of the form, one chunk per request, and only their upload tokens are posted with it.
+// A dropped connection (or a reload) resumes from the last byte the server confirmed, and a
+// form that fails validation is resubmitted without sending the files again.
+//
+//   data-chunked-upload  URL of the upload_session_create endpoint
+//   data-upload-purpose  'driver_report' or 'replaced_part'
+//   data-token-name      name of the hidden token inputs the view reads
+//   data-upload-list     selector of the <ul> listing the uploaded files
+(function () {
+    const MAX_RETRIES = 5;
+
+    function csrfToken(form) {
+        const input = form.querySelector('input[name="csrfmiddlewaretoken"]');
+        return input ? input.value : '';
+    }
+
+    async function sha256(buffer) {
+        // SubtleCrypto is only available on HTTPS pages; the server then skips the check
+        if (!window.crypto || !window.crypto.subtle) {
+            return '';
+        }
+        const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+        return Array.from(new Uint8Array(digest)).map(function (b) {
+            return b.toString(16).padStart(2, '0');
+        }).join('');
+    }
+
+    async function send(url, options) {
+        try {
+            const response = await fetch(url, Object.assign({ credentials: 'same-origin' }, options));
+            const data = await response.json().catch(function () { return {}; });
+            return { ok: response.ok, status: response.status, data: data };
+        } catch (error) {
+            return { ok: false, status: 0, data: {} };  // network error
+        }
+    }
+
+    function resumeKey(purpose, file) {
+        return ['chunked-upload', purpose, file.name, file.size, file.lastModified].join(':');
+    }
+
+    async function openSession(endpoint, purpose, file, headers) {
+        const key = resumeKey(purpose, file);
+        const saved = window.localStorage.getItem(key);
+        if (saved) {
+            const status = await send(endpoint + saved + '/', { headers: headers });
+            if (status.ok) {
+                return status.data;
+            }
+            window.localStorage.removeItem(key);
+        }
+        const body = new FormData();
+        body.append('purpose', purpose);
+        body.append('filename', file.name);
+        body.append('size', file.size);
+        const created = await send(endpoint, { method: 'POST', headers: headers, body: body });
+        if (!created.ok) {
+            throw new Error(created.data.error || 'The upload could not be started.');
+        }
+        window.localStorage.setItem(key, created.data.token);
+        return created.data;
+    }
+
+    async function uploadFile(endpoint, purpose, file, headers, onProgress) {
+        let session = await openSession(endpoint, purpose, file, headers);
+        let received = session.received;
+        let failures = 0;
+        while (!session.complete && received < file.size) {
+            const buffer = await file.slice(received, received + session.chunk_size).arrayBuffer();
+            const chunkHeaders = Object.assign({ 'Content-Type': 'application/octet-stream' }, headers);
+            const checksum = await sha256(buffer);
+            if (checksum) {
+                chunkHeaders['X-Chunk-Checksum'] = checksum;
+            }
+            const url = endpoint + session.token + '/chunk/?offset=' + received;
+            const result = await send(url, { method: 'POST', headers: chunkHeaders, body: buffer });
+            if (result.ok || result.status === 409) {
+                // 409: the server already has more (or less) than we thought; continue from there
+                received = result.data.received;
+                failures = 0;
+                onProgress(received / file.size);
+                continue;
+            }
+            // Network errors and rejected chunks (400: checksum mismatch, short body) are retried
+            failures += 1;
+            if (failures > MAX_RETRIES || result.status === 403 || result.status === 404) {
+                throw new Error(result.data.error || 'The upload failed.');
+            }
+            await new Promise(function (resolve) { setTimeout(resolve, 1000 * failures); });
+            const status = await send(endpoint + session.token + '/', { headers: headers });
+            if (status.ok) {
+                received = status.data.received;
+            }
+        }
+        if (!session.complete) {
+            const done = await send(endpoint + session.token + '/complete/', { method: 'POST', headers: headers });
+            if (!done.ok) {
+                window.localStorage.removeItem(resumeKey(purpose, file));
+                throw new Error(done.data.error || 'The upload could not be completed.');
+            }
+            session = done.data;
+        }
+        window.localStorage.removeItem(resumeKey(purpose, file));
+        return session;
+    }
+
+    function fileRow(name) {
+        const row = document.createElement('li');
+        row.className = 'd-flex align-items-center justify-content-between gap-2 mb-1';
+        const label = document.createElement('span');
+        label.textContent = name;
+        const state = document.createElement('small');
+        state.className = 'text-muted';
+        row.append(label, state);
+        return { row: row, state: state };
+    }
+
+    function initChunkedUpload(input) {
+        const form = input.form;
+        const list = document.querySelector(input.dataset.uploadList);
+        const endpoint = input.dataset.chunkedUpload;
+        const purpose = input.dataset.uploadPurpose;
+        const tokenName = input.dataset.tokenName;
+        let pending = 0;
+
+        input.addEventListener('change', function () {
+            const headers = { 'X-CSRFToken': csrfToken(form) };
+            Array.from(input.files).forEach(function (file) {
+                const entry = fileRow(file.name);
+                list.appendChild(entry.row);
+                pending += 1;
+                uploadFile(endpoint, purpose, file, headers, function (fraction) {
+                    entry.state.textContent = Math.floor(fraction * 100) + '%';
+                }).then(function (session) {
+                    const token = document.createElement('input');
+                    token.type = 'hidden';
+                    token.name = tokenName;
+                    token.value = session.token;
+                    const remove = document.createElement('button');
+                    remove.type = 'button';
+                    remove.className = 'btn btn-link btn-sm text-danger p-0 js-chunked-upload-remove';
+                    remove.textContent = 'Remove';
+                    entry.state.className = 'text-success';
+                    entry.state.textContent = 'Uploaded';
+                    entry.row.append(token, remove);
+                }).catch(function (error) {
+                    entry.state.className = 'text-danger';
+                    entry.state.textContent = error.message;
+                }).finally(function () {
+                    pending -= 1;
+                });
+            });
+            // The files travel through the upload endpoint, not with the form
+            input.value = '';
+        });
+
+        form.addEventListener('submit', function (event) {
+            if (pending > 0) {
+                event.preventDefault();
+                alert('Please wait until the attachments have finished uploading.');
+            }
+        });
+    }
+
+    // Remove a file from the form before it is submitted (it is not attached to anything yet)
+    document.addEventListener('click', function (event) {
+        const button = event.target.closest('.js-chunked-upload-remove');
+        if (button) {
+            button.closest('li').remove();
+        }
+    });
+
+    document.addEventListener('DOMContentLoaded', function () {
+        if (!window.fetch || !window.Blob || !Blob.prototype.arrayBuffer) {
+            return;  // older browsers keep the regular multipart upload
+        }
+        document.querySelectorAll('input[type="file"][data-chunked-upload]').forEach(initChunkedUpload);
+    });
+})();
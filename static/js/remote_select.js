@@ -0,0 +1,48 @@
+// Remote select: turns <select class="js-remote-select"> into a Select2 dropdown
+// that pages through a JSON endpoint instead of rendering every row as an <option>.
+// Requires jQuery and Select2 to be loaded first.
+(function ($) {
+    function initRemoteSelect(element) {
+        const $select = $(element);
+        if ($select.hasClass('select2-hidden-accessible')) {
+            return;
+        }
+        
+        $select.select2({
+            theme: 'bootstrap-5',
+            width: '100%',
+            allowClear: true,
+            placeholder: $select.data('placeholder') || 'Search...',
+            ajax: {
+                url: $select.data('ajax-url'),
+                dataType: 'json',
+                delay: 250,
+                data: function (params) {
+                    const query = { q: params.term || '', page: params.page || 1 };
+                    // Extra server-side filters, e.g. data-filter-status="Active"
+                    ['status', 'brand', 'model'].forEach(function (key) {
+                        const value = $select.data('filter-' + key);
+                        if (value) {
+                            query[key] = value;
+                        }
+                    });
+                    return query;
+                }
+            }
+        });
+        
+        // Select2 only fires jQuery events; re-dispatch a native change so
+        // listeners added with addEventListener (pre-inspection filtering) still run
+        $select.on('select2:select select2:clear', function () {
+            element.dispatchEvent(new Event('change', { bubbles: true }));
+        });
+    }
+    
+    window.initRemoteSelect = initRemoteSelect;
+    
+    $(function () {
+        $('select.js-remote-select').each(function () {
+            initRemoteSelect(this);
+        });
+    });
+})(jQuery);